@@ -0,0 +1,330 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Offline bulk mode.
+# Requests are written as JSONL and submitted through the OpenAI Batch API (or a
+# local stand-in). Every item, the batch it went out in and its result are kept
+# in a SQLite job store, so a crashed run picks up where it stopped: finished
+# items are never sent again and batches already submitted are polled, not resubmitted.
+
+DEFAULT_STORE_PATH = os.getenv("BATCH_STORE_PATH", ".batch_jobs.sqlite3")
+
+# Batch states after which no more results will arrive
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Per-item HTTP statuses worth sending again in a later batch
+RETRYABLE_ITEM_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class JobStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        """
+        SQLite store of batch items and submitted batches, keyed by run id.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " run_id TEXT NOT NULL, custom_id TEXT NOT NULL, body TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending', batch_id TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " response TEXT, error TEXT, PRIMARY KEY (run_id, custom_id))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " batch_id TEXT PRIMARY KEY, run_id TEXT NOT NULL, status TEXT NOT NULL, submitted_at REAL NOT NULL)"
+        )
+
+    def has_run(self, run_id):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM items WHERE run_id = ? LIMIT 1", (run_id,)).fetchone() is not None
+
+    def add(self, run_id, requests):
+        """
+        Record (custom_id, body) pairs for a run. Items already known are left untouched.
+        """
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO items (run_id, custom_id, body) VALUES (?, ?, ?)",
+                [(run_id, custom_id, json.dumps(body)) for custom_id, body in requests],
+            )
+
+    def pending(self, run_id, max_attempts):
+        """
+        Items still to be submitted; items out of attempts are marked failed instead.
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET status = 'failed', error = COALESCE(error, 'gave up after ' || attempts || ' attempts')"
+                " WHERE run_id = ? AND status = 'pending' AND attempts >= ?",
+                (run_id, max_attempts),
+            )
+            rows = self._db.execute(
+                "SELECT custom_id, body FROM items WHERE run_id = ? AND status = 'pending' ORDER BY rowid", (run_id,)
+            ).fetchall()
+        return [(custom_id, json.loads(body)) for custom_id, body in rows]
+
+    def mark_submitted(self, run_id, batch_id, custom_ids):
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT INTO batches (batch_id, run_id, status, submitted_at) VALUES (?, ?, 'submitted', ?)",
+                (batch_id, run_id, time.time()),
+            )
+            self._db.executemany(
+                "UPDATE items SET status = 'submitted', batch_id = ?, attempts = attempts + 1"
+                " WHERE run_id = ? AND custom_id = ?",
+                [(batch_id, run_id, custom_id) for custom_id in custom_ids],
+            )
+            self._db.execute("COMMIT")
+
+    def open_batches(self, run_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT batch_id FROM batches WHERE run_id = ? AND status = 'submitted' ORDER BY submitted_at",
+                (run_id,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def complete(self, run_id, custom_id, response):
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET status = 'done', response = ?, error = NULL WHERE run_id = ? AND custom_id = ?",
+                (json.dumps(response), run_id, custom_id),
+            )
+
+    def fail(self, run_id, custom_id, error, retry=False):
+        with self._lock:
+            self._db.execute(
+                "UPDATE items SET status = ?, error = ? WHERE run_id = ? AND custom_id = ?",
+                ("pending" if retry else "failed", error, run_id, custom_id),
+            )
+
+    def close_batch(self, run_id, batch_id, status):
+        """
+        Mark a batch final; its items without a result go back to pending.
+        """
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute("UPDATE batches SET status = ? WHERE batch_id = ?", (status, batch_id))
+            self._db.execute(
+                "UPDATE items SET status = 'pending', error = ? WHERE run_id = ? AND batch_id = ? AND status = 'submitted'",
+                (f"batch {status} without a result", run_id, batch_id),
+            )
+            self._db.execute("COMMIT")
+
+    def outcomes(self, run_id):
+        """
+        Return [(custom_id, response or None, error or None)] in submission order.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT custom_id, response, error FROM items WHERE run_id = ? ORDER BY rowid", (run_id,)
+            ).fetchall()
+        return [(custom_id, json.loads(response) if response else None, error) for custom_id, response, error in rows]
+
+    def stats(self, run_id):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM items WHERE run_id = ? GROUP BY status", (run_id,))
+            return dict(rows.fetchall())
+
+    def close(self):
+        self._db.close()
+
+
+class OpenAIBatchBackend:
+    def __init__(self, client=None, completion_window="24h"):
+        """
+        Submit JSONL files to the OpenAI Batch API through the shared LLMClient.
+        """
+        if client is None:
+            from llm_client import get_client
+
+            client = get_client()
+        self.client = client.sync_client
+        self.completion_window = completion_window
+
+    def submit(self, path):
+        with open(path, "rb") as f:
+            upload = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        """
+        Result lines of a finished batch, from both its output and its error file.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(json.loads(line) for line in self.client.files.content(file_id).text.splitlines() if line)
+        return lines
+
+
+class LocalBatchBackend:
+    def __init__(self, create=None, workdir=".batch", delay=0.0):
+        """
+        In-process stand-in for the Batch API, for tests and dry runs.
+        A batch completes `delay` seconds after submission, the first time its status
+        is checked; `create(**body)` answers each request (a canned reply by default).
+        Jobs live in `workdir`, so they survive a restart of the process.
+        """
+        self.create = create or stand_in_completion
+        self.workdir = workdir
+        self.delay = delay
+        os.makedirs(workdir, exist_ok=True)
+
+    def _path(self, batch_id, kind):
+        return os.path.join(self.workdir, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, path):
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        with open(path) as src, open(self._path(batch_id, "input"), "w") as dst:
+            dst.write(src.read())
+        return batch_id
+
+    def status(self, batch_id):
+        if os.path.exists(self._path(batch_id, "output")):
+            return "completed"
+        input_path = self._path(batch_id, "input")
+        if not os.path.exists(input_path):
+            return "expired"  # Lost, e.g. a cleaned-up workdir
+        if time.time() - os.path.getmtime(input_path) < self.delay:
+            return "in_progress"
+        self._process(batch_id)
+        return "completed"
+
+    def _process(self, batch_id):
+        lines = []
+        with open(self._path(batch_id, "input")) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    body = self.create(**request["body"])
+                    lines.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None})
+                except Exception as exc:
+                    status = getattr(exc, "status_code", None) or 500
+                    lines.append({"custom_id": request["custom_id"], "response": {"status_code": status, "body": None},
+                                  "error": {"message": str(exc)}})
+        with open(self._path(batch_id, "output") + ".tmp", "w") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+        os.replace(self._path(batch_id, "output") + ".tmp", self._path(batch_id, "output"))
+
+    def results(self, batch_id):
+        path = self._path(batch_id, "output")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def stand_in_completion(model, messages, **params):
+    """
+    Canned chat completion used by LocalBatchBackend when no `create` is given.
+    """
+    prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+    content = f"[batch stand-in] {model} analysis"
+    return {
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 8, "total_tokens": prompt_tokens + 8},
+    }
+
+
+class BatchRunner:
+    def __init__(self, backend, store, workdir=".batch", poll_interval=60.0, max_batch_size=50000, max_attempts=3):
+        """
+        Drive a run to completion: submit pending items in batches of at most
+        `max_batch_size`, poll open batches every `poll_interval` seconds and
+        store results as they arrive. Items are tried at most `max_attempts` times.
+        """
+        self.backend = backend
+        self.store = store
+        self.workdir = workdir
+        self.poll_interval = poll_interval
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        os.makedirs(workdir, exist_ok=True)
+
+    def run(self, run_id, requests=None):
+        """
+        Run (or resume) `run_id` and return its outcomes (see JobStore.outcomes).
+        `requests` are (custom_id, body) pairs; they can be omitted when resuming.
+        """
+        if requests is not None:
+            self.store.add(run_id, requests)
+        while True:
+            self.submit_pending(run_id)
+            for batch_id in self.store.open_batches(run_id):
+                status = self.backend.status(batch_id)
+                if status in FINAL_STATUSES:
+                    self.collect(run_id, batch_id, status)
+            if not self.store.open_batches(run_id) and not self.store.pending(run_id, self.max_attempts):
+                return self.store.outcomes(run_id)
+            if self.store.open_batches(run_id):
+                time.sleep(self.poll_interval)
+
+    def submit_pending(self, run_id):
+        pending = self.store.pending(run_id, self.max_attempts)
+        for start in range(0, len(pending), self.max_batch_size):
+            chunk = pending[start:start + self.max_batch_size]
+            path = os.path.join(self.workdir, f"{run_id}-{uuid.uuid4().hex[:8]}.jsonl")
+            with open(path, "w") as f:
+                for custom_id, body in chunk:
+                    f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n")
+            batch_id = self.backend.submit(path)
+            self.store.mark_submitted(run_id, batch_id, [custom_id for custom_id, _ in chunk])
+
+    def collect(self, run_id, batch_id, status):
+        for line in self.backend.results(batch_id):
+            response = line.get("response") or {}
+            if response.get("status_code") == 200 and not line.get("error"):
+                self.store.complete(run_id, line["custom_id"], response["body"])
+                continue
+            error = (line.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+            retry = response.get("status_code") in RETRYABLE_ITEM_STATUSES
+            self.store.fail(run_id, line["custom_id"], error, retry=retry)
+        self.store.close_batch(run_id, batch_id, status)
+
+
+def analysis_requests(aspects, snapshots):
+    """
+    One batch request per (company, aspect), with the same prompt and model as the interactive analyses.
+    """
+    return [
+        (f"{aspect.key}:{company}", {"model": aspect.model, "messages": [{"role": "system", "content": aspect.prompt(company, data)}]})
+        for company, data in snapshots
+        for aspect in aspects
+    ]
+
+
+def analysis_results(aspects, outcomes):
+    """
+    Turn batch outcomes back into the interactive output lines.
+    """
+    by_key = {aspect.key: aspect for aspect in aspects}
+    results = []
+    for custom_id, response, error in outcomes:
+        key, _, company = custom_id.partition(":")
+        aspect = by_key[key]
+        if response is not None:
+            results.append(f"{aspect.title} for {company}: {response['choices'][0]['message']['content']}")
+        else:
+            results.append(f"{aspect.analysis.__name__} failed for {company}: {error}")
+    return results
@@ -0,0 +1,109 @@
+"""
+Run time and completeness of market analyses and support turns, with and without deadlines.
+
+Run from the repository root:
+    python -m benchmarks.bench_deadline --companies 25 --runs 5 --deadlines 1,2
+
+Runs against the local mock chat-completion server with a long-tailed (log-normal)
+latency, drawn independently for every request, and with the response cache and
+hedging disabled, so each slow call is felt in full:
+  - market:  --runs fan-out analyses of --companies synthetic companies
+             (parallel_market_analysis); a run lasts as long as its slowest call
+  - support: --rounds support turns (support_turn, speculative follow-up)
+Each is run without a deadline and then under each of --deadlines (seconds). Reported:
+p50 and max run (or turn) time, the share of analyses completed (market) or of turns
+answered in full (support), and how many steps timed out.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_fused import make_market_data
+from mock_llm import MockLLMServer, parse_latency
+
+
+def report(label, samples, completed, total, timeouts):
+    p50 = statistics.median(samples)
+    print(f"{label:<20} {len(samples):>5} {p50 * 1000:>8.0f}ms {max(samples) * 1000:>8.0f}ms "
+          f"{completed / total:>9.1%} {timeouts:>8}")
+
+
+async def run_market(module, args, deadline):
+    samples = []
+    completed = timeouts = 0
+    for run in range(args.runs):
+        module.market_data = make_market_data(args.companies, seed=run)
+        started = time.perf_counter()
+        results = await module.parallel_market_analysis(deadline=deadline)
+        samples.append(time.perf_counter() - started)
+        late = sum(" timed out for " in text for text in results)
+        timeouts += late
+        completed += len(results) - late
+    total = args.runs * args.companies * len(module.MARKET_ASPECTS)
+    report(f"market {deadline or 'no'} deadline", samples, completed, total, timeouts)
+
+
+async def run_support(module, args, deadline):
+    samples = []
+    complete = timeouts = 0
+    for i in range(args.rounds):
+        started = time.perf_counter()
+        result = await module.support_turn(f"My order number {i} hasn't arrived yet", deadline=deadline)
+        samples.append(time.perf_counter() - started)
+        statuses = result["run"].statuses.values()
+        timeouts += sum(status == "timeout" for status in statuses)
+        complete += result["run"].complete
+    report(f"support {deadline or 'no'} deadline", samples, complete, args.rounds, timeouts)
+
+
+async def run_all(market, support, args):
+    for deadline in [None] + args.deadlines:
+        await run_market(market, args, deadline)
+    for deadline in [None] + args.deadlines:
+        await run_support(support, args, deadline)
+
+
+def run_benchmark(args):
+    mock = MockLLMServer(latency=args.latency, reply=" ".join(["insight"] * 40), seed=args.seed).start_in_thread()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from llm_scheduler import ModelLimits
+        from workflows import load_script
+
+        market = load_script("market")
+        support = load_script("support")
+        for module in (market, support):
+            module.llm.completion.cache.max_bytes = 0
+        market.hedger.policy.max_hedges = 0
+        lifted = ModelLimits(max_concurrency=64, requests_per_minute=10 ** 7, tokens_per_minute=10 ** 10)
+        market.scheduler.limits = {model: lifted for model in market.scheduler.limits}
+
+        print(f"mock latency={args.latency!r} companies={args.companies} runs={args.runs} "
+              f"support rounds={args.rounds}")
+        print(f"{'mode':<20} {'runs':>5} {'p50':>10} {'max':>10} {'completed':>9} {'timeouts':>8}")
+        asyncio.run(run_all(market, support, args))
+    finally:
+        mock.stop_thread()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=25)
+    parser.add_argument("--runs", type=int, default=5, help="market runs per mode")
+    parser.add_argument("--rounds", type=int, default=20, help="support turns per mode")
+    parser.add_argument("--deadlines", type=lambda text: [float(n) for n in text.split(",")], default=[1.0, 2.0],
+                        help="comma-separated deadlines to compare, in seconds")
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("lognormal:0.2,1.0"),
+                        help='mock latency: "0.05", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA"')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Prompt size and retrieval latency per support turn as the FAQ count grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_faq_index --sizes 4 100 1000 5000
+
+Compares shipping every FAQ in the system prompt (the original behaviour)
+with the top-k context from FAQIndex, using the lexical (BM25) index.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from faq_index import FAQIndex, format_faq
+
+TOPICS = ["password", "invoice", "shipping", "refund", "account", "order", "login", "subscription",
+          "payment", "delivery", "warranty", "coupon", "address", "email", "mobile", "security"]
+ACTIONS = ["reset", "change", "cancel", "update", "track", "find", "download", "verify", "contact", "renew"]
+
+QUERIES = [
+    "I forgot my password and can't log in",
+    "where is my order?",
+    "how can I get a refund for a damaged item",
+    "update the shipping address on my account",
+    "how do I cancel my subscription",
+]
+
+
+def synthetic_faqs(count, seed=0):
+    rng = random.Random(seed)
+    faqs = {}
+    for i in range(count):
+        topic, action = rng.choice(TOPICS), rng.choice(ACTIONS)
+        steps = "\n".join(f"{n}. {rng.choice(ACTIONS).title()} the {rng.choice(TOPICS)} settings" for n in range(1, 5))
+        faqs[f"faq_{i}"] = {
+            "question": f"How do I {action} my {topic} ({i})?",
+            "answer": f"To {action} your {topic}, follow these steps:\n{steps}",
+        }
+    return faqs
+
+
+def tokens(text):
+    return len(text) // 4
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 100, 1000, 5000])
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'faqs':>6}{'build ms':>10}{'full tokens':>13}{'top-k tokens':>14}{'p50 us':>9}{'p99 us':>9}")
+    for size in args.sizes:
+        faqs = synthetic_faqs(size)
+        started = time.perf_counter()
+        index = FAQIndex(faqs)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        full_tokens = tokens("\n".join(format_faq(faq) for faq in faqs.values()))
+        topk_tokens = []
+        latencies = []
+        for _ in range(args.repeat):
+            for query in QUERIES:
+                started = time.perf_counter()
+                context = index.context(query, k=args.top_k)
+                latencies.append((time.perf_counter() - started) * 1e6)
+                topk_tokens.append(tokens(context))
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"{size:>6}{build_ms:>10.1f}{full_tokens:>13}{statistics.mean(topk_tokens):>14.0f}"
+              f"{statistics.median(latencies):>9.0f}{p99:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
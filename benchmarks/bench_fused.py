@@ -0,0 +1,99 @@
+"""
+Request count, tokens and wall time of the fan-out and fused market analysis modes.
+
+Run from the repository root:
+    python -m benchmarks.bench_fused --companies 40 --companies-per-call 4
+
+Runs workflow_parallelization.py against the local mock chat-completion server
+for --companies synthetic companies, once per mode and each time on an empty
+cache. Rate limits are lifted unless --rate-limited is given, in which case the
+scheduler's default per-model limits apply. The mock's latency is per request
+and ignores the answer length, so the wall-time gain of fused calls is an upper bound.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from mock_llm import MockLLMServer
+
+
+def make_market_data(count, seed=0):
+    rng = random.Random(seed)
+    return {
+        f"Company {i}": {
+            "Current Stock Price": round(rng.uniform(50, 500), 2),
+            "Quarterly Revenue (Billions)": round(rng.uniform(10, 100), 2),
+            "Market Sentiment": rng.choice(["Strongly Bullish", "Neutral", "Strongly Bearish"]),
+            "Investment Risk Level": {"score": round(rng.uniform(1, 10), 1), "category": "Moderate Risk"},
+        }
+        for i in range(count)
+    }
+
+
+async def run_mode(module, mock, mode, companies_per_call):
+    import llm_metrics
+
+    module.llm.completion.cache.clear()
+    requests_before = mock.request_count
+    fallbacks_before = module.fused_analyzer.counters["fallbacks"]
+    mark = llm_metrics.default_recorder.mark()
+    started = time.perf_counter()
+    results = await module.parallel_market_analysis(mode=mode, companies_per_call=companies_per_call)
+    elapsed = time.perf_counter() - started
+    spans = llm_metrics.default_recorder.since(mark)
+    return {
+        "results": len(results),
+        "requests": mock.request_count - requests_before,
+        "prompt_tokens": sum(span.prompt_tokens for span in spans),
+        "completion_tokens": sum(span.completion_tokens for span in spans),
+        "queue": sum(span.queue_time for span in spans),
+        "wall": elapsed,
+        "fallbacks": module.fused_analyzer.counters["fallbacks"] - fallbacks_before,
+    }
+
+
+async def run_benchmark(args):
+    async with MockLLMServer(latency=args.latency, reply=" ".join(["insight"] * args.reply_tokens)) as mock:
+        # The script reads these when it is loaded
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from llm_scheduler import ModelLimits
+        from workflows import load_script
+
+        module = load_script("market")
+        module.market_data = make_market_data(args.companies)
+        if not args.rate_limited:
+            unlimited = ModelLimits(max_concurrency=256, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)
+            module.scheduler.limits = {model: unlimited for model in module.scheduler.limits}
+
+        print(f"companies={args.companies} mock latency={args.latency * 1000:.0f} ms "
+              f"limits={'scheduler defaults' if args.rate_limited else 'lifted'}")
+        print(f"{'mode':<22} {'results':>7} {'requests':>8} {'prompt tok':>10} {'compl tok':>10} "
+              f"{'queue':>8} {'wall':>8} {'fallbacks':>9}")
+        modes = [("fanout", 1), ("fused", 1)]
+        if args.companies_per_call > 1:
+            modes.append(("fused", args.companies_per_call))
+        for mode, per_call in modes:
+            row = await run_mode(module, mock, mode, per_call)
+            label = mode if mode == "fanout" else f"fused ({per_call}/call)"
+            print(f"{label:<22} {row['results']:>7} {row['requests']:>8} {row['prompt_tokens']:>10} "
+                  f"{row['completion_tokens']:>10} {row['queue']:>7.2f}s {row['wall']:>7.2f}s {row['fallbacks']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=40)
+    parser.add_argument("--companies-per-call", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.3, help="mock LLM latency in seconds")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="words per answer (per aspect in fused mode)")
+    parser.add_argument("--rate-limited", action="store_true", help="keep the scheduler's default per-model limits")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Tail latency of LLM calls with and without hedged requests.
+
+Run from the repository root:
+    python -m benchmarks.bench_hedge --companies 100 --rounds 200
+
+Runs against the local mock chat-completion server with a long-tailed (log-normal)
+latency, drawn independently for every request, and the response cache disabled:
+  - market:  the analyses of --companies synthetic companies (async, through the
+             scheduler), --batch companies at a time; latency per analysis
+  - hybrid:  --rounds streamed calls of HybridLLMApp.step_3_execute_action (blocking);
+             latency per call
+Each is run without hedging and then hedging at each --percentiles trigger, every
+time after a warm-up that fills the latency tracker. "extra" is the share of
+additional requests the hedges cost.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_fused import make_market_data
+from mock_llm import MockLLMServer, parse_latency
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(sorted(samples), n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def reset(hedger, percentile):
+    from llm_hedge import LatencyTracker
+
+    hedger.tracker = LatencyTracker()
+    hedger.policy.percentile = percentile or 95
+    hedger.policy.max_hedges = 1 if percentile else 0
+    for name in hedger.counters:
+        hedger.counters[name] = 0
+
+
+def report(label, samples, hedger, calls):
+    p50, p95, p99 = percentiles(samples)
+    counters = hedger.counters
+    print(f"{label:<24} {len(samples):>6} {p50 * 1000:>7.0f}ms {p95 * 1000:>7.0f}ms {p99 * 1000:>7.0f}ms "
+          f"{counters['hedged']:>7} {counters['hedge_wins']:>5} {(calls / len(samples) - 1) * 100:>6.1f}%")
+
+
+async def analyze_in_batches(module, market_data, batch):
+    # A steady, light load, so latencies come from the backend rather than from queueing
+    items = list(market_data.items())
+    for start in range(0, len(items), batch):
+        await module.analyze_companies(items[start:start + batch])
+
+
+async def run_market(module, mock, args, percentile):
+    import llm_metrics
+
+    reset(module.hedger, percentile)
+    # Warm-up: enough calls per model for the tracker's percentiles
+    await analyze_in_batches(module, make_market_data(args.warmup, seed=1), args.batch)
+    mark = llm_metrics.default_recorder.mark()
+    requests = mock.request_count
+    await analyze_in_batches(module, make_market_data(args.companies), args.batch)
+    spans = llm_metrics.default_recorder.since(mark)
+    report(f"market {f'p{percentile}' if percentile else 'no hedge'}", [span.latency for span in spans],
+           module.hedger, mock.request_count - requests)
+
+
+def run_hybrid(module, mock, args, percentile):
+    app = module.HybridLLMApp()
+    reset(module.hedger, percentile)
+    for i in range(args.warmup):
+        app.step_3_execute_action(f"warm-up topic {i}", 1, stream=True).read()
+    samples = []
+    requests = mock.request_count
+    for i in range(args.rounds):
+        started = time.perf_counter()
+        app.step_3_execute_action(f"topic {i}", 1, stream=True).read()
+        samples.append(time.perf_counter() - started)
+    report(f"hybrid {f'p{percentile}' if percentile else 'no hedge'}", samples, module.hedger,
+           mock.request_count - requests)
+
+
+async def run_markets(module, mock, args):
+    for percentile in [None] + args.percentiles:
+        await run_market(module, mock, args, percentile)
+
+
+def run_benchmark(args):
+    mock = MockLLMServer(latency=args.latency, reply=" ".join(["insight"] * 40), seed=args.seed).start_in_thread()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from llm_scheduler import ModelLimits
+        from workflows import load_script
+
+        market = load_script("market")
+        hybrid = load_script("hybrid")
+        for module in (market, hybrid):
+            module.llm.completion.cache.max_bytes = 0
+        lifted = ModelLimits(max_concurrency=64, requests_per_minute=10 ** 7, tokens_per_minute=10 ** 10)
+        market.scheduler.limits = {model: lifted for model in market.scheduler.limits}
+
+        print(f"mock latency={args.latency!r} companies={args.companies} hybrid rounds={args.rounds}")
+        print(f"{'mode':<24} {'calls':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'hedged':>7} {'won':>5} {'extra':>7}")
+        asyncio.run(run_markets(market, mock, args))
+        for percentile in [None] + args.percentiles:
+            run_hybrid(hybrid, mock, args, percentile)
+    finally:
+        mock.stop_thread()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200, help="hybrid step calls per mode")
+    parser.add_argument("--warmup", type=int, default=25, help="warm-up companies (market) or calls (hybrid)")
+    parser.add_argument("--percentiles", type=lambda text: [int(n) for n in text.split(",")], default=[90, 95],
+                        help="comma-separated hedge triggers to compare")
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("lognormal:0.05,1.0"),
+                        help='mock latency: "0.05", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA"')
+    parser.add_argument("--batch", type=int, default=2, help="market: companies analyzed at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
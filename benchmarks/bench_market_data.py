@@ -0,0 +1,68 @@
+"""
+Compare the old serial market-data loop with the batched, streamed fetch.
+
+Run from the repository root:
+    python -m benchmarks.bench_market_data --tickers 200
+
+Uses FakeMarketDataProvider, so no network access is needed.
+"""
+import argparse
+import asyncio
+import time
+
+from market_data import FakeMarketDataProvider, build_snapshot, stream_stock_data
+
+
+def serial_fetch(provider, company_tickers):
+    """
+    The original get_stock_data loop: one price call and two info lookups per ticker.
+    """
+    stock_data = {}
+    for company, ticker in company_tickers.items():
+        price = provider.fetch_prices([ticker])[ticker]
+        # The original code read `stock.info` twice, each a separate round trip
+        revenue_info = provider.fetch_info(ticker)
+        beta_info = provider.fetch_info(ticker)
+        info = {"totalRevenue": revenue_info["totalRevenue"], "beta": beta_info["beta"]}
+        stock_data[company] = build_snapshot(price, info)
+    return stock_data
+
+
+async def streamed_fetch(provider, company_tickers, batch_size, workers):
+    started = time.monotonic()
+    first = None
+    count = 0
+    async for _ in stream_stock_data(provider, company_tickers, batch_size=batch_size, max_workers=workers):
+        if first is None:
+            first = time.monotonic() - started
+        count += 1
+    return first, time.monotonic() - started, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--price-latency", type=float, default=0.2)
+    parser.add_argument("--info-latency", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--skip-serial", action="store_true", help="skip the slow serial baseline")
+    args = parser.parse_args()
+
+    company_tickers = {f"Company {i}": f"T{i:05d}" for i in range(args.tickers)}
+
+    if not args.skip_serial:
+        provider = FakeMarketDataProvider(args.price_latency, args.info_latency)
+        started = time.monotonic()
+        serial_fetch(provider, company_tickers)
+        elapsed = time.monotonic() - started
+        print(f"serial:   total {elapsed:7.2f}s  price calls {provider.price_calls:5d}  info calls {provider.info_calls:5d}")
+
+    provider = FakeMarketDataProvider(args.price_latency, args.info_latency)
+    first, elapsed, count = asyncio.run(streamed_fetch(provider, company_tickers, args.batch_size, args.workers))
+    print(f"streamed: total {elapsed:7.2f}s  price calls {provider.price_calls:5d}  info calls {provider.info_calls:5d}"
+          f"  first ticker after {first:.2f}s ({count} tickers)")
+
+
+if __name__ == "__main__":
+    main()
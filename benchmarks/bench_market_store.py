@@ -0,0 +1,155 @@
+"""
+Open time, memory and feature computation of the columnar market store, against nested dicts.
+
+Run from the repository root:
+    python -m benchmarks.bench_market_store --tickers 10000 --snapshots 250 --window 20
+
+Writes a synthetic universe (random-walk prices, revenue, beta and sentiment) to a
+temporary MarketStore, then reports: the time to open it and its resident memory, the
+time to compute the features of every ticker over the last --window snapshots, and the
+time to build the stock price prompts of every ticker from the feature table. The baseline
+keeps the same window as the nested dicts the scripts used ({ticker: [snapshot, ...]}),
+saved as JSON: its load time and memory, and the same features computed in Python.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from market_store import MarketStore
+
+
+def rss_mb():
+    # Resident memory of this process (Linux); None elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return None
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, result
+
+
+def synthetic_universe(tickers, snapshots, seed):
+    rng = np.random.default_rng(seed)
+    price = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (snapshots, tickers)), axis=0))
+    revenue = 1e9 * np.exp(np.cumsum(rng.normal(0, 0.001, (snapshots, tickers)), axis=0))
+    beta = np.round(1 + np.cumsum(rng.normal(0, 0.01, (snapshots, tickers)), axis=0), 2)
+    sentiment = rng.choice([-1.0, -0.5, 0.0, 0.5, 1.0], (snapshots, tickers))
+    return {"price": price, "revenue": revenue, "beta": beta, "sentiment": sentiment}
+
+
+def python_features(history):
+    """
+    The features of MarketStore.features, computed per ticker from a list of snapshot dicts.
+    """
+    features = {}
+    for ticker, snapshots in history.items():
+        prices = [snapshot["price"] for snapshot in snapshots]
+        returns = [math.log(b / a) for a, b in zip(prices, prices[1:])]
+        mean = sum(returns) / len(returns)
+        features[ticker] = {
+            "price": prices[-1],
+            "return": prices[-1] / prices[-2] - 1,
+            "window_return": prices[-1] / prices[0] - 1,
+            "volatility": math.sqrt(sum((r - mean) ** 2 for r in returns) / len(returns)),
+            "revenue_change": snapshots[-1]["revenue"] / snapshots[0]["revenue"] - 1,
+            "beta_change": snapshots[-1]["beta"] - snapshots[0]["beta"],
+            "sentiment_change": snapshots[-1]["sentiment"] - snapshots[0]["sentiment"],
+        }
+    return features
+
+
+def stock_price_prompts(module, features):
+    """
+    The real-time script's stock price prompt of every ticker, reading its history from `features`.
+    """
+    module.market_features = features
+    module.company_tickers = {ticker: ticker for ticker in features.tickers}
+    prices = features.columns["price"].tolist()
+    return [module.stock_price_prompt(ticker, {"Stock Price": price}) for ticker, price in zip(features.tickers, prices)]
+
+
+def run_benchmark(args):
+    root = tempfile.mkdtemp()
+    try:
+        compare(root, args)
+    finally:
+        shutil.rmtree(root)
+
+
+def compare(root, args):
+    tickers = [f"T{i:05d}" for i in range(args.tickers)]
+    columns = synthetic_universe(args.tickers, args.snapshots, args.seed)
+
+    started = time.perf_counter()
+    store = MarketStore(os.path.join(root, "store"))
+    store.add_tickers(tickers)
+    store.extend(time.time() + np.arange(args.snapshots), columns)
+    written = time.perf_counter() - started
+    size = sum(os.path.getsize(os.path.join(store.path, name)) for name in os.listdir(store.path))
+    del store
+
+    history = {ticker: [{field: float(columns[field][t, i]) for field in columns}
+                        for t in range(args.snapshots - args.window, args.snapshots)]
+               for i, ticker in enumerate(tickers)}
+    json_path = os.path.join(root, "history.json")
+    with open(json_path, "w") as f:
+        json.dump(history, f)
+    del history, columns
+
+    print(f"{args.tickers} tickers x {args.snapshots} snapshots, window {args.window}: "
+          f"store written in {written * 1000:.0f}ms, {size / 2 ** 20:.1f} MB on disk; "
+          f"baseline JSON of the window {os.path.getsize(json_path) / 2 ** 20:.1f} MB")
+    print(f"{'':<16} {'open':>9} {'memory':>9} {'features':>10} {'prompts':>9}")
+
+    from workflows import load_script
+
+    module = load_script("market-live")
+    before = rss_mb()
+    open_ms, store = timed(lambda: MarketStore(os.path.join(root, "store")), args.repeat)
+    features_ms, features = timed(lambda: store.features(args.window), args.repeat)
+    memory = rss_mb()
+    prompts_ms, _ = timed(lambda: stock_price_prompts(module, features), 1)
+    print(f"{'columnar store':<16} {open_ms:>7.1f}ms {memory - before if before else 0:>7.1f}MB {features_ms:>8.1f}ms "
+          f"{prompts_ms:>7.0f}ms")
+
+    before = rss_mb()
+
+    def load():
+        with open(json_path) as f:
+            return json.load(f)
+
+    load_ms, history = timed(load, 1)
+    features_ms, features = timed(lambda: python_features(history), 1)
+    memory = rss_mb()
+    print(f"{'nested dicts':<16} {load_ms:>7.1f}ms {memory - before if before else 0:>7.1f}MB {features_ms:>8.1f}ms "
+          f"{'-':>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", type=int, default=10000)
+    parser.add_argument("--snapshots", type=int, default=250, help="history length in the store")
+    parser.add_argument("--window", type=int, default=20, help="snapshots the features look back over")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of the store's open and features; the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
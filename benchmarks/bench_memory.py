@@ -0,0 +1,113 @@
+"""
+Prompt tokens per turn of the agent over a long conversation, with and without conversation memory.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory --turns 150
+
+Plays --turns user messages through SimpleAutonomousAgent.generate_response
+against the local mock chat-completion server, three times:
+  - windowed:  ConversationMemory with a --budget token window and background summaries
+  - full:      every earlier turn sent verbatim (a memory whose budget is never reached)
+  - stateless: no history at all, as before conversation memory
+Prompt tokens are the mock's usage counts (about four characters per token).
+The report also checks that the system prompt is the byte-identical first
+message of every call, which is what provider-side prompt caching keys on.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from mock_llm import MockLLMServer
+
+BUCKETS = [(1, 10), (11, 25), (26, 50), (51, 100), (101, 150), (151, 300), (301, 1000)]
+
+
+def run_conversation(agent, memory, turns):
+    import llm_metrics
+
+    rows = []
+    for turn in range(1, turns + 1):
+        user_input = f"Turn {turn}: tell me one more thing about topic number {turn} and how it relates to the last one."
+        mark = llm_metrics.default_recorder.mark()
+        started = time.perf_counter()
+        reply = agent.generate_response(user_input, memory=memory)
+        elapsed = time.perf_counter() - started
+        if memory is not None:
+            memory.add_exchange(user_input, reply)
+        spans = [span for span in llm_metrics.default_recorder.since(mark) if span.step == "generate_response"]
+        rows.append((turn, spans[-1].prompt_tokens, elapsed))
+    return rows
+
+
+def report(label, rows, memory, prefix_stable):
+    print(f"\n{label}")
+    print(f"{'turns':<10} {'prompt tok/turn':>16} {'max':>6} {'latency':>9}")
+    for low, high in BUCKETS:
+        bucket = [row for row in rows if low <= row[0] <= high]
+        if not bucket:
+            continue
+        tokens = [row[1] for row in bucket]
+        print(f"{f'{low}-{high}':<10} {statistics.mean(tokens):>16.0f} {max(tokens):>6} "
+              f"{statistics.mean(row[2] for row in bucket) * 1000:>7.1f}ms")
+    if memory is not None:
+        counters = memory.counters
+        print(f"compactions={counters['compactions']} compacted turns={counters['compacted_turns']} "
+              f"blocked on a summary={counters['blocked']} errors={counters['errors']} "
+              f"window now={memory.window_tokens()} tok")
+    print(f"system prompt byte-identical first message on every call: {prefix_stable}")
+
+
+def run_benchmark(args):
+    import asyncio
+    import threading
+
+    loop = asyncio.new_event_loop()
+    mock = MockLLMServer(latency=args.latency, reply=" ".join(["detail"] * args.reply_words))
+    loop.run_until_complete(mock.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from conversation import ConversationMemory
+        from llm_client import get_client
+        from workflows import load_script
+
+        module = load_script("agent")
+        agent = module.SimpleAutonomousAgent(module.system_prompt)
+        first_messages = []
+        get_client().add_request_hook(lambda params: first_messages.append(params["messages"][0]["content"]))
+
+        print(f"turns={args.turns} budget={args.budget} tok mock latency={args.latency * 1000:.0f} ms "
+              f"reply={args.reply_words} words")
+        modes = [
+            ("windowed", ConversationMemory(agent.summarize_history, max_tokens=args.budget)),
+            ("full", ConversationMemory(agent.summarize_history, max_tokens=10 ** 12)),
+            ("stateless", None),
+        ]
+        for label, memory in modes:
+            del first_messages[:]
+            module.llm.completion.cache.clear()  # Same inputs in every mode; don't answer them from the cache
+            rows = run_conversation(agent, memory, args.turns)
+            # Summaries use their own prompt; every other call must start with the system prompt
+            stable = all(m == module.system_prompt for m in first_messages if not m.startswith("Below is the summary"))
+            report(label, rows, memory, stable)
+    finally:
+        asyncio.run_coroutine_threadsafe(mock.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=150)
+    parser.add_argument("--budget", type=int, default=2000, help="token window of the conversation memory")
+    parser.add_argument("--latency", type=float, default=0.01, help="mock LLM latency in seconds")
+    parser.add_argument("--reply-words", type=int, default=80, help="words per mock answer")
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Escalation rate and routing latency of the HybridLLMApp action router.
+
+Run from the repository root:
+    python -m benchmarks.bench_router --inputs 2000
+
+Escalations go to a stub that sleeps for --llm-latency seconds instead of
+calling the LLM. The second pass repeats the same inputs to show cache hits.
+"""
+import argparse
+import random
+import time
+
+from router import (
+    ACTION_EXAMPLES,
+    ACTION_RULES,
+    CLARIFY,
+    HashedNgramClassifier,
+    RegexRouter,
+    RoutingEngine,
+)
+
+TOPICS = ["photosynthesis", "the stock market", "kubernetes", "the roman empire", "neural networks",
+          "climate change", "sourdough bread", "a home network", "the french revolution", "git rebase",
+          "jazz history", "a marathon", "tax returns", "black holes", "a job interview", "python decorators"]
+TEMPLATES = [
+    "{topic}", "explain {topic}", "tell me about {topic}", "how to set up {topic}", "how do I prepare for {topic}",
+    "steps to learn {topic}", "what is {topic}?", "who invented {topic}?", "when did {topic} start?",
+    "is {topic} hard to learn?", "{topic} in detail", "guide for {topic}", "the basics of {topic}",
+    "hmm", "help", "stuff", "I want to know things",
+]
+
+
+def make_inputs(count, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES).format(topic=rng.choice(TOPICS)) for _ in range(count)]
+
+
+def report(label, engine):
+    stats = engine.stats()
+    decided = stats["local"] + stats["escalated"]
+    uncached_rate = stats["escalated"] / decided if decided else 0.0
+    print(f"{label:<8}local {stats['local']:>6}  cached {stats['cached']:>6}  escalated {stats['escalated']:>6}"
+          f"  escalation rate {stats['escalation_rate']:6.1%} ({uncached_rate:.1%} of uncached)  p50 {stats['p50_us']:8.1f} us  p99 {stats['p99_us']:10.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per escalated call")
+    args = parser.parse_args()
+
+    def escalate(text):
+        time.sleep(args.llm_latency)
+        return CLARIFY
+
+    started = time.perf_counter()
+    engine = RoutingEngine(
+        [RegexRouter(ACTION_RULES), HashedNgramClassifier(ACTION_EXAMPLES)],
+        escalate=escalate,
+        threshold=args.threshold,
+    )
+    print(f"router built in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    inputs = make_inputs(args.inputs)
+    for text in inputs:
+        engine.route(text)
+    report("pass 1", engine)
+
+    engine.counts = dict.fromkeys(engine.counts, 0)
+    engine.latencies = []
+    for text in inputs:
+        engine.route(text)
+    report("pass 2", engine)
+
+
+if __name__ == "__main__":
+    main()
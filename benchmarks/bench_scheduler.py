@@ -0,0 +1,67 @@
+"""
+Benchmark the LLM scheduler against the local fake chat-completion server.
+
+Run from the repository root:
+    python -m benchmarks.bench_scheduler --requests 300 --rpm 600
+
+The achieved requests/min per model should settle at the configured limit.
+"""
+import argparse
+import asyncio
+import time
+
+from llm_scheduler import LLMScheduler, ModelLimits
+from mock_llm import MockLLMServer, post_chat_completion
+
+MODELS = ["gpt-4-turbo", "gpt-3.5-turbo-16k", "gpt-4", "gpt-3.5-turbo"]
+
+
+async def run_benchmark(total_requests, rpm, tpm, concurrency, latency):
+    async with MockLLMServer(latency=latency) as server:
+
+        async def create(**params):
+            return await post_chat_completion(server.base_url, **params)
+
+        limits = {
+            model: ModelLimits(max_concurrency=concurrency, requests_per_minute=rpm, tokens_per_minute=tpm)
+            for model in MODELS
+        }
+        scheduler = LLMScheduler(create=create, limits=limits)
+        messages = [{"role": "system", "content": "Analyze the current stock price for ACME." * 4}]
+
+        completed_at = {model: [] for model in MODELS}
+
+        async def one(model):
+            await scheduler.chat(model=model, messages=messages, max_tokens=16)
+            completed_at[model].append(time.monotonic())
+
+        started = time.monotonic()
+        await asyncio.gather(*(one(MODELS[i % len(MODELS)]) for i in range(total_requests)))
+        elapsed = time.monotonic() - started
+
+    print(f"{total_requests} requests in {elapsed:.2f}s "
+          f"(limit {rpm} req/min and {concurrency} in flight per model, {latency * 1000:.0f} ms latency)")
+    print(f"{'model':<20}{'requests':>10}{'req/min':>12}{'retries':>10}")
+    stats = scheduler.stats()
+    for model in MODELS:
+        times = completed_at[model]
+        # Measure the sustained rate after the initial burst has been spent
+        steady = times[len(times) // 2:]
+        window = steady[-1] - steady[0] if len(steady) > 1 else elapsed
+        rate = (len(steady) - 1) / window * 60 if window else float("nan")
+        print(f"{model:<20}{len(times):>10}{rate:>12.1f}{stats[model]['retries']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rpm", type=int, default=600, help="requests per minute per model")
+    parser.add_argument("--tpm", type=int, default=1_000_000, help="tokens per minute per model")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight requests per model")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake server latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.requests, args.rpm, args.tpm, args.concurrency, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Load-test the workflow server against the local mock LLM endpoint.
+
+Run from the repository root:
+    python -m benchmarks.bench_server --sessions 1000 --turns 3 --app support
+
+Starts the mock chat-completion server and the workflow server in this
+process, opens --sessions concurrent sessions and reports throughput,
+tail latency and rejected (503) turns; with --turn-deadline, also the turns that ran
+out of time (504).
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from mock_llm import MockLLMServer
+
+INPUTS = {
+    "agent": "What is the best way to learn topic {n}?",
+    "workflow": "topic number {n}",
+    "hybrid": "how to set up project {n}",
+    "support": "My order {n} has not arrived, what should I do?",
+}
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+async def run_session(client, base_url, app, turns, session_number, latencies, statuses):
+    async with client.post(f"{base_url}/sessions", json={"app": app}) as response:
+        session_id = (await response.json())["session_id"]
+    for turn in range(turns):
+        text = INPUTS[app].format(n=f"{session_number}-{turn}")
+        started = time.perf_counter()
+        async with client.post(f"{base_url}/sessions/{session_id}/turns", json={"text": text}) as response:
+            await response.read()
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if response.status == 200:
+                latencies.append(time.perf_counter() - started)
+
+
+async def run_benchmark(args):
+    async with MockLLMServer(latency=args.latency, reply=" ".join(["token"] * args.reply_tokens)) as mock:
+        # The scripts read these when they are loaded by the server
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from server import WorkflowServer
+
+        server = WorkflowServer(max_workers=args.workers, max_queue=args.max_queue,
+                                turn_deadline=args.turn_deadline, max_async_turns=args.async_turns)
+        runner = web.AppRunner(server.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+        latencies = []
+        statuses = {}
+        connector = aiohttp.TCPConnector(limit=args.sessions)
+        async with aiohttp.ClientSession(connector=connector) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                run_session(client, base_url, args.app, args.turns, n, latencies, statuses)
+                for n in range(args.sessions)
+            ))
+            elapsed = time.perf_counter() - started
+            async with client.get(f"{base_url}/stats") as response:
+                stats = await response.json()
+        await runner.cleanup()
+
+    latencies.sort()
+    print(f"app={args.app} sessions={args.sessions} turns/session={args.turns} workers={args.workers} "
+          f"async turns={args.async_turns} mock latency={args.latency * 1000:.0f} ms")
+    print(f"completed {len(latencies)} turns in {elapsed:.2f}s -> {len(latencies) / elapsed:.1f} turns/s "
+          f"({mock.request_count} upstream LLM calls)")
+    print(f"latency p50 {percentile(latencies, 0.50) * 1000:.0f} ms  p95 {percentile(latencies, 0.95) * 1000:.0f} ms"
+          f"  p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+    print(f"HTTP statuses {statuses}  server stats {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(INPUTS), default="support")
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=128)
+    parser.add_argument("--async-turns", type=int, default=4096, help="support turns run at once")
+    parser.add_argument("--max-queue", type=int, default=4096)
+    parser.add_argument("--latency", type=float, default=0.1, help="mock LLM latency in seconds")
+    parser.add_argument("--reply-tokens", type=int, default=20)
+    parser.add_argument("--turn-deadline", type=float, help="server time budget per turn, in seconds")
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
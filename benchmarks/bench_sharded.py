@@ -0,0 +1,121 @@
+"""
+Throughput of the market analysis on one event loop versus sharded over worker processes.
+
+Run from the repository root:
+    python -m benchmarks.bench_sharded --companies 500 --processes 1,2,4
+
+Analyzes --companies synthetic companies (four calls each) with workflow_parallelization.py
+against the local mock chat-completion server, which runs in a process of its own:
+  - single loop:  analyze_companies in this process, as the fan-out mode does
+  - sharded N:    ShardedRunner with N worker processes
+Each run starts on an empty cache. Rate limits are lifted unless --rpm is given, which
+caps every model at that many requests/min across all workers; the report then shows
+the rate actually reached. Scaling is bounded by the number of cores, which the
+worker processes share with the mock server.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.bench_fused import make_market_data
+
+
+def serve_mock(ports, latency, reply):
+    from mock_llm import MockLLMServer
+
+    async def serve():
+        async with MockLLMServer(latency=latency, reply=reply) as mock:
+            ports.put(mock.port)
+            await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def fresh_cache():
+    # Read by every process that loads the script from now on
+    os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+
+
+def in_order(results, companies):
+    expected = [company for company in companies for _ in range(4)]
+    return all(f" for {company}:" in result for result, company in zip(results, expected)) and len(results) == len(expected)
+
+
+def report(label, results, calls, elapsed, companies, baseline, args):
+    rate = len(results) / elapsed
+    line = (f"{label:<14} {len(results):>8} {calls:>7} {elapsed:>7.2f}s {rate:>9.0f}/s "
+            f"{rate / baseline if baseline else 1.0:>7.2f}x {str(in_order(results, companies)):>8}")
+    if args.rpm:
+        # Four models, each capped at --rpm requests/min
+        line += f" {calls / 4 / elapsed * 60:>9.0f} (cap {args.rpm})"
+    print(line)
+    return rate
+
+
+def run_benchmark(args):
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    server = context.Process(target=serve_mock, args=(ports, args.latency, " ".join(["insight"] * args.reply_words)),
+                             daemon=True)
+    server.start()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{ports.get(timeout=30)}/v1"
+        fresh_cache()
+        import llm_metrics
+        from llm_scheduler import DEFAULT_MODEL_LIMITS, ModelLimits
+        from sharded_runner import ShardedRunner
+        from workflows import load_script
+
+        module = load_script("market")
+        limit = ModelLimits(max_concurrency=args.concurrency, requests_per_minute=args.rpm or 10 ** 7,
+                            tokens_per_minute=10 ** 10)
+        limits = {model: limit for model in DEFAULT_MODEL_LIMITS}
+        module.scheduler.limits = dict(limits)
+        items = list(make_market_data(args.companies).items())
+        companies = [company for company, _ in items]
+
+        print(f"companies={args.companies} analyses={4 * args.companies} cores={os.cpu_count()} "
+              f"mock latency={args.latency * 1000:.0f} ms limits={f'{args.rpm} req/min per model' if args.rpm else 'lifted'}")
+        print(f"{'mode':<14} {'results':>8} {'calls':>7} {'wall':>8} {'throughput':>11} {'speedup':>8} "
+              f"{'ordered':>8}" + (f" {'req/min/model':>14}" if args.rpm else ""))
+
+        module.llm.completion.cache.clear()
+        mark = llm_metrics.default_recorder.mark()
+        started = time.perf_counter()
+        results = asyncio.run(module.analyze_companies(items))
+        baseline = report("single loop", results, len(llm_metrics.default_recorder.since(mark)),
+                          time.perf_counter() - started, companies, None, args)
+
+        for processes in args.processes:
+            fresh_cache()
+            runner = ShardedRunner("market", processes, args.shard_size, limits)
+            mark = llm_metrics.default_recorder.mark()
+            started = time.perf_counter()
+            results = list(runner.run(items))
+            report(f"sharded {processes}", results, len(llm_metrics.default_recorder.since(mark)),
+                   time.perf_counter() - started, companies, baseline, args)
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=500)
+    parser.add_argument("--processes", type=lambda text: [int(n) for n in text.split(",")], default=[1, 2, 4],
+                        help="comma-separated worker counts to compare")
+    parser.add_argument("--shard-size", type=int, default=50, help="companies per shard")
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight calls per model, across all workers")
+    parser.add_argument("--rpm", type=int, help="cap every model at this many requests/min across all workers")
+    parser.add_argument("--latency", type=float, default=0.02, help="mock LLM latency in seconds")
+    parser.add_argument("--reply-words", type=int, default=60, help="words per mock answer")
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Upstream calls and turn latency of the support chatbot under bursts of identical questions,
+with and without in-flight request coalescing.
+
+Run from the repository root:
+    python -m benchmarks.bench_singleflight --bursts 4 --users 32 --unique 0.25
+
+Each burst has --users customers arriving within --spread seconds, each on its own
+thread as in server mode; most ask one of a few popular questions, a --unique share
+asks its own. A turn is identify_issue followed by the streamed generate_solution,
+read to the end. The response cache is disabled, so without coalescing every turn
+makes its own two calls; with it, identical calls in flight at the same time share
+one, and the streamed solution is fanned out to every customer who asked.
+Reported per mode: calls to the backend, p50/p95 turn time and the coalescing counters.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from mock_llm import MockLLMServer
+
+POPULAR = ["How do I reset my password?", "Where is my order?", "Can I get a refund?", "How do I contact support?"]
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(sorted(samples), n=100, method="inclusive")
+    return cuts[49], cuts[94]
+
+
+def burst_questions(burst, args, rng):
+    return [f"My question number {burst}-{i} is unique" if rng.random() < args.unique else rng.choice(POPULAR)
+            for i in range(args.users)]
+
+
+def turn(module, question, delay, samples):
+    time.sleep(delay)
+    started = time.perf_counter()
+    issue = module.identify_issue(question)
+    module.generate_solution(issue, stream=True).read()
+    samples.append(time.perf_counter() - started)
+
+
+def run_mode(module, mock, enabled, args):
+    module.flights.enabled = enabled
+    module.flights.counters = dict.fromkeys(module.flights.counters, 0)
+    rng = random.Random(args.seed)
+    requests = mock.request_count
+    samples = []
+    for burst in range(args.bursts):
+        threads = [threading.Thread(target=turn, args=(module, question, rng.uniform(0, args.spread), samples))
+                   for question in burst_questions(burst, args, rng)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    p50, p95 = percentiles(samples)
+    counters = module.flights.counters
+    label = "coalescing" if enabled else "no coalescing"
+    print(f"{label:<14} {len(samples):>6} {mock.request_count - requests:>6} {p50 * 1000:>7.0f}ms {p95 * 1000:>7.0f}ms "
+          f"{counters['coalesced']:>9} {counters['dropped']:>7}")
+
+
+def run_benchmark(args):
+    mock = MockLLMServer(latency=args.latency, reply=" ".join(["step"] * args.reply_words),
+                         tokens_per_second=args.tokens_per_second, seed=args.seed).start_in_thread()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from workflows import load_script
+
+        module = load_script("support")
+        module.llm.completion.cache.max_bytes = 0
+        # Warm up the client's connection pool
+        module.identify_issue("warm-up")
+
+        print(f"mock latency={args.latency}s tokens/s={args.tokens_per_second} bursts={args.bursts} "
+              f"users={args.users} spread={args.spread}s unique={args.unique:.0%}")
+        print(f"{'mode':<14} {'turns':>6} {'calls':>6} {'p50':>9} {'p95':>9} {'coalesced':>9} {'dropped':>7}")
+        for enabled in (False, True):
+            run_mode(module, mock, enabled, args)
+    finally:
+        mock.stop_thread()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=4)
+    parser.add_argument("--users", type=int, default=32, help="customers per burst")
+    parser.add_argument("--spread", type=float, default=0.2, help="seconds over which a burst's customers arrive")
+    parser.add_argument("--unique", type=float, default=0.25, help="share of customers asking their own question")
+    parser.add_argument("--latency", type=float, default=0.4, help="mock time to the first token, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="mock generation speed")
+    parser.add_argument("--reply-words", type=int, default=60, help="words per mock answer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Time to a complete result in the hybrid app with and without speculative execution.
+
+Run from the repository root:
+    python -m benchmarks.bench_speculation --rounds 30 --candidates 1,2
+
+Uses inputs the local router is not confident about, so each round escalates the
+decision to the LLM (the mock answers it with the input's true action) and then
+streams the result of step 3. Without speculation the two calls run one after the
+other; with --candidates K, step 3 is started for the router's K most likely actions
+while the decision is in flight. Reported per mode: p50/p95 from the input to the
+complete result, hit rate, tokens wasted on wrong guesses and calls to the backend.
+The response cache is disabled.
+"""
+import argparse
+import os
+import re
+import statistics
+import tempfile
+import time
+
+from mock_llm import MockLLMServer
+
+# Inputs the router escalates, with the action the "LLM" decides for them
+INPUTS = [
+    ("vaccines and the immune system", 1),
+    ("sourdough starter feeding schedule", 2),
+    ("bones in the human body count", 3),
+    ("the roman empire's fall", 1),
+    ("marathon training plan for beginners", 2),
+    ("capital city of canada", 3),
+    ("black holes and time", 1),
+    ("docker compose for a django project", 2),
+    ("boiling point of water at altitude", 3),
+    ("blockchain consensus", 1),
+    ("changing a bike chain", 2),
+    ("author of war and peace", 3),
+]
+
+
+class DecidingMock(MockLLMServer):
+    # Answers the action decision of each input with its true action, everything else with the reply
+    def __init__(self, actions, **kwargs):
+        super().__init__(**kwargs)
+        self.actions = actions
+
+    def content_for(self, request):
+        prompt = request["messages"][-1]["content"]
+        if "Return only the number of the chosen action" in prompt:
+            match = re.search(r'input: "(.*)"', prompt)
+            return str(self.actions.get(match.group(1) if match else "", 4))
+        return super().content_for(request)
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(sorted(samples), n=100, method="inclusive")
+    return cuts[49], cuts[94]
+
+
+def run_mode(module, mock, inputs, candidates, args):
+    """
+    Run every input through steps 2 and 3 as the workflow does: speculation starts
+    together with the decision, and step 3 adopts or replaces it.
+    """
+    app = module.HybridLLMApp(speculate=candidates)
+    requests = mock.request_count
+    samples = []
+    for text in inputs:
+        started = time.perf_counter()
+        speculation = app.speculate(text)
+        action = app.step_2_decide_action(text)
+        result = app.start_result(text, action, speculation)
+        if not isinstance(result, str):
+            result.read()
+        samples.append(time.perf_counter() - started)
+    p50, p95 = percentiles(samples)
+    label = f"speculate {candidates}" if candidates else "no speculation"
+    if app.speculator is None:
+        hit_rate, wasted = "-", 0
+    else:
+        counters = app.speculator.counters
+        decided = counters["hits"] + counters["misses"]
+        hit_rate = f"{counters['hits'] / decided:.0%}" if decided else "-"
+        wasted = counters["wasted_tokens"]
+    print(f"{label:<16} {len(samples):>6} {p50 * 1000:>7.0f}ms {p95 * 1000:>7.0f}ms {hit_rate:>6} {wasted:>8} "
+          f"{mock.request_count - requests:>6}")
+    # Let cancelled runs wind down before the next mode
+    time.sleep(1)
+
+
+def run_benchmark(args):
+    rounds = [(f"{text} #{i}", action) for i in range(args.rounds // len(INPUTS) + 1) for text, action in INPUTS]
+    rounds = rounds[:args.rounds]
+    mock = DecidingMock(dict(rounds), latency=args.latency, reply=" ".join(["insight"] * args.reply_words),
+                        tokens_per_second=args.tokens_per_second, seed=args.seed).start_in_thread()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from workflows import load_script
+
+        module = load_script("hybrid")
+        module.llm.completion.cache.max_bytes = 0
+        router = module.HybridLLMApp().router
+        inputs = [text for text, _ in rounds if router.will_escalate(text)]
+
+        print(f"mock latency={args.latency}s tokens/s={args.tokens_per_second} inputs={len(inputs)} "
+              f"(of {len(rounds)}, the others are decided locally)")
+        print(f"{'mode':<16} {'rounds':>6} {'p50':>9} {'p95':>9} {'hits':>6} {'wasted':>8} {'calls':>6}")
+        for candidates in [0] + args.candidates:
+            run_mode(module, mock, inputs, candidates, args)
+    finally:
+        mock.stop_thread()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--candidates", type=lambda text: [int(n) for n in text.split(",")], default=[1, 2],
+                        help="comma-separated numbers of actions to speculate on")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock time to the first token, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="mock generation speed")
+    parser.add_argument("--reply-words", type=int, default=120, help="words per mock answer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
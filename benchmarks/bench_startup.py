@@ -0,0 +1,93 @@
+"""
+Cold-start cost of every CLI subcommand, measured with python -X importtime, against a budget.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --repeat 5 --budget-ms 300
+
+For each subcommand, runs `python -X importtime cli.py SUBCOMMAND --help` --repeat times
+in a fresh interpreter; --help returns right after the script is loaded, so this is
+what a short-lived job pays before doing any work. Reported per subcommand: median wall
+time, median total import time, the slowest top-level imports and any heavy dependency
+(openai, httpx, numpy, pandas, yfinance, dotenv, aiohttp) that was loaded although the
+subcommand doesn't need it to start. Exits with status 1 when a subcommand is over
+--budget-ms of import time or loads a heavy dependency it shouldn't, so it can guard
+against regressions in CI.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from workflows import SCRIPTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["openai", "httpx", "numpy", "pandas", "yfinance", "dotenv", "aiohttp"]
+# Heavy modules a subcommand may load at startup
+ALLOWED = {"support": {"numpy"}}  # faq_index vectorizes BM25 with numpy
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def parse_importtime(stderr):
+    """
+    Return (total import time in µs, {top-level module: cumulative µs}, set of every module imported).
+    """
+    top = {}
+    modules = set()
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        modules.add(name)
+        if not indent:
+            top[name] = top.get(name, 0) + int(cumulative)
+    return sum(top.values()), top, modules
+
+
+def measure(command, repeat):
+    walls, totals = [], []
+    top, modules = {}, set()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        done = subprocess.run([sys.executable, "-X", "importtime", "cli.py", command, "--help"], cwd=ROOT,
+                              capture_output=True, text=True)
+        walls.append(time.perf_counter() - started)
+        if done.returncode != 0:
+            raise RuntimeError(f"cli.py {command} --help failed:\n{done.stderr[-2000:]}")
+        total, top, modules = parse_importtime(done.stderr)
+        totals.append(total)
+    return statistics.median(walls), statistics.median(totals) / 1000, top, modules
+
+
+def run_benchmark(args):
+    print(f"python {sys.version.split()[0]}, {args.repeat} runs per subcommand, budget {args.budget_ms:.0f} ms of imports")
+    print(f"{'subcommand':<12} {'wall':>8} {'imports':>9} {'status':>7}  slowest imports / unexpected heavy modules")
+    failed = False
+    for command in args.commands:
+        wall, imports, top, modules = measure(command, args.repeat)
+        unexpected = [name for name in HEAVY if name in modules and name not in ALLOWED.get(command, ())]
+        over = imports > args.budget_ms
+        failed = failed or over or bool(unexpected)
+        slowest = ", ".join(f"{name} {us / 1000:.0f}ms" for name, us in sorted(top.items(), key=lambda item: -item[1])[:3])
+        status = "OVER" if over else "HEAVY" if unexpected else "ok"
+        print(f"{command:<12} {wall * 1000:>6.0f}ms {imports:>7.0f}ms {status:>7}  {slowest}"
+              + (f"; loads {', '.join(unexpected)}" if unexpected else ""))
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=lambda text: text.split(","), default=list(SCRIPTS),
+                        help="comma-separated subcommands (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per subcommand; the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="maximum import time per subcommand")
+    args = parser.parse_args()
+    sys.exit(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
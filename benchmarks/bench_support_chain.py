@@ -0,0 +1,103 @@
+"""
+Per-turn latency of the support chatbot: the serial chain versus the concurrent DAG turn.
+
+Run from the repository root:
+    python -m benchmarks.bench_support_chain --turns 20 --latency 0.4
+
+Plays --turns distinct customer messages through workflow_prompt_chaining.py
+against the local mock chat-completion server, with the response cache disabled:
+  - sync serial:    identify_issue -> generate_solution -> check_satisfaction, as before
+  - dag <mode>:     support_turn with each follow-up mode, with and without --fuse
+"solution" is the time until the whole solution has been shown, "turn" the time
+until the follow-up question is ready too. The mock's latency is per request and
+ignores the answer length, so the gain of fusing calls is an upper bound.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from mock_llm import MockLLMServer
+
+ISSUES = ["my password reset email never arrives", "I can't find last month's order", "are you open on saturday",
+          "how can I talk to a person", "the app logs me out every time", "I was charged twice for one order",
+          "where do I change my email address", "my order history is empty", "the live chat button does nothing",
+          "I forgot which email I signed up with"]
+
+
+def messages(turns):
+    return [f"{ISSUES[i % len(ISSUES)]} (case {i})" for i in range(turns)]
+
+
+def sync_serial(module, user_input):
+    started = time.perf_counter()
+    issue = module.identify_issue(user_input)
+    solution = module.generate_solution(issue, stream=True).read()
+    shown = time.perf_counter() - started
+    module.check_satisfaction(solution)
+    return shown, time.perf_counter() - started
+
+
+async def dag_turn(module, user_input, follow_up, fuse):
+    started = time.perf_counter()
+    result = await module.support_turn(user_input, follow_up=follow_up, fuse=fuse)
+    total = time.perf_counter() - started
+    # The solution has been shown once its node finishes
+    _, shown = result["run"].timings["solution"]
+    return shown, total
+
+
+def report(label, rows, calls):
+    shown = [row[0] for row in rows]
+    total = [row[1] for row in rows]
+    print(f"{label:<26} {statistics.median(shown) * 1000:>9.0f}ms {statistics.median(total) * 1000:>9.0f}ms "
+          f"{max(total) * 1000:>9.0f}ms {calls / len(rows):>10.1f}")
+
+
+async def run_async_modes(module, mock, inputs):
+    for fuse in (False, True):
+        for follow_up in module.FOLLOW_UP_MODES:
+            before = mock.request_count
+            rows = [await dag_turn(module, text, follow_up, fuse) for text in inputs]
+            report(f"dag {follow_up}{' + fuse' if fuse else ''}", rows, mock.request_count - before)
+
+
+def run_benchmark(args):
+    loop = asyncio.new_event_loop()
+    mock = MockLLMServer(latency=args.latency, reply=" ".join(["step"] * args.reply_words))
+    loop.run_until_complete(mock.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    try:
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from workflows import load_script
+
+        module = load_script("support")
+        inputs = messages(args.turns)
+        print(f"turns={args.turns} mock latency={args.latency * 1000:.0f} ms (medians over turns)")
+        print(f"{'mode':<26} {'solution':>11} {'turn':>11} {'max turn':>11} {'calls/turn':>10}")
+        # The mock gives every prompt the same answer, so keep nothing cached: every call reaches it
+        module.llm.completion.cache.max_bytes = 0
+        before = mock.request_count
+        report("sync serial (before)", [sync_serial(module, text) for text in inputs], mock.request_count - before)
+        asyncio.run(run_async_modes(module, mock, inputs))
+    finally:
+        asyncio.run_coroutine_threadsafe(mock.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.4, help="mock LLM latency in seconds")
+    parser.add_argument("--reply-words", type=int, default=80, help="words per mock answer")
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Throughput and p50/p95/p99 latency of every workflow against the mock backend, as JSON.
+
+Run from the repository root:
+    python -m benchmarks.bench_workflows --rounds 20 --tickers 10,100,1000 --json-out bench.json
+
+Drives each app end to end through its entry point, with the response cache disabled:
+  - hybrid:       HybridLLMApp.run_hybrid_app, one topic per round
+  - workflow:     WorkflowBasedApp.run_workflow, one topic per round
+  - support:      one support_turn of the chatbot per round
+  - market[N]:    parallel_market_analysis over N synthetic tickers; latency is per analysis
+The mock backend's latency distribution, token rate, error injection and seed are set
+on the command line; with the same seed, runs see the same inputs and the same mock.
+Results are printed as a table and, with --json-out, written as JSON modelled on
+pytest-benchmark's (machine_info, commit_info, benchmarks[].stats), to compare runs over time.
+"""
+import argparse
+import asyncio
+import builtins
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+from benchmarks.bench_fused import make_market_data
+from mock_llm import MockLLMServer, parse_error, parse_latency
+
+TOPICS = ["photosynthesis", "how do I set up a python virtual environment", "what is the capital of australia",
+          "explain the causes of inflation", "stuff", "how to bake sourdough bread", "quantum entanglement"]
+ISSUES = ["my password reset email never arrives", "I can't find last month's order", "are you open on saturday",
+          "I was charged twice for one order", "the app logs me out every time"]
+
+
+def summarize(samples, elapsed):
+    """
+    pytest-benchmark style statistics of `samples` (seconds), plus tail percentiles.
+    `ops` is completed samples per second of wall time.
+    """
+    ordered = sorted(samples)
+    if len(ordered) > 1:
+        cuts = statistics.quantiles(ordered, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ordered[0]
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": statistics.mean(ordered),
+        "stddev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "median": statistics.median(ordered),
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "rounds": len(ordered),
+        "ops": len(ordered) / elapsed,
+    }
+
+
+@contextlib.contextmanager
+def answering(text):
+    # The apps ask for their topic with input() and print their output
+    original = builtins.input
+    builtins.input = lambda prompt="": text
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        builtins.input = original
+
+
+class Tally:
+    def __init__(self, mock):
+        """
+        Mock requests, injected errors and client retries since it was created.
+        """
+        import llm_metrics
+
+        self.mock = mock
+        self.requests = mock.request_count
+        self.statuses = dict(mock.status_counts)
+        self.mark = llm_metrics.default_recorder.mark()
+
+    def extra(self, failures=0):
+        import llm_metrics
+
+        spans = llm_metrics.default_recorder.since(self.mark)
+        return {
+            "calls": self.mock.request_count - self.requests,
+            "injected_errors": sum(count - self.statuses.get(status, 0)
+                                   for status, count in self.mock.status_counts.items() if status != 200),
+            "retries": sum(span.retries for span in spans),
+            "failures": failures,
+        }
+
+
+def bench_app(name, run, mock, rounds, inputs):
+    """
+    Time `run()` once per round, answering its input() prompt with the next input.
+    A round that raises counts as a failure and is left out of the latencies.
+    """
+    tally = Tally(mock)
+    samples = []
+    failures = 0
+    started = time.perf_counter()
+    for i in range(rounds):
+        with answering(f"{inputs[i % len(inputs)]} (round {i})"):
+            round_started = time.perf_counter()
+            try:
+                run()
+            except Exception:
+                failures += 1
+                continue
+            samples.append(time.perf_counter() - round_started)
+    return result(name, name, {"rounds": rounds}, samples, time.perf_counter() - started, tally.extra(failures))
+
+
+async def bench_support(module, mock, rounds):
+    tally = Tally(mock)
+    samples = []
+    failures = 0
+    started = time.perf_counter()
+    for i in range(rounds):
+        round_started = time.perf_counter()
+        try:
+            await module.support_turn(f"{ISSUES[i % len(ISSUES)]} (round {i})")
+        except Exception:
+            failures += 1
+            continue
+        samples.append(time.perf_counter() - round_started)
+    return result("support", "support", {"rounds": rounds}, samples, time.perf_counter() - started,
+                  tally.extra(failures))
+
+
+async def bench_market(module, mock, tickers):
+    import llm_metrics
+
+    module.market_data = make_market_data(tickers)
+    tally = Tally(mock)
+    started = time.perf_counter()
+    results = await module.parallel_market_analysis()
+    elapsed = time.perf_counter() - started
+    # Per analysis: waiting for the scheduler plus the call itself, retries included
+    samples = [span.queue_time + (span.latency or 0.0) for span in llm_metrics.default_recorder.since(tally.mark)]
+    failures = sum(" failed for " in text for text in results)
+    return result(f"market[{tickers}]", "market", {"tickers": tickers}, samples or [elapsed], elapsed,
+                  tally.extra(failures))
+
+
+def result(name, group, params, samples, elapsed, extra):
+    return {"name": name, "group": group, "params": params, "stats": summarize(samples or [float("nan")], elapsed),
+            "extra": extra}
+
+
+async def run_async_benchmarks(args, mock, support, market):
+    results = [await bench_support(support, mock, args.rounds)]
+    for tickers in args.tickers:
+        results.append(await bench_market(market, mock, tickers))
+    return results
+
+
+def commit_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"id": None, "dirty": None}
+    return {"id": commit, "dirty": dirty}
+
+
+def print_table(results):
+    print(f"{'benchmark':<16} {'rounds':>7} {'ops/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} "
+          f"{'calls':>7} {'errors':>7} {'retries':>8} {'failed':>7}")
+    for row in results:
+        stats, extra = row["stats"], row["extra"]
+        print(f"{row['name']:<16} {stats['rounds']:>7} {stats['ops']:>8.1f} {stats['p50'] * 1000:>7.0f}ms "
+              f"{stats['p95'] * 1000:>7.0f}ms {stats['p99'] * 1000:>7.0f}ms {extra['calls']:>7} "
+              f"{extra['injected_errors']:>7} {extra['retries']:>8} {extra['failures']:>7}")
+
+
+def run_benchmark(args):
+    mock = MockLLMServer(latency=args.latency, reply=" ".join(["insight"] * args.reply_words),
+                         tokens_per_second=args.tokens_per_second, errors=dict(args.error),
+                         retry_after=args.retry_after, seed=args.seed).start_in_thread()
+    try:
+        # The scripts read these when they are loaded
+        os.environ["OPENAI_API_KEY"] = "mock"
+        os.environ["OPENAI_BASE_URL"] = mock.base_url
+        os.environ["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+        from llm_scheduler import ModelLimits
+        from workflows import load_script
+
+        modules = {name: load_script(name) for name in ("hybrid", "workflow", "support", "market")}
+        # Rounds repeat similar prompts and the mock answers them all alike; keep nothing cached
+        for module in modules.values():
+            module.llm.completion.cache.max_bytes = 0
+        # Measure the pipeline rather than the default per-model budgets
+        market = modules["market"]
+        lifted = ModelLimits(max_concurrency=args.concurrency, requests_per_minute=10 ** 7, tokens_per_minute=10 ** 10)
+        market.scheduler.limits = {model: lifted for model in market.scheduler.limits}
+
+        hybrid = modules["hybrid"].HybridLLMApp()
+        workflow = modules["workflow"].WorkflowBasedApp()
+        results = [
+            bench_app("hybrid", hybrid.run_hybrid_app, mock, args.rounds, TOPICS),
+            bench_app("workflow", workflow.run_workflow, mock, args.rounds, TOPICS),
+        ]
+        results += asyncio.run(run_async_benchmarks(args, mock, modules["support"], market))
+    finally:
+        mock.stop_thread()
+
+    print(f"mock latency={args.latency} tokens/s={args.tokens_per_second or 'instant'} "
+          f"errors={dict(args.error) or 'none'} seed={args.seed}")
+    print_table(results)
+    if args.json_out:
+        report = {
+            "machine_info": {"python_version": platform.python_version(), "platform": platform.platform(),
+                             "cpu_count": os.cpu_count()},
+            "commit_info": commit_info(),
+            "datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "mock": {"latency": repr(args.latency), "tokens_per_second": args.tokens_per_second,
+                     "errors": {str(status): p for status, p in args.error}, "seed": args.seed},
+            "benchmarks": results,
+        }
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="runs of each app")
+    parser.add_argument("--tickers", type=lambda text: [int(n) for n in text.split(",")], default=[10, 100, 1000],
+                        help="comma-separated market sizes")
+    parser.add_argument("--latency", type=parse_latency, default=parse_latency("lognormal:0.05,0.5"),
+                        help='mock latency: "0.05", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA"')
+    parser.add_argument("--tokens-per-second", type=float, help="mock generation speed (default: instant)")
+    parser.add_argument("--error", type=parse_error, action="append", default=[], metavar="STATUS=PROBABILITY",
+                        help='inject errors, e.g. --error 429=0.02 --error 503=0.01')
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of injected 429s, in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reply-words", type=int, default=60, help="words per mock answer")
+    parser.add_argument("--concurrency", type=int, default=8, help="market: in-flight calls per model")
+    parser.add_argument("--json-out", help="write the results to this JSON file")
+    args = parser.parse_args()
+    run_benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
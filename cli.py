@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+
+from workflows import SCRIPTS, load_script
+
+# One entry point for every workflow:
+#     python cli.py hybrid --speculate 1
+#     python cli.py market --mode fused --profile
+# Only the chosen script is loaded, and the scripts import their heavy dependencies
+# (openai, numpy, yfinance, ...) when they first need them, so starting a short job
+# or printing --help stays fast. Everything after the subcommand is passed to the
+# script's own options (python cli.py SUBCOMMAND --help).
+
+DESCRIPTIONS = {
+    "agent": "chat with the simple autonomous agent",
+    "workflow": "run the fixed workflow on a topic",
+    "hybrid": "run the hybrid agent-workflow app on a topic",
+    "support": "chat with the customer support bot",
+    "market": "analyze the sample market data in parallel",
+    "market-live": "analyze real-time market data from Yahoo Finance",
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run one of the LLM workflows.",
+        epilog="\n".join(f"  {name:<12} {DESCRIPTIONS[name]}" for name in SCRIPTS),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=list(SCRIPTS), metavar="SUBCOMMAND", help="one of: " + ", ".join(SCRIPTS))
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="options of the subcommand")
+    args = parser.parse_args(argv)
+    # The script's own parser names itself after argv[0] in its usage and errors
+    sys.argv[0] = f"{os.path.basename(sys.argv[0])} {args.command}"
+    load_script(args.command).main(args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Conversation memory for the chat loops.
+# Recent turns are sent verbatim within a token budget; older turns are folded
+# into a running summary on a background thread, so compaction never delays a
+# reply. The caller's prefix (system prompt, FAQs) always comes first and is sent
+# unchanged, so the provider can reuse its cached prompt prefix every turn.
+# asyncio is only imported by `wait_for_summary`, for the async chat loops.
+
+COMPACT_PROMPT = (
+    "Below is the summary of a conversation between a user and an assistant so far, followed by "
+    "newer turns. Write an updated summary of the whole conversation in at most {words} words. "
+    "Keep names, facts, decisions and open questions; drop small talk. Answer with the summary only."
+    "\n\nSummary so far:\n{summary}\n\nNewer turns:\n{turns}"
+)
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def compaction_pool():
+    """
+    Thread pool shared by every ConversationMemory for background summaries.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="compaction")
+        return _pool
+
+
+def count_tokens(text):
+    # Same four-characters-per-token estimate the scheduler uses, plus message overhead
+    return len(text) // 4 + 4
+
+
+class ConversationMemory:
+    def __init__(self, complete, max_tokens=2000, min_recent=4, summary_tokens=300, executor=None):
+        """
+        `complete(prompt)` sends one prompt to the LLM and returns its text.
+        `max_tokens` bounds the summary plus the recent turns sent with each message.
+        Once the turns go over it, the oldest are summarized in the background and
+        keep being sent verbatim until the summary is ready; the window only blocks
+        on a summary if it reaches twice the budget (async callers await it with
+        wait_for_summary instead). The last `min_recent` turns are never summarized.
+        """
+        self.complete = complete
+        self.max_tokens = max_tokens
+        self.min_recent = min_recent
+        self.summary_tokens = summary_tokens
+        self.executor = executor or compaction_pool()
+        self.summary = ""
+        self.turns = []
+        self.counters = {"turns": 0, "compactions": 0, "compacted_turns": 0, "blocked": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._compaction = None  # (future, number of oldest turns it covers)
+
+    def add(self, role, content):
+        with self._lock:
+            self.turns.append({"role": role, "content": content})
+            self.counters["turns"] += 1
+            self._apply()
+            self._maybe_compact()
+
+    def add_exchange(self, user_input, reply):
+        """
+        Record one user message and the assistant's reply.
+        """
+        self.add("user", user_input)
+        self.add("assistant", reply)
+
+    def messages(self, prefix, user_input):
+        """
+        Messages for the next call: `prefix` (a list of messages, sent as given), the
+        running summary, the recent turns and the new user message.
+        """
+        with self._lock:
+            self._apply(wait=self.window_tokens() > 2 * self.max_tokens)
+            history = [{"role": "system", "content": SUMMARY_HEADER + self.summary}] if self.summary else []
+            return list(prefix) + history + list(self.turns) + [{"role": "user", "content": user_input}]
+
+    async def wait_for_summary(self):
+        """
+        For async callers, before messages(): wait for a summary that messages() would
+        block on, without blocking the event loop.
+        """
+        import asyncio
+
+        with self._lock:
+            if self._compaction is None or self.window_tokens() <= 2 * self.max_tokens:
+                return
+            future = self._compaction[0]
+            if future.done():
+                return
+            self.counters["blocked"] += 1
+        try:
+            # Shielded: a cancelled turn must not cancel the summary the next turns need
+            await asyncio.shield(asyncio.wrap_future(future))
+        except Exception:
+            pass  # Counted by messages(), which keeps the turns verbatim
+
+    def window_tokens(self):
+        """
+        Estimated tokens of the summary and recent turns sent with the next message.
+        """
+        tokens = sum(count_tokens(turn["content"]) for turn in self.turns)
+        if self.summary:
+            tokens += count_tokens(SUMMARY_HEADER + self.summary)
+        return tokens
+
+    def _apply(self, wait=False):
+        # Swap in a finished summary; callers hold the lock
+        if self._compaction is None:
+            return
+        future, count = self._compaction
+        if not future.done():
+            if not wait:
+                return
+            self.counters["blocked"] += 1
+        try:
+            summary = future.result()
+        except Exception:
+            self.counters["errors"] += 1  # Keep the turns verbatim; the next turn tries again
+        else:
+            self.summary = summary
+            del self.turns[:count]
+            self.counters["compactions"] += 1
+            self.counters["compacted_turns"] += count
+        self._compaction = None
+
+    def _maybe_compact(self):
+        if self._compaction is not None or self.window_tokens() <= self.max_tokens:
+            return
+        # Summarize enough old turns to get back to half the budget, so this doesn't run every turn
+        keep = len(self.turns)
+        tokens = count_tokens(self.summary) if self.summary else 0
+        budget = self.max_tokens // 2 - self.summary_tokens
+        while keep > 0 and tokens + count_tokens(self.turns[keep - 1]["content"]) <= budget:
+            keep -= 1
+            tokens += count_tokens(self.turns[keep]["content"])
+        count = min(keep, len(self.turns) - self.min_recent)
+        if count <= 0:
+            return
+        prompt = COMPACT_PROMPT.format(
+            words=self.summary_tokens * 3 // 4,
+            summary=self.summary or "(none)",
+            turns="\n".join(f"{turn['role']}: {turn['content']}" for turn in self.turns[:count]),
+        )
+        future = self.executor.submit(contextvars.copy_context().run, self.complete, prompt)
+        self._compaction = (future, count)
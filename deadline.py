@@ -0,0 +1,98 @@
+import contextlib
+import contextvars
+import time
+
+# End-to-end deadlines.
+# A deadline is a point in time (on the time.monotonic() clock) carried in a context
+# variable, so it follows a run into its steps: coroutines and tasks, and threads
+# started with a copy of the context (asyncio.to_thread, the hedger's pool). A run
+# sets its total budget with budget(seconds); each step may take a share of the time
+# left with budget(share=...), which never extends the enclosing deadline. Calls use
+# the time left as their timeout: the LLM client sends it as the request timeout and
+# cuts streams off at the deadline, the workflow engine cancels nodes that run past
+# it and the market data fetch stops waiting for tickers.
+# asyncio is only imported by `within`, so sync apps don't load it at startup.
+
+
+class DeadlineExceeded(TimeoutError):
+    # Raised when a call or step can't finish before its deadline; never retried
+    pass
+
+
+_expires = contextvars.ContextVar("deadline", default=None)
+
+
+def expires_at():
+    """
+    The current deadline (a time.monotonic() value), or None if there is none.
+    """
+    return _expires.get()
+
+
+def remaining(expires=None):
+    """
+    Seconds left before `expires` (default: the current deadline), at least 0; None without a deadline.
+    """
+    expires = _expires.get() if expires is None else expires
+    if expires is None:
+        return None
+    return max(0.0, expires - time.monotonic())
+
+
+def check(what="the call", expires=None):
+    """
+    Raise DeadlineExceeded if the deadline (default: the current one) has passed.
+    """
+    if remaining(expires) == 0:
+        raise DeadlineExceeded(f"deadline passed before {what}")
+
+
+@contextlib.contextmanager
+def budget(seconds=None, share=None):
+    """
+    Run the block under a deadline `seconds` from now, or `share` (0-1) of the time
+    left before the enclosing deadline; it is never later than the enclosing deadline.
+    With neither, the enclosing deadline (if any) applies unchanged.
+    """
+    expires = _expires.get()
+    now = time.monotonic()
+    limit = None
+    if seconds is not None:
+        limit = now + seconds
+    elif share is not None and expires is not None:
+        limit = now + max(0.0, expires - now) * share
+    if limit is not None and (expires is None or limit < expires):
+        expires = limit
+    token = _expires.set(expires)
+    try:
+        yield expires
+    finally:
+        _expires.reset(token)
+
+
+def call_with_budget(seconds, fn, *args, **kwargs):
+    """
+    Call `fn(*args, **kwargs)` under a deadline `seconds` from now (None: no deadline),
+    e.g. as the target of a worker thread.
+    """
+    with budget(seconds):
+        return fn(*args, **kwargs)
+
+
+async def within(awaitable, what="the step"):
+    """
+    Await `awaitable`; if the current deadline passes first, cancel it and raise DeadlineExceeded.
+    """
+    import asyncio
+
+    left = remaining()
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except DeadlineExceeded:
+        raise
+    except asyncio.TimeoutError:
+        if remaining():
+            raise  # A timeout of the awaitable itself, before the deadline
+        raise DeadlineExceeded(f"{what} did not finish before the deadline") from None
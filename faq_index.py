@@ -0,0 +1,211 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# FAQ retrieval for the customer support chatbot.
+# The index is built once (or loaded from disk with the embedding matrix
+# memory-mapped) and each turn only ships the top-k entries to the LLM.
+# With embeddings, a query's vector is kept in a small LRU keyed on its text, so the
+# prompts of one turn (or of repeated questions) searching the same text embed it once.
+
+STOPWORDS = {
+    "a", "an", "and", "are", "can", "do", "does", "for", "how", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "the", "to", "what", "where", "when", "you", "your",
+}
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def content_terms(text):
+    """
+    Tokens without stopwords, used for exact-match detection.
+    """
+    return frozenset(token for token in tokenize(text) if token not in STOPWORDS)
+
+
+def openai_embedder(model="text-embedding-3-small"):
+    """
+    Return a function that embeds a list of texts with the OpenAI embeddings endpoint.
+    """
+    from llm_client import get_client
+
+    def embed(texts):
+        return get_client().embed(texts, model=model)
+
+    return embed
+
+
+def format_faq(faq):
+    return f"Q: {faq['question']}\nA: {faq['answer']}"
+
+
+class FAQIndex:
+    def __init__(self, faqs, embed=None, embeddings=None, k1=1.5, b=0.75, query_cache_size=1024):
+        """
+        Build the index over `faqs` ({key: {"question": ..., "answer": ...}}).
+        `embed` is an optional function mapping a list of texts to vectors; when it is
+        missing (or fails) search falls back to BM25 over question and answer text.
+        `embeddings` may be passed in precomputed, e.g. a memory-mapped array from `load`.
+        The vectors of the last `query_cache_size` queries are kept for reuse.
+        """
+        self.keys = list(faqs)
+        self.faqs = [faqs[key] for key in self.keys]
+        self.embed = embed
+        self.k1 = k1
+        self.b = b
+        self.query_cache_size = query_cache_size
+        self._query_vectors = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._build_bm25()
+        self._exact = {}
+        for i, faq in enumerate(self.faqs):
+            self._exact.setdefault(content_terms(faq["question"]), i)
+        if embeddings is None and embed is not None:
+            embeddings = self._embed_documents()
+        self.embeddings = embeddings
+
+    def _build_bm25(self):
+        # Postings are stored per term as (document ids, term frequencies) arrays,
+        # so scoring a query is a handful of vectorized updates
+        postings = {}
+        lengths = np.zeros(len(self.faqs), dtype=np.float32)
+        for doc_id, faq in enumerate(self.faqs):
+            tokens = tokenize(f"{faq['question']} {faq['question']} {faq['answer']}")
+            lengths[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(doc_id)
+                postings[token][1].append(count)
+        n_docs = max(1, len(self.faqs))
+        avg_length = float(lengths.mean()) if len(self.faqs) else 1.0
+        self._norm = self.k1 * (1 - self.b + self.b * lengths / max(avg_length, 1.0))
+        self._postings = {}
+        for token, (doc_ids, counts) in postings.items():
+            idf = math.log(1 + (n_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            self._postings[token] = (np.array(doc_ids), np.array(counts, dtype=np.float32), idf)
+
+    def _embed_documents(self, batch_size=256):
+        texts = [format_faq(faq) for faq in self.faqs]
+        vectors = []
+        for i in range(0, len(texts), batch_size):
+            vectors.extend(self.embed(texts[i:i + batch_size]))
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def bm25_scores(self, query):
+        scores = np.zeros(len(self.faqs), dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token in self._postings:
+                doc_ids, counts, idf = self._postings[token]
+                scores[doc_ids] += idf * counts * (self.k1 + 1) / (counts + self._norm[doc_ids])
+        return scores
+
+    @property
+    def embeds_queries(self):
+        """
+        Whether searching embeds the query (a call to the embedding service, unless cached).
+        """
+        return self.embeddings is not None and self.embed is not None
+
+    def query_vector(self, query):
+        """
+        The normalized embedding of `query`, from the LRU or embedded now (thread-safe).
+        Embedding failures are raised and not cached.
+        """
+        with self._query_lock:
+            if query in self._query_vectors:
+                self._query_vectors.move_to_end(query)
+                return self._query_vectors[query]
+        vector = _normalize(np.asarray(self.embed([query]), dtype=np.float32))[0]
+        with self._query_lock:
+            self._query_vectors[query] = vector
+            while len(self._query_vectors) > self.query_cache_size:
+                self._query_vectors.popitem(last=False)
+        return vector
+
+    def search(self, query, k=3):
+        """
+        Return the `k` most relevant FAQs as a list of (key, faq, score), best first.
+        Uses cosine similarity over the embeddings when available, BM25 otherwise.
+        """
+        scores = None
+        if self.embeds_queries:
+            try:
+                scores = np.asarray(self.embeddings @ self.query_vector(query))
+            except Exception:
+                scores = None  # Embedding service unavailable, use the lexical index
+        if scores is None:
+            scores = self.bm25_scores(query)
+        k = min(k, len(self.faqs))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[i], self.faqs[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    def exact_match(self, query):
+        """
+        Return (key, faq) when the query is the same question as an FAQ, ignoring
+        case, punctuation and stopwords; otherwise None. No LLM call is needed for these.
+        """
+        terms = content_terms(query)
+        if not terms or terms not in self._exact:
+            return None
+        i = self._exact[terms]
+        return self.keys[i], self.faqs[i]
+
+    def context(self, query, k=3):
+        """
+        Build the FAQ context string for a prompt from the top-k matches.
+        """
+        return "\n".join(format_faq(faq) for _, faq, _ in self.search(query, k))
+
+    def save(self, path):
+        """
+        Save the FAQs and embeddings to `path` (a directory) for fast startup.
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "faqs.json"), "w") as f:
+            json.dump(dict(zip(self.keys, self.faqs)), f)
+        if self.embeddings is not None:
+            np.save(os.path.join(path, "embeddings.npy"), np.asarray(self.embeddings))
+
+    @classmethod
+    def load(cls, path, embed=None):
+        """
+        Load an index saved with `save`; the embedding matrix is memory-mapped, not read into memory.
+        """
+        with open(os.path.join(path, "faqs.json")) as f:
+            faqs = json.load(f)
+        embeddings_path = os.path.join(path, "embeddings.npy")
+        embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+        return cls(faqs, embed=embed, embeddings=embeddings)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Build an index with embeddings from a JSON file of FAQs
+if __name__ == "__main__":
+    import sys
+
+    from dotenv import load_dotenv
+
+    if len(sys.argv) != 3:
+        sys.exit("usage: python faq_index.py FAQS.json INDEX_DIR")
+    load_dotenv()
+    with open(sys.argv[1]) as f:
+        index = FAQIndex(json.load(f), embed=openai_embedder())
+    index.save(sys.argv[2])
+    print(f"Indexed {len(index.keys)} FAQs into {sys.argv[2]}")
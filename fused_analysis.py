@@ -0,0 +1,188 @@
+import asyncio
+import json
+import textwrap
+
+from llm_cache import quantize
+from llm_metrics import step
+
+# Fused market analysis.
+# Instead of one completion per (company, aspect), a single call returns every
+# aspect for one or more companies as JSON constrained by a schema. Companies
+# whose part of the answer can't be parsed fall back to the per-aspect calls.
+
+# Structured outputs (json_schema response format) need a gpt-4o class model
+FUSED_MODEL = "gpt-4o"
+
+FUSED_INSTRUCTIONS = (
+    "Complete every task below. Answer as JSON with one object per company and one field "
+    "per task, holding the full written answer to that task."
+)
+
+
+class Aspect:
+    def __init__(self, key, title, prompt, analysis, model=None):
+        """
+        One part of the market analysis.
+        `prompt(company, data)` builds its task text and `analysis(company, data)` is the
+        per-aspect coroutine used as fallback; results read "{title} for {company}: ...".
+        `model` is the model `analysis` uses, for modes that send the prompt themselves (batch).
+        """
+        self.key = key
+        self.title = title
+        self.prompt = prompt
+        self.analysis = analysis
+        self.model = model
+
+
+def fused_schema(companies, aspects):
+    """
+    Strict JSON schema for a fused answer: every company and every aspect is required.
+    """
+    entry = {
+        "type": "object",
+        "properties": {aspect.key: {"type": "string"} for aspect in aspects},
+        "required": [aspect.key for aspect in aspects],
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "market_analysis",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {company: entry for company in companies},
+                "required": list(companies),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def fused_prompt(batch, aspects):
+    sections = []
+    for company, data in batch:
+        tasks = "\n\n".join(
+            f'Task "{aspect.key}":\n{textwrap.dedent(aspect.prompt(company, data)).strip()}' for aspect in aspects
+        )
+        sections.append(f'Company "{company}":\n{tasks}')
+    return FUSED_INSTRUCTIONS + "\n\n" + "\n\n".join(sections)
+
+
+def parse_fused(text, companies, aspects):
+    """
+    Return {company: {aspect key: text}} for the companies whose answer is complete.
+    Raises ValueError if the response isn't a JSON object at all.
+    """
+    try:
+        payload = json.loads(text)
+    except (TypeError, json.JSONDecodeError) as exc:
+        raise ValueError(f"fused response is not valid JSON: {exc}") from exc
+    if not isinstance(payload, dict):
+        raise ValueError("fused response is not a JSON object")
+    parsed = {}
+    for company in companies:
+        entry = payload.get(company)
+        if isinstance(entry, dict) and all(isinstance(entry.get(a.key), str) and entry[a.key].strip() for a in aspects):
+            parsed[company] = {aspect.key: entry[aspect.key] for aspect in aspects}
+    return parsed
+
+
+class FusedAnalyzer:
+    def __init__(self, llm, aspects, fallback, model=FUSED_MODEL, ttl=None, key_prefix="fused"):
+        """
+        `llm` is the (cached, traced) completion wrapper of the calling script and
+        `fallback(analysis, company, data)` runs one per-aspect analysis, returning its result text.
+        """
+        self.llm = llm
+        self.aspects = aspects
+        self.fallback = fallback
+        self.model = model
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.counters = {"calls": 0, "companies": 0, "fallbacks": 0}
+
+    async def analyze_batch(self, batch):
+        """
+        Analyze a list of (company, data) pairs with one call; return the result texts.
+        """
+        companies = [company for company, _ in batch]
+        self.counters["calls"] += 1
+        self.counters["companies"] += len(batch)
+        try:
+            with step("fused_analysis"):
+                response = await self.llm.acreate(
+                    model=self.model,
+                    messages=[{"role": "system", "content": fused_prompt(batch, self.aspects)}],
+                    response_format=fused_schema(companies, self.aspects),
+                    ttl=self.ttl,
+                    key_data=(self.key_prefix, [(company, quantize(data)) for company, data in batch]),
+                )
+        except Exception as exc:
+            return [f"{aspect.analysis.__name__} failed for {company}: {exc}"
+                    for company in companies for aspect in self.aspects]
+        try:
+            parsed = parse_fused(response["choices"][0]["message"]["content"], companies, self.aspects)
+        except ValueError:
+            parsed = {}
+        results = []
+        retry = []
+        for company, data in batch:
+            if company in parsed:
+                results.extend(f"{aspect.title} for {company}: {parsed[company][aspect.key]}" for aspect in self.aspects)
+            else:
+                retry.append((company, data))
+        if retry:
+            # Only unparseable answers fall back to one call per aspect
+            self.counters["fallbacks"] += len(retry)
+            results.extend(await asyncio.gather(*(
+                self.fallback(aspect.analysis, company, data) for company, data in retry for aspect in self.aspects
+            )))
+        return results
+
+    async def stream(self, snapshots, companies_per_call=1):
+        """
+        Analyze (company, data) pairs from an iterable or async iterable, up to
+        `companies_per_call` per call, and yield results as each call completes.
+        A batch is sent as soon as it is full, so slow snapshots don't hold up the rest.
+        """
+        results = asyncio.Queue()
+
+        async def analyze(batch):
+            for result in await self.analyze_batch(batch):
+                await results.put(result)
+
+        async def schedule():
+            tasks = []
+            batch = []
+            try:
+                async for company, data in _aiter(snapshots):
+                    batch.append((company, data))
+                    if len(batch) >= companies_per_call:
+                        tasks.append(asyncio.create_task(analyze(batch)))
+                        batch = []
+                if batch:
+                    tasks.append(asyncio.create_task(analyze(batch)))
+                await asyncio.gather(*tasks)
+            finally:
+                await results.put(None)
+
+        producer = asyncio.create_task(schedule())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+            await producer
+        finally:
+            producer.cancel()
+
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
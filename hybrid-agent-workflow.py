@@ -1,35 +1,100 @@
-import openai
-from dotenv import load_dotenv
-import os
+import argparse
+import asyncio
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_client import get_client
+from llm_hedge import HedgedCompletion, HedgePolicy
+import llm_metrics
+from llm_metrics import TracedChatCompletion, step
+from llm_singleflight import SingleFlight
+from llm_stream import TokenStream, format_timings, print_stream
+from summarizer import ChunkedSummarizer
+from speculation import Speculator
+from router import ACTION_EXAMPLES, ACTION_RULES, HashedNgramClassifier, RegexRouter, RoutingEngine, parse_action
+from workflow_engine import FAILED, Node, Workflow, new_run_id
 
-# Load environment variables
-load_dotenv()
+# A step's call that runs past the 95th percentile of its model's recent latencies is
+# also sent to the next model of the step's tier, and the first answer wins (llm_hedge.py)
+HEDGE_TIERS = {
+    "ask_llm_for_action": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
+    "step_3_execute_action": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
+    "summarize_text": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
+}
+hedger = HedgedCompletion(HedgePolicy(HEDGE_TIERS), create=get_client().create)
 
-# Set up OpenAI API key from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Identical requests are answered from the shared on-disk response cache;
+# misses go through the shared OpenAI client (reads OPENAI_API_KEY), and
+# identical misses made at the same time share one call (llm_singleflight.py).
+# Every call is recorded in llm_metrics, tagged with the step that made it.
+flights = SingleFlight(create=hedger.create)
+llm = TracedChatCompletion(CachedChatCompletion(ResponseCache(), create=flights.create), workflow="hybrid")
 
 class HybridLLMApp:
-    def __init__(self):
+    def __init__(self, speculate=0, speculation_budget=None, deadline=None):
         """
         Initialize the hybrid application with a combination of workflow steps and agent-like autonomy.
+        With speculate=N, step 3 is started for the N most likely actions while the LLM is
+        still deciding (see speculate); `speculation_budget` caps the tokens per hour spent
+        on guesses that turn out wrong. `deadline` is the time budget, in seconds, of the
+        steps after the user has entered the topic.
         """
-        self.workflow_steps = [
-            self.step_1_ask_for_topic,
-            self.step_2_decide_action,
-            self.step_3_execute_action,
-            self.step_4_summarize_results,
-        ]
+        self.deadline = deadline
+        self.topic = None
+        # The steps and their inputs; workflow_engine runs them in dependency order.
+        # Completed steps are recorded in the response cache so a failed run can be resumed,
+        # and decisions are memoized by input, like the LLM calls they may make.
+        # Under a deadline, deciding may use up to 30% of the time left, so a slow
+        # decision still leaves time to execute the action and summarize the result.
+        self.workflow = Workflow(
+            [
+                Node("user_input", self.step_1_ask_for_topic),
+                Node("speculation", self.speculate, ["user_input"]),
+                Node("action", self.step_2_decide_action, ["user_input"], memoize=True, ttl=7 * 24 * 60 * 60, budget=0.3),
+                Node("result_stream", self.start_result, ["user_input", "action", "speculation"]),
+                Node("result", self.print_result, ["result_stream"]),
+                Node("summary_stream", self.start_summary, ["result"]),
+                Node("summary", self.print_summary, ["summary_stream"]),
+            ],
+            name="hybrid",
+            store=llm.completion.cache,
+        )
+        # Long results are summarized chunk by chunk while they are still being generated
+        self.summarizer = ChunkedSummarizer(self.summarize_text)
+        # Confident decisions are made locally; only unclear inputs are sent to the LLM
+        self.router = RoutingEngine(
+            [RegexRouter(ACTION_RULES), HashedNgramClassifier(ACTION_EXAMPLES)],
+            escalate=self.ask_llm_for_action,
+        )
+        self.speculator = None
+        if speculate:
+            self.speculator = Speculator(
+                lambda user_input, action: self.step_3_execute_action(user_input, action, stream=True),
+                prompt_tokens=lambda user_input, action: len(self.action_prompt(user_input, action) or "") // 4,
+                max_candidates=speculate,
+                wasted_tokens_per_hour=speculation_budget,
+                step="step_3_execute_action",
+            )
 
     def step_1_ask_for_topic(self):
         """
-        Step 1: Ask the user for a topic or task.
+        Step 1: Ask the user for a topic or task (unless it was asked before the run started).
         """
+        if self.topic is not None:
+            return self.topic
         return input("What topic or task would you like assistance with? ")
 
+    @step("step_2_decide_action")
     def step_2_decide_action(self, user_input):
         """
-        Step 2: Use the LLM to decide the best action based on the user input.
-        This is where the agent-like autonomy comes into play.
+        Step 2: Decide the best action based on the user input.
+        This is where the agent-like autonomy comes into play: a local router handles
+        confident cases and the LLM is only asked when it is unsure.
+        """
+        return self.router.route(user_input)
+
+    @step("ask_llm_for_action")
+    def ask_llm_for_action(self, user_input):
+        """
+        Use the LLM to decide the best action when the local router is not confident.
         """
         prompt = f"""
         The user has provided the following input: "{user_input}".
@@ -40,68 +105,192 @@ class HybridLLMApp:
         4. Ask for clarification if the input is unclear.
         Return only the number of the chosen action.
         """
-        response = openai.ChatCompletion.create(
+        response = llm.create(
             model="gpt-4",  # or "gpt-3.5-turbo"
             messages=[{"role": "user", "content": prompt}],
             temperature=0.3,  # Low temperature for deterministic decisions
+            ttl=7 * 24 * 60 * 60,
         )
-        action = int(response['choices'][0]['message']['content'].strip())
-        return action
+        return parse_action(response['choices'][0]['message']['content'])
 
-    def step_3_execute_action(self, user_input, action):
+    def action_prompt(self, user_input, action):
         """
-        Step 3: Execute the chosen action using the LLM.
+        The prompt that carries out `action`, or None if it needs no LLM call.
         """
         if action == 1:
-            prompt = f"Write a detailed explanation about {user_input}."
-        elif action == 2:
-            prompt = f"Provide a step-by-step guide for {user_input}."
-        elif action == 3:
-            prompt = f"Answer the following question: {user_input}"
-        elif action == 4:
+            return f"Write a detailed explanation about {user_input}."
+        if action == 2:
+            return f"Provide a step-by-step guide for {user_input}."
+        if action == 3:
+            return f"Answer the following question: {user_input}"
+        return None
+
+    def speculate(self, user_input):
+        """
+        While step 2 asks the LLM for the action, start step 3 for the most likely
+        actions according to the local router, so a correct guess skips a round trip.
+        Returns a Speculation, or None if the router decides locally or speculation is off.
+        """
+        if self.speculator is None or not self.router.will_escalate(user_input):
+            return None
+        # Clarifying needs no LLM call, so there is nothing to gain by guessing it
+        candidates = [action for action in self.router.candidates(user_input, k=4)
+                      if self.action_prompt(user_input, action) is not None]
+        return self.speculator.start(user_input, candidates)
+
+    def start_result(self, user_input, action, speculation):
+        """
+        Adopt the speculative step 3 for `action` if there is one, otherwise run step 3 now.
+        """
+        if speculation is not None:
+            stream = speculation.adopt(action)
+            if stream is not None:
+                return stream
+        return self.step_3_execute_action(user_input, action, stream=True)
+
+    @step("step_3_execute_action")
+    def step_3_execute_action(self, user_input, action, stream=False):
+        """
+        Step 3: Execute the chosen action using the LLM.
+        With stream=True, return a TokenStream that yields the result as it is generated.
+        """
+        if action == 4:
             return "I need more information. Can you please clarify your request?"
-        else:
+        prompt = self.action_prompt(user_input, action)
+        if prompt is None:
             return "Invalid action selected."
 
-        response = openai.ChatCompletion.create(
+        response = llm.create(
             model="gpt-4",  # or "gpt-3.5-turbo"
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
+            ttl=7 * 24 * 60 * 60,
+            stream=stream,
         )
+        if stream:
+            return TokenStream(response, step="step_3_execute_action")
         return response['choices'][0]['message']['content']
 
-    def step_4_summarize_results(self, result):
+    @step("summarize_text")
+    def summarize_text(self, prompt, stream=False):
         """
-        Step 4: Summarize the results of the executed action.
+        Send one summarization prompt (a chunk, a merge or a whole text) to the LLM.
         """
-        if result.startswith("I need more information"):
-            return result  # No summarization needed for clarification requests
-
-        prompt = f"Summarize the following text in one paragraph:\n\n{result}"
-        response = openai.ChatCompletion.create(
+        response = llm.create(
             model="gpt-4",  # or "gpt-3.5-turbo"
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
+            ttl=7 * 24 * 60 * 60,
+            stream=stream,
         )
+        if stream:
+            return TokenStream(response, step="step_4_summarize_results")
         return response['choices'][0]['message']['content']
 
-    def run_hybrid_app(self):
+    @step("step_4_summarize_results")
+    def step_4_summarize_results(self, result, stream=False):
+        """
+        Step 4: Summarize the results of the executed action.
+        `result` may be text, a TokenStream from step 3, or a SummaryPipeline
+        that has been summarizing the result while it was generated.
+        """
+        pipeline = self.summarizer.pipeline(result)
+        if pipeline.read().startswith("I need more information"):
+            return pipeline.text  # No summarization needed for clarification requests
+        return pipeline.merge(stream=stream)
+
+    def print_result(self, result_stream):
+        """
+        Show the result as it streams, summarizing completed chunks of it in the
+        meantime; returns the SummaryPipeline for step 4.
+        """
+        pipeline = self.summarizer.pipeline(result_stream)
+        print("\nResult:")
+        print_stream(pipeline)
+        return pipeline
+
+    def start_summary(self, result):
+        print("\nSummarizing results...")
+        return self.step_4_summarize_results(result, stream=True)
+
+    def print_summary(self, summary_stream):
+        print("\nSummary:")
+        return print_stream(summary_stream)
+
+    def run_hybrid_app(self, profile=False, run_id=None):
         """
         Execute the hybrid workflow step by step.
+        Pass the `run_id` of a failed run to resume it from its last completed step.
+        With profile=True, print a per-step breakdown of the LLM calls at the end.
+        Under a deadline, the steps still running when it passes are cancelled and
+        the run ends with what it has, e.g. the result without its summary.
         """
+        mark = llm_metrics.default_recorder.mark()
+        resuming = run_id is not None
+        run_id = run_id or new_run_id()
+        progress = {"user_input": "\nDeciding the best action...", "action": "\nExecuting action..."}
+        speculation = {}
+
+        def on_result(name, value):
+            if name in progress:
+                print(progress[name])
+            if name == "speculation":
+                speculation["value"] = value
+
         print("Welcome to the Hybrid LLM-Based Application!")
-        user_input = self.step_1_ask_for_topic()
-        print("\nDeciding the best action...")
-        action = self.step_2_decide_action(user_input)
-        print("\nExecuting action...")
-        result = self.step_3_execute_action(user_input, action)
-        print("\nResult:\n", result)
-        print("\nSummarizing results...")
-        summary = self.step_4_summarize_results(result)
-        print("\nSummary:\n", summary)
-        print("\nWorkflow complete. Thank you for using the app!")
+        self.topic = None
+        if self.deadline is not None and not resuming:
+            # The budget starts once the user has answered, not while they are typing
+            self.topic = self.step_1_ask_for_topic()
+        try:
+            run = asyncio.run(self.workflow.run({}, on_result=on_result, run_id=run_id, deadline=self.deadline,
+                                                partial=self.deadline is not None))
+        except (Exception, KeyboardInterrupt):
+            if speculation.get("value") is not None:
+                speculation["value"].cancel()
+            print(f"\nThe workflow stopped; resume it with --resume {run_id}")
+            raise
+        if not run.complete:
+            if speculation.get("value") is not None:
+                speculation["value"].cancel()
+            unfinished = [name for name, status in run.statuses.items() if status in FAILED]
+            reason = "ran past its deadline" if "timeout" in run.statuses.values() else "stopped"
+            print(f"\nThe workflow {reason} before {', '.join(unfinished)}; resume it with --resume {run_id}")
+        timings = format_timings([run.get("result_stream"), run.get("summary_stream")])
+        if timings:
+            print("\n" + timings)
+        if profile:
+            print("\n" + run.format_timings())
+            print("\n" + llm_metrics.default_recorder.breakdown(since=mark))
+            print(f"Hedging - {hedger.summary()}")
+            print(f"Coalescing - {flights.summary()}")
+            if self.speculator is not None:
+                print(f"Speculation - {self.speculator.summary()}")
+        if run.complete:
+            print("\nWorkflow complete. Thank you for using the app!")
 
 # Initialize and run the hybrid app
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hybrid LLM-based application")
+    parser.add_argument("--resume", metavar="RUN_ID", help="resume a run that stopped, skipping its completed steps")
+    parser.add_argument("--no-hedge", action="store_true",
+                        help="don't duplicate slow calls (fallback tiers are still used after errors)")
+    parser.add_argument("--speculate", type=int, default=0, metavar="K",
+                        help="start executing the K most likely actions while the LLM decides (default: off)")
+    parser.add_argument("--speculation-budget", type=int, metavar="TOKENS",
+                        help="stop speculating while wrong guesses cost more than TOKENS per hour")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="time budget once the topic is entered; steps still running then are cut short")
+    llm_metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.no_hedge:
+        hedger.policy.max_hedges = 0
+    app = HybridLLMApp(speculate=args.speculate, speculation_budget=args.speculation_budget, deadline=args.deadline)
+    app.run_hybrid_app(profile=args.profile, run_id=args.resume)
+    llm_metrics.export(args)
+
 if __name__ == "__main__":
-    app = HybridLLMApp()
-    app.run_hybrid_app() 
\ No newline at end of file
+    main() 
\ No newline at end of file
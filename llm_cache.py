@@ -0,0 +1,243 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from llm_metrics import annotate, answered_by
+from llm_stream import chunk_text
+
+# Default on-disk location, shared by every script in the repository (LLM_CACHE_PATH overrides it)
+DEFAULT_CACHE_PATH = ".llm_cache.sqlite3"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Parameters that don't change the model output and so are left out of the cache key
+UNKEYED_PARAMS = {"stream", "timeout", "request_timeout", "user"}
+
+
+def cache_key(model, messages=None, key_data=None, **params):
+    """
+    Content hash of a chat request.
+    When `key_data` is given it replaces the messages in the key, so callers
+    can key on a normalized input (e.g. a quantized market snapshot).
+    """
+    keyed = {name: value for name, value in params.items() if name not in UNKEYED_PARAMS}
+    payload = {"model": model, "params": keyed}
+    if key_data is not None:
+        payload["data"] = key_data
+    else:
+        payload["messages"] = messages
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def quantize(data, significant_digits=3):
+    """
+    Round every number in a (nested) snapshot to a few significant digits,
+    so near-identical snapshots produce the same cache key.
+    """
+    if isinstance(data, dict):
+        return {key: quantize(value, significant_digits) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [quantize(value, significant_digits) for value in data]
+    if isinstance(data, bool) or not isinstance(data, (int, float)) or not data or not math.isfinite(data):
+        return data
+    digits = significant_digits - int(math.floor(math.log10(abs(data)))) - 1
+    return round(float(data), digits)
+
+
+class ResponseCache:
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, default_ttl=None):
+        """
+        SQLite-backed response cache with per-entry TTLs and a byte-bounded LRU policy.
+        `path` defaults to LLM_CACHE_PATH or DEFAULT_CACHE_PATH, read when the database
+        is opened on first use, so creating a cache at import time touches no files.
+        `default_ttl` (seconds) applies when a call doesn't pass its own; None means no expiry.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0}
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def _db(self):
+        if self._connection is None:
+            with self._open_lock:
+                if self._connection is None:
+                    self._connection = self._open()
+        return self._connection
+
+    def _open(self):
+        self.path = self.path or os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL, last_access REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return db
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or None on a miss or expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, size, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            value, size, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.counters["hits"] += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a JSON-serializable value, then evict least recently used entries
+        until the cache fits in `max_bytes`.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        blob = json.dumps(value, separators=(",", ":")).encode()
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), expires_at, now),
+            )
+            self.total_bytes += len(blob) - (previous[0] if previous else 0)
+            self.counters["writes"] += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now):
+        # Expired entries go first, then the least recently used ones
+        expired = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses WHERE expires_at <= ?", (now,)
+        ).fetchone()
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self.total_bytes -= expired[0]
+        self.counters["evictions"] += expired[1]
+        if self.total_bytes <= self.max_bytes:
+            return
+        victims = []
+        freed = 0
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if self.total_bytes - freed <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.total_bytes -= freed
+        self.counters["evictions"] += len(victims)
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters, the hit rate and the current size in bytes.
+        """
+        self._db  # Opening the database reads its current size
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return dict(self.counters, hit_rate=self.counters["hits"] / lookups if lookups else 0.0, bytes=self.total_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class CachedChatCompletion:
+    def __init__(self, cache, create=None, acreate=None):
+        """
+        Caching wrapper around a chat-completion function.
+        Pass the sync `create` and/or async `acreate` function to wrap;
+        both accept `ttl` and `key_data` in addition to the usual request parameters.
+        Answers from another model than the one requested (see llm_hedge.py) aren't cached.
+        """
+        self.cache = cache
+        self._create = create
+        self._acreate = acreate
+
+    def create(self, ttl=None, key_data=None, **params):
+        key = cache_key(key_data=key_data, **params)
+        response = self.cache.get(key)
+        annotate(cache_hit=response is not None)
+        if params.get("stream"):
+            if response is not None:
+                return iter([_as_chunk(response)])
+            return self._record_stream(key, self._create(**params), ttl)
+        if response is None:
+            response = self._create(**params)
+            if not answered_by(response):
+                self.cache.set(key, response, ttl)
+        return response
+
+    async def acreate(self, ttl=None, key_data=None, **params):
+        key = cache_key(key_data=key_data, **params)
+        response = self.cache.get(key)
+        annotate(cache_hit=response is not None)
+        if params.get("stream"):
+            if response is not None:
+                return _iterate_async([_as_chunk(response)])
+            return self._arecord_stream(key, await self._acreate(**params), ttl)
+        if response is None:
+            response = await self._acreate(**params)
+            if not answered_by(response):
+                self.cache.set(key, response, ttl)
+        return response
+
+    def _record_stream(self, key, chunks, ttl):
+        # Pass chunks through and cache the assembled response once the stream completes
+        parts = []
+        substitute = None
+        for chunk in chunks:
+            parts.append(chunk_text(chunk))
+            substitute = substitute or answered_by(chunk)
+            yield chunk
+        if not substitute:
+            self.cache.set(key, _as_response("".join(parts)), ttl)
+
+    async def _arecord_stream(self, key, chunks, ttl):
+        parts = []
+        substitute = None
+        async for chunk in chunks:
+            parts.append(chunk_text(chunk))
+            substitute = substitute or answered_by(chunk)
+            yield chunk
+        if not substitute:
+            self.cache.set(key, _as_response("".join(parts)), ttl)
+
+
+def _as_response(content):
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}
+
+
+def _as_chunk(response):
+    content = response["choices"][0]["message"]["content"]
+    return {"choices": [{"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}
+
+
+async def _iterate_async(items):
+    for item in items:
+        yield item
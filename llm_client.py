@@ -0,0 +1,240 @@
+import importlib.util
+import os
+import time
+
+import deadline
+from llm_metrics import count_attempt
+
+# Shared LLM client for every script in the repository.
+# It wraps the openai>=1.0 OpenAI/AsyncOpenAI clients on top of pooled
+# (HTTP/2 when available) httpx connections, applies one timeout policy and
+# runs request/response hooks around every call. Responses are returned as
+# plain dicts so the cache, scheduler and streaming helpers stay SDK-agnostic.
+# Every HTTP attempt, SDK retries included, is counted on the call's metrics span.
+# Under a deadline (deadline.py) a call gets the time left as its timeout, isn't
+# retried by the SDK (the scheduler and hedger know the budget) and a stream is cut
+# off with DeadlineExceeded when the deadline passes.
+# openai and httpx are imported when the first connection is made, so loading a
+# script (or printing its --help) doesn't pay for them.
+
+
+class LLMClient:
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        timeout=60.0,
+        connect_timeout=10.0,
+        max_connections=100,
+        max_keepalive_connections=20,
+        max_retries=2,
+        http2=True,
+    ):
+        """
+        Configure the client. Connections are opened lazily, on the first call.
+        `api_key` and `base_url` default to OPENAI_API_KEY and OPENAI_BASE_URL,
+        read at that point, so a .env file loaded after the client is created still applies.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.max_retries = max_retries
+        # HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.request_hooks = []
+        self.response_hooks = []
+        self._sync = None
+        self._async = None
+
+    def _http_options(self, httpx):
+        return {
+            "http2": self.http2,
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+            ),
+            "timeout": httpx.Timeout(self.timeout, connect=self.connect_timeout),
+        }
+
+    @property
+    def sync_client(self):
+        if self._sync is None:
+            import httpx
+            from openai import OpenAI
+
+            self._sync = OpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY"),
+                base_url=self.base_url or os.getenv("OPENAI_BASE_URL"),
+                max_retries=self.max_retries,
+                http_client=httpx.Client(**self._http_options(httpx), event_hooks={"request": [_on_attempt]}),
+            )
+        return self._sync
+
+    @property
+    def async_client(self):
+        if self._async is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            self._async = AsyncOpenAI(
+                api_key=self.api_key or os.getenv("OPENAI_API_KEY"),
+                base_url=self.base_url or os.getenv("OPENAI_BASE_URL"),
+                max_retries=self.max_retries,
+                http_client=httpx.AsyncClient(**self._http_options(httpx), event_hooks={"request": [_aon_attempt]}),
+            )
+        return self._async
+
+    def add_request_hook(self, hook):
+        """
+        Register `hook(params)`, called before every request; it may modify `params`.
+        """
+        self.request_hooks.append(hook)
+
+    def add_response_hook(self, hook):
+        """
+        Register `hook(params, response, elapsed)`, called after every completed request.
+        For streamed calls `response` is None and `elapsed` covers the whole stream.
+        """
+        self.response_hooks.append(hook)
+
+    def _before(self, params):
+        for hook in self.request_hooks:
+            hook(params)
+
+    def _after(self, params, response, started):
+        elapsed = time.perf_counter() - started
+        for hook in self.response_hooks:
+            hook(params, response, elapsed)
+
+    def _completions(self, client, max_retries):
+        if max_retries is not None:
+            client = client.with_options(max_retries=max_retries)
+        return client.chat.completions
+
+    def _bound(self, params, max_retries):
+        """
+        Apply the current deadline to a call: returns (max_retries, expires).
+        """
+        expires = deadline.expires_at()
+        if expires is None:
+            return max_retries, None
+        deadline.check("the LLM call", expires)
+        params.setdefault("timeout", deadline.remaining(expires))
+        return 0, expires
+
+    @staticmethod
+    def _late(exc, expires):
+        # A call that fails once its deadline has passed (e.g. the SDK's timeout, set to
+        # the time that was left) is reported as DeadlineExceeded
+        if expires is not None and deadline.remaining(expires) == 0 and not isinstance(exc, deadline.DeadlineExceeded):
+            late = deadline.DeadlineExceeded("the LLM call did not finish before the deadline")
+            late.__cause__ = exc
+            return late
+        return exc
+
+    def create(self, max_retries=None, **params):
+        """
+        Chat completion (blocking). With stream=True, returns an iterator of chunk dicts.
+        """
+        max_retries, expires = self._bound(params, max_retries)
+        self._before(params)
+        started = time.perf_counter()
+        try:
+            response = self._completions(self.sync_client, max_retries).create(**params)
+        except Exception as exc:
+            raise self._late(exc, expires)
+        if params.get("stream"):
+            return self._iterate(params, response, started, expires)
+        response = response.model_dump()
+        self._after(params, response, started)
+        return response
+
+    async def acreate(self, max_retries=None, **params):
+        """
+        Chat completion (async). With stream=True, returns an async iterator of chunk dicts.
+        """
+        max_retries, expires = self._bound(params, max_retries)
+        self._before(params)
+        started = time.perf_counter()
+        try:
+            response = await self._completions(self.async_client, max_retries).create(**params)
+        except Exception as exc:
+            raise self._late(exc, expires)
+        if params.get("stream"):
+            return self._aiterate(params, response, started, expires)
+        response = response.model_dump()
+        self._after(params, response, started)
+        return response
+
+    def _iterate(self, params, stream, started, expires=None):
+        try:
+            with stream:
+                for chunk in stream:
+                    if expires is not None:
+                        deadline.check("the end of the stream", expires)
+                    yield chunk.model_dump()
+        except Exception as exc:
+            raise self._late(exc, expires)
+        self._after(params, None, started)
+
+    async def _aiterate(self, params, stream, started, expires=None):
+        try:
+            async with stream:
+                async for chunk in stream:
+                    if expires is not None:
+                        deadline.check("the end of the stream", expires)
+                    yield chunk.model_dump()
+        except Exception as exc:
+            raise self._late(exc, expires)
+        self._after(params, None, started)
+
+    def embed(self, texts, model="text-embedding-3-small"):
+        """
+        Embed a list of texts and return one vector per text.
+        """
+        response = self.sync_client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in response.data]
+
+    def close(self):
+        if self._sync is not None:
+            self._sync.close()
+            self._sync = None
+
+    async def aclose(self):
+        if self._async is not None:
+            await self._async.close()
+            self._async = None
+
+
+def _on_attempt(request):
+    count_attempt()
+
+
+async def _aon_attempt(request):
+    count_attempt()
+
+
+_default_client = None
+
+
+def configure(**options):
+    """
+    Replace the shared client with one built from `options` (see LLMClient).
+    Call before the scripts make their first request, e.g. to size the connection pool.
+    """
+    global _default_client
+    _default_client = LLMClient(**options)
+    return _default_client
+
+
+def get_client():
+    """
+    Return the process-wide shared client, creating it on first use.
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = LLMClient()
+    return _default_client
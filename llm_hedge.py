@@ -0,0 +1,296 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+from collections import deque
+
+import llm_metrics
+from llm_scheduler import is_retryable
+
+# Hedged requests with per-step model fallback tiers.
+# A step declares the models it may use, e.g. gpt-4 -> gpt-4-turbo -> gpt-3.5-turbo.
+# When a call runs longer than a high percentile of the recent latencies of its
+# model, the same request is sent to the next tier; the first answer wins and the
+# other request is cancelled. A tier that fails with a transient error hands over
+# to the next one at once. Latencies are tracked per model and per streaming mode
+# (for streams, the time until the response starts). Sits between the cache and
+# the client or scheduler, so cache hits are never hedged. An answer from another
+# tier than the requested model names its model (llm_metrics.ANSWERED_BY), in the
+# response or in every streamed chunk: it isn't cached under the original request,
+# and the call's span reports that model. HTTP attempts are counted per model.
+
+# Recent latencies kept per (model, stream)
+LATENCY_WINDOW = 200
+
+
+class LatencyTracker:
+    def __init__(self, window=LATENCY_WINDOW):
+        """
+        Recent successful call latencies per (model, stream) key.
+        """
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+            self._samples[key].append(seconds)
+
+    def percentile(self, key, percentile, min_samples=1):
+        """
+        The `percentile` of the recent latencies for `key`, or None with fewer than `min_samples`.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+
+class HedgePolicy:
+    def __init__(self, tiers, percentile=95, min_samples=20, max_hedges=1, budget=0.1):
+        """
+        `tiers` maps step names (see llm_metrics.step) to the models to use, in order.
+        A call running longer than the `percentile` of its model's recent latencies
+        (once `min_samples` are known) is duplicated on the next tier, at most
+        `max_hedges` times per call and for at most `budget` of all calls.
+        Calls outside the listed steps are passed through untouched.
+        """
+        self.tiers = tiers
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.budget = budget
+
+    def models_for(self, model):
+        """
+        The requested model followed by the fallbacks declared for the current step.
+        """
+        tiers = self.tiers.get(llm_metrics.current_step())
+        if not tiers:
+            return [model]
+        return [model] + [tier for tier in tiers if tier != model]
+
+
+class _Call:
+    # Bookkeeping shared by the sync and async paths for one hedged call
+    def __init__(self, hedger, params):
+        self.hedger = hedger
+        self.params = params
+        self.stream = bool(params.get("stream"))
+        self.models = hedger.policy.models_for(params["model"])
+        self.next_tier = 0
+        self.hedges = 0
+        self.launched_at = None
+
+    def next_params(self):
+        params = dict(self.params, model=self.models[self.next_tier])
+        self.next_tier += 1
+        self.launched_at = time.perf_counter()
+        return params
+
+    def hedge_delay(self):
+        """
+        Seconds until the latest request should be hedged, or None if it shouldn't be.
+        """
+        hedger = self.hedger
+        policy = hedger.policy
+        if self.next_tier >= len(self.models) or self.hedges >= policy.max_hedges:
+            return None
+        if not self.within_budget():
+            return None
+        model = self.models[self.next_tier - 1]
+        trigger = hedger.tracker.percentile((model, self.stream), policy.percentile, policy.min_samples)
+        if trigger is None:
+            return None
+        return max(0.0, trigger - (time.perf_counter() - self.launched_at))
+
+    def within_budget(self):
+        counters = self.hedger.counters
+        return counters["hedged"] < self.hedger.policy.budget * counters["calls"]
+
+    def hedge(self):
+        """
+        Count a hedge, or return False (and stop hedging this call) if the budget is spent.
+        Checked again when the hedge fires, as concurrent calls may have used it up meanwhile.
+        """
+        if not self.within_budget():
+            self.hedges = self.hedger.policy.max_hedges
+            return False
+        self.hedges += 1
+        self.hedger.counters["hedged"] += 1
+        return True
+
+    def can_fall_back(self, error):
+        return self.next_tier < len(self.models) and is_retryable(error)
+
+
+class HedgedCompletion:
+    def __init__(self, policy, create=None, acreate=None, tracker=None, max_workers=32):
+        """
+        Wrap a blocking `create` and/or an async `acreate` completion function
+        (e.g. LLMClient.create, LLMScheduler.chat) with `policy`.
+        Blocking calls of hedged steps run on a pool of `max_workers` threads.
+        """
+        self.policy = policy
+        self._create = create
+        self._acreate = acreate
+        self.tracker = tracker or LatencyTracker()
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0, "cancelled": 0, "abandoned": 0}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="hedge")
+
+    def summary(self):
+        counters = self.counters
+        return (f"{counters['calls']} calls, {counters['hedged']} hedged, {counters['hedge_wins']} won by the hedge, "
+                f"{counters['fallbacks']} fallbacks after errors")
+
+    def _timed(self, params, stream, started, response):
+        self.tracker.observe((params["model"], stream), time.perf_counter() - started)
+        return response
+
+    def _attempt(self, params, stream):
+        started = time.perf_counter()
+        with llm_metrics.attempting(params["model"]):
+            return self._timed(params, stream, started, self._create(**params))
+
+    async def _aattempt(self, params, stream):
+        started = time.perf_counter()
+        with llm_metrics.attempting(params["model"]):
+            return self._timed(params, stream, started, await self._acreate(**params))
+
+    def create(self, **params):
+        call = _Call(self, params)
+        if len(call.models) == 1:
+            return self._attempt(params, call.stream)
+        self.counters["calls"] += 1
+        pending = {}
+
+        def launch():
+            # Run in a copy of this context, so the attempt keeps the step and the call's span
+            future = self._executor.submit(contextvars.copy_context().run, self._attempt, call.next_params(), call.stream)
+            pending[future] = call.next_tier - 1
+
+        launch()
+        error = None
+        try:
+            while pending:
+                done, _ = concurrent.futures.wait(pending, timeout=call.hedge_delay(),
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    if call.hedge():
+                        launch()
+                    continue
+                for future in done:
+                    tier = pending.pop(future)
+                    if future.exception() is None:
+                        if tier > 0 and call.hedges:
+                            self.counters["hedge_wins"] += 1
+                        return _answered_by(future.result(), call.models[tier]) if tier > 0 else future.result()
+                    error = future.exception()
+                if not pending:
+                    if not call.can_fall_back(error):
+                        raise error
+                    self.counters["fallbacks"] += 1
+                    launch()
+            raise error
+        finally:
+            # A blocking request can't be interrupted; its answer (or one that finished
+            # together with the winner) is dropped when it arrives
+            for future in pending:
+                self.counters["abandoned"] += 1
+                future.add_done_callback(_drop)
+
+    async def acreate(self, **params):
+        call = _Call(self, params)
+        if len(call.models) == 1:
+            return await self._aattempt(params, call.stream)
+        self.counters["calls"] += 1
+        pending = {}
+
+        def launch():
+            task = asyncio.ensure_future(self._aattempt(call.next_params(), call.stream))
+            pending[task] = call.next_tier - 1
+
+        launch()
+        error = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=call.hedge_delay(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if call.hedge():
+                        launch()
+                    continue
+                for task in done:
+                    tier = pending.pop(task)
+                    if task.exception() is None:
+                        if tier > 0 and call.hedges:
+                            self.counters["hedge_wins"] += 1
+                        return _answered_by(task.result(), call.models[tier]) if tier > 0 else task.result()
+                    error = task.exception()
+                if not pending:
+                    if not call.can_fall_back(error):
+                        raise error
+                    self.counters["fallbacks"] += 1
+                    launch()
+            raise error
+        finally:
+            for task in pending:
+                self.counters["cancelled"] += 1
+                task.cancel()
+            # A request may have finished just before it was cancelled; release its stream
+            for response in await asyncio.gather(*pending, return_exceptions=True):
+                if not isinstance(response, BaseException):
+                    await _aclose(response)
+
+
+def _answered_by(response, model):
+    """
+    Mark a response (or each chunk of a stream) as given by `model` rather than the requested one.
+    """
+    if isinstance(response, dict):
+        return dict(response, **{llm_metrics.ANSWERED_BY: model})
+    if hasattr(response, "__aiter__"):
+        return _amark(response, model)
+    return _mark(response, model)
+
+
+def _mark(chunks, model):
+    try:
+        for chunk in chunks:
+            yield dict(chunk, **{llm_metrics.ANSWERED_BY: model})
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+async def _amark(chunks, model):
+    try:
+        async for chunk in chunks:
+            yield dict(chunk, **{llm_metrics.ANSWERED_BY: model})
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+
+
+def _close(response):
+    # Streams only release their connection once entered, so start the stream before closing it
+    if hasattr(response, "close"):
+        next(response, None)
+        response.close()
+
+
+async def _aclose(response):
+    if hasattr(response, "aclose"):
+        try:
+            await response.__anext__()
+        except StopAsyncIteration:
+            pass
+        await response.aclose()
+
+
+def _drop(future):
+    if not future.cancelled() and future.exception() is None:
+        _close(future.result())
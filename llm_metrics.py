@@ -0,0 +1,577 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from llm_stream import chunk_text
+
+# Per-call LLM instrumentation.
+# Every completion made through a TracedChatCompletion becomes a CallSpan that
+# records queue time, time-to-first-token, latency, tokens, retries, cache hits
+# and cost, tagged with the workflow and the (nested) steps it was made from.
+# Spans are aggregated into Prometheus metrics, exported as OTLP/JSON spans and
+# summarized in a per-step breakdown. A call answered by another model than the one
+# requested (a hedge or fallback, see llm_hedge.py) is attributed to the answering
+# model, and its HTTP attempts are counted per model.
+
+# List prices in USD per million tokens (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-3.5-turbo-16k": (3.0, 4.0),
+}
+
+# Histogram buckets (seconds) for latency, time-to-first-token and queue time
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_steps = contextvars.ContextVar("llm_steps", default=())
+_trace_id = contextvars.ContextVar("llm_trace_id", default=None)
+_span = contextvars.ContextVar("llm_span", default=None)
+_attempt_model = contextvars.ContextVar("llm_attempt_model", default=None)
+
+# A response, or streamed chunk, from another model than the one requested names it under this key
+ANSWERED_BY = "answered_by"
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+@contextlib.contextmanager
+def step(name):
+    """
+    Tag every LLM call made inside the block with the step `name`.
+    Steps nest, and also work as function decorators: @step("identify_issue").
+    """
+    steps_token = _steps.set(_steps.get() + (name,))
+    trace_token = _trace_id.set(_trace_id.get() or _new_id(16))
+    try:
+        yield
+    finally:
+        _steps.reset(steps_token)
+        _trace_id.reset(trace_token)
+
+
+def current_step():
+    """
+    The innermost step the current code runs in, or None.
+    """
+    steps = _steps.get()
+    return steps[-1] if steps else None
+
+
+def current_span():
+    """
+    The span of the call being made in this context, if any.
+    """
+    return _span.get()
+
+
+def annotate(**fields):
+    """
+    Set fields (e.g. cache_hit=True) on the current call's span.
+    """
+    span = _span.get()
+    if span is not None:
+        for name, value in fields.items():
+            setattr(span, name, value)
+
+
+def add_queue_time(seconds):
+    span = _span.get()
+    if span is not None:
+        span.queue_time += seconds
+
+
+def answered_by(item):
+    """
+    The model that gave a response or chunk, if it isn't the one that was requested.
+    """
+    return item.get(ANSWERED_BY) if isinstance(item, dict) else None
+
+
+@contextlib.contextmanager
+def attempting(model):
+    """
+    Count the HTTP attempts made inside the block as attempts of `model` (e.g. a hedge's).
+    """
+    token = _attempt_model.set(model)
+    try:
+        yield
+    finally:
+        _attempt_model.reset(token)
+
+
+def count_attempt():
+    """
+    Count one HTTP attempt for the current call; attempts beyond the first to a model are retries.
+    """
+    span = _span.get()
+    if span is not None:
+        span.attempts += 1
+        model = _attempt_model.get() or span.request_model
+        span.attempts_by_model[model] = span.attempts_by_model.get(model, 0) + 1
+
+
+class CallSpan:
+    def __init__(self, workflow, model):
+        self.workflow = workflow
+        self.steps = _steps.get()
+        self.model = model
+        self.request_model = model
+        self.trace_id = _trace_id.get() or _new_id(16)
+        self.span_id = _new_id(8)
+        self.start_time = time.time()
+        self.queue_time = 0.0
+        self.ttft = None
+        self.latency = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tokens_estimated = False
+        self.attempts = 0
+        self.attempts_by_model = {}
+        self.cache_hit = False
+        self.coalesced = False
+        self.error = None
+        self.seq = None
+        self._started = time.perf_counter()
+
+    @property
+    def step(self):
+        return "/".join(self.steps) or "-"
+
+    @property
+    def retries(self):
+        return sum(max(0, attempts - 1) for attempts in self.attempts_by_model.values())
+
+    @property
+    def cost(self):
+        if self.cache_hit or self.coalesced:
+            return 0.0
+        prompt_price, completion_price = MODEL_PRICES.get(self.model, (0.0, 0.0))
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1e6
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self._started
+
+    def finish(self, params, response=None, text=None, error=None):
+        """
+        Close the span. Token counts come from the response's usage when present,
+        otherwise they are estimated from the text (about four characters per token).
+        """
+        self.latency = time.perf_counter() - self._started
+        self.model = answered_by(response) or self.model
+        if error is not None:
+            self.error = type(error).__name__
+        if self.cache_hit or self.coalesced:
+            # No tokens of its own: answered from the cache or by another caller's call
+            return
+        usage = response.get("usage") if isinstance(response, dict) else None
+        if usage:
+            self.prompt_tokens = usage.get("prompt_tokens") or 0
+            self.completion_tokens = usage.get("completion_tokens") or 0
+            return
+        if text is None and isinstance(response, dict) and response.get("choices"):
+            text = response["choices"][0]["message"]["content"]
+        self.prompt_tokens = sum(len(m.get("content") or "") for m in params.get("messages", [])) // 4
+        self.completion_tokens = len(text or "") // 4
+        self.tokens_estimated = True
+
+    def to_otlp(self):
+        """
+        This span in OpenTelemetry's OTLP/JSON encoding (GenAI semantic conventions).
+        """
+        end_time = self.start_time + (self.latency or 0.0)
+        attributes = [
+            _attribute("gen_ai.system", "openai"),
+            _attribute("gen_ai.operation.name", "chat"),
+            _attribute("gen_ai.request.model", self.request_model or ""),
+            _attribute("gen_ai.response.model", self.model or ""),
+            _attribute("gen_ai.usage.input_tokens", self.prompt_tokens),
+            _attribute("gen_ai.usage.output_tokens", self.completion_tokens),
+            _attribute("llm.workflow", self.workflow),
+            _attribute("llm.step", self.step),
+            _attribute("llm.queue_time_s", self.queue_time),
+            _attribute("llm.retries", self.retries),
+            _attribute("llm.attempts", ",".join(f"{model}={n}" for model, n in self.attempts_by_model.items())),
+            _attribute("llm.cache_hit", self.cache_hit),
+            _attribute("llm.coalesced", self.coalesced),
+            _attribute("llm.cost_usd", self.cost),
+            _attribute("llm.tokens_estimated", self.tokens_estimated),
+        ]
+        if self.ttft is not None:
+            attributes.append(_attribute("llm.ttft_s", self.ttft))
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": f"chat {self.request_model}",
+            "kind": 3,  # SPAN_KIND_CLIENT
+            "startTimeUnixNano": str(int(self.start_time * 1e9)),
+            "endTimeUnixNano": str(int(end_time * 1e9)),
+            "attributes": attributes,
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Series:
+    def __init__(self):
+        self.counters = dict.fromkeys(
+            ("calls", "cache_hits", "coalesced", "errors", "retries", "prompt_tokens", "completion_tokens", "cost_usd"), 0
+        )
+        self.latency = _Histogram()
+        self.ttft = _Histogram()
+        self.queue = _Histogram()
+
+    def add(self, span):
+        self.counters["calls"] += 1
+        self.counters["cache_hits"] += span.cache_hit
+        self.counters["coalesced"] += span.coalesced
+        self.counters["errors"] += span.error is not None
+        self.counters["retries"] += span.retries
+        self.counters["prompt_tokens"] += span.prompt_tokens
+        self.counters["completion_tokens"] += span.completion_tokens
+        self.counters["cost_usd"] += span.cost
+        self.latency.observe(span.latency)
+        self.queue.observe(span.queue_time)
+        if span.ttft is not None:
+            self.ttft.observe(span.ttft)
+
+
+COUNTERS = (
+    ("calls", "llm_calls_total", "LLM calls, including cache hits."),
+    ("cache_hits", "llm_cache_hits_total", "LLM calls answered from the response cache."),
+    ("coalesced", "llm_coalesced_total", "LLM calls that shared an identical call already in flight."),
+    ("errors", "llm_errors_total", "LLM calls that failed."),
+    ("retries", "llm_retries_total", "HTTP retries made for LLM calls."),
+    ("prompt_tokens", "llm_prompt_tokens_total", "Prompt tokens sent."),
+    ("completion_tokens", "llm_completion_tokens_total", "Completion tokens received."),
+    ("cost_usd", "llm_cost_usd_total", "Estimated spend in US dollars."),
+)
+HISTOGRAMS = (
+    ("latency", "llm_call_latency_seconds", "Total latency of LLM calls."),
+    ("ttft", "llm_time_to_first_token_seconds", "Time to first token of streamed LLM calls."),
+    ("queue", "llm_queue_time_seconds", "Time LLM calls waited for rate-limit capacity."),
+)
+
+
+class MetricsRecorder:
+    def __init__(self, max_spans=100000):
+        """
+        Keeps running totals per (workflow, step, model) and the last `max_spans` spans.
+        """
+        self.spans = deque(maxlen=max_spans)
+        self.recorded = 0
+        self._series = {}
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            span.seq = self.recorded
+            self.recorded += 1
+            self.spans.append(span)
+            key = (span.workflow, span.step, span.model or "")
+            if key not in self._series:
+                self._series[key] = _Series()
+            self._series[key].add(span)
+
+    def record_node(self, workflow, node, seconds, status="ok"):
+        """
+        Record the duration of one workflow_engine node (status: ok, memoized, resumed or error).
+        """
+        with self._lock:
+            key = (workflow, node, status)
+            if key not in self._nodes:
+                self._nodes[key] = _Histogram()
+            self._nodes[key].observe(seconds)
+
+    def node_timings(self):
+        """
+        {(workflow, node, status): (runs, total seconds)} for every node recorded.
+        """
+        with self._lock:
+            return {key: (histogram.count, histogram.sum) for key, histogram in self._nodes.items()}
+
+    def mark(self):
+        """
+        Position to pass as `since` to report only the calls made after this point.
+        """
+        return self.recorded
+
+    def since(self, mark=0):
+        with self._lock:
+            return [span for span in self.spans if span.seq >= mark]
+
+    def prometheus(self):
+        """
+        All totals in the Prometheus text exposition format.
+        """
+        with self._lock:
+            series = sorted(self._series.items())
+            lines = []
+            for field, name, help_text in COUNTERS:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for key, values in series:
+                    lines.append(f"{name}{{{_labels(key)}}} {values.counters[field]:g}")
+            for field, name, help_text in HISTOGRAMS:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, values in series:
+                    histogram = getattr(values, field)
+                    labels = _labels(key)
+                    for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+            if self._nodes:
+                name = "workflow_node_duration_seconds"
+                lines.append(f"# HELP {name} Duration of workflow engine nodes.")
+                lines.append(f"# TYPE {name} histogram")
+                for (workflow, node, status), histogram in sorted(self._nodes.items()):
+                    labels = ",".join(f'{label}="{_escape(value)}"' for label, value in
+                                      (("workflow", workflow), ("node", node), ("status", status)))
+                    for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def otlp(self, since=0, service_name="ai-agent-workflows"):
+        """
+        Recorded spans as an OTLP/JSON ExportTraceServiceRequest.
+        """
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "llm_metrics"},
+                    "spans": [span.to_otlp() for span in self.since(since)],
+                }],
+            }]
+        }
+
+    def folded(self, since=0):
+        """
+        Call time per step path in the folded-stack format read by flame graph tools
+        (flamegraph.pl, speedscope), in milliseconds.
+        """
+        totals = {}
+        for span in self.since(since):
+            path = ";".join((span.workflow,) + span.steps)
+            totals[path] = totals.get(path, 0.0) + span.latency
+        return "\n".join(f"{path} {round(seconds * 1000)}" for path, seconds in sorted(totals.items()))
+
+    def breakdown(self, since=0, width=24):
+        """
+        Flame-style text report: one row per step (nested steps indented), with
+        the step's share of the workflow's LLM time drawn as a bar.
+        Times are summed over calls, so concurrent calls can add up to more than the wall time.
+        """
+        spans = self.since(since)
+        if not spans:
+            return "No LLM calls recorded."
+        nodes = {}
+        for span in spans:
+            path = (span.workflow,) + span.steps
+            for depth in range(1, len(path) + 1):
+                node = nodes.setdefault(path[:depth], _Node())
+                node.add(span)
+        lines = [
+            f"{'step':<40} {'calls':>5} {'hits':>4} {'retry':>5} {'time':>8} {'ttft':>7} {'queue':>7} "
+            f"{'tokens':>8} {'cost':>9}  share"
+        ]
+        for path in sorted(nodes, key=lambda p: [(-nodes[p[:d]].time, p[d - 1]) for d in range(1, len(p) + 1)]):
+            node = nodes[path]
+            total = nodes[path[:1]].time or 1.0
+            label = ("  " * (len(path) - 1) + path[-1])[:40]
+            ttft = f"{node.ttft / node.streamed:6.2f}s" if node.streamed else f"{'-':>7}"
+            bar = "█" * max(1, round(width * node.time / total)) if node.time else ""
+            lines.append(
+                f"{label:<40} {node.calls:>5} {node.hits:>4} {node.retries:>5} {node.time:>7.2f}s {ttft} "
+                f"{node.queue:>6.2f}s {node.tokens:>8} ${node.cost:>8.4f}  {bar}"
+            )
+            if len(path) == 1:
+                lines[-1] += f" (wall {node.end - node.start:.2f}s)"
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self._series.clear()
+            self._nodes.clear()
+
+
+class _Node:
+    def __init__(self):
+        self.calls = self.hits = self.retries = self.tokens = self.streamed = 0
+        self.time = self.ttft = self.queue = self.cost = 0.0
+        self.start = float("inf")
+        self.end = 0.0
+
+    def add(self, span):
+        self.calls += 1
+        self.hits += span.cache_hit
+        self.retries += span.retries
+        self.tokens += span.prompt_tokens + span.completion_tokens
+        self.time += span.latency
+        self.queue += span.queue_time
+        self.cost += span.cost
+        if span.ttft is not None:
+            self.ttft += span.ttft
+            self.streamed += 1
+        self.start = min(self.start, span.start_time)
+        self.end = max(self.end, span.start_time + span.latency)
+
+
+def _labels(key):
+    workflow, step_name, model = key
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in
+                    (("workflow", workflow), ("step", step_name), ("model", model)))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Process-wide recorder used by default
+default_recorder = MetricsRecorder()
+
+
+class TracedChatCompletion:
+    def __init__(self, completion, workflow, recorder=None):
+        """
+        Record a CallSpan for every call made through `completion`
+        (anything with `create` and/or `acreate`, e.g. a CachedChatCompletion).
+        """
+        self.completion = completion
+        self.workflow = workflow
+        self.recorder = recorder or default_recorder
+
+    def create(self, **params):
+        span = CallSpan(self.workflow, params.get("model"))
+        token = _span.set(span)
+        try:
+            response = self.completion.create(**params)
+        except BaseException as exc:
+            self._finish(span, params, error=exc)
+            raise
+        finally:
+            _span.reset(token)
+        if params.get("stream"):
+            return self._trace_stream(span, params, response)
+        self._finish(span, params, response)
+        return response
+
+    async def acreate(self, **params):
+        span = CallSpan(self.workflow, params.get("model"))
+        token = _span.set(span)
+        try:
+            response = await self.completion.acreate(**params)
+        except BaseException as exc:
+            self._finish(span, params, error=exc)
+            raise
+        finally:
+            _span.reset(token)
+        if params.get("stream"):
+            return self._atrace_stream(span, params, response)
+        self._finish(span, params, response)
+        return response
+
+    def _finish(self, span, params, response=None, text=None, error=None):
+        span.finish(params, response, text, error)
+        self.recorder.record(span)
+
+    def _trace_stream(self, span, params, chunks):
+        # The span stays open until the stream is exhausted (or abandoned)
+        parts = []
+        usage = None
+        error = None
+        try:
+            for chunk in chunks:
+                text = chunk_text(chunk)
+                if text:
+                    span.first_token()
+                    parts.append(text)
+                usage = chunk.get("usage") or usage
+                span.model = answered_by(chunk) or span.model
+                yield chunk
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            self._finish(span, params, {"usage": usage} if usage else None, "".join(parts), error)
+
+    async def _atrace_stream(self, span, params, chunks):
+        parts = []
+        usage = None
+        error = None
+        try:
+            async for chunk in chunks:
+                text = chunk_text(chunk)
+                if text:
+                    span.first_token()
+                    parts.append(text)
+                usage = chunk.get("usage") or usage
+                span.model = answered_by(chunk) or span.model
+                yield chunk
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            self._finish(span, params, {"usage": usage} if usage else None, "".join(parts), error)
+
+
+def add_arguments(parser):
+    """
+    Add the --profile, --metrics-out and --trace-out flags to a script's argument parser.
+    """
+    parser.add_argument("--profile", action="store_true",
+                        help="print a per-step breakdown of LLM time, tokens and cost at the end")
+    parser.add_argument("--metrics-out", metavar="FILE", help="write Prometheus text metrics to FILE at the end")
+    parser.add_argument("--trace-out", metavar="FILE", help="write LLM call spans to FILE as OTLP/JSON at the end")
+
+
+def export(args, recorder=None):
+    """
+    Write the files requested with --metrics-out and --trace-out.
+    """
+    recorder = recorder or default_recorder
+    if args.metrics_out:
+        with open(args.metrics_out, "w") as f:
+            f.write(recorder.prometheus())
+    if args.trace_out:
+        with open(args.trace_out, "w") as f:
+            json.dump(recorder.otlp(), f)
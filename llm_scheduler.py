@@ -0,0 +1,309 @@
+import asyncio
+import math
+import multiprocessing
+import random
+import time
+
+import deadline
+from llm_metrics import add_queue_time
+
+# HTTP status codes worth retrying: rate limits, timeouts and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Exception class names used by the OpenAI SDKs for transient failures
+RETRYABLE_ERROR_NAMES = {
+    "RateLimitError",
+    "APIConnectionError",
+    "APITimeoutError",
+    "Timeout",
+    "ServiceUnavailableError",
+    "TryAgain",
+}
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=1.0):
+        """
+        Token bucket refilled continuously at `per_minute` tokens per minute.
+        The bucket holds at most `burst_seconds` worth of tokens, so traffic is
+        spread over the minute instead of being spent in one burst.
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens can be taken.
+        Requests larger than the bucket are let through once it is full and
+        leave the bucket in debt, which keeps the long-run rate exact.
+        """
+        async with self._lock:
+            while True:
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        """
+        Give back (positive) or take extra (negative) tokens once the real usage is known.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class SharedTokenBucket:
+    def __init__(self, per_minute, burst_seconds=1.0, context=None):
+        """
+        TokenBucket whose level lives in shared memory, so worker processes started
+        with it (e.g. through a pool initializer) all draw from one budget.
+        `context` is the multiprocessing context the workers are started with.
+        """
+        context = context or multiprocessing.get_context()
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        # [tokens, updated_at]; time.monotonic() is the same clock in every process
+        self._state = context.RawArray("d", [self.capacity, time.monotonic()])
+        self._lock = context.Lock()
+        self._waiters = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_waiters"] = None  # Per-process, per-event-loop
+        return state
+
+    def _refill(self):
+        now = time.monotonic()
+        self._state[0] = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+        self._state[1] = now
+
+    def _take(self, amount):
+        """
+        Take `amount` tokens if the bucket allows it and return 0, or return the seconds to wait.
+        The process lock is only held for the arithmetic, never across a wait.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self._state[0] >= needed:
+                self._state[0] -= amount
+                return 0.0
+            return (needed - self._state[0]) / self.rate
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens can be taken; same semantics as TokenBucket.acquire.
+        """
+        if self._waiters is None:
+            self._waiters = asyncio.Lock()
+        async with self._waiters:
+            while True:
+                wait = self._take(amount)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+
+    def adjust(self, amount):
+        """
+        Give back (positive) or take extra (negative) tokens once the real usage is known.
+        """
+        with self._lock:
+            self._refill()
+            self._state[0] = min(self.capacity, self._state[0] + amount)
+
+
+class ModelLimits:
+    def __init__(self, max_concurrency=8, requests_per_minute=500, tokens_per_minute=30000):
+        """
+        Per-model limits enforced by the scheduler.
+        """
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+
+# Conservative defaults for the models used by the market analysis scripts
+DEFAULT_MODEL_LIMITS = {
+    "gpt-4o": ModelLimits(max_concurrency=8, requests_per_minute=500, tokens_per_minute=30000),
+    "gpt-4-turbo": ModelLimits(max_concurrency=8, requests_per_minute=500, tokens_per_minute=30000),
+    "gpt-4": ModelLimits(max_concurrency=4, requests_per_minute=500, tokens_per_minute=10000),
+    "gpt-3.5-turbo-16k": ModelLimits(max_concurrency=16, requests_per_minute=3500, tokens_per_minute=60000),
+    "gpt-3.5-turbo": ModelLimits(max_concurrency=16, requests_per_minute=3500, tokens_per_minute=60000),
+}
+
+
+def shared_buckets(limits=None, context=None):
+    """
+    Build a requests/min and a tokens/min SharedTokenBucket per model, for
+    LLMScheduler.share in several processes. `limits` overrides the defaults per model.
+    """
+    limits = dict(DEFAULT_MODEL_LIMITS, **(limits or {}))
+    return {
+        model: (
+            SharedTokenBucket(model_limits.requests_per_minute, context=context),
+            SharedTokenBucket(model_limits.tokens_per_minute, context=context),
+        )
+        for model, model_limits in limits.items()
+    }
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """
+    Rough token estimate for a chat request (about four characters per token),
+    plus the completion budget.
+    """
+    prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4 + 4 * len(messages)
+    return prompt_tokens + (max_tokens or 512)
+
+
+def is_retryable(exc):
+    """
+    Decide whether a failed call is worth retrying.
+    """
+    if isinstance(exc, deadline.DeadlineExceeded):
+        return False  # There is no time left for another attempt
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class _ModelState:
+    def __init__(self, limits, shards=1, buckets=None):
+        self.limits = limits
+        self.semaphore = asyncio.Semaphore(max(1, math.ceil(limits.max_concurrency / shards)))
+        if buckets is not None:
+            self.requests, self.tokens = buckets
+        else:
+            self.requests = TokenBucket(limits.requests_per_minute)
+            self.tokens = TokenBucket(limits.tokens_per_minute)
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+
+class LLMScheduler:
+    def __init__(self, create, limits=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+        """
+        Schedule chat-completion calls under per-model concurrency caps,
+        requests/min and tokens/min budgets, retrying transient failures
+        with jittered exponential backoff.
+
+        `create` is the async completion function, e.g. `LLMClient.acreate`.
+        """
+        self.create = create
+        self.limits = dict(DEFAULT_MODEL_LIMITS, **(limits or {}))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {}
+        self.shards = 1
+        self._models = {}
+
+    def share(self, buckets, shards=1):
+        """
+        Take requests/min and tokens/min from `buckets` (see shared_buckets), which
+        other processes draw from too, and keep 1/shards of each concurrency cap.
+        Call before the first request.
+        """
+        self.buckets = buckets
+        self.shards = shards
+        self._models = {}
+
+    def _state(self, model):
+        if model not in self._models:
+            limits = self.limits.get(model, ModelLimits())
+            self._models[model] = _ModelState(limits, self.shards, self.buckets.get(model))
+        return self._models[model]
+
+    def stats(self):
+        """
+        Return per-model request, retry and failure counters.
+        """
+        return {model: dict(state.stats) for model, state in self._models.items()}
+
+    def backoff_delay(self, attempt, exc=None):
+        """
+        Full-jitter exponential backoff, honouring a server-provided Retry-After if present.
+        """
+        retry_after = _retry_after(exc)
+        if retry_after:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def chat(self, model, messages, **params):
+        """
+        Send one chat completion through the scheduler.
+        """
+        estimated = estimate_tokens(messages, params.get("max_tokens"))
+        return await self.submit(
+            model,
+            lambda: self.create(model=model, messages=messages, **params),
+            estimated,
+        )
+
+    async def submit(self, model, call, estimated_tokens=1):
+        """
+        Run `call` (a zero-argument coroutine factory) under the limits of `model`.
+        """
+        state = self._state(model)
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            async with state.semaphore:
+                await state.requests.acquire(1)
+                await state.tokens.acquire(estimated_tokens)
+                add_queue_time(time.perf_counter() - queued_at)
+                state.stats["requests"] += 1
+                try:
+                    response = await call()
+                except Exception as exc:
+                    if attempt >= self.max_retries or not is_retryable(exc):
+                        state.stats["failures"] += 1
+                        raise
+                    error = exc
+                else:
+                    usage = _usage_tokens(response)
+                    if usage is not None:
+                        state.tokens.adjust(estimated_tokens - usage)
+                    return response
+            # Back off outside the semaphore so other calls can use the slot,
+            # unless the deadline would pass before the next attempt
+            delay = self.backoff_delay(attempt, error)
+            left = deadline.remaining()
+            if left is not None and left <= delay:
+                state.stats["failures"] += 1
+                raise error
+            state.stats["retries"] += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def _retry_after(exc):
+    """
+    Seconds to wait according to the error, if the server said so.
+    openai>=1.0 errors carry the HTTP response; older ones a `retry_after` attribute.
+    """
+    response = getattr(exc, "response", None)
+    value = getattr(exc, "retry_after", None) or (response.headers.get("retry-after") if response is not None else None)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _usage_tokens(response):
+    try:
+        return response["usage"]["total_tokens"]
+    except (KeyError, TypeError):
+        return None
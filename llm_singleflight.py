@@ -0,0 +1,331 @@
+import contextvars
+import copy
+import threading
+
+import deadline
+from llm_cache import cache_key
+from llm_metrics import annotate
+
+# In-flight request coalescing ("single flight").
+# Identical chat requests made while one is already running share its upstream
+# call instead of making their own: the first caller starts it, the others wait
+# for its response. Streamed responses are read once, on a background thread or
+# task, and fanned out to every caller; a caller joining late first gets the
+# chunks received so far. A caller that stops reading leaves the call running
+# for the others, and only when every caller has left is the upstream call
+# cancelled. Requests are keyed like the response cache (model, messages and the
+# parameters that change the output), plus whether they stream. Sits below the
+# response cache, which answers the identical requests made after the call is done.
+# asyncio is imported by the async paths only, so sync apps don't load it at startup.
+# A sync caller waits at most until its deadline (deadline.py); async callers are
+# cancelled by theirs. The shared call runs under the deadline of the caller that started it.
+
+
+def flight_key(params):
+    return cache_key(**params), bool(params.get("stream"))
+
+
+def _wait(condition, predicate):
+    # Wait on `condition` (held) until `predicate` holds or the caller's deadline passes
+    if not condition.wait_for(predicate, deadline.remaining()):
+        raise deadline.DeadlineExceeded("deadline passed while waiting for a coalesced call")
+
+
+class _Flight:
+    # One upstream call: its response or the chunks streamed so far
+    def __init__(self, condition=None):
+        self.waiters = 0
+        self.response = None
+        self.chunks = []
+        self.error = None
+        self.started = False
+        self.done = False
+        self.cancelled = False
+        self.task = None
+        self.condition = condition
+        self.changed = None
+
+    def notify(self):
+        # Async flights: wake the subscribers waiting for a chunk
+        import asyncio
+
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class _Subscriber:
+    # One caller's view of a streamed flight (sync)
+    def __init__(self, singleflight, key, flight):
+        self.singleflight = singleflight
+        self.key = key
+        self.flight = flight
+        self.position = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        flight = self.flight
+        with flight.condition:
+            try:
+                _wait(flight.condition, lambda: self.position < len(flight.chunks) or flight.done)
+            except deadline.DeadlineExceeded:
+                self.close()
+                raise
+            if self.position < len(flight.chunks):
+                self.position += 1
+                return flight.chunks[self.position - 1]
+        self.close()
+        if flight.error is not None:
+            raise flight.error
+        raise StopIteration
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.singleflight._leave(self.key, self.flight)
+
+    def __del__(self):
+        self.close()
+
+
+class _AsyncSubscriber(_Subscriber):
+    # One caller's view of a streamed flight (async)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        import asyncio
+
+        flight = self.flight
+        while self.position >= len(flight.chunks) and not flight.done:
+            try:
+                await flight.changed.wait()
+            except asyncio.CancelledError:
+                self.close()
+                raise
+        if self.position < len(flight.chunks):
+            self.position += 1
+            return flight.chunks[self.position - 1]
+        self.close()
+        if flight.error is not None:
+            raise flight.error
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.singleflight._leave(self.key, self.flight):
+                self.flight.task.cancel()
+
+
+class SingleFlight:
+    def __init__(self, create=None, acreate=None):
+        """
+        Coalescing wrapper around a chat-completion function: pass the sync `create`
+        and/or async `acreate` function to wrap. Async requests are only coalesced
+        with requests made on the same event loop. Setting `enabled` to False passes
+        every request straight through.
+        """
+        self._create = create
+        self._acreate = acreate
+        self.enabled = True
+        # calls: upstream calls made; coalesced: requests that shared one (calls saved);
+        # dropped: callers that left before the response was complete; cancelled: upstream
+        # calls stopped because every caller left
+        self.counters = {"calls": 0, "coalesced": 0, "dropped": 0, "cancelled": 0}
+        self._flights = {}
+        # Reentrant, as a dropped subscriber may leave from __del__ while its thread holds the lock
+        self._lock = threading.RLock()
+
+    def summary(self):
+        counters = self.counters
+        requests = counters["calls"] + counters["coalesced"]
+        share = f"{counters['coalesced'] / requests:.0%}" if requests else "-"
+        return (f"{counters['calls']} upstream calls, {counters['coalesced']} requests coalesced ({share} saved), "
+                f"{counters['dropped']} dropped, {counters['cancelled']} cancelled")
+
+    def _join(self, key, new_flight):
+        """
+        Return (flight, leader): the flight in progress for `key`, or a new one that this caller leads.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = new_flight()
+                self.counters["calls"] += 1
+            else:
+                self.counters["coalesced"] += 1
+            flight.waiters += 1
+        if not leader:
+            annotate(coalesced=True)
+        return flight, leader
+
+    def _new_flight(self):
+        return _Flight(threading.Condition(self._lock))
+
+    def _land(self, key, flight):
+        # The call is over: later requests start a new one
+        with self._lock:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, key, flight):
+        """
+        A caller is done with the flight; returns True if it was the last caller of an
+        unfinished call, which should then be cancelled.
+        """
+        with self._lock:
+            flight.waiters -= 1
+            if flight.done:
+                return False
+            self.counters["dropped"] += 1
+            if flight.waiters:
+                return False
+            flight.cancelled = True
+            self.counters["cancelled"] += 1
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return True
+
+    def create(self, **params):
+        if not self.enabled:
+            return self._create(**params)
+        key = ("sync",) + flight_key(params)
+        if params.get("stream"):
+            return self._subscribe(key, params)
+        flight, leader = self._join(key, self._new_flight)
+        if leader:
+            try:
+                flight.response = self._create(**params)
+            except BaseException as exc:
+                flight.error = exc
+                raise
+            finally:
+                self._land(key, flight)
+                with flight.condition:
+                    flight.started = True
+                    flight.condition.notify_all()
+            return flight.response
+        with flight.condition:
+            _wait(flight.condition, lambda: flight.started)
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.response)
+
+    def _subscribe(self, key, params):
+        flight, leader = self._join(key, self._new_flight)
+        subscriber = _Subscriber(self, key, flight)
+        if leader:
+            # Keep the leader's context, so the call is traced under its span
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._pump, key, flight, params), daemon=True).start()
+        with flight.condition:
+            try:
+                _wait(flight.condition, lambda: flight.started)
+            except deadline.DeadlineExceeded:
+                subscriber.close()
+                raise
+        if flight.error is not None and not flight.chunks:
+            # The call failed before streaming anything
+            subscriber.close()
+            raise flight.error
+        return subscriber
+
+    def _pump(self, key, flight, params):
+        chunks = None
+        try:
+            chunks = self._create(**params)
+            with flight.condition:
+                flight.started = True
+                flight.condition.notify_all()
+            for chunk in chunks:
+                with flight.condition:
+                    if flight.cancelled:
+                        break
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            if flight.cancelled and hasattr(chunks, "close"):
+                # Closing the stream closes the connection, which stops the generation
+                chunks.close()
+            self._land(key, flight)
+            with flight.condition:
+                flight.started = True
+                flight.condition.notify_all()
+
+    async def acreate(self, **params):
+        if not self.enabled:
+            return await self._acreate(**params)
+        import asyncio
+
+        key = (id(asyncio.get_running_loop()),) + flight_key(params)
+        if params.get("stream"):
+            return await self._asubscribe(key, params)
+        flight, leader = self._join(key, _Flight)
+        if leader:
+            flight.task = asyncio.ensure_future(self._acreate(**params))
+            flight.task.add_done_callback(lambda task: self._land(key, flight))
+        try:
+            # A caller that is cancelled leaves the call running for the others
+            response = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and self._leave(key, flight):
+                flight.task.cancel()
+            raise
+        self._leave(key, flight)
+        return response if leader else copy.deepcopy(response)
+
+    async def _asubscribe(self, key, params):
+        import asyncio
+
+        def new_flight():
+            flight = _Flight()
+            flight.changed = asyncio.Event()
+            return flight
+
+        flight, leader = self._join(key, new_flight)
+        subscriber = _AsyncSubscriber(self, key, flight)
+        if leader:
+            flight.task = asyncio.ensure_future(self._apump(key, flight, params))
+        while not flight.started:
+            try:
+                await flight.changed.wait()
+            except asyncio.CancelledError:
+                subscriber.close()
+                raise
+        if flight.error is not None and not flight.chunks:
+            subscriber.close()
+            raise flight.error
+        return subscriber
+
+    async def _apump(self, key, flight, params):
+        import asyncio
+
+        chunks = None
+        try:
+            chunks = await self._acreate(**params)
+            flight.started = True
+            flight.notify()
+            async for chunk in chunks:
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            pass  # Every caller left
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            self._land(key, flight)
+            flight.started = True
+            flight.notify()
@@ -0,0 +1,128 @@
+import sys
+import time
+
+# Streaming helpers shared by the interactive scripts.
+# A TokenStream wraps the chunks of a `stream=True` completion, yields the text
+# deltas, keeps the text received so far and records time-to-first-token.
+
+
+def chunk_text(chunk):
+    """
+    Return the text delta carried by one streamed chunk (may be empty).
+    """
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+class TokenStream:
+    def __init__(self, chunks, step=None):
+        """
+        Wrap the chunk iterator of a streamed completion.
+        `step` is a label used when reporting timings.
+        """
+        self.step = step
+        self.parts = []
+        self.done = False
+        self.ttft = None
+        self.elapsed = None
+        self._chunks = chunks
+        self._started = time.perf_counter()
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self._started
+            self.parts.append(text)
+            yield text
+        self.elapsed = time.perf_counter() - self._started
+        self.done = True
+
+    @property
+    def text(self):
+        """
+        The text received so far (the complete text once the stream is exhausted).
+        """
+        return "".join(self.parts)
+
+    def read(self):
+        """
+        Consume the rest of the stream and return the complete text.
+        """
+        for _ in self:
+            pass
+        return self.text
+
+    def close(self):
+        """
+        Stop reading early; closing the chunk iterator releases its connection.
+        """
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class AsyncTokenStream(TokenStream):
+    # Async variant for streams returned by `acreate(stream=True)`
+
+    async def __aiter__(self):
+        async for chunk in self._chunks:
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self._started
+            self.parts.append(text)
+            yield text
+        self.elapsed = time.perf_counter() - self._started
+        self.done = True
+
+    async def read(self):
+        async for _ in self:
+            pass
+        return self.text
+
+    async def aclose(self):
+        """
+        Stop reading early; closing the async chunk iterator releases its connection.
+        """
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def static_stream(text, step=None):
+    """
+    A TokenStream over fixed text, for steps that answer without calling the LLM.
+    """
+    return TokenStream(iter([{"choices": [{"delta": {"content": text}}]}]), step)
+
+
+def print_stream(stream, file=None):
+    """
+    Print tokens as they arrive and return the complete text.
+    Plain strings are printed as-is.
+    """
+    file = file or sys.stdout
+    if isinstance(stream, str):
+        print(stream, file=file)
+        return stream
+    for text in stream:
+        file.write(text)
+        file.flush()
+    file.write("\n")
+    return stream.text
+
+
+def format_timings(streams):
+    """
+    One-line time-to-first-token / total time summary for the given streams.
+    """
+    parts = [
+        f"{stream.step}: first token {stream.ttft:.2f}s, total {stream.elapsed:.2f}s"
+        for stream in streams
+        if isinstance(stream, TokenStream) and stream.done and stream.ttft is not None
+    ]
+    return "Timings - " + "; ".join(parts) if parts else ""
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import deadline
+
+# Market data providers for the real-time market analysis.
+# A provider fetches closing prices for many tickers in one batched call and
+# company info once per ticker; `stream_stock_data` runs both on a thread pool
+# and yields each ticker as soon as its snapshot is complete, until the deadline
+# (deadline.py), if any: tickers still being fetched then are left out. A ticker
+# whose fetch fails is logged and left out too, without ending the stream.
+
+logger = logging.getLogger(__name__)
+
+
+class MarketDataProvider:
+    def fetch_prices(self, tickers):
+        """
+        Return {ticker: latest closing price} for a batch of tickers.
+        """
+        raise NotImplementedError
+
+    def fetch_info(self, ticker):
+        """
+        Return the company info dict for one ticker (revenue, beta, ...).
+        """
+        raise NotImplementedError
+
+
+class YFinanceProvider(MarketDataProvider):
+    def __init__(self, period="1d"):
+        """
+        Yahoo Finance provider. yfinance is imported on first use since it pulls in pandas.
+        """
+        self.period = period
+
+    def fetch_prices(self, tickers):
+        import yfinance as yf
+
+        frame = yf.download(tickers, period=self.period, group_by="ticker", progress=False, threads=True)
+        prices = {}
+        for ticker in tickers:
+            closes = frame[ticker]["Close"] if frame.columns.nlevels > 1 else frame["Close"]
+            closes = closes.dropna()
+            if len(closes):
+                prices[ticker] = float(closes.iloc[-1])
+        return prices
+
+    def fetch_info(self, ticker):
+        import yfinance as yf
+
+        return yf.Ticker(ticker).info
+
+
+class FakeMarketDataProvider(MarketDataProvider):
+    def __init__(self, price_latency=0.2, info_latency=0.1, seed=0, drift=0.0):
+        """
+        Offline provider that simulates network latency with deterministic data.
+        With `drift` > 0 prices follow a random walk with that relative step per fetch.
+        Call counts are recorded so callers can check how often each endpoint is hit.
+        """
+        self.price_latency = price_latency
+        self.info_latency = info_latency
+        self.seed = seed
+        self.drift = drift
+        self.price_calls = 0
+        self.info_calls = 0
+        self._prices = {}
+        self._walk = random.Random(seed)
+
+    def fetch_prices(self, tickers):
+        self.price_calls += 1
+        time.sleep(self.price_latency)
+        for ticker in tickers:
+            if ticker in self._prices:
+                self._prices[ticker] *= 1 + self._walk.gauss(0, self.drift) if self.drift else 1
+            else:
+                self._prices[ticker] = random.Random(f"{self.seed}:{ticker}").uniform(50, 500)
+        return {ticker: round(self._prices[ticker], 2) for ticker in tickers}
+
+    def fetch_info(self, ticker):
+        self.info_calls += 1
+        time.sleep(self.info_latency)
+        rng = random.Random(f"{self.seed}:{ticker}:info")
+        return {"totalRevenue": rng.uniform(1e9, 4e11), "beta": rng.uniform(0.5, 2.5)}
+
+
+def build_snapshot(price, info):
+    """
+    Build the per-company data dict used by the analysis prompts.
+    """
+    return {
+        "Stock Price": round(price, 2),
+        "Revenue": info.get("totalRevenue", "N/A"),
+        "Market Sentiment": "Neutral",  # Placeholder for now
+        "Risk Score": round(info.get("beta") or 1.0, 2),  # Beta as risk proxy
+    }
+
+
+async def stream_stock_data(provider, company_tickers, batch_size=50, max_workers=8):
+    """
+    Yield (company, snapshot) pairs as each ticker's data arrives.
+    Prices are fetched in batches of `batch_size` tickers; info is fetched once per ticker.
+    All provider calls run on a thread pool so the event loop is never blocked.
+    Under a deadline, stops when it passes and leaves out the tickers not fetched yet.
+    Tickers whose price or info fetch fails are logged and left out.
+    """
+    loop = asyncio.get_running_loop()
+    companies_by_ticker = {ticker: company for company, ticker in company_tickers.items()}
+    tickers = list(companies_by_ticker)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        price_batches = {}
+        for i in range(0, len(tickers), batch_size):
+            batch = tickers[i:i + batch_size]
+            prices = loop.run_in_executor(pool, provider.fetch_prices, batch)
+            price_batches.update((ticker, prices) for ticker in batch)
+        infos = {ticker: loop.run_in_executor(pool, provider.fetch_info, ticker) for ticker in tickers}
+
+        async def snapshot(ticker):
+            try:
+                prices = await price_batches[ticker]
+                info = await infos[ticker]
+            except Exception as exc:
+                logger.warning("could not fetch market data for %s: %s", ticker, exc)
+                return None
+            if ticker not in prices:
+                return None
+            return companies_by_ticker[ticker], build_snapshot(prices[ticker], info)
+
+        tasks = [asyncio.ensure_future(snapshot(ticker)) for ticker in tickers]
+        try:
+            for task in asyncio.as_completed(tasks, timeout=deadline.remaining()):
+                result = await task
+                if result is not None:
+                    yield result
+        except asyncio.TimeoutError:
+            pass  # The deadline passed; the tickers still loading are left out
+        finally:
+            for task in tasks:
+                task.cancel()
+    finally:
+        # Don't block the event loop waiting for fetches nobody will consume
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_stock_data(provider, company_tickers):
+    """
+    Fetch every snapshot and return them as one dict (blocking).
+    """
+
+    async def collect():
+        return {company: data async for company, data in stream_stock_data(provider, company_tickers)}
+
+    return asyncio.run(collect())
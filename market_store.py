@@ -0,0 +1,266 @@
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+
+# Columnar, memory-mapped history of market snapshots.
+# Each field is one file holding a (snapshots x tickers) matrix in row-major order,
+# so recording a snapshot appends one row per field and reading the latest window
+# for every ticker touches a contiguous block. The files are memory-mapped: opening
+# a universe of thousands of tickers reads only the small metadata file, and pages
+# are loaded when a computation touches them. Derived features (returns, volatility,
+# revenue and beta changes) are computed for all tickers at once with NumPy, along
+# with coarse buckets of them (trend direction, volatility band) that are stable
+# enough to key cached analyses on.
+
+FIELDS = {"price": np.float64, "revenue": np.float64, "beta": np.float32, "sentiment": np.float32}
+
+# Sentiment labels as scores, so sentiment can be stored and compared like the other fields
+SENTIMENT_SCORES = {
+    "Strongly Bearish": -1.0,
+    "Moderately Bearish": -0.5,
+    "Neutral": 0.0,
+    "Moderately Bullish": 0.5,
+    "Strongly Bullish": 1.0,
+}
+
+# A window return within this of zero is a flat trend
+FLAT_TREND = 0.01
+# Upper bounds of the low and moderate volatility bands (std. of snapshot log returns)
+VOLATILITY_BANDS = (0.01, 0.03)
+
+
+class MarketStore:
+    def __init__(self, path):
+        """
+        Open the store in directory `path`, creating an empty one if there is none.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        else:
+            meta = {"tickers": [], "snapshots": 0}
+        self.tickers = meta["tickers"]
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.snapshots = meta["snapshots"]
+        self._map()
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _map(self):
+        self.times = self._memmap("time", np.float64, (self.snapshots,))
+        self.columns = {field: self._memmap(field, dtype, (self.snapshots, len(self.tickers)))
+                        for field, dtype in FIELDS.items()}
+
+    def _memmap(self, name, dtype, shape):
+        if not all(shape):
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"tickers": self.tickers, "snapshots": self.snapshots}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def add_tickers(self, tickers):
+        """
+        Add columns for tickers not in the store yet; their history is NaN.
+        Rewrites the field files, so add a universe up front rather than one ticker at a time.
+        """
+        new = [ticker for ticker in dict.fromkeys(tickers) if ticker not in self.index]
+        if not new:
+            return
+        width = len(self.tickers) + len(new)
+        for field, dtype in FIELDS.items():
+            matrix = np.full((self.snapshots, width), np.nan, dtype=dtype)
+            matrix[:, :len(self.tickers)] = self.columns[field]
+            matrix.tofile(self._file(field) + ".tmp")
+            os.replace(self._file(field) + ".tmp", self._file(field))
+        self.tickers = self.tickers + new
+        self.index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self._save_meta()
+        self._map()
+
+    def extend(self, times, columns):
+        """
+        Append several snapshots at once: `columns` maps each field to a (len(times) x tickers)
+        array in the store's ticker order; missing fields are recorded as NaN.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        shape = (len(times), len(self.tickers))
+        for field, dtype in FIELDS.items():
+            rows = np.asarray(columns[field], dtype=dtype) if field in columns else np.full(shape, np.nan, dtype=dtype)
+            if rows.shape != shape:
+                raise ValueError(f"{field}: expected shape {shape}, got {rows.shape}")
+            with open(self._file(field), "ab") as f:
+                rows.tofile(f)
+        with open(self._file("time"), "ab") as f:
+            times.tofile(f)
+        self.snapshots += len(times)
+        self._save_meta()
+        self._map()
+
+    def append(self, values, timestamp=None):
+        """
+        Record one snapshot: `values` maps tickers to {field: value}; tickers and
+        fields that are missing are recorded as NaN, and new tickers are added.
+        """
+        self.add_tickers(values)
+        row = {field: np.full((1, len(self.tickers)), np.nan, dtype=dtype) for field, dtype in FIELDS.items()}
+        for ticker, fields in values.items():
+            i = self.index[ticker]
+            for field, value in fields.items():
+                if value is not None:
+                    row[field][0, i] = value
+        self.extend([time.time() if timestamp is None else timestamp], row)
+
+    def features(self, window=20):
+        """
+        Features of every ticker over its latest `window` snapshots, as a Features table.
+        """
+        return Features(self.tickers, compute_features({field: self.columns[field][-window:] for field in FIELDS}))
+
+
+def compute_features(columns):
+    """
+    Vectorized features from {field: (snapshots x tickers) array}; every value is NaN where
+    the history is too short or missing.
+    """
+    price = np.asarray(columns["price"], dtype=np.float64)
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        # All-NaN columns (tickers with no history yet) are expected
+        warnings.simplefilter("ignore", RuntimeWarning)
+        log_returns = np.diff(np.log(price), axis=0)
+        window_return = _last(price) / _first(price) - 1
+        volatility = np.nanstd(log_returns, axis=0) if len(log_returns) > 1 else _nan(price)
+        features = {
+            "price": _last(price),
+            "return": _last(price) / _previous(price) - 1,
+            "window_return": window_return,
+            "volatility": volatility,
+            # -1 (down), 0 (flat) or 1 (up)
+            "trend": np.where(np.abs(window_return) <= FLAT_TREND, 0.0, np.sign(window_return)),
+            # 0 (low), 1 (moderate) or 2 (high)
+            "volatility_band": np.where(np.isnan(volatility), np.nan, np.digitize(volatility, VOLATILITY_BANDS)),
+            "revenue": _last(columns["revenue"]),
+            "revenue_change": _last(columns["revenue"]) / _first(columns["revenue"]) - 1,
+            "beta": _last(columns["beta"]),
+            "beta_change": _last(columns["beta"]) - _first(columns["beta"]),
+            "sentiment": _last(columns["sentiment"]),
+            "sentiment_change": _last(columns["sentiment"]) - _first(columns["sentiment"]),
+        }
+    return features
+
+
+def _nan(matrix):
+    return np.full(matrix.shape[1], np.nan)
+
+
+def _last(matrix):
+    return np.asarray(matrix[-1], dtype=np.float64) if len(matrix) else _nan(matrix)
+
+
+def _previous(matrix):
+    return np.asarray(matrix[-2], dtype=np.float64) if len(matrix) > 1 else _nan(matrix)
+
+
+def _first(matrix):
+    return np.asarray(matrix[0], dtype=np.float64) if len(matrix) > 1 else _nan(matrix)
+
+
+def snapshot_values(snapshot):
+    """
+    The fields of a market_data snapshot as stored: non-numeric values (e.g. "N/A" revenue) become None.
+    """
+    def number(value):
+        return float(value) if isinstance(value, (int, float)) else None
+
+    return {
+        "price": number(snapshot.get("Stock Price")),
+        "revenue": number(snapshot.get("Revenue")),
+        "beta": number(snapshot.get("Risk Score")),
+        "sentiment": SENTIMENT_SCORES.get(snapshot.get("Market Sentiment")),
+    }
+
+
+def change(now, before):
+    """
+    Relative change from `before` to `now`, or None if either is unknown.
+    """
+    return None if now is None or not before else now / before - 1
+
+
+def delta(now, before):
+    """
+    Difference from `before` to `now`, or None if either is unknown. Rounded, as float32
+    columns (beta, sentiment) don't hold a snapshot's decimals exactly.
+    """
+    # Adding 0.0 turns a rounded -0.0 into 0.0
+    return None if now is None or before is None else round(now - before, 4) + 0.0
+
+
+async def record_stream(store, snapshots, company_tickers):
+    """
+    Pass on the (company, snapshot) pairs of the `snapshots` stream, and record the
+    fetched snapshots when the stream ends.
+    """
+    fetched = {}
+    async for company, snapshot in snapshots:
+        fetched[company_tickers[company]] = snapshot_values(snapshot)
+        yield company, snapshot
+    if fetched:
+        store.append(fetched)
+
+
+class Features:
+    def __init__(self, tickers, columns):
+        """
+        Per-ticker features: `columns` maps feature names to arrays in `tickers` order.
+        """
+        self.tickers = tickers
+        self.index = {ticker: i for i, ticker in enumerate(tickers)}
+        self.columns = columns
+
+    def row(self, ticker):
+        """
+        Return {feature: float or None} for one ticker; every value is None if it has no history.
+        """
+        i = self.index.get(ticker)
+        if i is None:
+            return {name: None for name in self.columns}
+        return {name: _number(values[i]) for name, values in self.columns.items()}
+
+    def get(self, ticker, name):
+        """
+        One feature of one ticker, as a float, or None if it has no history.
+        """
+        i = self.index.get(ticker)
+        return None if i is None else _number(self.columns[name][i])
+
+    def subset(self, tickers):
+        """
+        The features of `tickers` only (those without history are left out), e.g. to send to a worker process.
+        """
+        tickers = [ticker for ticker in tickers if ticker in self.index]
+        rows = [self.index[ticker] for ticker in tickers]
+        return Features(tickers, {name: np.asarray(values)[rows] for name, values in self.columns.items()})
+
+    def rows(self):
+        """
+        Yield (ticker, row) for every ticker, converting whole columns at once.
+        """
+        names = list(self.columns)
+        for ticker, values in zip(self.tickers, zip(*(self.columns[name].tolist() for name in names))):
+            yield ticker, {name: None if value != value else value for name, value in zip(names, values)}
+
+
+def _number(value):
+    value = float(value)
+    return None if value != value else value
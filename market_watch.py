@@ -0,0 +1,159 @@
+import asyncio
+import math
+import numbers
+
+from llm_cache import quantize
+
+# Incremental market analysis.
+# Market data is polled on an interval and each ticker's snapshot is compared with
+# the values its analyses last ran on. Only the aspects whose input moved past a
+# threshold are re-run, so a refresh costs work proportional to what changed.
+# The analyses' cache keys round each input finely enough that a move past its
+# threshold always changes the key (see MarketWatcher.key), so a re-run doesn't
+# get the cached analysis it was meant to replace.
+
+# Relative change of a numeric input that triggers a re-run; None means any change
+DEFAULT_THRESHOLDS = {
+    "Stock Price": 0.005,
+    "Revenue": 0.01,
+    "Risk Score": 0.05,
+    "Market Sentiment": None,
+}
+
+# Significant digits of an input in a cache key, when its threshold allows it
+KEY_DIGITS = 3
+
+
+def changed(old, new, threshold=None):
+    """
+    Whether an input moved enough to re-run its analysis.
+    Numbers are compared relative to the old value; anything else on equality.
+    """
+    numeric = all(isinstance(v, numbers.Real) and not isinstance(v, bool) for v in (old, new))
+    if threshold is None or not numeric:
+        return old != new
+    if old == 0:
+        return new != 0
+    return abs(new - old) > threshold * abs(old)
+
+
+def parse_threshold(text):
+    """
+    Parse a "Field=0.01" command-line override; "Field=any" re-runs on any change.
+    """
+    field, sep, value = text.partition("=")
+    if not sep:
+        raise ValueError(f"expected FIELD=VALUE, got {text!r}")
+    return field.strip(), None if value.strip() == "any" else float(value)
+
+
+class MarketWatcher:
+    def __init__(self, aspects, inputs, run, thresholds=None):
+        """
+        `inputs` maps each aspect key to the snapshot field its prompt reads and
+        `run(analysis, company, data)` runs one analysis, returning its result text.
+        `run` should raise when the analysis fails, so it is tried again at the next poll.
+        """
+        self.aspects = aspects
+        self.inputs = inputs
+        self.run = run
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.analyzed = {}  # (company, aspect key) -> input value the last analysis ran on
+        self.running = set()
+        self.counters = {"polls": 0, "snapshots": 0, "analyses": 0, "skipped": 0, "busy": 0, "failures": 0}
+
+    def key(self, field, value):
+        """
+        `value` of `field` rounded for a response cache key: to KEY_DIGITS significant
+        digits, or more when its threshold is finer, since a move past the threshold
+        must change the key. Fields re-run on any change are keyed on their exact value.
+        """
+        threshold = self.thresholds.get(field)
+        if not threshold:
+            return value
+        # A relative step of 10 ** (1 - digits) or less between rounded values
+        return quantize(value, max(KEY_DIGITS, math.ceil(1 - math.log10(threshold))))
+
+    def stale(self, company, data):
+        """
+        Aspects of `company` whose input changed past its threshold since they last ran.
+        """
+        aspects = []
+        for aspect in self.aspects:
+            key = (company, aspect.key)
+            field = self.inputs[aspect.key]
+            if key in self.running:
+                self.counters["busy"] += 1  # Still analyzing an earlier value; the next poll compares against it
+                continue
+            if key not in self.analyzed or changed(self.analyzed[key], data[field], self.thresholds.get(field)):
+                aspects.append(aspect)
+            else:
+                self.counters["skipped"] += 1
+        return aspects
+
+    async def watch(self, fetch, interval=60.0, rounds=None):
+        """
+        Poll `fetch()` (an iterable or async iterable of (company, data) pairs) every
+        `interval` seconds, for `rounds` polls or forever, and yield the result of
+        every re-run analysis as soon as it completes.
+        """
+        results = asyncio.Queue()
+
+        async def analyze(aspect, company, data):
+            key = (company, aspect.key)
+            value = data[self.inputs[aspect.key]]
+            try:
+                result = await self.run(aspect.analysis, company, data)
+            except Exception as exc:
+                # Not recorded as analyzed, so the next poll runs it again
+                self.counters["failures"] += 1
+                result = f"{aspect.analysis.__name__} failed for {company}: {exc}"
+            else:
+                # Later polls compare with the value analyzed, so slow drifts still add up to a re-run
+                self.analyzed[key] = value
+            finally:
+                self.running.discard(key)
+            await results.put(result)
+
+        async def poll():
+            tasks = set()
+            try:
+                count = 0
+                while rounds is None or count < rounds:
+                    if count:
+                        await asyncio.sleep(interval)
+                    count += 1
+                    self.counters["polls"] += 1
+                    async for company, data in _aiter(fetch()):
+                        self.counters["snapshots"] += 1
+                        for aspect in self.stale(company, data):
+                            self.running.add((company, aspect.key))
+                            self.counters["analyses"] += 1
+                            task = asyncio.create_task(analyze(aspect, company, data))
+                            tasks.add(task)
+                            task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await results.put(None)
+
+        producer = asyncio.create_task(poll())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+            await producer
+        finally:
+            producer.cancel()
+
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+# A tiny fake chat-completion server used by the benchmarks.
+# It speaks just enough HTTP/1.1 to serve POST /v1/chat/completions
+# and only depends on the standard library, so it runs without an API key.
+# Every script can run against it instead of OpenAI: start it with
+#   python mock_llm.py --port 8000 --latency lognormal:0.3,0.5 --error 429=0.02
+# and set OPENAI_BASE_URL=http://127.0.0.1:8000/v1 (the shared client reads it).
+
+
+class Uniform:
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng):
+        return rng.uniform(self.low, self.high)
+
+    def __repr__(self):
+        return f"uniform:{self.low},{self.high}"
+
+
+class LogNormal:
+    def __init__(self, median, sigma=0.5):
+        """
+        Long-tailed latency: half the requests are faster than `median`,
+        and `sigma` sets the tail (0.5 puts p99 at about 3.2x the median).
+        """
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self, rng):
+        return rng.lognormvariate(math.log(self.median), self.sigma)
+
+    def __repr__(self):
+        return f"lognormal:{self.median},{self.sigma}"
+
+
+def parse_latency(spec):
+    """
+    Parse "0.05" (fixed seconds), "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA".
+    """
+    kind, _, args = spec.partition(":")
+    if not args:
+        return float(kind)
+    values = [float(value) for value in args.split(",")]
+    if kind == "uniform":
+        return Uniform(*values)
+    if kind == "lognormal":
+        return LogNormal(*values)
+    raise ValueError(f"unknown latency distribution {kind!r}")
+
+
+def parse_error(spec):
+    """
+    Parse "STATUS=PROBABILITY", e.g. "429=0.05".
+    """
+    status, _, probability = spec.partition("=")
+    return int(status), float(probability)
+
+
+class MockLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, reply="OK", tokens_per_second=None,
+                 errors=None, retry_after=1.0, seed=None):
+        """
+        Initialize the fake server.
+        `latency` is the delay (in seconds) before each response is sent: a number,
+        or a distribution such as LogNormal(0.3) (anything with `sample(rng)`).
+        With `tokens_per_second` the answer also takes as long as generating it
+        at that rate, and streamed answers are paced token by token.
+        `errors` maps HTTP statuses to the probability of answering with them
+        (e.g. {429: 0.05, 503: 0.01}); 429s carry a `retry_after` second Retry-After.
+        A `seed` makes the latencies and injected errors reproducible.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.reply = reply
+        self.tokens_per_second = tokens_per_second
+        self.errors = dict(errors or {})
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.request_count = 0
+        self.request_times = []
+        self.status_counts = Counter()
+        self._server = None
+        self._writers = set()
+        self._thread_loop = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        # A deep accept backlog, so hundreds of clients connecting at once aren't dropped and retried
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Close idle keep-alive connections, otherwise wait_closed() waits for them
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def start_in_thread(self):
+        """
+        Serve from an event loop on a background thread, for callers that are
+        not async or run their own event loops. Returns the server.
+        """
+        self._thread_loop = asyncio.new_event_loop()
+        self._thread_loop.run_until_complete(self.start())
+        threading.Thread(target=self._thread_loop.run_forever, daemon=True).start()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._thread_loop).result()
+        self._thread_loop.call_soon_threadsafe(self._thread_loop.stop)
+        self._thread_loop = None
+
+    def sample_latency(self):
+        if hasattr(self.latency, "sample"):
+            return max(0.0, self.latency.sample(self.rng))
+        return self.latency
+
+    def injected_error(self):
+        """
+        The error status to answer the next request with, or None.
+        """
+        draw = self.rng.random()
+        for status, probability in self.errors.items():
+            if draw < probability:
+                return status
+            draw -= probability
+        return None
+
+    def generation_time(self, content):
+        if not self.tokens_per_second:
+            return 0.0
+        return max(1, len(content) // 4) / self.tokens_per_second
+
+    def content_for(self, request):
+        """
+        The reply text, or for structured-output requests a JSON document that
+        matches the requested schema with the reply text in every string field.
+        """
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            return json.dumps(_sample(response_format["json_schema"]["schema"], self.reply))
+        if response_format.get("type") == "json_object":
+            return json.dumps({"result": self.reply})
+        return self.reply
+
+    def completion_body(self, request):
+        """
+        Build an OpenAI-shaped chat completion for the parsed request body.
+        """
+        content = self.content_for(request)
+        prompt_tokens = sum(len(m.get("content", "")) // 4 for m in request.get("messages", []))
+        completion_tokens = max(1, len(content) // 4)
+        return {
+            "id": f"chatcmpl-mock-{self.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    async def _stream(self, writer, request):
+        """
+        Send the reply as server-sent events, one word per chunk, using chunked encoding.
+        """
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+        )
+        content = self.content_for(request)
+        words = content.split(" ")
+        # Spread the generation time over the chunks
+        pause = self.generation_time(content) / len(words)
+        for i, word in enumerate(words):
+            if pause:
+                await asyncio.sleep(pause)
+            chunk = {
+                "id": f"chatcmpl-mock-{self.request_count}",
+                "object": "chat.completion.chunk",
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            _write_chunk(writer, f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+        _write_chunk(writer, b"data: [DONE]\n\n")
+        _write_chunk(writer, b"")
+        await writer.drain()
+
+    async def _error(self, writer, status):
+        """
+        Answer with an OpenAI-shaped error body.
+        """
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        body = json.dumps({"error": {"message": f"mock injected HTTP {status}", "type": kind, "code": kind}}).encode()
+        headers = {}
+        if status == 429:
+            headers = {"Retry-After": str(math.ceil(self.retry_after)), "retry-after-ms": str(int(self.retry_after * 1000))}
+        _write_response(writer, status, body, headers=headers)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                self.request_count += 1
+                self.request_times.append(time.monotonic())
+                status = self.injected_error()
+                await asyncio.sleep(self.sample_latency())
+                if status is not None:
+                    self.status_counts[status] += 1
+                    await self._error(writer, status)
+                    continue
+                self.status_counts[200] += 1
+                if request.get("stream"):
+                    await self._stream(writer, request)
+                    continue
+                completion = self.completion_body(request)
+                await asyncio.sleep(self.generation_time(completion["choices"][0]["message"]["content"]))
+                _write_response(writer, 200, json.dumps(completion).encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+async def _read_request(reader):
+    """
+    Read one HTTP request and return its JSON body, or None on EOF.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b"{}"
+    return json.loads(body or b"{}")
+
+
+def _sample(schema, text):
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _sample(sub, text) for name, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_sample(schema.get("items", {}), text)]
+    if kind in ("number", "integer"):
+        return 0
+    if kind == "boolean":
+        return True
+    return text
+
+
+HTTP_REASONS = {
+    200: "OK",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    502: "Bad Gateway",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+def _write_response(writer, status, body, content_type="application/json", headers=None):
+    reason = HTTP_REASONS.get(status, "OK")
+    extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"{extra}"
+        "Connection: keep-alive\r\n\r\n".encode()
+        + body
+    )
+
+
+def _write_chunk(writer, data):
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+async def post_chat_completion(base_url, **params):
+    """
+    Minimal standard-library client for the mock server.
+    Opens one connection per call, which is enough for local benchmarks.
+    """
+    host, _, port = base_url.split("//", 1)[1].split("/", 1)[0].partition(":")
+    reader, writer = await asyncio.open_connection(host, int(port or 80))
+    try:
+        body = json.dumps(params).encode()
+        writer.write(
+            "POST /v1/chat/completions HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        payload = json.loads(await reader.readexactly(length))
+        if status != 200:
+            raise MockHTTPError(status, payload)
+        return payload
+    finally:
+        writer.close()
+
+
+class MockHTTPError(Exception):
+    def __init__(self, status_code, payload=None):
+        super().__init__(f"mock server returned HTTP {status_code}")
+        self.status_code = status_code
+        self.payload = payload
+
+
+async def _serve(args):
+    server = MockLLMServer(
+        args.host, args.port, latency=args.latency, reply=args.reply, tokens_per_second=args.tokens_per_second,
+        errors=dict(args.error), retry_after=args.retry_after, seed=args.seed,
+    )
+    async with server:
+        print(f"Mock LLM server on {server.base_url}", flush=True)
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat-completion server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=parse_latency, default=0.05,
+                        help='seconds before each answer: "0.05", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA"')
+    parser.add_argument("--tokens-per-second", type=float, help="generation speed (default: instant)")
+    parser.add_argument("--error", type=parse_error, action="append", default=[], metavar="STATUS=PROBABILITY",
+                        help='answer this share of requests with an error, e.g. "429=0.05"')
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of injected 429s, in seconds")
+    parser.add_argument("--seed", type=int, help="make latencies and injected errors reproducible")
+    parser.add_argument("--reply", default="OK", help="answer text")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,246 @@
+import re
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, deque
+
+# Pluggable routing for "which action should handle this input" decisions.
+# Cheap local routers answer confident cases in microseconds; only inputs none
+# of them is sure about are escalated to the LLM. Decisions are cached.
+
+
+class RegexRouter:
+    def __init__(self, rules, confidence=0.95):
+        """
+        `rules` is a list of (pattern, action); the first pattern that matches wins.
+        """
+        self.rules = [(re.compile(pattern, re.IGNORECASE), action) for pattern, action in rules]
+        self.confidence = confidence
+
+    def predict(self, text):
+        """
+        Return (action, confidence), or (None, 0.0) when no rule matches.
+        """
+        for pattern, action in self.rules:
+            if pattern.search(text):
+                return action, self.confidence
+        return None, 0.0
+
+
+def hashed_ngrams(text, dim):
+    """
+    Feature indices for word unigrams/bigrams and character trigrams, hashed into `dim` buckets.
+    """
+    import numpy as np
+
+    words = re.findall(r"[a-z0-9']+|[?!]", text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {' '.join(words)} "
+    grams += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    return np.fromiter((zlib.crc32(gram.encode()) % dim for gram in grams), dtype=np.int64, count=len(grams))
+
+
+class HashedNgramClassifier:
+    def __init__(self, examples, dim=2 ** 16, epochs=30, learning_rate=0.5):
+        """
+        Small linear (softmax) model over hashed n-grams, trained at startup on
+        `examples`, a list of (text, action) pairs.
+        numpy is imported here rather than with the module, as the rule-based routers don't need it.
+        """
+        import numpy as np
+
+        self.dim = dim
+        self.actions = sorted({action for _, action in examples}, key=str)
+        self.weights = np.zeros((len(self.actions), dim), dtype=np.float32)
+        self.bias = np.zeros(len(self.actions), dtype=np.float32)
+        self._train(examples, epochs, learning_rate)
+
+    def _train(self, examples, epochs, learning_rate):
+        import numpy as np
+
+        index = {action: i for i, action in enumerate(self.actions)}
+        features = [hashed_ngrams(text, self.dim) for text, _ in examples]
+        targets = [index[action] for _, action in examples]
+        for _ in range(epochs):
+            for x, y in zip(features, targets):
+                probs = self._probabilities(x)
+                probs[y] -= 1.0
+                # Scale by the feature count so long and short examples weigh the same;
+                # the bias gets a small fixed step so unseen inputs stay low-confidence
+                step = learning_rate / np.sqrt(max(1, len(x)))
+                np.add.at(self.weights, (slice(None), x), -step * probs[:, None])
+                self.bias -= 0.01 * learning_rate * probs
+
+    def _probabilities(self, x):
+        import numpy as np
+
+        scores = self.weights[:, x].sum(axis=1) + self.bias
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    def predict(self, text):
+        probs = self._probabilities(hashed_ngrams(text, self.dim))
+        best = int(probs.argmax())
+        return self.actions[best], float(probs[best])
+
+    def probabilities(self, text):
+        """
+        Return {action: probability} for every action.
+        """
+        probs = self._probabilities(hashed_ngrams(text, self.dim))
+        return {action: float(prob) for action, prob in zip(self.actions, probs)}
+
+
+class RoutingEngine:
+    def __init__(self, routers, escalate, threshold=0.8, cache_size=4096):
+        """
+        Route inputs through `routers` in order; the first one with confidence at or above
+        `threshold` decides. Otherwise `escalate(text)` (usually an LLM call) decides.
+        """
+        self.routers = routers
+        self.escalate = escalate
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.counts = {"local": 0, "escalated": 0, "cached": 0}
+        self.escalated_actions = Counter()  # What the escalations decided, as a prior
+        self.latencies = deque(maxlen=100000)
+        self._lock = threading.Lock()  # The engine may be shared by server worker threads
+
+    def route(self, text):
+        """
+        Return the action for `text`.
+        """
+        started = time.perf_counter()
+        key = " ".join(text.lower().split())
+        with self._lock:
+            action = self.cache.get(key)
+            if action is not None:
+                self.cache.move_to_end(key)
+                self.counts["cached"] += 1
+        if action is None:
+            source = "local"
+            action = self._decide_locally(text)
+            if action is None:
+                source = "escalated"
+                action = self.escalate(text)
+            with self._lock:
+                self.counts[source] += 1
+                if source == "escalated":
+                    self.escalated_actions[action] += 1
+                self.cache[key] = action
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        self.latencies.append(time.perf_counter() - started)
+        return action
+
+    def _decide_locally(self, text):
+        for router in self.routers:
+            candidate, confidence = router.predict(text)
+            if candidate is not None and confidence >= self.threshold:
+                return candidate
+        return None
+
+    def will_escalate(self, text):
+        """
+        Whether route(text) would have to call `escalate`, i.e. it is neither cached nor confident locally.
+        """
+        with self._lock:
+            if " ".join(text.lower().split()) in self.cache:
+                return False
+        return self._decide_locally(text) is None
+
+    def candidates(self, text, k=1):
+        """
+        The `k` most likely actions for `text` before it is decided: ranked by the local
+        models' probabilities, or by how often escalations chose each action.
+        """
+        scores = Counter()
+        for router in self.routers:
+            if hasattr(router, "probabilities"):
+                scores.update(router.probabilities(text))
+        if not scores:
+            with self._lock:
+                scores = Counter(self.escalated_actions)
+        return [action for action, _ in scores.most_common(k)]
+
+    def stats(self):
+        """
+        Decision counts, escalation rate and p50/p99 routing latency in microseconds.
+        """
+        total = sum(self.counts.values())
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e6 if latencies else 0.0
+
+        return dict(
+            self.counts,
+            escalation_rate=self.counts["escalated"] / total if total else 0.0,
+            p50_us=percentile(0.50),
+            p99_us=percentile(0.99),
+        )
+
+
+# Actions used by SimpleAutonomousAgent.decide_action
+RESPOND, ASK_FOR_DETAILS = "respond", "ask_for_details"
+
+AGENT_RULES = [
+    (r"\?\s*$", RESPOND),
+    (r"^\s*(please\s+)?(explain|describe|tell|give|write|list|show|compare|summarize|recommend|suggest|help me|find|translate|calculate|what|how|why|who|when|where|which|can you|could you)\b", RESPOND),
+    (r"^\s*\S{0,12}\s*[.!]*\s*$", ASK_FOR_DETAILS),
+]
+
+
+# Actions used by HybridLLMApp.step_2_decide_action
+EXPLAIN, GUIDE, ANSWER, CLARIFY = 1, 2, 3, 4
+
+ACTION_RULES = [
+    (r"^\s*(how (do|can|should) (i|we|you)|how to|steps? (to|for)|guide (to|for)|walk me through|set ?up|install|configure)\b", GUIDE),
+    (r"^\s*(who|what|when|where|which|why|how (many|much|long|old|far)|is|are|does|did|can|will)\b.+\?\s*$", ANSWER),
+    (r"^\s*(explain|describe|tell me (about|more)|what (is|are)|overview of|introduction to)\b", EXPLAIN),
+    (r"^\s*\W*\s*$|^\s*(help|hi|hello|hey|hmm+|idk|\?+|something|stuff|things?)\s*[.!?]*\s*$", CLARIFY),
+]
+
+ACTION_EXAMPLES = [
+    ("quantum computing", EXPLAIN),
+    ("the french revolution", EXPLAIN),
+    ("explain how vaccines work", EXPLAIN),
+    ("machine learning basics", EXPLAIN),
+    ("photosynthesis in detail", EXPLAIN),
+    ("tell me about black holes", EXPLAIN),
+    ("the history of the roman empire", EXPLAIN),
+    ("what is blockchain", EXPLAIN),
+    ("how to bake sourdough bread", GUIDE),
+    ("setting up a python virtual environment", GUIDE),
+    ("steps to change a car tire", GUIDE),
+    ("deploy a flask app to heroku", GUIDE),
+    ("guide for training for a marathon", GUIDE),
+    ("install docker on ubuntu", GUIDE),
+    ("how do i write a cover letter", GUIDE),
+    ("create a budget spreadsheet", GUIDE),
+    ("what year did world war 2 end?", ANSWER),
+    ("who wrote pride and prejudice?", ANSWER),
+    ("what is the capital of australia?", ANSWER),
+    ("how many bones are in the human body?", ANSWER),
+    ("is coffee bad for you?", ANSWER),
+    ("when was the eiffel tower built?", ANSWER),
+    ("what's the boiling point of water?", ANSWER),
+    ("does python support multiple inheritance?", ANSWER),
+    ("help", CLARIFY),
+    ("hmm", CLARIFY),
+    ("something", CLARIFY),
+    ("idk", CLARIFY),
+    ("stuff", CLARIFY),
+    ("it", CLARIFY),
+    ("the thing", CLARIFY),
+]
+
+
+def parse_action(text, default=CLARIFY):
+    """
+    Extract the action number from an LLM reply, falling back to `default`
+    instead of crashing on anything unexpected.
+    """
+    match = re.search(r"[1-4]", text or "")
+    return int(match.group()) if match else default
@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import WSMsgType, web
+
+from deadline import DeadlineExceeded, budget, call_with_budget
+import llm_client
+import llm_metrics
+from workflows import load_script
+
+# Server mode: hosts the agent, workflow, hybrid and support chatbot apps behind
+# one asyncio HTTP/WebSocket server.
+#
+#   POST   /sessions                {"app": "hybrid"}  -> {"session_id": ...}
+#   POST   /sessions/{id}/turns     {"text": "..."}    -> {"result": {...}}
+#   GET    /sessions/{id}/ws        WebSocket; each text message is a turn and
+#                                   tokens are pushed as they are generated
+#   DELETE /sessions/{id}
+#   GET    /stats                   turns, sessions and LLM calls coalesced per app
+#   GET    /metrics                 LLM call metrics in the Prometheus text format
+#
+# The agent, workflow and hybrid steps are blocking calls, so their turns run on a
+# bounded worker pool. Support turns are the chatbot's async DAG (identify, solve and
+# follow up, overlapped), awaited on the event loop without holding a worker; up to
+# `max_async_turns` run at once. Turns beyond those limits and the waiting queue are
+# rejected with 503, and a turn without a "text" string with 400.
+# With a turn deadline, a turn's LLM calls get the time left before it (counted
+# from when the turn arrived) as their timeout, and a turn that runs out of time
+# fails with 504 instead of holding its worker.
+
+APPS = ("agent", "workflow", "hybrid", "support")
+MAX_HISTORY = 20
+
+
+def relay(stream, emit, field):
+    """
+    Forward a step's output to `emit` token by token (if given) and return the full text.
+    `stream` may be plain text, a TokenStream or a SummaryPipeline.
+    """
+    if isinstance(stream, str):
+        if emit:
+            emit({"type": "token", "field": field, "text": stream})
+        return stream
+    for text in stream:
+        if emit:
+            emit({"type": "token", "field": field, "text": text})
+    return stream.text
+
+
+def agent_turn(agent, text, emit, memory=None):
+    reply = relay(agent.decide_action(text, stream=emit is not None, memory=memory), emit, "reply")
+    if memory is not None:
+        memory.add_exchange(text, reply)
+    return {"reply": reply}
+
+
+def workflow_turn(app, topic, emit, memory=None):
+    content = app.step_2_generate_content(topic, stream=True)
+    pipeline = app.summarizer.pipeline(content)
+    content_text = relay(pipeline, emit, "content")
+    summary = app.step_3_summarize_content(pipeline, stream=emit is not None)
+    return {"content": content_text, "summary": relay(summary, emit, "summary")}
+
+
+def hybrid_turn(app, text, emit, memory=None):
+    action = app.step_2_decide_action(text)
+    result = app.step_3_execute_action(text, action, stream=True)
+    pipeline = app.summarizer.pipeline(result)
+    result_text = relay(pipeline, emit, "result")
+    summary = app.step_4_summarize_results(pipeline, stream=emit is not None)
+    return {"action": action, "result": result_text, "summary": relay(summary, emit, "summary")}
+
+
+async def support_turn(chatbot, text, emit, memory=None):
+    # Exact FAQ questions are answered without calling the LLM; the conversation
+    # memory is updated by the chatbot's turn
+    def relay_solution(field, token):
+        if emit:
+            emit({"type": "token", "field": field, "text": token})
+
+    result = await chatbot.support_turn(text, memory, emit=relay_solution)
+    return {"solution": result["solution"], "follow_up": relay(result["follow_up"], emit, "follow_up")}
+
+
+# Blocking turns, run on the worker pool, and async turns, awaited on the event loop
+TURNS = {"agent": agent_turn, "workflow": workflow_turn, "hybrid": hybrid_turn}
+ASYNC_TURNS = {"support": support_turn}
+
+
+def create_instance(name):
+    """
+    Build the shared app object for a workflow. Apps keep no per-user state
+    (conversation memory belongs to the session), so one instance serves every session.
+    """
+    module = load_script(name)
+    if name == "agent":
+        return module.SimpleAutonomousAgent(module.system_prompt)
+    if name == "workflow":
+        return module.WorkflowBasedApp()
+    if name == "hybrid":
+        return module.HybridLLMApp()
+    return module
+
+
+class Overloaded(Exception):
+    pass
+
+
+async def send(ws, event):
+    """
+    Send `event` to a WebSocket client; returns False if the client has disconnected.
+    """
+    if ws.closed:
+        return False
+    try:
+        await ws.send_json(event)
+    except ConnectionResetError:
+        return False
+    return True
+
+
+class Session:
+    def __init__(self, app, memory=None):
+        self.id = uuid.uuid4().hex
+        self.app = app
+        self.memory = memory  # ConversationMemory for the chat apps
+        self.history = deque(maxlen=MAX_HISTORY)
+        self.last_seen = time.monotonic()
+        self.lock = asyncio.Lock()  # One turn at a time per session
+
+
+class WorkflowServer:
+    def __init__(self, max_workers=64, max_queue=1024, idle_timeout=30 * 60, turn_deadline=None, max_async_turns=1024):
+        """
+        `max_workers` blocking turns and `max_async_turns` async (support) turns run at
+        once; up to `max_queue` more may wait for a slot. Sessions idle for `idle_timeout`
+        seconds are dropped. Each turn must finish within `turn_deadline` seconds of its
+        arrival, if given.
+        """
+        self.max_workers = max_workers
+        self.max_async_turns = max_async_turns
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.turn_deadline = turn_deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.sessions = {}
+        self.instances = {}
+        self.counters = {"turns": 0, "rejected": 0, "errors": 0, "timeouts": 0}
+        self.waiting = 0
+        self.in_flight = 0
+        self._slots = None
+        self._async_slots = None
+
+    async def start(self, app):
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._async_slots = asyncio.Semaphore(self.max_async_turns)
+        # One keep-alive connection pool shared by every turn; must exist before the apps load
+        self.client = llm_client.configure(
+            max_connections=self.max_workers + self.max_async_turns, max_keepalive_connections=self.max_workers
+        )
+        loop = asyncio.get_running_loop()
+        # Load and build every app up front so the first requests don't pay for it
+        for name in APPS:
+            self.instances[name] = await loop.run_in_executor(self.executor, create_instance, name)
+        self._sweeper = asyncio.create_task(self._sweep_sessions())
+
+    async def stop(self, app):
+        self._sweeper.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
+        await self.client.aclose()
+
+    async def _sweep_sessions(self):
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.monotonic() - self.idle_timeout
+            for session_id in [sid for sid, s in self.sessions.items() if s.last_seen < cutoff]:
+                del self.sessions[session_id]
+
+    async def run_turn(self, session, text, emit=None):
+        """
+        Run one turn, on the event loop or the worker pool, applying backpressure.
+        """
+        if self.waiting >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise Overloaded()
+        arrived = time.monotonic()
+        turn = ASYNC_TURNS.get(session.app)
+        slots = self._slots if turn is None else self._async_slots
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            # The time spent waiting for a slot counts against the deadline
+            left = None if self.turn_deadline is None else self.turn_deadline - (time.monotonic() - arrived)
+            if turn is not None:
+                with budget(left):
+                    result = await turn(self.instances[session.app], text, emit, session.memory)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, call_with_budget, left,
+                    TURNS[session.app], self.instances[session.app], text, emit, session.memory
+                )
+        except DeadlineExceeded:
+            self.counters["timeouts"] += 1
+            raise
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            slots.release()
+        self.counters["turns"] += 1
+        session.history.append({"text": text, "result": result})
+        session.last_seen = time.monotonic()
+        return result
+
+    def _session(self, request):
+        session = self.sessions.get(request.match_info["session_id"])
+        if session is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": "unknown session"}), content_type="application/json")
+        session.last_seen = time.monotonic()
+        return session
+
+    async def create_session(self, request):
+        body = await request.json()
+        if body.get("app") not in APPS:
+            raise web.HTTPBadRequest(text=json.dumps({"error": f"app must be one of {', '.join(APPS)}"}),
+                                     content_type="application/json")
+        new_memory = getattr(self.instances[body["app"]], "new_memory", None)
+        session = Session(body["app"], new_memory() if new_memory else None)
+        self.sessions[session.id] = session
+        return web.json_response({"session_id": session.id, "app": session.app}, status=201)
+
+    async def delete_session(self, request):
+        session = self._session(request)
+        del self.sessions[session.id]
+        return web.Response(status=204)
+
+    async def post_turn(self, request):
+        session = self._session(request)
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict) or not isinstance(body.get("text"), str):
+            raise web.HTTPBadRequest(text=json.dumps({"error": 'the body must be a JSON object with a "text" string'}),
+                                     content_type="application/json")
+        async with session.lock:
+            try:
+                result = await self.run_turn(session, body["text"])
+            except Overloaded:
+                return web.json_response({"error": "server busy"}, status=503, headers={"Retry-After": "1"})
+            except DeadlineExceeded:
+                return web.json_response({"error": "the turn ran past its deadline"}, status=504)
+        return web.json_response({"session_id": session.id, "result": result})
+
+    async def websocket(self, request):
+        session = self._session(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        loop = asyncio.get_running_loop()
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            events = asyncio.Queue()
+
+            def emit(event):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+
+            async def forward():
+                while True:
+                    event = await events.get()
+                    if event is None or not await send(ws, event):
+                        return
+
+            forwarder = asyncio.create_task(forward())
+            try:
+                async with session.lock:
+                    result = await self.run_turn(session, message.data, emit)
+                reply = {"type": "result", "result": result}
+            except Overloaded:
+                reply = {"type": "error", "error": "server busy"}
+            except DeadlineExceeded:
+                reply = {"type": "error", "error": "the turn ran past its deadline"}
+            except Exception as exc:
+                reply = {"type": "error", "error": str(exc)}
+            except asyncio.CancelledError:
+                forwarder.cancel()  # The client went away mid-turn
+                raise
+            # Tokens are queued via call_soon_threadsafe, so flush them before the result
+            loop.call_soon_threadsafe(events.put_nowait, None)
+            await forwarder
+            await send(ws, reply)
+        return ws
+
+    async def stats(self, request):
+        return web.json_response(dict(
+            self.counters,
+            sessions=len(self.sessions),
+            in_flight=self.in_flight,
+            waiting=self.waiting,
+            # Identical LLM calls shared between concurrent turns, per app
+            coalescing={name: load_script(name).flights.counters for name in self.instances},
+        ))
+
+    async def metrics(self, request):
+        return web.Response(
+            body=llm_metrics.default_recorder.prometheus().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    def make_app(self):
+        app = web.Application()
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        app.add_routes([
+            web.post("/sessions", self.create_session),
+            web.post("/sessions/{session_id}/turns", self.post_turn),
+            web.get("/sessions/{session_id}/ws", self.websocket),
+            web.delete("/sessions/{session_id}", self.delete_session),
+            web.get("/stats", self.stats),
+            web.get("/metrics", self.metrics),
+        ])
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the LLM workflows over HTTP and WebSocket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=64, help="agent, workflow and hybrid turns processed at once")
+    parser.add_argument("--async-turns", type=int, default=1024, help="support turns processed at once")
+    parser.add_argument("--max-queue", type=int, default=1024, help="turns allowed to wait for a slot")
+    parser.add_argument("--turn-deadline", type=float, metavar="SECONDS",
+                        help="time budget of a turn, from its arrival; late turns fail with 504")
+    args = parser.parse_args()
+    # The scripts no longer read .env when they are loaded
+    from dotenv import load_dotenv
+    load_dotenv()
+    server = WorkflowServer(max_workers=args.workers, max_queue=args.max_queue, turn_deadline=args.turn_deadline,
+                            max_async_turns=args.async_turns)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
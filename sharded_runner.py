@@ -0,0 +1,89 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import llm_metrics
+from llm_scheduler import shared_buckets
+
+# Multi-process runner for large market analyses.
+# One event loop spends most of its time on Python-side work (prompt formatting,
+# JSON parsing, aggregation) once rate limits are high, and that pins one core.
+# ShardedRunner splits the companies into shards and analyzes them on a pool of
+# worker processes, each loading the market script and running its own event loop.
+# The requests/min and tokens/min budgets are token buckets in shared memory, so
+# all workers together stay within the same limits as one process would; each
+# worker keeps 1/processes of every concurrency cap. Shards are merged back in
+# input order, and the workers' call metrics are recorded in this process.
+# State the script builds in this process (e.g. the live script's feature table)
+# isn't in the freshly loaded workers; `shard_args` sends each shard what it needs.
+
+# Worker process state, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(script, limits, buckets, shards):
+    from workflows import load_script
+
+    module = load_script(script)
+    module.scheduler.limits.update(limits)
+    module.scheduler.share(buckets, shards)
+    _worker["module"] = module
+    # One loop for the life of the worker: the scheduler's semaphores and the
+    # shared HTTP client are bound to the loop that first uses them
+    _worker["loop"] = asyncio.new_event_loop()
+
+
+def _run_shard(items, kwargs):
+    module = _worker["module"]
+    mark = llm_metrics.default_recorder.mark()
+    results = _worker["loop"].run_until_complete(module.analyze_companies(items, **kwargs))
+    return results, llm_metrics.default_recorder.since(mark)
+
+
+class ShardedRunner:
+    def __init__(self, script, processes=None, shard_size=25, limits=None, recorder=None, shard_args=None):
+        """
+        Analyze companies with the market script registered as `script` (see workflows.py),
+        which must define `analyze_companies(items)`, on `processes` worker processes
+        (default: one per core). `limits` overrides the scheduler's per-model limits;
+        they apply to all workers together. `shard_args(shard)`, called in this process,
+        returns extra keyword arguments of analyze_companies for a shard's items.
+        """
+        self.script = script
+        self.processes = processes or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.limits = limits or {}
+        self.shard_args = shard_args or (lambda shard: {})
+        self.recorder = recorder or llm_metrics.default_recorder
+        self.stats = {"shards": 0, "companies": 0, "results": 0}
+
+    def run(self, items):
+        """
+        Analyze `items` ((company, data) pairs) and yield the results in input order:
+        company by company, each company's analyses in aspect order. A shard's results
+        are yielded as soon as it and every shard before it are done.
+        """
+        items = list(items)
+        shards = [items[start:start + self.shard_size] for start in range(0, len(items), self.shard_size)]
+        # Spawned workers don't inherit the parent's open connections and threads
+        context = multiprocessing.get_context("spawn")
+        buckets = shared_buckets(self.limits, context)
+        pool = ProcessPoolExecutor(
+            self.processes,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.script, self.limits, buckets, self.processes),
+        )
+        try:
+            futures = [pool.submit(_run_shard, shard, self.shard_args(shard)) for shard in shards]
+            for shard, future in zip(shards, futures):
+                results, spans = future.result()
+                for span in spans:
+                    self.recorder.record(span)
+                self.stats["shards"] += 1
+                self.stats["companies"] += len(shard)
+                self.stats["results"] += len(results)
+                yield from results
+        finally:
+            pool.shutdown(cancel_futures=True)
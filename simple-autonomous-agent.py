@@ -1,12 +1,18 @@
-import openai
-from dotenv import load_dotenv
-import os
+import argparse
+from conversation import ConversationMemory
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_client import get_client
+from llm_metrics import TracedChatCompletion, step
+from llm_singleflight import SingleFlight
+from llm_stream import TokenStream, print_stream
+from router import AGENT_RULES, ASK_FOR_DETAILS, RESPOND, RegexRouter, RoutingEngine
 
-# Load environment variables
-load_dotenv()
-
-# Set up OpenAI API key from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Identical requests are answered from the shared on-disk response cache;
+# misses go through the shared OpenAI client (reads OPENAI_API_KEY), and
+# identical misses made at the same time share one call (llm_singleflight.py).
+# Every call is recorded in llm_metrics, tagged with the step that made it.
+flights = SingleFlight(create=get_client().create)
+llm = TracedChatCompletion(CachedChatCompletion(ResponseCache(), create=flights.create), workflow="agent")
 
 class SimpleAutonomousAgent:
     def __init__(self, system_prompt):
@@ -14,32 +20,81 @@ class SimpleAutonomousAgent:
         Initialize the agent with a system prompt that defines its behavior.
         """
         self.system_prompt = system_prompt
+        # Obvious questions and requests are recognized locally; the LLM decides the rest
+        self.router = RoutingEngine([RegexRouter(AGENT_RULES)], escalate=self.ask_llm_for_action)
+
+    def new_memory(self):
+        """
+        Conversation memory for one user; earlier turns are summarized with summarize_history.
+        """
+        return ConversationMemory(self.summarize_history)
 
-    def generate_response(self, user_input):
+    @step("generate_response")
+    def generate_response(self, user_input, stream=False, memory=None):
         """
         Generate a response based on the user input and the agent's system prompt.
+        With a ConversationMemory, the earlier conversation is sent along (after the system prompt).
+        With stream=True, return a TokenStream that yields the response as it is generated.
         """
-        response = openai.ChatCompletion.create(
+        prefix = [{"role": "system", "content": self.system_prompt}]
+        if memory is not None:
+            messages = memory.messages(prefix, user_input)
+        else:
+            messages = prefix + [{"role": "user", "content": user_input}]
+        response = llm.create(
             model="gpt-4",  
-            messages=[
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": user_input},
-            ],
+            messages=messages,
             temperature=0.7,  # Controls randomness; lower values make responses more deterministic
+            ttl=60 * 60,  # Answers are cached for an hour
+            stream=stream,
         )
+        if stream:
+            return TokenStream(response, step="generate_response")
         return response['choices'][0]['message']['content']
 
-    def decide_action(self, user_input):
+    @step("decide_action")
+    def decide_action(self, user_input, stream=False, memory=None):
         """
         Decide the best action based on the user input.
         This is where the agent's autonomy comes into play.
         """
-        # Example: The agent decides whether to answer a question or ask for clarification
-        if "?" in user_input:
-            return self.generate_response(user_input)
+        # The agent decides whether to answer or ask for clarification
+        if self.router.route(user_input) == RESPOND:
+            return self.generate_response(user_input, stream=stream, memory=memory)
         else:
             return "I need more information. Can you please ask a question or provide more details?"
 
+    @step("ask_llm_for_action")
+    def ask_llm_for_action(self, user_input):
+        """
+        Ask the LLM whether the input can be answered as it is, for inputs the local rules can't decide.
+        """
+        response = llm.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "Decide whether an assistant can respond helpfully to the user's message as it is. Reply with only RESPOND or CLARIFY."},
+                {"role": "user", "content": user_input},
+            ],
+            temperature=0,
+            max_tokens=3,
+            ttl=7 * 24 * 60 * 60,
+        )
+        if "CLARIFY" in response['choices'][0]['message']['content'].upper():
+            return ASK_FOR_DETAILS
+        return RESPOND
+
+    @step("summarize_history")
+    def summarize_history(self, prompt):
+        """
+        Fold older turns into the conversation summary (runs in the background).
+        """
+        response = llm.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+        )
+        return response['choices'][0]['message']['content']
+
 # Define the agent's system prompt
 system_prompt = """
 You are a helpful and autonomous AI assistant. Your goal is to assist users by answering their questions, 
@@ -47,14 +102,25 @@ providing recommendations, or solving problems. If the user input is unclear, as
 Be concise and helpful in your responses.
 """
 
-# Initialize the agent
-agent = SimpleAutonomousAgent(system_prompt)
-
 # Simulate a conversation with the agent
-while True:
-    user_input = input("You: ")
-    if user_input.lower() in ["exit", "quit"]:
-        print("Agent: Goodbye!")
-        break
-    response = agent.decide_action(user_input)
-    print(f"Agent: {response}")
\ No newline at end of file
+def main(argv=None):
+    argparse.ArgumentParser(description="Simple autonomous agent").parse_args(argv)
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    # Initialize the agent
+    agent = SimpleAutonomousAgent(system_prompt)
+    memory = agent.new_memory()
+
+    while True:
+        user_input = input("You: ")
+        if user_input.lower() in ["exit", "quit"]:
+            print("Agent: Goodbye!")
+            break
+        response = agent.decide_action(user_input, stream=True, memory=memory)
+        print("Agent: ", end="", flush=True)
+        memory.add_exchange(user_input, print_stream(response))
+
+if __name__ == "__main__":
+    main()
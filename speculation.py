@@ -0,0 +1,159 @@
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+
+from llm_stream import TokenStream
+
+# Speculative execution of a step whose input is still being decided.
+# While a decision is in flight (e.g. the hybrid app asking the LLM which action
+# to take), the step is started for the most likely outcomes on background
+# threads, and their streamed text is buffered. Once the decision is known, a
+# matching run is adopted (its text replays from the buffer, then continues
+# live) and every other run is cancelled by closing its stream, which stops the
+# generation. Tokens spent on cancelled runs are counted as wasted, and new
+# speculation stops while the wasted tokens of the last hour exceed the budget.
+
+_DONE = object()
+
+
+class _Run:
+    def __init__(self, outcome, prompt_tokens):
+        self.outcome = outcome
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self.pieces = queue.Queue()
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+
+    def replay(self):
+        """
+        The run's chunks, buffered ones first, then live until it finishes.
+        """
+        while True:
+            piece = self.pieces.get()
+            if piece is _DONE:
+                return
+            if isinstance(piece, BaseException):
+                raise piece
+            yield {"choices": [{"delta": {"content": piece}}]}
+
+
+class Speculation:
+    def __init__(self, speculator, runs):
+        """
+        The runs started for one decision; see Speculator.start.
+        """
+        self.speculator = speculator
+        self.runs = runs
+        self.settled = False
+
+    def adopt(self, outcome):
+        """
+        Return a TokenStream of the run for `outcome` (a hit) or None (a miss),
+        cancelling every other run. Only the first call has an effect.
+        """
+        if self.settled:
+            return None
+        self.settled = True
+        run = self.runs.get(outcome)
+        self.speculator.settle(self, run)
+        if run is None:
+            return None
+        return TokenStream(run.replay(), step=self.speculator.step)
+
+    def cancel(self):
+        """
+        Cancel every run, e.g. when the decision failed.
+        """
+        if not self.settled:
+            self.settled = True
+            self.speculator.settle(self, None)
+
+
+class Speculator:
+    def __init__(self, launch, prompt_tokens=None, max_candidates=1, wasted_tokens_per_hour=None, step=None):
+        """
+        `launch(key, outcome)` starts the step for one possible outcome of the decision
+        about `key` and returns a TokenStream (or a plain string when no call is needed);
+        `prompt_tokens(key, outcome)` estimates its prompt size, counted as wasted if
+        the run is cancelled. At most `max_candidates` outcomes are started per decision,
+        and nothing is started while the last hour's wasted tokens exceed `wasted_tokens_per_hour`.
+        `step` labels the adopted streams in timings.
+        """
+        self.launch = launch
+        self.step = step
+        self.prompt_tokens = prompt_tokens or (lambda key, outcome: 0)
+        self.max_candidates = max_candidates
+        self.wasted_tokens_per_hour = wasted_tokens_per_hour
+        self.counters = {"decisions": 0, "runs": 0, "hits": 0, "misses": 0, "over_budget": 0, "wasted_tokens": 0}
+        self._wasted = deque()  # (time, tokens) of cancelled runs in the last hour
+        self._lock = threading.Lock()
+
+    def summary(self):
+        counters = self.counters
+        decided = counters["hits"] + counters["misses"]
+        hit_rate = f"{counters['hits'] / decided:.0%}" if decided else "-"
+        return (f"{counters['decisions']} speculated decisions, hit rate {hit_rate}, "
+                f"{counters['wasted_tokens']} wasted tokens, {counters['over_budget']} skipped over budget")
+
+    def wasted_last_hour(self):
+        cutoff = time.monotonic() - 3600
+        with self._lock:
+            while self._wasted and self._wasted[0][0] < cutoff:
+                self._wasted.popleft()
+            return sum(tokens for _, tokens in self._wasted)
+
+    def start(self, key, candidates):
+        """
+        Start the step for the first `max_candidates` of `candidates` (most likely first)
+        and return a Speculation, or None if there is nothing to start or no budget left.
+        """
+        candidates = list(dict.fromkeys(candidates))[:self.max_candidates]
+        if not candidates or self.max_candidates < 1:
+            return None
+        if self.wasted_tokens_per_hour is not None and self.wasted_last_hour() >= self.wasted_tokens_per_hour:
+            self.counters["over_budget"] += 1
+            return None
+        runs = {outcome: _Run(outcome, self.prompt_tokens(key, outcome)) for outcome in candidates}
+        with self._lock:
+            self.counters["decisions"] += 1
+            self.counters["runs"] += len(runs)
+        for run in runs.values():
+            # Keep the caller's context, so the run's calls are traced under its step
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._pump, key, run), daemon=True).start()
+        return Speculation(self, runs)
+
+    def _pump(self, key, run):
+        try:
+            stream = self.launch(key, run.outcome)
+            if isinstance(stream, str):
+                run.pieces.put(stream)
+                return
+            for piece in stream:
+                run.completion_tokens += max(1, len(piece) // 4)
+                run.pieces.put(piece)
+                if run.cancelled.is_set():
+                    # Closing the stream closes the connection, which stops the generation
+                    stream.close()
+                    return
+        except Exception as exc:
+            run.pieces.put(exc)
+        finally:
+            run.pieces.put(_DONE)
+            run.finished.set()
+
+    def settle(self, speculation, adopted):
+        wasted = 0
+        for run in speculation.runs.values():
+            if run is adopted:
+                continue
+            run.cancelled.set()
+            # A run that already finished cost its whole answer; others are stopped at the next token
+            wasted += run.prompt_tokens + run.completion_tokens
+        with self._lock:
+            self.counters["hits" if adopted is not None else "misses"] += 1
+            self.counters["wasted_tokens"] += wasted
+            self._wasted.append((time.monotonic(), wasted))
@@ -0,0 +1,141 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Chunked map-reduce summarization.
+# Completed chunks of a (possibly still streaming) text are summarized in the
+# background while the rest is generated; the partial summaries and the final
+# section are then merged in one call. Texts longer than the model's context
+# window are handled the same way, with extra reduce rounds if needed.
+
+SUMMARY_PROMPT = "Summarize the following text in one paragraph:\n\n{text}"
+CHUNK_PROMPT = "Summarize the following section of a longer text in a few sentences, keeping the key facts:\n\n{text}"
+MERGE_PROMPT = (
+    "Below are summaries of consecutive sections of a text, followed by its final section. "
+    "Combine them into one paragraph summarizing the whole text:\n\n{text}"
+)
+
+
+def split_point(text, limit):
+    """
+    Index at which to cut `text` so the first part is at most `limit` characters,
+    preferring paragraph, then sentence, then word boundaries.
+    """
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n\n", "\n", ". ", " "):
+        index = text.rfind(separator, limit // 2, limit)
+        if index != -1:
+            return index + len(separator)
+    return limit
+
+
+class ChunkedSummarizer:
+    def __init__(self, complete, chunk_chars=12000, max_workers=4):
+        """
+        `complete(prompt, stream=False)` sends one prompt to the LLM and returns its text
+        (or a TokenStream when stream=True). `chunk_chars` should leave room for the
+        prompt and the answer within the model's context window.
+        """
+        self.complete = complete
+        self.chunk_chars = chunk_chars
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def pipeline(self, tokens):
+        """
+        Wrap a text, TokenStream or other iterable of text deltas in a SummaryPipeline.
+        """
+        if isinstance(tokens, SummaryPipeline):
+            return tokens
+        if isinstance(tokens, str):
+            tokens = [tokens]
+        return SummaryPipeline(self, tokens)
+
+    def summarize(self, text, stream=False):
+        """
+        Summarize a complete text of any length.
+        """
+        return self.pipeline(text).merge(stream=stream)
+
+    def reduce(self, summaries, tail=""):
+        """
+        Merge partial summaries (and the unsummarized tail) into one input that fits a
+        single call, summarizing groups of summaries again as long as it doesn't fit.
+        """
+        while True:
+            combined = "\n\n".join(summaries + ([tail] if tail else []))
+            if len(combined) <= self.chunk_chars:
+                return combined
+            if tail:
+                summaries = summaries + [self.complete(CHUNK_PROMPT.format(text=tail))]
+                tail = ""
+                continue
+            groups = []
+            group = []
+            for summary in summaries:
+                if group and len("\n\n".join(group + [summary])) > self.chunk_chars:
+                    groups.append(group)
+                    group = []
+                group.append(summary)
+            groups.append(group)
+            futures = [self.submit(CHUNK_PROMPT.format(text="\n\n".join(g))) for g in groups]
+            summaries = [future.result() for future in futures]
+
+    def submit(self, prompt):
+        """
+        Send `prompt` on the thread pool, keeping the caller's context (e.g. metrics step tags).
+        """
+        return self.pool.submit(contextvars.copy_context().run, self.complete, prompt)
+
+
+class SummaryPipeline:
+    def __init__(self, summarizer, tokens):
+        """
+        Iterate over this object to pass the text deltas through (e.g. to print them);
+        every time a full chunk has been received it is summarized on the thread pool.
+        """
+        self.summarizer = summarizer
+        self.parts = []
+        self.partials = []
+        self.done = False
+        self._tokens = iter(tokens)  # Resuming iteration must not replay text or resubmit chunks
+        self._buffer = ""
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def __iter__(self):
+        limit = self.summarizer.chunk_chars
+        for delta in self._tokens:
+            self.parts.append(delta)
+            self._buffer += delta
+            while len(self._buffer) > limit:
+                cut = split_point(self._buffer, limit)
+                self._submit(self._buffer[:cut])
+                self._buffer = self._buffer[cut:]
+            yield delta
+        self.done = True
+
+    def _submit(self, chunk):
+        self.partials.append(self.summarizer.submit(CHUNK_PROMPT.format(text=chunk)))
+
+    def read(self):
+        """
+        Consume the rest of the input and return the complete text.
+        """
+        for _ in self:
+            pass
+        return self.text
+
+    def merge(self, stream=False):
+        """
+        Wait for the chunk summaries and merge them into the final summary.
+        Short inputs that fit in one chunk are summarized directly, in a single call.
+        """
+        if not self.done:
+            self.read()
+        if not self.partials:
+            return self.summarizer.complete(SUMMARY_PROMPT.format(text=self._buffer), stream=stream)
+        summaries = [partial.result() for partial in self.partials]
+        combined = self.summarizer.reduce(summaries, self._buffer)
+        return self.summarizer.complete(MERGE_PROMPT.format(text=combined), stream=stream)
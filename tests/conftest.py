@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to the scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_client  # noqa: E402
+from llm_client import LLMClient  # noqa: E402
+from mock_llm import MockLLMServer  # noqa: E402
+from workflows import load_script  # noqa: E402
+
+
+@pytest.fixture
+def mock_llm():
+    """
+    Local mock chat-completion server, answering "OK" without delay.
+    Tests may change its `reply`, `latency` or `errors` before calling it.
+    """
+    server = MockLLMServer(latency=0, seed=0).start_in_thread()
+    yield server
+    server.stop_thread()
+
+
+@pytest.fixture
+def client(mock_llm):
+    """
+    LLMClient talking to the mock server, without SDK retries.
+    """
+    client = LLMClient(api_key="mock", base_url=mock_llm.base_url, max_retries=0)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def run(client):
+    """
+    Run a coroutine to completion; the client's async connections are closed
+    in the same event loop, as they can't be reused by the next one.
+    """
+    def run(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await client.aclose()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    """
+    Point the scripts' response cache at a fresh file.
+    """
+    path = str(tmp_path / "cache.sqlite3")
+    monkeypatch.setenv("LLM_CACHE_PATH", path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def script_llm(tmp_path_factory):
+    """
+    Mock server for the workflow scripts. Scripts bind the shared client when they are
+    loaded, once per process, so one server (and environment) serves every test using them.
+    """
+    server = MockLLMServer(latency=0, seed=0).start_in_thread()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("OPENAI_API_KEY", "mock")
+        patch.setenv("OPENAI_BASE_URL", server.base_url)
+        patch.setenv("LLM_CACHE_PATH", str(tmp_path_factory.mktemp("scripts") / "cache.sqlite3"))
+        yield server
+    server.stop_thread()
+
+
+class Scripts:
+    def __init__(self, server):
+        self.server = server
+
+    def load(self, name):
+        """
+        Load the script registered under `name` (see workflows.SCRIPTS) with an empty response cache.
+        """
+        module = load_script(name)
+        module.llm.completion.cache.clear()
+        return module
+
+    def run(self, coroutine):
+        """
+        Run a coroutine calling the scripts; the shared client's async connections
+        are closed in the same event loop, as they can't be reused by the next one.
+        """
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await llm_client.get_client().aclose()
+
+        return asyncio.run(main())
+
+
+@pytest.fixture
+def scripts(script_llm, monkeypatch):
+    """
+    Loader for the workflow scripts, talking to `script_llm`; the mock's reply,
+    latency and errors are reset after each test.
+    """
+    # Keep the shared client the scripts were loaded with, even if a test replaces it
+    monkeypatch.setattr(llm_client, "_default_client", llm_client.get_client())
+    yield Scripts(script_llm)
+    script_llm.reply = "OK"
+    script_llm.latency = 0
+    script_llm.errors = {}
@@ -0,0 +1,103 @@
+import pytest
+
+from batch_runner import BatchRunner, JobStore, LocalBatchBackend, analysis_requests, analysis_results
+from fused_analysis import Aspect
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def requests(count):
+    return [(f"item-{i}", {"model": "gpt-4", "messages": [{"role": "user", "content": f"question {i}"}]})
+            for i in range(count)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    yield store
+    store.close()
+
+
+def runner(store, backend, tmp_path, **options):
+    return BatchRunner(backend, store, workdir=str(tmp_path / "runs"), poll_interval=0.01, **options)
+
+
+def test_run_against_the_mock_server(mock_llm, client, store, tmp_path):
+    mock_llm.reply = "Batched answer"
+    backend = LocalBatchBackend(create=client.create, workdir=str(tmp_path / "batches"))
+    outcomes = runner(store, backend, tmp_path, max_batch_size=2).run("run-1", requests(5))
+    assert [custom_id for custom_id, _, _ in outcomes] == [f"item-{i}" for i in range(5)]
+    assert all(response["choices"][0]["message"]["content"] == "Batched answer" for _, response, _ in outcomes)
+    assert mock_llm.request_count == 5
+    assert len(store.open_batches("run-1")) == 0
+    assert store.stats("run-1") == {"done": 5}
+
+
+def test_retryable_items_go_out_in_a_later_batch(store, tmp_path):
+    failures = {"item-1": [StatusError(429)], "item-2": [StatusError(400)]}
+
+    def create(model, messages, **params):
+        custom_id = "item-" + messages[0]["content"].split()[-1]
+        if failures.get(custom_id):
+            raise failures[custom_id].pop()
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    backend = LocalBatchBackend(create=create, workdir=str(tmp_path / "batches"))
+    outcomes = dict((custom_id, (response, error)) for custom_id, response, error in
+                    runner(store, backend, tmp_path).run("run-1", requests(3)))
+    assert outcomes["item-1"][0] is not None  # Succeeded on its second attempt
+    assert outcomes["item-2"] == (None, "HTTP 400")
+    assert store.stats("run-1") == {"done": 2, "failed": 1}
+
+
+def test_items_give_up_after_max_attempts(store, tmp_path):
+    def create(**body):
+        raise StatusError(503)
+
+    backend = LocalBatchBackend(create=create, workdir=str(tmp_path / "batches"))
+    outcomes = runner(store, backend, tmp_path, max_attempts=2).run("run-1", requests(1))
+    assert outcomes == [("item-0", None, "HTTP 503")]
+
+
+def test_resuming_polls_submitted_batches_without_resubmitting(store, tmp_path):
+    calls = []
+
+    def create(**body):
+        calls.append(body)
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    backend = LocalBatchBackend(create=create, workdir=str(tmp_path / "batches"), delay=60)
+    store.add("run-1", requests(3))
+    runner(store, backend, tmp_path).submit_pending("run-1")
+    batch_id, = store.open_batches("run-1")
+    assert backend.status(batch_id) == "in_progress"
+
+    # A new process resumes the run; the batch finishes meanwhile
+    backend.delay = 0
+    outcomes = runner(store, backend, tmp_path).run("run-1")
+    assert len(outcomes) == 3 and all(response for _, response, _ in outcomes)
+    assert store.open_batches("run-1") == []
+    assert len(calls) == 3
+
+
+def test_lost_batches_are_resubmitted(store, tmp_path):
+    backend = LocalBatchBackend(workdir=str(tmp_path / "batches"))
+    store.add("run-1", requests(2))
+    store.mark_submitted("run-1", "batch_gone", ["item-0", "item-1"])
+    outcomes = runner(store, backend, tmp_path).run("run-1")
+    assert all(response is not None for _, response, _ in outcomes)
+
+
+def test_analysis_requests_round_trip():
+    async def price(company, data):
+        return ""
+
+    aspects = [Aspect("price", "Price analysis", lambda company, data: f"Price of {company}", price, model="gpt-4")]
+    built = analysis_requests(aspects, [("Apple", {}), ("Tesla", {})])
+    assert built[0] == ("price:Apple", {"model": "gpt-4", "messages": [{"role": "system", "content": "Price of Apple"}]})
+    outcomes = [("price:Apple", {"choices": [{"message": {"content": "Up"}}]}, None), ("price:Tesla", None, "HTTP 500")]
+    assert analysis_results(aspects, outcomes) == ["Price analysis for Apple: Up", "price failed for Tesla: HTTP 500"]
@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+
+from benchmarks.bench_fused import make_market_data
+from benchmarks.bench_workflows import ISSUES, TOPICS, answering, summarize
+from llm_scheduler import ModelLimits
+
+# pytest-benchmark suite for the workflows, against the mock backend with its
+# response cache disabled. Run with `pytest tests/test_benchmarks.py --benchmark-only
+# --benchmark-json bench.json` to keep machine-readable results (the largest market
+# run only runs then), or skip it with --benchmark-skip.
+# benchmarks/bench_workflows.py reports the same workloads under error injection and
+# long-tailed latencies.
+
+pytest.importorskip("pytest_benchmark")
+
+LIFTED = ModelLimits(max_concurrency=64, requests_per_minute=10 ** 7, tokens_per_minute=10 ** 10)
+
+
+@pytest.fixture
+def uncached(scripts, monkeypatch):
+    """
+    Load a script with its response cache disabled, so every round calls the mock.
+    """
+    def load(name):
+        module = scripts.load(name)
+        monkeypatch.setattr(module.llm.completion.cache, "max_bytes", 0)
+        return module
+
+    scripts.server.latency = 0.005
+    return load
+
+
+def answered(run, inputs):
+    """
+    Wrap `run` so each call answers its input() prompt with the next of `inputs`.
+    """
+    rounds = itertools.count()
+
+    def call():
+        i = next(rounds)
+        with answering(f"{inputs[i % len(inputs)]} (round {i})"):
+            return run()
+
+    return call
+
+
+def test_hybrid_app(benchmark, uncached):
+    app = uncached("hybrid").HybridLLMApp()
+    benchmark.pedantic(answered(app.run_hybrid_app, TOPICS), rounds=5)
+
+
+def test_workflow_app(benchmark, uncached):
+    app = uncached("workflow").WorkflowBasedApp()
+    benchmark.pedantic(answered(app.run_workflow, TOPICS), rounds=5)
+
+
+def test_support_turn(benchmark, uncached, scripts):
+    support = uncached("support")
+    rounds = itertools.count()
+
+    def turn():
+        i = next(rounds)
+        return scripts.run(support.support_turn(f"{ISSUES[i % len(ISSUES)]} (round {i})"))
+
+    result = benchmark.pedantic(turn, rounds=5)
+    assert result["run"].complete
+
+
+@pytest.mark.parametrize("tickers", [10, 100, 1000])
+def test_parallel_market_analysis(benchmark, uncached, monkeypatch, request, tickers):
+    import llm_client
+    import llm_metrics
+
+    if tickers > 100 and not request.config.getoption("benchmark_only"):
+        pytest.skip("4,000 calls take a minute or more; run with --benchmark-only")
+    market = uncached("market")
+    monkeypatch.setattr(market, "market_data", make_market_data(tickers))
+    # Fresh per-model state under lifted limits: the scheduler's semaphores are bound to
+    # the event loop that first waits on them, so every round runs on this test's loop
+    monkeypatch.setattr(market.scheduler, "limits", {model: LIFTED for model in market.scheduler.limits})
+    monkeypatch.setattr(market.scheduler, "_models", {})
+    loop = asyncio.new_event_loop()
+    mark = llm_metrics.default_recorder.mark()
+    started = time.perf_counter()
+    try:
+        results = benchmark.pedantic(lambda: loop.run_until_complete(market.parallel_market_analysis()),
+                                     rounds=1 if tickers > 100 else 3)
+    finally:
+        elapsed = time.perf_counter() - started
+        loop.run_until_complete(llm_client.get_client().aclose())
+        loop.close()
+    assert len(results) == tickers * len(market.MARKET_ASPECTS)
+    assert not any(" failed for " in text for text in results)
+    # Per analysis: waiting for the scheduler plus the call itself
+    spans = llm_metrics.default_recorder.since(mark)
+    stats = summarize([span.queue_time + (span.latency or 0.0) for span in spans], elapsed)
+    benchmark.extra_info.update(tickers=tickers, p50=stats["p50"], p95=stats["p95"], p99=stats["p99"])
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+import workflows
+from benchmarks.bench_startup import ALLOWED, HEAVY
+from workflows import SCRIPTS, load_script
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_help_lists_every_subcommand(capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["--help"])
+    assert exit.value.code == 0
+    out = capsys.readouterr().out
+    for name in SCRIPTS:
+        assert f"  {name} " in out
+
+
+def test_unknown_subcommand(capsys):
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["trading"])
+    assert exit.value.code == 2
+    assert "invalid choice: 'trading'" in capsys.readouterr().err
+
+
+def test_options_after_the_subcommand_go_to_the_script(capsys, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["cli.py"])
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["market", "--help"])
+    assert exit.value.code == 0
+    out = capsys.readouterr().out
+    assert out.startswith("usage: cli.py market")
+    assert "--mode" in out
+
+
+@pytest.mark.parametrize("command", list(SCRIPTS))
+def test_help_does_not_import_heavy_dependencies(command):
+    # A fresh interpreter, as the modules may already be imported in this one
+    code = (
+        "import sys, cli\n"
+        "try:\n"
+        f"    cli.main([{command!r}, '--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print('imported:', [name for name in {HEAVY!r} if name in sys.modules])\n"
+    )
+    expected = [name for name in HEAVY if name in ALLOWED.get(command, ())]
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines()[-1] == f"imported: {expected}"
+
+
+def test_load_script_once_per_process(tmp_path, monkeypatch):
+    assert load_script("agent") is load_script("agent")
+    broken = tmp_path / "broken_script.py"
+    broken.write_text("raise ImportError('missing dependency')\n")
+    monkeypatch.setitem(workflows.SCRIPTS, "broken", str(broken))
+    with pytest.raises(ImportError):
+        load_script("broken")
+    # A script that failed to load isn't left half-initialized in sys.modules
+    assert "broken_script" not in sys.modules
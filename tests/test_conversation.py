@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conversation import SUMMARY_HEADER, ConversationMemory, count_tokens
+
+PREFIX = [{"role": "system", "content": "You are a support assistant."}]
+
+
+class Summarizer:
+    """
+    complete(prompt) stand-in that holds each summary until released.
+    """
+
+    def __init__(self, hold=False, fail=False):
+        self.prompts = []
+        self.released = threading.Event()
+        self.fail = fail
+        if not hold:
+            self.released.set()
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        self.released.wait(5)
+        if self.fail:
+            raise RuntimeError("summary failed")
+        return f"summary {len(self.prompts)}"
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def turn(i, size=40):
+    return f"message {i} " + "x" * size
+
+
+def fill(memory, exchanges, size=40):
+    for i in range(exchanges):
+        memory.add_exchange(turn(i, size), turn(i, size))
+
+
+def test_short_conversations_are_sent_verbatim(executor):
+    memory = ConversationMemory(Summarizer(), max_tokens=1000, executor=executor)
+    fill(memory, 2)
+    messages = memory.messages(PREFIX, "new question")
+    assert messages[0] == PREFIX[0]
+    assert len(messages) == 1 + 4 + 1
+    assert messages[-1] == {"role": "user", "content": "new question"}
+
+
+def test_old_turns_are_summarized_in_the_background(executor):
+    summarizer = Summarizer(hold=True)
+    memory = ConversationMemory(summarizer, max_tokens=100, min_recent=2, executor=executor)
+    fill(memory, 4)
+    assert memory.window_tokens() > 100
+    assert len(memory.messages(PREFIX, "next")) == 1 + 8 + 1  # Not waiting for the summary
+    summarizer.released.set()
+    memory._compaction[0].result()
+    messages = memory.messages(PREFIX, "next")
+    assert messages[1] == {"role": "system", "content": SUMMARY_HEADER + "summary 1"}
+    assert memory.counters["compactions"] == 1
+    assert memory.counters["blocked"] == 0
+    assert len(memory.turns) >= 2
+
+
+def test_messages_block_past_twice_the_budget(executor):
+    summarizer = Summarizer(hold=True)
+    memory = ConversationMemory(summarizer, max_tokens=100, min_recent=2, executor=executor)
+    fill(memory, 8)
+    assert memory.window_tokens() > 200
+    threading.Timer(0.1, summarizer.released.set).start()
+    messages = memory.messages(PREFIX, "next")
+    assert messages[1]["content"] == SUMMARY_HEADER + "summary 1"
+    assert memory.counters["blocked"] == 1
+
+
+def test_async_callers_wait_without_blocking_the_event_loop(executor):
+    summarizer = Summarizer(hold=True)
+    memory = ConversationMemory(summarizer, max_tokens=100, min_recent=2, executor=executor)
+    fill(memory, 8)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        asyncio.get_running_loop().call_later(0.2, summarizer.released.set)
+        await memory.wait_for_summary()
+        ticking.cancel()
+        return ticks, memory.messages(PREFIX, "next")
+
+    ticks, messages = asyncio.run(main())
+    assert ticks >= 5  # The loop kept running while the summary was written
+    assert messages[1]["content"] == SUMMARY_HEADER + "summary 1"
+    assert memory.counters["blocked"] == 1
+
+
+def test_cancelled_waits_leave_the_summary_running(executor):
+    summarizer = Summarizer(hold=True)
+    memory = ConversationMemory(summarizer, max_tokens=100, min_recent=2, executor=executor)
+    fill(memory, 8)
+
+    async def main():
+        waiting = asyncio.create_task(memory.wait_for_summary())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(main())
+    future = memory._compaction[0]
+    summarizer.released.set()
+    assert future.result(timeout=5) == "summary 1"
+
+
+def test_nothing_to_wait_for():
+    memory = ConversationMemory(Summarizer(), max_tokens=1000)
+    started = time.monotonic()
+    asyncio.run(memory.wait_for_summary())
+    assert time.monotonic() - started < 0.1
+
+
+def test_failed_summaries_keep_the_turns(executor):
+    memory = ConversationMemory(Summarizer(fail=True), max_tokens=100, min_recent=2, executor=executor)
+    fill(memory, 8)
+    asyncio.run(memory.wait_for_summary())
+    messages = memory.messages(PREFIX, "next")
+    assert len(messages) == 1 + 16 + 1
+    assert memory.counters["errors"] >= 1
+
+
+def test_compaction_keeps_the_latest_turns(executor):
+    memory = ConversationMemory(Summarizer(), max_tokens=100, min_recent=4, executor=executor)
+    fill(memory, 3, size=200)
+    memory._compaction[0].result()
+    memory.messages(PREFIX, "next")
+    assert len(memory.turns) >= 4
+    assert memory.turns[-1]["content"] == turn(2, 200)
+
+
+def test_count_tokens():
+    assert count_tokens("x" * 40) == 14
+
+
+def test_summaries_with_the_mock_server(mock_llm, client, executor):
+    mock_llm.reply = "The customer asked about shipping."
+
+    def complete(prompt):
+        response = client.create(model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}])
+        return response["choices"][0]["message"]["content"]
+
+    memory = ConversationMemory(complete, max_tokens=100, min_recent=2, executor=executor)
+    fill(memory, 8)
+    messages = memory.messages(PREFIX, "next")
+    assert messages[1]["content"] == SUMMARY_HEADER + "The customer asked about shipping."
+
+
+def test_async_support_turns_use_the_memory(scripts):
+    support = scripts.load("support")
+    scripts.server.reply = "Please check the tracking link."
+    memory = support.new_memory()
+    for question in ("My order hasn't arrived", "It was supposed to come on Monday"):
+        result = scripts.run(support.support_turn(question, memory))
+        assert result["solution"] == "Please check the tracking link."
+    assert [turn["role"] for turn in memory.turns] == ["user", "assistant"] * 2
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import deadline
+from benchmarks.bench_fused import make_market_data
+from deadline import DeadlineExceeded, budget, call_with_budget, check, expires_at, remaining, within
+from workflow_engine import Node, Workflow
+
+
+def test_no_deadline_by_default():
+    assert expires_at() is None
+    assert remaining() is None
+    check()
+    with budget():
+        assert expires_at() is None
+
+
+def test_budgets_never_extend_the_enclosing_deadline():
+    with budget(1.0) as outer:
+        assert expires_at() == outer
+        assert 0.9 < remaining() <= 1.0
+        with budget(5.0) as inner:
+            assert inner == outer
+        with budget(share=0.5):
+            assert 0.4 < remaining() <= 0.5
+        with budget(0.1) as inner:
+            assert inner < outer
+        assert expires_at() == outer
+    assert expires_at() is None
+
+
+def test_check_after_the_deadline():
+    with budget(0):
+        assert remaining() == 0
+        with pytest.raises(DeadlineExceeded, match="deadline passed before the fetch"):
+            check("the fetch")
+    check("the fetch", expires=time.monotonic() + 1)
+    # Never retried: the scheduler treats it as a timeout
+    assert issubclass(DeadlineExceeded, TimeoutError)
+
+
+def test_deadlines_follow_tasks_but_not_plain_threads():
+    seen = {}
+
+    async def task():
+        seen["task"] = remaining()
+
+    async def main():
+        with budget(1.0):
+            await asyncio.create_task(task())
+            seen["to_thread"] = await asyncio.to_thread(remaining)
+
+    asyncio.run(main())
+    assert 0 < seen["task"] <= 1.0 and 0 < seen["to_thread"] <= 1.0
+
+    with budget(1.0):
+        thread = threading.Thread(target=lambda: seen.update(thread=remaining()))
+        thread.start()
+        thread.join()
+    assert seen["thread"] is None
+    # call_with_budget gives a worker thread its own deadline
+    thread = threading.Thread(target=lambda: seen.update(thread=call_with_budget(1.0, remaining)))
+    thread.start()
+    thread.join()
+    assert 0 < seen["thread"] <= 1.0
+
+
+def test_within_cancels_what_runs_past_the_deadline():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def own_timeout():
+        raise asyncio.TimeoutError
+
+    async def main():
+        assert await within(asyncio.sleep(0, "done")) == "done"
+        with budget(0.05):
+            with pytest.raises(DeadlineExceeded, match="the fetch did not finish"):
+                await within(slow(), "the fetch")
+        with budget(1.0):
+            # A timeout of its own before the deadline isn't the deadline's
+            with pytest.raises(asyncio.TimeoutError) as raised:
+                await within(own_timeout())
+            assert not isinstance(raised.value, DeadlineExceeded)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+
+
+def test_workflow_nodes_that_run_past_the_deadline_time_out():
+    async def fast(x):
+        return x + 1
+
+    async def slow(x):
+        await asyncio.sleep(1)
+        return x
+
+    workflow = Workflow([Node("fast", fast, ["x"]), Node("slow", slow, ["x"]), Node("after", fast, ["slow"])])
+    started = time.monotonic()
+    run = asyncio.run(workflow.run({"x": 1}, deadline=0.1, partial=True))
+    assert time.monotonic() - started < 0.5
+    assert run["fast"] == 2
+    assert run.statuses["slow"] == "timeout"
+    assert run.statuses["after"] == "skipped"
+    assert not run.complete
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(workflow.run({"x": 1}, deadline=0.1))
+
+
+def test_streams_are_cut_off_at_the_deadline(mock_llm, client):
+    mock_llm.reply = "one two three four five six"
+    mock_llm.tokens_per_second = 10
+    with budget(0.25):
+        stream = client.create(model="gpt-4", messages=[{"role": "user", "content": "Count"}], stream=True)
+        with pytest.raises(DeadlineExceeded):
+            for _ in stream:
+                pass
+    assert mock_llm.request_count == 1  # Not retried
+
+
+def test_market_analyses_past_the_deadline_are_reported_as_timed_out(scripts, monkeypatch):
+    market = scripts.load("market")
+    monkeypatch.setattr(market, "market_data", make_market_data(2))
+    # The scheduler's semaphores are bound to the event loop that first waits on them
+    monkeypatch.setattr(market.scheduler, "_models", {})
+    scripts.server.latency = 1.0
+    started = time.monotonic()
+    results = scripts.run(market.parallel_market_analysis(deadline=0.2))
+    assert time.monotonic() - started < 1.0
+    assert len(results) == 2 * len(market.MARKET_ASPECTS)
+    assert all(" timed out for " in result for result in results)
+    assert deadline.expires_at() is None
+    time.sleep(1.0)  # Let the mock finish the abandoned requests
@@ -0,0 +1,131 @@
+import threading
+
+import numpy as np
+import pytest
+
+from faq_index import FAQIndex, content_terms, tokenize
+
+FAQS = {
+    "shipping": {"question": "How long does shipping take?", "answer": "Orders arrive within 5 business days."},
+    "returns": {"question": "What is your return policy?", "answer": "Items can be returned within 30 days."},
+    "payment": {"question": "Which payment methods do you accept?", "answer": "We accept cards and PayPal."},
+    "tracking": {"question": "Where is my order?", "answer": "Use the tracking link in your confirmation email."},
+}
+
+VOCABULARY = sorted({token for faq in FAQS.values() for token in tokenize(f"{faq['question']} {faq['answer']}")})
+
+
+def embed(texts):
+    """
+    Bag-of-words vectors over the FAQ vocabulary, a stand-in for an embedding model.
+    """
+    return [[tokenize(text).count(token) for token in VOCABULARY] for text in texts]
+
+
+def broken_embed(texts):
+    raise ConnectionError("embedding service unavailable")
+
+
+def test_content_terms_drop_stopwords():
+    assert content_terms("Where is MY order?") == frozenset({"order"})
+
+
+def test_bm25_search_ranks_the_relevant_faq_first():
+    index = FAQIndex(FAQS)
+    results = index.search("can I return an item?", k=2)
+    assert results[0][0] == "returns"
+    assert len(results) <= 2
+    assert all(score > 0 for _, _, score in results)
+
+
+def test_search_skips_unrelated_faqs():
+    assert FAQIndex(FAQS).search("zebra", k=3) == []
+
+
+def test_embedding_search():
+    index = FAQIndex(FAQS, embed=embed)
+    assert index.embeddings.shape == (len(FAQS), len(VOCABULARY))
+    assert index.search("payment methods accepted", k=1)[0][0] == "payment"
+
+
+def test_falls_back_to_bm25_when_embedding_fails():
+    index = FAQIndex(FAQS, embed=embed)
+    index.embed = broken_embed
+    assert index.search("return policy", k=1)[0][0] == "returns"
+
+
+class CountingEmbed:
+    """
+    `embed` recording the texts of each call and the thread it ran on.
+    """
+
+    def __init__(self, vocabulary=VOCABULARY):
+        self.vocabulary = vocabulary
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append((list(texts), threading.current_thread()))
+        return [[tokenize(text).count(token) + 0.01 for token in self.vocabulary] for text in texts]
+
+
+def test_query_vectors_are_reused():
+    counting = CountingEmbed()
+    index = FAQIndex(FAQS, embed=counting, query_cache_size=2)
+    counting.calls.clear()
+    for query in ["return policy", "return policy", "shipping", "return policy"]:
+        assert index.search(query, k=1)
+    assert [texts for texts, _ in counting.calls] == [["return policy"], ["shipping"]]
+    # The least recently used vector is dropped
+    index.search("payment", k=1)
+    index.search("shipping", k=1)
+    assert [texts for texts, _ in counting.calls][2:] == [["payment"], ["shipping"]]
+    assert not FAQIndex(FAQS).embeds_queries
+
+
+def test_failed_embeddings_are_not_cached():
+    index = FAQIndex(FAQS, embed=embed)
+    index.embed = broken_embed
+    assert index.search("return policy", k=1)[0][0] == "returns"
+    index.embed = CountingEmbed()
+    index.search("return policy", k=1)
+    assert len(index.embed.calls) == 1
+
+
+def test_support_turns_embed_each_text_once_off_the_event_loop(scripts, monkeypatch):
+    support = scripts.load("support")
+    vocabulary = sorted({token for faq in support.FAQS.values() for token in tokenize(f"{faq['question']} {faq['answer']}")})
+    counting = CountingEmbed(vocabulary)
+    index = FAQIndex(support.FAQS, embed=counting)
+    counting.calls.clear()
+    monkeypatch.setattr(support, "get_faq_index", lambda: index)
+    scripts.server.reply = "The password reset email is not arriving"
+    message = "I never got the email to reset my password"
+    result = scripts.run(support.support_turn(message, follow_up="template"))
+    assert result["run"].complete
+    assert sorted(texts for texts, _ in counting.calls) == [[message], [scripts.server.reply]]
+    assert all(thread is not threading.main_thread() for _, thread in counting.calls)
+
+
+def test_exact_match_ignores_case_punctuation_and_stopwords():
+    index = FAQIndex(FAQS)
+    key, faq = index.exact_match("where is my ORDER")
+    assert key == "tracking"
+    assert index.exact_match("where is my parcel") is None
+
+
+def test_context_lists_the_top_matches():
+    context = FAQIndex(FAQS).context("shipping", k=1)
+    assert context == "Q: How long does shipping take?\nA: Orders arrive within 5 business days."
+
+
+def test_save_and_load_memory_maps_the_embeddings(tmp_path):
+    FAQIndex(FAQS, embed=embed).save(str(tmp_path))
+    index = FAQIndex.load(str(tmp_path), embed=embed)
+    assert isinstance(index.embeddings, np.memmap)
+    assert index.keys == list(FAQS)
+    assert index.search("return policy", k=1)[0][0] == "returns"
+
+
+@pytest.mark.parametrize("k", [0, 10])
+def test_k_is_bounded_by_the_index(k):
+    assert len(FAQIndex(FAQS).search("order", k=k)) <= min(k, len(FAQS))
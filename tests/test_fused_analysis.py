@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+
+from fused_analysis import Aspect, FusedAnalyzer, fused_prompt, fused_schema, parse_fused
+from llm_cache import CachedChatCompletion, ResponseCache
+
+
+async def per_aspect(company, data):
+    return "unused"
+
+
+ASPECTS = [
+    Aspect("price", "Stock price analysis", lambda company, data: f"Analyze the price of {company}: {data['price']}",
+           per_aspect),
+    Aspect("risk", "Risk assessment", lambda company, data: f"Assess the risk of {company}", per_aspect),
+]
+
+BATCH = [("Apple", {"price": 189.98}), ("Tesla", {"price": 251.05})]
+
+
+class FakeLLM:
+    def __init__(self, content=None, error=None):
+        self.content = content
+        self.error = error
+        self.calls = []
+
+    async def acreate(self, **params):
+        self.calls.append(params)
+        if self.error is not None:
+            raise self.error
+        return {"choices": [{"message": {"content": self.content}}]}
+
+
+async def fallback(analysis, company, data):
+    return f"{analysis.__name__} (fallback) for {company}"
+
+
+def test_schema_requires_every_company_and_aspect():
+    schema = fused_schema(["Apple", "Tesla"], ASPECTS)["json_schema"]["schema"]
+    assert schema["required"] == ["Apple", "Tesla"]
+    assert schema["properties"]["Apple"]["required"] == ["price", "risk"]
+    assert schema["properties"]["Apple"]["additionalProperties"] is False
+
+
+def test_prompt_lists_every_task():
+    prompt = fused_prompt(BATCH, ASPECTS)
+    assert 'Company "Tesla"' in prompt
+    assert 'Task "risk":\nAssess the risk of Apple' in prompt
+
+
+def test_parse_fused_keeps_complete_answers_only():
+    text = json.dumps({"Apple": {"price": "Up", "risk": "Low"}, "Tesla": {"price": "Down", "risk": " "}})
+    assert parse_fused(text, ["Apple", "Tesla"], ASPECTS) == {"Apple": {"price": "Up", "risk": "Low"}}
+    with pytest.raises(ValueError):
+        parse_fused("not json", ["Apple"], ASPECTS)
+    with pytest.raises(ValueError):
+        parse_fused("[1, 2]", ["Apple"], ASPECTS)
+
+
+def test_one_call_per_batch_against_the_mock(mock_llm, client, run, tmp_path):
+    mock_llm.reply = "Looks solid"
+    llm = CachedChatCompletion(ResponseCache(str(tmp_path / "cache.sqlite3")), acreate=client.acreate)
+    analyzer = FusedAnalyzer(llm, ASPECTS, fallback)
+    results = run(analyzer.analyze_batch(BATCH))
+    assert results == [
+        "Stock price analysis for Apple: Looks solid",
+        "Risk assessment for Apple: Looks solid",
+        "Stock price analysis for Tesla: Looks solid",
+        "Risk assessment for Tesla: Looks solid",
+    ]
+    assert mock_llm.request_count == 1
+    assert analyzer.counters == {"calls": 1, "companies": 2, "fallbacks": 0}
+
+
+def test_incomplete_companies_fall_back_to_per_aspect_calls():
+    llm = FakeLLM(json.dumps({"Apple": {"price": "Up", "risk": "Low"}}))
+    analyzer = FusedAnalyzer(llm, ASPECTS, fallback)
+    results = asyncio.run(analyzer.analyze_batch(BATCH))
+    assert results[:2] == ["Stock price analysis for Apple: Up", "Risk assessment for Apple: Low"]
+    assert results[2:] == ["per_aspect (fallback) for Tesla"] * 2
+    assert analyzer.counters["fallbacks"] == 1
+
+
+def test_failed_call_reports_every_analysis():
+    analyzer = FusedAnalyzer(FakeLLM(error=RuntimeError("rate limited")), ASPECTS, fallback)
+    results = asyncio.run(analyzer.analyze_batch(BATCH))
+    assert results == [f"per_aspect failed for {company}: rate limited" for company in ("Apple", "Apple", "Tesla", "Tesla")]
+
+
+def test_stream_batches_companies():
+    answer = {company: {"price": "Up", "risk": "Low"} for company in ("A", "B", "C", "D", "E")}
+    llm = FakeLLM(json.dumps(answer))
+    analyzer = FusedAnalyzer(llm, ASPECTS, fallback)
+
+    async def main():
+        snapshots = [(company, {"price": 1.0}) for company in answer]
+        return [result async for result in analyzer.stream(snapshots, companies_per_call=2)]
+
+    results = asyncio.run(main())
+    assert len(results) == 10
+    assert len(llm.calls) == 3
+    assert llm.calls[0]["key_data"][0] == "fused"
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from llm_cache import CachedChatCompletion, ResponseCache, cache_key, quantize
+
+MESSAGES = [{"role": "user", "content": "Summarize AAPL"}]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def content(response):
+    return response["choices"][0]["message"]["content"]
+
+
+def test_cache_key_ignores_transport_params():
+    key = cache_key(model="gpt-4", messages=MESSAGES, temperature=0)
+    assert key == cache_key(model="gpt-4", messages=MESSAGES, temperature=0, stream=True, timeout=5)
+    assert key != cache_key(model="gpt-4", messages=MESSAGES, temperature=1)
+    assert key != cache_key(model="gpt-3.5-turbo", messages=MESSAGES, temperature=0)
+
+
+def test_key_data_replaces_the_messages():
+    other = [{"role": "user", "content": "Summarize AAPL at 189.9842"}]
+    assert cache_key(model="gpt-4", messages=MESSAGES, key_data={"price": 190}) == cache_key(
+        model="gpt-4", messages=other, key_data={"price": 190}
+    )
+
+
+def test_quantize():
+    assert quantize({"price": 189.9842, "volume": [12345678, 0], "name": "AAPL", "up": True}) == {
+        "price": 190.0,
+        "volume": [12300000.0, 0],
+        "name": "AAPL",
+        "up": True,
+    }
+    assert quantize(0.0012345) == 0.00123
+
+
+def test_hit_miss_and_stats(cache):
+    assert cache.get("a") is None
+    cache.set("a", {"value": 1})
+    assert cache.get("a") == {"value": 1}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["writes"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+    assert stats["bytes"] > 0
+
+
+def test_entries_expire(cache):
+    cache.set("a", {"value": 1}, ttl=0.05)
+    cache.set("b", {"value": 2})
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.get("b") == {"value": 2}
+    assert cache.counters["expired"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.max_bytes = 100
+    cache.set("a", {"value": "x" * 30})
+    cache.set("b", {"value": "y" * 30})
+    cache.get("a")  # Now "b" is the least recently used
+    cache.set("c", {"value": "z" * 30})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.total_bytes <= 100
+
+
+def test_cache_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path)
+    cache.set("a", {"value": 1})
+    cache.close()
+    reopened = ResponseCache(path)
+    assert reopened.get("a") == {"value": 1}
+    assert reopened.stats()["bytes"] == cache.total_bytes
+    reopened.close()
+
+
+def test_cached_completion_calls_the_model_once(mock_llm, client, cache):
+    completion = CachedChatCompletion(cache, create=client.create)
+    first = completion.create(model="gpt-4", messages=MESSAGES)
+    second = completion.create(model="gpt-4", messages=MESSAGES)
+    assert content(first) == content(second) == "OK"
+    assert mock_llm.request_count == 1
+
+
+def test_streams_are_recorded_and_replayed(mock_llm, client, cache):
+    mock_llm.reply = "Apple looks strong"
+    completion = CachedChatCompletion(cache, create=client.create)
+    streamed = list(completion.create(model="gpt-4", messages=MESSAGES, stream=True))
+    assert len(streamed) > 1
+    replayed = list(completion.create(model="gpt-4", messages=MESSAGES, stream=True))
+    assert len(replayed) == 1
+    assert replayed[0]["choices"][0]["delta"]["content"] == "Apple looks strong"
+    assert content(completion.create(model="gpt-4", messages=MESSAGES)) == "Apple looks strong"
+    assert mock_llm.request_count == 1
+
+
+def test_async_cached_completion(mock_llm, client, cache, run):
+    completion = CachedChatCompletion(cache, acreate=client.acreate)
+
+    async def main():
+        first = await completion.acreate(model="gpt-4", messages=MESSAGES, key_data={"price": 190})
+        second = await completion.acreate(model="gpt-4", messages=[], key_data={"price": 190})
+        chunks = [chunk async for chunk in await completion.acreate(model="gpt-4", messages=MESSAGES, stream=True)]
+        return first, second, chunks
+
+    first, second, chunks = run(main())
+    assert content(first) == content(second) == "OK"
+    assert chunks
+    assert mock_llm.request_count == 2
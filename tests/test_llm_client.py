@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import deadline
+import llm_client
+from llm_client import LLMClient
+from llm_metrics import MetricsRecorder, TracedChatCompletion
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class Completion:
+    # Adapts an LLMClient to the `completion` interface of TracedChatCompletion
+    def __init__(self, client):
+        self.create = client.create
+        self.acreate = client.acreate
+
+
+def test_create_returns_a_plain_dict(mock_llm, client):
+    mock_llm.reply = "Hello there"
+    response = client.create(model="gpt-4", messages=MESSAGES)
+    assert isinstance(response, dict)
+    assert response["choices"][0]["message"]["content"] == "Hello there"
+    assert response["usage"]["total_tokens"] > 0
+
+
+def test_streamed_chunks_are_dicts(mock_llm, client):
+    mock_llm.reply = "one two"
+    chunks = list(client.create(model="gpt-4", messages=MESSAGES, stream=True))
+    assert all(isinstance(chunk, dict) for chunk in chunks)
+    assert "".join(chunk["choices"][0]["delta"].get("content") or "" for chunk in chunks if chunk["choices"]) == "one two"
+
+
+def test_acreate(mock_llm, client, run):
+    async def main():
+        response = await client.acreate(model="gpt-4", messages=MESSAGES)
+        chunks = [chunk async for chunk in await client.acreate(model="gpt-4", messages=MESSAGES, stream=True)]
+        return response, chunks
+
+    response, chunks = run(main())
+    assert response["choices"][0]["message"]["content"] == "OK"
+    assert chunks
+    assert mock_llm.request_count == 2
+
+
+def test_hooks_see_every_call(mock_llm, client):
+    seen = []
+    client.add_request_hook(lambda params: params.setdefault("temperature", 0))
+    client.add_response_hook(lambda params, response, elapsed: seen.append((params["temperature"], response, elapsed)))
+    client.create(model="gpt-4", messages=MESSAGES)
+    list(client.create(model="gpt-4", messages=MESSAGES, stream=True))
+    assert [temperature for temperature, _, _ in seen] == [0, 0]
+    assert seen[0][1]["choices"][0]["message"]["content"] == "OK"
+    assert seen[1][1] is None  # Streamed: no single response object
+    assert all(elapsed >= 0 for _, _, elapsed in seen)
+
+
+def test_sdk_retries_are_counted_on_the_span(mock_llm):
+    mock_llm.errors = {503: 1.0}
+    client = LLMClient(api_key="mock", base_url=mock_llm.base_url, max_retries=1)
+    recorder = MetricsRecorder()
+    traced = TracedChatCompletion(Completion(client), workflow="test", recorder=recorder)
+    with pytest.raises(Exception):
+        traced.create(model="gpt-4", messages=MESSAGES)
+    client.close()
+    span, = recorder.spans
+    assert span.attempts == 2
+    assert span.retries == 1
+    assert span.error == "InternalServerError"
+
+
+def test_calls_get_the_time_left_before_the_deadline(mock_llm, client):
+    mock_llm.latency = 0.6
+    started = time.monotonic()
+    with deadline.budget(0.1):
+        with pytest.raises(deadline.DeadlineExceeded):
+            client.create(model="gpt-4", messages=MESSAGES)
+    assert time.monotonic() - started < 0.5
+    time.sleep(0.6)  # Let the mock finish the abandoned request before it stops
+
+
+def test_no_call_after_the_deadline(mock_llm, client):
+    with deadline.budget(0):
+        with pytest.raises(deadline.DeadlineExceeded):
+            client.create(model="gpt-4", messages=MESSAGES)
+    assert mock_llm.request_count == 0
+
+
+def test_shared_client(monkeypatch):
+    monkeypatch.setattr(llm_client, "_default_client", None)
+    client = llm_client.get_client()
+    assert llm_client.get_client() is client
+    configured = llm_client.configure(max_connections=4)
+    assert llm_client.get_client() is configured
+    assert configured.max_connections == 4
+
+
+def test_openai_is_imported_on_first_connection():
+    code = "import sys, llm_client; llm_client.LLMClient().create; print('openai' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(llm_client.__file__))
+    assert output.stdout.strip() == "False"
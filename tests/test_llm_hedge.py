@@ -0,0 +1,184 @@
+import asyncio
+import builtins
+import time
+
+import pytest
+
+import llm_metrics
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_hedge import HedgedCompletion, HedgePolicy, LatencyTracker, _aclose
+from llm_metrics import ANSWERED_BY, MetricsRecorder, TracedChatCompletion
+
+MESSAGES = [{"role": "user", "content": "How is AAPL doing?"}]
+TIERS = {"analyze": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"]}
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class Models:
+    def __init__(self, delays=None, failing=()):
+        """
+        Fake completion functions: each model answers "from <model>" after its delay,
+        or fails with a 503. Every call counts as one HTTP attempt.
+        """
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.calls = []
+
+    def _send(self, model):
+        self.calls.append(model)
+        llm_metrics.count_attempt()
+        return self.delays.get(model, 0)
+
+    def _answer(self, model, stream):
+        if model in self.failing:
+            raise StatusError(503)
+        if stream:
+            return [{"choices": [{"index": 0, "delta": {"content": word}}]} for word in ("from ", model)]
+        return {"model": model, "choices": [{"index": 0, "message": {"role": "assistant", "content": f"from {model}"}}]}
+
+    def create(self, model, messages, stream=False, **params):
+        time.sleep(self._send(model))
+        answer = self._answer(model, stream)
+        return iter(answer) if stream else answer
+
+    async def acreate(self, model, messages, stream=False, **params):
+        await asyncio.sleep(self._send(model))
+        answer = self._answer(model, stream)
+        return _aiter(answer) if stream else answer
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def text(response):
+    return response["choices"][0]["message"]["content"]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def stack(models, cache, **policy):
+    """
+    Traced -> cached -> hedged completion over `models`, recording into its own recorder.
+    """
+    hedger = HedgedCompletion(HedgePolicy(TIERS, **policy), create=models.create, acreate=models.acreate)
+    recorder = MetricsRecorder()
+    return hedger, recorder, TracedChatCompletion(
+        CachedChatCompletion(cache, create=hedger.create, acreate=hedger.acreate), "test", recorder
+    )
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(window=10)
+    assert tracker.percentile(("gpt-4", False), 95) is None
+    for seconds in range(20):
+        tracker.observe(("gpt-4", False), seconds)
+    assert tracker.percentile(("gpt-4", False), 50) == 15  # only the last 10 are kept
+    assert tracker.percentile(("gpt-4", False), 95, min_samples=11) is None
+
+
+def test_requested_model_answers_are_cached(cache):
+    models = Models()
+    _, recorder, llm = stack(models, cache)
+    with llm_metrics.step("analyze"):
+        assert text(llm.create(model="gpt-4", messages=MESSAGES)) == "from gpt-4"
+        assert text(llm.create(model="gpt-4", messages=MESSAGES)) == "from gpt-4"
+    assert models.calls == ["gpt-4"]
+    assert [span.cache_hit for span in recorder.spans] == [False, True]
+
+
+def test_fallback_answers_are_not_cached_and_are_attributed(cache):
+    models = Models(failing={"gpt-4"})
+    hedger, recorder, llm = stack(models, cache)
+    with llm_metrics.step("analyze"):
+        response = llm.create(model="gpt-4", messages=MESSAGES)
+        assert response[ANSWERED_BY] == "gpt-4-turbo"
+        llm.create(model="gpt-4", messages=MESSAGES)
+    assert text(response) == "from gpt-4-turbo"
+    assert models.calls == ["gpt-4", "gpt-4-turbo"] * 2
+    assert hedger.counters["fallbacks"] == 2
+    span = recorder.spans[0]
+    assert (span.request_model, span.model, span.error) == ("gpt-4", "gpt-4-turbo", None)
+    # A fallback isn't a retry of the same model
+    assert span.attempts_by_model == {"gpt-4": 1, "gpt-4-turbo": 1}
+    assert span.retries == 0
+    attributes = {a["key"]: a["value"] for a in span.to_otlp()["attributes"]}
+    assert attributes["gen_ai.request.model"] == {"stringValue": "gpt-4"}
+    assert attributes["gen_ai.response.model"] == {"stringValue": "gpt-4-turbo"}
+
+
+def test_hedge_wins_async_and_is_not_cached(cache):
+    models = Models(delays={"gpt-4": 0.5, "gpt-4-turbo": 0.0})
+    hedger, recorder, llm = stack(models, cache, min_samples=1, budget=1.0)
+    hedger.tracker.observe(("gpt-4", False), 0.05)
+
+    async def main():
+        with llm_metrics.step("analyze"):
+            return await llm.acreate(model="gpt-4", messages=MESSAGES)
+
+    started = time.perf_counter()
+    response = asyncio.run(main())
+    assert time.perf_counter() - started < 0.4
+    assert text(response) == "from gpt-4-turbo"
+    assert hedger.counters["hedge_wins"] == 1
+    assert cache.stats()["bytes"] == 0
+    span = recorder.spans[0]
+    assert span.model == "gpt-4-turbo"
+    assert span.attempts_by_model == {"gpt-4": 1, "gpt-4-turbo": 1}
+
+
+def test_streamed_fallback_is_marked_and_not_cached(cache):
+    models = Models(failing={"gpt-4", "gpt-4-turbo"})
+    _, recorder, llm = stack(models, cache)
+
+    async def main():
+        with llm_metrics.step("analyze"):
+            stream = await llm.acreate(model="gpt-4", messages=MESSAGES, stream=True)
+            return [chunk async for chunk in stream]
+
+    chunks = asyncio.run(main())
+    assert "".join(chunk["choices"][0]["delta"]["content"] for chunk in chunks) == "from gpt-3.5-turbo"
+    assert all(chunk[ANSWERED_BY] == "gpt-3.5-turbo" for chunk in chunks)
+    assert cache.stats()["bytes"] == 0
+    assert recorder.spans[0].model == "gpt-3.5-turbo"
+
+
+def test_dropped_streams_are_started_and_closed(monkeypatch):
+    monkeypatch.delattr(builtins, "anext")  # Python 3.10+; the README promises 3.9
+    events = []
+
+    async def stream(words):
+        try:
+            for word in words:
+                events.append(f"sent {word}")
+                yield word
+        finally:
+            events.append("closed")
+
+    async def main():
+        await _aclose(stream(["from", "gpt-4"]))
+        await _aclose(stream([]))
+        await _aclose({"choices": []})
+
+    asyncio.run(main())
+    assert events == ["sent from", "closed", "closed"]
+
+
+def test_calls_outside_hedged_steps_pass_through(cache):
+    models = Models(failing={"gpt-4"})
+    hedger, _, llm = stack(models, cache)
+    with pytest.raises(StatusError):
+        llm.create(model="gpt-4", messages=MESSAGES)
+    assert models.calls == ["gpt-4"]
+    assert hedger.counters["calls"] == 0
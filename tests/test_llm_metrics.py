@@ -0,0 +1,121 @@
+import pytest
+
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_metrics import CallSpan, MetricsRecorder, TracedChatCompletion, current_step, step
+
+MESSAGES = [{"role": "user", "content": "x" * 400}]
+
+
+class Completion:
+    def __init__(self, client):
+        self.create = client.create
+        self.acreate = client.acreate
+
+
+@pytest.fixture
+def recorder():
+    return MetricsRecorder()
+
+
+@pytest.fixture
+def traced(client, recorder):
+    return TracedChatCompletion(Completion(client), workflow="test", recorder=recorder)
+
+
+def test_steps_nest_and_decorate():
+    @step("inner")
+    def inner():
+        return current_step()
+
+    assert current_step() is None
+    with step("outer"):
+        assert current_step() == "outer"
+        assert inner() == "inner"
+    assert current_step() is None
+
+
+def test_span_cost_and_estimated_tokens():
+    span = CallSpan("test", "gpt-4")
+    span.finish({"messages": MESSAGES}, text="y" * 40)
+    assert (span.prompt_tokens, span.completion_tokens) == (100, 10)
+    assert span.tokens_estimated
+    assert span.cost == pytest.approx((100 * 30 + 10 * 60) / 1e6)
+    span.cache_hit = True
+    assert span.cost == 0.0
+
+
+def test_calls_are_recorded_with_their_step(mock_llm, traced, recorder):
+    with step("analyze"):
+        with step("fetch"):
+            traced.create(model="gpt-4", messages=MESSAGES)
+    span, = recorder.spans
+    assert span.step == "analyze/fetch"
+    assert span.workflow == "test"
+    assert span.attempts == 1
+    assert span.prompt_tokens > 0 and not span.tokens_estimated
+    assert span.latency > 0
+
+
+def test_streams_record_time_to_first_token(mock_llm, traced, recorder):
+    mock_llm.reply = "one two three"
+    chunks = traced.create(model="gpt-4", messages=MESSAGES, stream=True)
+    assert not recorder.spans  # Open until the stream is consumed
+    list(chunks)
+    span, = recorder.spans
+    assert 0 < span.ttft <= span.latency
+    assert span.completion_tokens > 0
+
+
+def test_failed_calls_are_recorded(mock_llm, traced, recorder):
+    mock_llm.errors = {400: 1.0}
+    with pytest.raises(Exception):
+        traced.create(model="gpt-4", messages=MESSAGES)
+    assert recorder.spans[0].error == "BadRequestError"
+
+
+def test_async_calls_are_recorded(mock_llm, traced, recorder, run):
+    async def main():
+        with step("async"):
+            await traced.acreate(model="gpt-4", messages=MESSAGES)
+
+    run(main())
+    assert recorder.spans[0].step == "async"
+
+
+def test_cache_hits_cost_nothing(mock_llm, client, recorder, tmp_path):
+    cached = CachedChatCompletion(ResponseCache(str(tmp_path / "cache.sqlite3")), create=client.create)
+    traced = TracedChatCompletion(cached, workflow="test", recorder=recorder)
+    traced.create(model="gpt-4", messages=MESSAGES)
+    traced.create(model="gpt-4", messages=MESSAGES)
+    miss, hit = recorder.spans
+    assert not miss.cache_hit and miss.cost > 0
+    assert hit.cache_hit and hit.cost == 0.0
+
+
+def test_prometheus_exposition(mock_llm, traced, recorder):
+    with step("analyze"):
+        traced.create(model="gpt-4", messages=MESSAGES)
+    recorder.record_node("test", "fetch", 0.2)
+    text = recorder.prometheus()
+    assert 'llm_calls_total{workflow="test",step="analyze",model="gpt-4"} 1' in text
+    assert 'llm_call_latency_seconds_bucket{workflow="test",step="analyze",model="gpt-4",le="+Inf"} 1' in text
+    assert 'workflow_node_duration_seconds_count{workflow="test",node="fetch",status="ok"} 1' in text
+    assert "# TYPE llm_retries_total counter" in text
+
+
+def test_reports_since_a_mark(mock_llm, traced, recorder):
+    with step("first"):
+        traced.create(model="gpt-4", messages=MESSAGES)
+    mark = recorder.mark()
+    with step("second"):
+        traced.create(model="gpt-4", messages=MESSAGES)
+    assert [span.step for span in recorder.since(mark)] == ["second"]
+    spans = recorder.otlp(since=mark)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [span["name"] for span in spans] == ["chat gpt-4"]
+    assert recorder.folded(since=mark).startswith("test;second ")
+    breakdown = recorder.breakdown(since=mark)
+    assert "second" in breakdown and "first" not in breakdown
+
+
+def test_empty_breakdown(recorder):
+    assert recorder.breakdown() == "No LLM calls recorded."
@@ -0,0 +1,155 @@
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+
+import deadline
+from llm_scheduler import LLMScheduler, ModelLimits, SharedTokenBucket, TokenBucket, estimate_tokens, is_retryable
+
+
+# Limits high enough that only the behaviour under test slows calls down
+LIFTED = {"gpt-4": ModelLimits(max_concurrency=64, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)}
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def failing(statuses, reply=None):
+    """
+    Fake `create` raising StatusError for each status in turn, then answering.
+    """
+    statuses = list(statuses)
+    calls = []
+
+    async def create(**params):
+        calls.append(params)
+        if statuses:
+            raise StatusError(statuses.pop(0))
+        return reply or {"choices": [{"message": {"content": "OK"}}], "usage": {"total_tokens": 10}}
+
+    create.calls = calls
+    return create
+
+
+def test_is_retryable():
+    assert is_retryable(StatusError(429))
+    assert is_retryable(StatusError(503))
+    assert not is_retryable(StatusError(400))
+    assert is_retryable(ConnectionResetError())
+    assert not is_retryable(ValueError())
+    assert not is_retryable(deadline.DeadlineExceeded())
+
+
+def test_estimate_tokens():
+    messages = [{"role": "user", "content": "x" * 400}]
+    assert estimate_tokens(messages, max_tokens=100) == 100 + 4 + 100
+    assert estimate_tokens(messages) == 100 + 4 + 512
+
+
+def test_retries_transient_errors():
+    create = failing([429, 503])
+    scheduler = LLMScheduler(create, limits=LIFTED, base_delay=0.01)
+    response = asyncio.run(scheduler.chat("gpt-4", [{"role": "user", "content": "hi"}]))
+    assert response["choices"][0]["message"]["content"] == "OK"
+    assert len(create.calls) == 3
+    assert scheduler.stats()["gpt-4"] == {"requests": 3, "retries": 2, "failures": 0}
+
+
+def test_does_not_retry_client_errors():
+    create = failing([400])
+    scheduler = LLMScheduler(create, limits=LIFTED, base_delay=0.01)
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler.chat("gpt-4", [{"role": "user", "content": "hi"}]))
+    assert len(create.calls) == 1
+    assert scheduler.stats()["gpt-4"]["failures"] == 1
+
+
+def test_gives_up_after_max_retries():
+    create = failing([429] * 10)
+    scheduler = LLMScheduler(create, limits=LIFTED, max_retries=2, base_delay=0.01)
+    with pytest.raises(StatusError):
+        asyncio.run(scheduler.chat("gpt-4", [{"role": "user", "content": "hi"}]))
+    assert len(create.calls) == 3
+
+
+def test_no_backoff_past_the_deadline():
+    create = failing([429])
+    scheduler = LLMScheduler(create, limits=LIFTED)
+    scheduler.backoff_delay = lambda attempt, exc=None: 10
+
+    async def main():
+        with deadline.budget(1):
+            return await scheduler.chat("gpt-4", [{"role": "user", "content": "hi"}])
+
+    started = time.monotonic()
+    with pytest.raises(StatusError):
+        asyncio.run(main())
+    assert time.monotonic() - started < 1
+    assert len(create.calls) == 1
+
+
+def test_caps_concurrency_per_model():
+    running = []
+    peak = [0]
+
+    async def create(**params):
+        running.append(params)
+        peak[0] = max(peak[0], len(running))
+        await asyncio.sleep(0.01)
+        running.remove(params)
+        return {}
+
+    limits = {"gpt-4": ModelLimits(max_concurrency=3, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)}
+    scheduler = LLMScheduler(create, limits=limits)
+
+    async def main():
+        messages = [{"role": "user", "content": "hi"}]
+        await asyncio.gather(*(scheduler.chat("gpt-4", messages) for _ in range(12)))
+
+    asyncio.run(main())
+    assert peak[0] == 3
+
+
+def test_retries_server_errors(mock_llm, client, run):
+    mock_llm.errors = {503: 0.5}
+    scheduler = LLMScheduler(client.acreate, limits=LIFTED, max_retries=10, base_delay=0.01)
+
+    async def main():
+        messages = [{"role": "user", "content": "hi"}]
+        return await asyncio.gather(*(scheduler.chat("gpt-4", messages) for _ in range(8)))
+
+    responses = run(main())
+    assert [r["choices"][0]["message"]["content"] for r in responses] == ["OK"] * 8
+    assert mock_llm.status_counts[503] > 0
+    assert scheduler.stats()["gpt-4"]["retries"] == mock_llm.status_counts[503]
+
+
+def test_token_bucket_spreads_requests():
+    bucket = TokenBucket(per_minute=6000)  # 100 per second, bursts of 100
+
+    async def main():
+        started = time.monotonic()
+        await bucket.acquire(100)
+        await bucket.acquire(20)
+        return time.monotonic() - started
+
+    assert 0.15 <= asyncio.run(main()) < 1
+
+
+def _take_one(bucket):
+    asyncio.run(bucket.acquire(1))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_shared_token_bucket_is_shared_between_processes():
+    context = multiprocessing.get_context("fork")
+    bucket = SharedTokenBucket(per_minute=60, context=context)  # One token, refilled every second
+    worker = context.Process(target=_take_one, args=(bucket,))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    assert bucket._take(1) > 0  # The worker took the only token
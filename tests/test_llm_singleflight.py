@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_metrics import MetricsRecorder, TracedChatCompletion
+from llm_singleflight import SingleFlight
+
+MESSAGES = [{"role": "user", "content": "How do I reset my password?"}]
+
+
+class Upstream:
+    def __init__(self, delay=0.05, words=("Open", " settings"), error=None):
+        """
+        Fake completion functions, answering after `delay` seconds (per chunk when
+        streaming) or failing with `error`; records every call and whether it was stopped.
+        """
+        self.delay = delay
+        self.words = words
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.closed = 0
+
+    def _response(self, params):
+        if self.error is not None:
+            raise self.error
+        return {"model": params["model"], "choices": [{"index": 0, "message": {"content": "".join(self.words)}}]}
+
+    def _chunk(self, word):
+        return {"choices": [{"index": 0, "delta": {"content": word}}]}
+
+    def create(self, **params):
+        self.calls += 1
+        if params.get("stream"):
+            return self._chunks()
+        time.sleep(self.delay)
+        return self._response(params)
+
+    def _chunks(self):
+        try:
+            for word in self.words:
+                time.sleep(self.delay)
+                yield self._chunk(word)
+        except GeneratorExit:
+            self.closed += 1
+            raise
+
+    async def acreate(self, **params):
+        self.calls += 1
+        if params.get("stream"):
+            return self._achunks()
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self._response(params)
+
+    async def _achunks(self):
+        try:
+            for word in self.words:
+                await asyncio.sleep(self.delay)
+                yield self._chunk(word)
+        except (GeneratorExit, asyncio.CancelledError):
+            self.closed += 1
+            raise
+
+
+def content(response):
+    return response["choices"][0]["message"]["content"]
+
+
+def test_identical_async_requests_share_one_call():
+    upstream = Upstream()
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def main():
+        return await asyncio.gather(*(flights.acreate(model="gpt-4", messages=MESSAGES) for _ in range(5)),
+                                    flights.acreate(model="gpt-4", messages=MESSAGES, temperature=1))
+
+    responses = asyncio.run(main())
+    assert upstream.calls == 2
+    assert flights.counters == {"calls": 2, "coalesced": 4, "dropped": 0, "cancelled": 0}
+    assert all(content(response) == "Open settings" for response in responses)
+    # Every caller gets its own copy
+    responses[1]["choices"][0]["message"]["content"] = "changed"
+    assert content(responses[0]) == "Open settings"
+    assert "4 requests coalesced (67% saved)" in flights.summary()
+
+
+def test_finished_calls_are_not_reused():
+    upstream = Upstream(delay=0)
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def main():
+        await flights.acreate(model="gpt-4", messages=MESSAGES)
+        await flights.acreate(model="gpt-4", messages=MESSAGES)
+
+    asyncio.run(main())
+    assert upstream.calls == 2
+    flights.enabled = False
+    asyncio.run(main())
+    assert flights.counters["calls"] == 2
+
+
+def test_errors_reach_every_caller():
+    upstream = Upstream(error=RuntimeError("upstream failed"))
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def main():
+        return await asyncio.gather(*(flights.acreate(model="gpt-4", messages=MESSAGES) for _ in range(3)),
+                                    return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert upstream.calls == 1
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+
+def test_a_cancelled_caller_leaves_the_call_to_the_others():
+    upstream = Upstream(delay=0.1)
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def main():
+        first = asyncio.ensure_future(flights.acreate(model="gpt-4", messages=MESSAGES))
+        second = asyncio.ensure_future(flights.acreate(model="gpt-4", messages=MESSAGES))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        return await second
+
+    assert content(asyncio.run(main())) == "Open settings"
+    assert upstream.cancelled == 0
+    assert flights.counters["dropped"] == 1
+
+
+def test_the_call_is_cancelled_when_every_caller_left():
+    upstream = Upstream(delay=0.5)
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def main():
+        calls = [asyncio.ensure_future(flights.acreate(model="gpt-4", messages=MESSAGES)) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert upstream.cancelled == 1
+    assert flights.counters["cancelled"] == 1
+
+
+def test_async_streams_fan_out_to_late_joiners():
+    upstream = Upstream(delay=0.03, words=("one", " two", " three"))
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def read(start_after):
+        await asyncio.sleep(start_after)
+        stream = await flights.acreate(model="gpt-4", messages=MESSAGES, stream=True)
+        return "".join([chunk["choices"][0]["delta"]["content"] async for chunk in stream])
+
+    async def main():
+        return await asyncio.gather(read(0), read(0.05))
+
+    assert asyncio.run(main()) == ["one two three", "one two three"]
+    assert upstream.calls == 1
+    assert flights.counters["coalesced"] == 1
+
+
+def test_sync_requests_share_one_call_across_threads():
+    upstream = Upstream(delay=0.1)
+    flights = SingleFlight(create=upstream.create)
+    recorder = MetricsRecorder()
+    llm = TracedChatCompletion(flights, "test", recorder)
+    results = []
+
+    def ask():
+        results.append(content(llm.create(model="gpt-4", messages=MESSAGES)))
+
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["Open settings"] * 4
+    assert upstream.calls == 1
+    # Coalesced calls are marked and cost nothing
+    assert sorted(span.coalesced for span in recorder.spans) == [False, True, True, True]
+
+
+def test_a_sync_stream_abandoned_by_every_caller_is_closed():
+    upstream = Upstream(delay=0.05, words=("one", " two", " three", " four"))
+    flights = SingleFlight(create=upstream.create)
+    stream = flights.create(model="gpt-4", messages=MESSAGES, stream=True)
+    assert next(stream)["choices"][0]["delta"]["content"] == "one"
+    stream.close()
+    deadline = time.monotonic() + 1
+    while not upstream.closed:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert flights.counters["cancelled"] == 1
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_streamed_and_plain_requests_are_separate_flights(stream):
+    upstream = Upstream(delay=0.05)
+    flights = SingleFlight(acreate=upstream.acreate)
+
+    async def ask(stream):
+        response = await flights.acreate(model="gpt-4", messages=MESSAGES, stream=stream)
+        if stream:
+            return [chunk async for chunk in response]
+        return response
+
+    async def main():
+        await asyncio.gather(ask(stream), ask(not stream))
+
+    asyncio.run(main())
+    assert upstream.calls == 2
@@ -0,0 +1,84 @@
+import io
+
+from llm_stream import AsyncTokenStream, TokenStream, chunk_text, format_timings, print_stream, static_stream
+
+
+def chunks(*texts):
+    return [{"choices": [{"delta": {"content": text}}]} for text in texts]
+
+
+def test_chunk_text():
+    assert chunk_text({"choices": [{"delta": {"content": "Hi"}}]}) == "Hi"
+    assert chunk_text({"choices": [{"delta": {"role": "assistant"}}]}) == ""
+    assert chunk_text({"choices": []}) == ""
+
+
+def test_stream_yields_text_and_records_timings():
+    stream = TokenStream(iter(chunks("", "Hello", " world")), step="answer")
+    assert list(stream) == ["Hello", " world"]
+    assert stream.text == "Hello world"
+    assert stream.done
+    assert 0 <= stream.ttft <= stream.elapsed
+    assert format_timings([stream, "plain text"]).startswith("Timings - answer: first token ")
+
+
+def test_read_returns_the_rest_of_the_stream():
+    stream = TokenStream(iter(chunks("a", "b", "c")))
+    assert next(iter(stream)) == "a"
+    assert stream.read() == "abc"
+
+
+def test_streams_from_the_mock_server(mock_llm, client):
+    mock_llm.reply = "one two three"
+    stream = TokenStream(client.create(model="gpt-4", messages=[{"role": "user", "content": "hi"}], stream=True))
+    assert len(list(stream)) == 3
+    assert stream.text == "one two three"
+
+
+def test_close_stops_the_stream(mock_llm, client):
+    mock_llm.reply = "one two three"
+    stream = TokenStream(client.create(model="gpt-4", messages=[{"role": "user", "content": "hi"}], stream=True))
+    pieces = iter(stream)
+    assert next(pieces) == "one"
+    stream.close()
+    assert list(pieces) == []
+    assert stream.text == "one"
+
+
+def test_print_stream():
+    out = io.StringIO()
+    assert print_stream(static_stream("Fixed answer"), file=out) == "Fixed answer"
+    assert print_stream("plain", file=out) == "plain"
+    assert out.getvalue() == "Fixed answer\nplain\n"
+
+
+def test_format_timings_skips_unfinished_streams():
+    assert format_timings([TokenStream(iter(chunks("a")))]) == ""
+
+
+def test_async_stream_aclose_stops_the_stream(mock_llm, client, run):
+    mock_llm.reply = "one two three"
+
+    async def main():
+        response = await client.acreate(model="gpt-4", messages=[{"role": "user", "content": "hi"}], stream=True)
+        stream = AsyncTokenStream(response, step="answer")
+        pieces = stream.__aiter__()
+        first = await pieces.__anext__()
+        await stream.aclose()
+        rest = [text async for text in pieces]
+        return first, rest, stream
+
+    first, rest, stream = run(main())
+    assert first == "one"
+    assert rest == []
+    assert stream.text == "one"
+
+
+def test_async_stream_read(mock_llm, client, run):
+    mock_llm.reply = "one two three"
+
+    async def main():
+        response = await client.acreate(model="gpt-4", messages=[{"role": "user", "content": "hi"}], stream=True)
+        return await AsyncTokenStream(response).read()
+
+    assert run(main()) == "one two three"
@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+import deadline
+from market_data import FakeMarketDataProvider, MarketDataProvider, build_snapshot, get_stock_data, stream_stock_data
+
+COMPANIES = {f"Company {i}": f"T{i}" for i in range(10)}
+
+
+class MissingPrices(FakeMarketDataProvider):
+    def fetch_prices(self, tickers):
+        prices = super().fetch_prices(tickers)
+        prices.pop("T3", None)
+        return prices
+
+
+class FailingInfo(FakeMarketDataProvider):
+    def fetch_info(self, ticker):
+        if ticker == "T2":
+            raise ConnectionError("connection reset")
+        return super().fetch_info(ticker)
+
+
+class FailingPrices(FakeMarketDataProvider):
+    def fetch_prices(self, tickers):
+        if "T0" in tickers:
+            raise ConnectionError("rate limited")
+        return super().fetch_prices(tickers)
+
+
+class SlowInfo(FakeMarketDataProvider):
+    def fetch_info(self, ticker):
+        if ticker == "T0":
+            time.sleep(2)
+        return super().fetch_info(ticker)
+
+
+def test_build_snapshot():
+    snapshot = build_snapshot(123.456, {"totalRevenue": 1e9, "beta": 1.234})
+    assert snapshot == {"Stock Price": 123.46, "Revenue": 1e9, "Market Sentiment": "Neutral", "Risk Score": 1.23}
+    assert build_snapshot(10, {})["Revenue"] == "N/A"
+    assert build_snapshot(10, {})["Risk Score"] == 1.0
+
+
+def test_prices_are_fetched_in_batches():
+    provider = FakeMarketDataProvider(price_latency=0, info_latency=0)
+
+    async def collect():
+        return {company: data async for company, data in stream_stock_data(provider, COMPANIES, batch_size=4)}
+
+    data = asyncio.run(collect())
+    assert set(data) == set(COMPANIES)
+    assert provider.price_calls == 3
+    assert provider.info_calls == len(COMPANIES)
+
+
+def test_snapshots_are_deterministic():
+    first = get_stock_data(FakeMarketDataProvider(price_latency=0, info_latency=0), COMPANIES)
+    second = get_stock_data(FakeMarketDataProvider(price_latency=0, info_latency=0), COMPANIES)
+    assert first == second
+
+
+def test_tickers_without_a_price_are_left_out():
+    data = get_stock_data(MissingPrices(price_latency=0, info_latency=0), COMPANIES)
+    assert "Company 3" not in data
+    assert len(data) == len(COMPANIES) - 1
+
+
+def test_failing_tickers_are_logged_and_left_out(caplog):
+    data = get_stock_data(FailingInfo(price_latency=0, info_latency=0), COMPANIES)
+    assert "Company 2" not in data
+    assert len(data) == len(COMPANIES) - 1
+    assert "could not fetch market data for T2: connection reset" in caplog.text
+    # A failed price batch only loses its own tickers
+    provider = FailingPrices(price_latency=0, info_latency=0)
+
+    async def collect():
+        return {company: data async for company, data in stream_stock_data(provider, COMPANIES, batch_size=4)}
+
+    assert sorted(asyncio.run(collect())) == sorted(f"Company {i}" for i in range(4, 10))
+
+
+def test_deadline_leaves_out_slow_tickers():
+    provider = SlowInfo(price_latency=0, info_latency=0)
+
+    async def collect():
+        with deadline.budget(0.5):
+            return {company: data async for company, data in stream_stock_data(provider, COMPANIES, max_workers=10)}
+
+    data = asyncio.run(collect())
+    assert "Company 0" not in data
+    assert len(data) == len(COMPANIES) - 1
+
+
+def test_provider_interface():
+    provider = MarketDataProvider()
+    with pytest.raises(NotImplementedError):
+        provider.fetch_prices(["T0"])
+    with pytest.raises(NotImplementedError):
+        provider.fetch_info("T0")
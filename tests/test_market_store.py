@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import math
+
+import numpy as np
+import pytest
+
+import market_store
+from llm_scheduler import ModelLimits
+from market_data import FakeMarketDataProvider
+from market_store import Features, MarketStore, compute_features, record_stream, snapshot_values
+
+PRICES = [100.0, 102.0, 99.0, 105.0]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MarketStore(str(tmp_path / "store"))
+    for i, price in enumerate(PRICES):
+        store.append({"AAPL": {"price": price, "revenue": 90e9 + i * 1e9, "beta": 1.2, "sentiment": 0.5},
+                      "TSLA": {"price": 200.0}}, timestamp=i)
+    return store
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def test_snapshots_are_stored_as_columns(store, tmp_path):
+    assert store.tickers == ["AAPL", "TSLA"]
+    assert store.snapshots == 4
+    assert store.columns["price"][:, 0].tolist() == PRICES
+    assert np.isnan(store.columns["revenue"][:, 1]).all()
+    # A new ticker gets a NaN history
+    store.append({"MSFT": {"price": 300.0}}, timestamp=4)
+    assert np.isnan(store.columns["price"][:4, 2]).all()
+    reopened = MarketStore(str(tmp_path / "store"))
+    assert reopened.tickers == ["AAPL", "TSLA", "MSFT"]
+    assert reopened.times.tolist() == [0, 1, 2, 3, 4]
+    assert np.isnan(reopened.columns["price"][-1, 1]) and reopened.columns["price"][-1, 2] == 300.0
+
+
+def test_extend_checks_the_shape(store):
+    with pytest.raises(ValueError):
+        store.extend([10], {"price": np.zeros((1, 3))})
+
+
+def test_features(store):
+    features = store.features(window=3)
+    aapl = features.row("AAPL")
+    assert aapl["price"] == 105.0
+    assert aapl["return"] == pytest.approx(105 / 99 - 1)
+    assert aapl["window_return"] == pytest.approx(105 / 102 - 1)
+    log_returns = [math.log(99 / 102), math.log(105 / 99)]
+    assert aapl["volatility"] == pytest.approx(np.std(log_returns))
+    assert aapl["revenue_change"] == pytest.approx(93 / 91 - 1)
+    assert aapl["beta_change"] == 0.0
+    # A flat price: no trend and no volatility
+    assert features.get("TSLA", "trend") == 0.0
+    assert features.get("TSLA", "volatility_band") == 0.0
+    assert features.get("TSLA", "revenue") is None
+    assert features.row("NVDA") == dict.fromkeys(features.columns)
+    assert dict(features.rows())["AAPL"] == aapl
+
+
+def test_trend_and_volatility_buckets():
+    price = np.array([[100.0, 100.0, 100.0, np.nan], [100.5, 110.0, 90.0, np.nan], [100.2, 111.0, 91.0, np.nan]])
+    features = compute_features({"price": price, "revenue": price, "beta": price, "sentiment": price})
+    assert features["trend"][:3].tolist() == [0.0, 1.0, -1.0]
+    assert features["volatility_band"][:3].tolist() == [0.0, 2.0, 2.0]
+    assert np.isnan(features["trend"][3]) and np.isnan(features["volatility_band"][3])
+    bands = compute_features({"price": np.array([[100.0], [100.0 * math.exp(0.02)], [100.0]]),
+                              "revenue": np.ones((3, 1)), "beta": np.ones((3, 1)), "sentiment": np.ones((3, 1))})
+    assert bands["volatility_band"].tolist() == [1.0]
+
+
+def test_record_stream_passes_snapshots_on_and_records_them(store):
+    snapshot = {"Stock Price": 110.0, "Revenue": "N/A", "Risk Score": 1.3, "Market Sentiment": "Neutral"}
+
+    async def collect():
+        return [pair async for pair in record_stream(store, _aiter([("Apple", snapshot)]), {"Apple": "AAPL"})]
+
+    assert asyncio.run(collect()) == [("Apple", snapshot)]
+    assert store.snapshots == 5
+    assert store.columns["price"][-1, 0] == 110.0
+    assert np.isnan(store.columns["revenue"][-1, 0])
+    assert np.isnan(store.columns["price"][-1, 1])  # Not fetched this time
+    assert snapshot_values(snapshot) == {"price": 110.0, "revenue": None, "beta": 1.3, "sentiment": 0.0}
+
+
+def test_change_and_delta():
+    assert market_store.change(110.0, 100.0) == pytest.approx(0.1)
+    assert market_store.change(110.0, None) is None
+    assert market_store.delta(1.2, 1.2000000476837158) == 0.0
+    assert market_store.delta(None, 1.0) is None
+
+
+def test_live_prompts_read_the_feature_table_and_keys_use_buckets(scripts, monkeypatch):
+    live = scripts.load("market-live")
+    tickers = ["AAPL"]
+    data = {"Stock Price": 105.0, "Revenue": 93e9, "Risk Score": 1.25, "Market Sentiment": "Neutral"}
+
+    def features(window_return, volatility):
+        return Features(tickers, {
+            "price": np.array([100.0]), "revenue": np.array([90e9]), "beta": np.array([1.2]),
+            "window_return": np.array([window_return]), "volatility": np.array([volatility]),
+            "trend": np.array([1.0]), "volatility_band": np.array([1.0]),
+        })
+
+    monkeypatch.setattr(live, "company_tickers", {"Apple": "AAPL"})
+    monkeypatch.setattr(live, "market_features", features(0.031, 0.012))
+    prompt = live.stock_price_prompt("Apple", data)
+    assert "Change Since Last Snapshot: +5.00%" in prompt
+    assert "Trend Over Recent Snapshots: +3.10%" in prompt
+    assert "Volatility (std. of snapshot log returns): 1.20%" in prompt
+    assert "Beta Change Since Last Snapshot: +0.05" in live.risk_prompt("Apple", data)
+    assert "Revenue Change Since Last Snapshot: +3.33%" in live.financials_prompt("Apple", data)
+
+    requests = scripts.server.request_count
+    scripts.run(live.analyze_stock_price("Apple", data))
+    # The next fetch moved the trend and volatility, but not out of their buckets
+    monkeypatch.setattr(live, "market_features", features(0.034, 0.013))
+    scripts.run(live.analyze_stock_price("Apple", data))
+    assert scripts.server.request_count == requests + 1
+
+
+def test_feature_subset(store):
+    features = store.features(window=3)
+    subset = features.subset(["TSLA", "NVDA", "AAPL"])
+    assert subset.tickers == ["TSLA", "AAPL"]
+    assert subset.row("AAPL") == features.row("AAPL")
+    assert subset.get("NVDA", "trend") is None
+
+
+def test_sharded_runs_write_the_same_prompts_and_keys(scripts, monkeypatch, tmp_path):
+    live = scripts.load("market-live")
+    store = MarketStore(str(tmp_path / "store"))
+    monkeypatch.setattr(live, "get_market_store", lambda: store)
+    monkeypatch.setattr(live, "market_data_provider", FakeMarketDataProvider(price_latency=0, info_latency=0))
+    # Lifted limits, in this process and the workers; the scheduler's semaphores are
+    # bound to the event loop that first waits on them
+    limits = {model: ModelLimits(64, 10 ** 6, 10 ** 9) for model in live.scheduler.limits}
+    monkeypatch.setattr(live.scheduler, "limits", limits)
+    monkeypatch.setattr(live.scheduler, "_models", {})
+    monkeypatch.setattr(live, "ShardedRunner", functools.partial(live.ShardedRunner, limits=limits))
+    # Enough unchanged snapshots that another fetch doesn't change the features
+    for _ in range(3):
+        live.get_stock_data()
+    prompts = []
+    completion_body = scripts.server.completion_body
+
+    def record(request):
+        prompts.append(request["messages"][0]["content"])
+        return completion_body(request)
+
+    monkeypatch.setattr(scripts.server, "completion_body", record)
+
+    sharded = list(live.sharded_market_analysis(processes=2, shard_size=2))
+    sharded_prompts = sorted(prompts)
+    prompts.clear()
+    live.llm.completion.cache.clear()
+    fanout = scripts.run(live.parallel_market_analysis())
+    assert sorted(fanout) == sorted(sharded)
+    assert sorted(prompts) == sharded_prompts
+    assert len(sharded_prompts) == len(live.company_tickers) * len(live.MARKET_ASPECTS)
+    assert not any("n/a" in prompt for prompt in sharded_prompts)
+    # Keyed the same way: a sharded run finds every analysis of the fan-out run in the cache
+    requests = scripts.server.request_count
+    list(live.sharded_market_analysis(processes=2, shard_size=2))
+    assert scripts.server.request_count == requests
+
+
+def test_live_prompts_without_history(scripts, monkeypatch):
+    live = scripts.load("market-live")
+    monkeypatch.setattr(live, "market_features", None)
+    prompt = live.stock_price_prompt("Apple", {"Stock Price": 105.0})
+    assert "Change Since Last Snapshot: n/a" in prompt
+    assert "Trend Over Recent Snapshots: n/a" in prompt
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+from fused_analysis import Aspect
+from llm_cache import quantize
+from market_watch import MarketWatcher, changed, parse_threshold
+
+
+async def price_analysis(company, data):
+    return f"price {company} {data['Stock Price']}"
+
+
+async def revenue_analysis(company, data):
+    return f"revenue {company} {data['Revenue']}"
+
+
+ASPECTS = [
+    Aspect("price", "Price", None, price_analysis),
+    Aspect("revenue", "Revenue", None, revenue_analysis),
+]
+INPUTS = {"price": "Stock Price", "revenue": "Revenue"}
+
+
+class RateLimited(Exception):
+    pass
+
+
+class Runner:
+    """
+    Runs the analyses, failing the first `failures` calls of each named analysis.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.calls = []
+
+    async def __call__(self, analysis, company, data):
+        self.calls.append((analysis.__name__, company))
+        if self.failures.get(analysis.__name__):
+            self.failures[analysis.__name__] -= 1
+            raise RateLimited("429 Too Many Requests")
+        return await analysis(company, data)
+
+
+def polls(*snapshots):
+    """
+    A fetch function returning the next snapshot list on every poll.
+    """
+    remaining = list(snapshots)
+    return lambda: remaining.pop(0)
+
+
+def watch(watcher, fetch, rounds):
+    async def main():
+        return [result async for result in watcher.watch(fetch, interval=0, rounds=rounds)]
+
+    return asyncio.run(main())
+
+
+def test_changed():
+    assert not changed(100.0, 100.4, 0.005)
+    assert changed(100.0, 100.6, 0.005)
+    assert changed(0, 1, 0.5)
+    assert changed("Neutral", "Bullish", 0.5)
+    assert not changed(True, True, None)
+
+
+def test_parse_threshold():
+    assert parse_threshold("Stock Price=0.01") == ("Stock Price", 0.01)
+    assert parse_threshold("Market Sentiment=any") == ("Market Sentiment", None)
+    with pytest.raises(ValueError):
+        parse_threshold("Stock Price")
+
+
+def test_keys_change_whenever_an_input_moves_past_its_threshold():
+    watcher = MarketWatcher(ASPECTS, INPUTS, Runner(), thresholds={"Revenue": 0.01})
+    # 3 significant digits would put both prices in the same bucket
+    assert changed(1196.0, 1204.0, watcher.thresholds["Stock Price"])
+    assert quantize(1196.0) == quantize(1204.0)
+    assert watcher.key("Stock Price", 1196.0) != watcher.key("Stock Price", 1204.0)
+    assert watcher.key("Stock Price", 1196.04) == watcher.key("Stock Price", 1196.0)
+    assert watcher.key("Revenue", 1.2345e9) == quantize(1.2345e9)
+    assert watcher.key("Market Sentiment", "Neutral") == "Neutral"
+    watcher.thresholds["Stock Price"] = 0.0001
+    assert watcher.key("Stock Price", 1196.2) != watcher.key("Stock Price", 1196.0)
+
+
+def test_a_watch_rerun_does_not_get_the_cached_analysis(scripts, monkeypatch):
+    live = scripts.load("market-live")
+    watcher = MarketWatcher(live.MARKET_ASPECTS, live.market_watcher.inputs, run=live.traced_analysis)
+    monkeypatch.setattr(live, "market_watcher", watcher)
+    monkeypatch.setattr(live, "market_features", None)
+    # The scheduler's semaphores are bound to the event loop that first waits on them
+    monkeypatch.setattr(live.scheduler, "_models", {})
+    snapshot = {"Stock Price": 1196.0, "Revenue": 9e10, "Market Sentiment": "Neutral", "Risk Score": 1.2}
+    moved = dict(snapshot, **{"Stock Price": 1204.0})  # +0.67%, the same 3-digit bucket
+
+    async def second_poll():
+        while len(watcher.analyzed) < len(live.MARKET_ASPECTS):  # The first poll's analyses finished
+            await asyncio.sleep(0.01)
+        scripts.server.reply = "after the move"
+        yield "Apple", moved
+
+    fetch = iter([lambda: [("Apple", snapshot)], second_poll])
+
+    async def main():
+        return [result async for result in watcher.watch(lambda: next(fetch)(), interval=0, rounds=2)]
+
+    results = scripts.run(main())
+    assert len(results) == len(live.MARKET_ASPECTS) + 1
+    assert results[-1] == "Stock Analysis for Apple: after the move"
+
+
+def test_only_the_aspects_whose_input_moved_are_rerun():
+    runner = Runner()
+    watcher = MarketWatcher(ASPECTS, INPUTS, runner)
+    fetch = polls(
+        [("Apple", {"Stock Price": 100.0, "Revenue": 1e9})],
+        [("Apple", {"Stock Price": 100.1, "Revenue": 1e9})],  # Below the threshold
+        [("Apple", {"Stock Price": 110.0, "Revenue": 1e9})],
+    )
+    results = watch(watcher, fetch, rounds=3)
+    assert sorted(results) == ["price Apple 100.0", "price Apple 110.0", "revenue Apple 1000000000.0"]
+    assert watcher.counters["analyses"] == 3
+    assert watcher.counters["skipped"] == 3
+
+
+def test_failed_analyses_are_retried_at_the_next_poll():
+    runner = Runner(failures={"price_analysis": 1})
+    watcher = MarketWatcher(ASPECTS, INPUTS, runner)
+    snapshot = [("Apple", {"Stock Price": 100.0, "Revenue": 1e9})]
+    results = watch(watcher, polls(snapshot, snapshot), rounds=2)
+    assert "price_analysis failed for Apple: 429 Too Many Requests" in results
+    assert "price Apple 100.0" in results  # Re-run although the price didn't move
+    assert runner.calls.count(("price_analysis", "Apple")) == 2
+    assert runner.calls.count(("revenue_analysis", "Apple")) == 1
+    assert watcher.analyzed[("Apple", "price")] == 100.0
+    assert watcher.counters["failures"] == 1
+
+
+def test_a_failed_rerun_keeps_comparing_with_the_last_success():
+    runner = Runner()
+    watcher = MarketWatcher(ASPECTS[:1], INPUTS, runner)
+    fetch = polls(
+        [("Apple", {"Stock Price": 100.0})],
+        [("Apple", {"Stock Price": 110.0})],
+        [("Apple", {"Stock Price": 110.0})],
+    )
+
+    async def main():
+        results = []
+        async for result in watcher.watch(fetch, interval=0, rounds=3):
+            results.append(result)
+            if len(results) == 1:
+                runner.failures["price_analysis"] = 1  # The re-run for 110.0 fails
+        return results
+
+    results = asyncio.run(main())
+    assert results == ["price Apple 100.0", "price_analysis failed for Apple: 429 Too Many Requests", "price Apple 110.0"]
+
+
+def test_analyses_still_running_are_not_started_twice():
+    class Slow(Runner):
+        async def __call__(self, analysis, company, data):
+            await asyncio.sleep(0.05)
+            return await super().__call__(analysis, company, data)
+
+    runner = Slow()
+    watcher = MarketWatcher(ASPECTS[:1], INPUTS, runner)
+    fetch = polls([("Apple", {"Stock Price": 100.0})], [("Apple", {"Stock Price": 120.0})])
+    results = watch(watcher, fetch, rounds=2)
+    assert results == ["price Apple 100.0"]
+    assert watcher.counters["busy"] == 1
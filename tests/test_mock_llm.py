@@ -0,0 +1,72 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from mock_llm import LogNormal, MockHTTPError, MockLLMServer, Uniform, parse_error, parse_latency, post_chat_completion
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_parse_latency_and_error():
+    assert parse_latency("0.05") == 0.05
+    assert repr(parse_latency("uniform:0.1,0.2")) == "uniform:0.1,0.2"
+    assert repr(parse_latency("lognormal:0.3,0.5")) == "lognormal:0.3,0.5"
+    with pytest.raises(ValueError):
+        parse_latency("gamma:1,2")
+    assert parse_error("429=0.05") == (429, 0.05)
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    assert all(0.1 <= Uniform(0.1, 0.2).sample(rng) <= 0.2 for _ in range(100))
+    samples = sorted(LogNormal(0.3, 0.5).sample(rng) for _ in range(2000))
+    assert samples[1000] == pytest.approx(0.3, rel=0.1)
+    assert samples[-20] > 2 * samples[1000]  # p99 well above the median
+
+
+def test_seeded_error_injection_is_reproducible():
+    first = MockLLMServer(errors={429: 0.2, 503: 0.1}, seed=7)
+    second = MockLLMServer(errors={429: 0.2, 503: 0.1}, seed=7)
+    draws = [first.injected_error() for _ in range(500)]
+    assert draws == [second.injected_error() for _ in range(500)]
+    assert draws.count(429) == pytest.approx(100, abs=30)
+    assert draws.count(503) == pytest.approx(50, abs=25)
+
+
+def test_completion_and_error_responses(mock_llm):
+    async def main():
+        response = await post_chat_completion(mock_llm.base_url, model="gpt-4", messages=MESSAGES)
+        mock_llm.errors = {429: 1.0}
+        mock_llm.retry_after = 0.2
+        with pytest.raises(MockHTTPError) as error:
+            await post_chat_completion(mock_llm.base_url, model="gpt-4", messages=MESSAGES)
+        return response, error.value
+
+    response, error = asyncio.run(main())
+    assert response["model"] == "gpt-4"
+    assert response["choices"][0]["message"]["content"] == "OK"
+    assert error.status_code == 429
+    assert error.payload["error"]["type"] == "rate_limit_exceeded"
+    assert mock_llm.request_count == 2
+    assert mock_llm.status_counts == {200: 1, 429: 1}
+
+
+def test_structured_output_matches_the_schema(client, mock_llm):
+    schema = {"type": "object", "properties": {"answer": {"type": "string"}, "score": {"type": "number"},
+                                               "tags": {"type": "array", "items": {"type": "string"}}}}
+    response = client.create(model="gpt-4", messages=MESSAGES,
+                             response_format={"type": "json_schema", "json_schema": {"name": "a", "schema": schema}})
+    assert response["choices"][0]["message"]["content"] == '{"answer": "OK", "score": 0, "tags": ["OK"]}'
+
+
+def test_streams_word_by_word_at_the_token_rate(client, mock_llm):
+    mock_llm.reply = "one two three four"
+    mock_llm.tokens_per_second = 20  # 18 characters, so 4 tokens: 0.2s
+    started = time.perf_counter()
+    chunks = list(client.create(model="gpt-4", messages=MESSAGES, stream=True))
+    elapsed = time.perf_counter() - started
+    deltas = [chunk["choices"][0]["delta"]["content"] for chunk in chunks if chunk["choices"][0]["delta"].get("content")]
+    assert deltas == ["one", " two", " three", " four"]
+    assert 0.15 < elapsed < 1.0
@@ -0,0 +1,91 @@
+import pytest
+
+from router import (
+    ACTION_EXAMPLES,
+    ACTION_RULES,
+    AGENT_RULES,
+    ANSWER,
+    ASK_FOR_DETAILS,
+    CLARIFY,
+    GUIDE,
+    RESPOND,
+    HashedNgramClassifier,
+    RegexRouter,
+    RoutingEngine,
+    parse_action,
+)
+
+
+class Escalation:
+    def __init__(self, action):
+        self.action = action
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return self.action
+
+
+@pytest.mark.parametrize(
+    "text, action",
+    [("How do I install numpy", GUIDE), ("who wrote hamlet?", ANSWER), ("hmm", CLARIFY), ("quantum computing", None)],
+)
+def test_action_rules(text, action):
+    assert RegexRouter(ACTION_RULES).predict(text)[0] == action
+
+
+def test_agent_rules():
+    router = RegexRouter(AGENT_RULES)
+    assert router.predict("what is a monad?")[0] == RESPOND
+    assert router.predict("hi")[0] == ASK_FOR_DETAILS
+
+
+def test_classifier_learns_the_examples():
+    classifier = HashedNgramClassifier(ACTION_EXAMPLES, dim=2 ** 12)
+    correct = sum(classifier.predict(text)[0] == action for text, action in ACTION_EXAMPLES)
+    assert correct / len(ACTION_EXAMPLES) > 0.9
+    probabilities = classifier.probabilities("install python on windows")
+    assert sum(probabilities.values()) == pytest.approx(1.0)
+
+
+def test_confident_local_decisions_skip_the_llm():
+    escalate = Escalation(CLARIFY)
+    engine = RoutingEngine([RegexRouter(ACTION_RULES)], escalate)
+    assert engine.route("How do I set up a VPN") == GUIDE
+    assert escalate.calls == []
+    assert engine.stats()["local"] == 1
+
+
+def test_uncertain_inputs_are_escalated_once():
+    escalate = Escalation(ANSWER)
+    engine = RoutingEngine([RegexRouter(ACTION_RULES)], escalate)
+    assert not engine.will_escalate("How do I set up a VPN")
+    assert engine.will_escalate("quantum computing")
+    assert engine.route("quantum computing") == ANSWER
+    assert engine.route("  Quantum   COMPUTING ") == ANSWER  # Cached under the normalized text
+    assert escalate.calls == ["quantum computing"]
+    assert not engine.will_escalate("quantum computing")
+    stats = engine.stats()
+    assert (stats["escalated"], stats["cached"]) == (1, 1)
+    assert stats["escalation_rate"] == 0.5
+
+
+def test_decision_cache_is_bounded():
+    engine = RoutingEngine([], Escalation(CLARIFY), cache_size=2)
+    for text in ("a", "b", "c"):
+        engine.route(text)
+    assert list(engine.cache) == ["b", "c"]
+
+
+def test_candidates_fall_back_to_escalation_history():
+    engine = RoutingEngine([RegexRouter(ACTION_RULES)], Escalation(ANSWER))
+    engine.route("first question")
+    assert engine.candidates("something else", k=2) == [ANSWER]
+    with_model = RoutingEngine([HashedNgramClassifier(ACTION_EXAMPLES, dim=2 ** 12)], Escalation(ANSWER))
+    assert len(with_model.candidates("how to cook rice", k=2)) == 2
+
+
+def test_parse_action():
+    assert parse_action("Action: 2") == 2
+    assert parse_action("no idea") == CLARIFY
+    assert parse_action(None, default=ANSWER) == ANSWER
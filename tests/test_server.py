@@ -0,0 +1,222 @@
+import asyncio
+import gc
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import llm_client
+from server import APPS, WorkflowServer
+
+
+@pytest.fixture
+def serve(scripts):
+    """
+    Run `test(http, server)` against a WorkflowServer on a test HTTP server.
+    """
+    for name in APPS:
+        scripts.load(name)  # Before the server replaces the shared client
+    client = llm_client.get_client()
+
+    def serve(test, **options):
+        options.setdefault("max_workers", 4)
+        server = WorkflowServer(**options)
+
+        async def main():
+            try:
+                async with TestClient(TestServer(server.make_app())) as http:
+                    return await test(http, server)
+            finally:
+                await client.aclose()  # The scripts' async connections, used by support turns
+
+        return asyncio.run(main()), server
+
+    return serve
+
+
+async def create_session(http, app):
+    response = await http.post("/sessions", json={"app": app})
+    assert response.status == 201
+    return (await response.json())["session_id"]
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+
+def test_http_turn(serve, scripts):
+    scripts.server.reply = "Paris is the capital of France."
+
+    async def test(http, server):
+        session_id = await create_session(http, "agent")
+        response = await http.post(f"/sessions/{session_id}/turns", json={"text": "What is the capital of France?"})
+        return response.status, await response.json()
+
+    (status, body), server = serve(test)
+    assert status == 200
+    assert body["result"] == {"reply": "Paris is the capital of France."}
+    assert server.counters["turns"] == 1
+
+
+def test_support_faq_turn_skips_the_llm(serve, scripts):
+    faq = next(iter(scripts.load("support").FAQS.values()))
+
+    async def test(http, server):
+        session_id = await create_session(http, "support")
+        response = await http.post(f"/sessions/{session_id}/turns", json={"text": faq["question"]})
+        return await response.json()
+
+    requests = scripts.server.request_count
+    body, _ = serve(test)
+    assert body["result"]["solution"] == faq["answer"]
+    assert scripts.server.request_count == requests
+
+
+def test_support_turns_run_on_the_event_loop(serve, scripts):
+    scripts.server.reply = "Check your spam folder for the reset email."
+    scripts.server.latency = 0.2
+    peak = []
+
+    async def test(http, server):
+        async def turn(n):
+            session_id = await create_session(http, "support")
+            response = await http.post(f"/sessions/{session_id}/turns", json={"text": f"Reset email {n} never came"})
+            return await response.json()
+
+        turns = [asyncio.ensure_future(turn(n)) for n in range(4)]
+        # More turns at once than there are workers
+        await wait_for(lambda: server.in_flight == 4)
+        peak.append(server.in_flight)
+        return await asyncio.gather(*turns)
+
+    bodies, server = serve(test, max_workers=1)
+    assert peak == [4]
+    for body in bodies:
+        assert body["result"] == {"solution": scripts.server.reply, "follow_up": scripts.server.reply}
+    assert server.counters["turns"] == 4
+
+
+def test_support_turns_over_the_websocket(serve, scripts):
+    scripts.server.reply = "one two three"
+
+    async def test(http, server):
+        session_id = await create_session(http, "support")
+        messages = []
+        async with http.ws_connect(f"/sessions/{session_id}/ws") as ws:
+            await ws.send_str("My parcel never arrived")
+            while not messages or messages[-1]["type"] != "result":
+                messages.append(await ws.receive_json())
+        return messages
+
+    messages, _ = serve(test)
+    tokens = [(message["field"], message["text"]) for message in messages if message["type"] == "token"]
+    assert "".join(text for field, text in tokens if field == "solution") == "one two three"
+    assert tokens[-1] == ("follow_up", "one two three")
+    assert messages[-1]["result"] == {"solution": "one two three", "follow_up": "one two three"}
+
+
+def test_malformed_turns_are_rejected(serve):
+    async def test(http, server):
+        session_id = await create_session(http, "support")
+        statuses = []
+        for body in [{}, {"text": 42}, ["text"]]:
+            statuses.append((await http.post(f"/sessions/{session_id}/turns", json=body)).status)
+        response = await http.post(f"/sessions/{session_id}/turns", data="not json")
+        statuses.append(response.status)
+        return statuses, await response.json()
+
+    (statuses, error), server = serve(test)
+    assert statuses == [400, 400, 400, 400]
+    assert error == {"error": 'the body must be a JSON object with a "text" string'}
+    assert server.counters == {"turns": 0, "rejected": 0, "errors": 0, "timeouts": 0}
+
+
+def test_websocket_streams_tokens_before_the_result(serve, scripts):
+    scripts.server.reply = "one two three"
+
+    async def test(http, server):
+        session_id = await create_session(http, "agent")
+        messages = []
+        async with http.ws_connect(f"/sessions/{session_id}/ws") as ws:
+            await ws.send_str("What is the tallest mountain?")
+            while not messages or messages[-1]["type"] != "result":
+                messages.append(await ws.receive_json())
+        return messages
+
+    messages, _ = serve(test)
+    tokens = [message["text"] for message in messages if message["type"] == "token"]
+    assert "".join(tokens) == "one two three"
+    assert messages[-1]["result"] == {"reply": "one two three"}
+
+
+def test_websocket_client_disconnecting_mid_turn(serve, scripts):
+    scripts.server.reply = " ".join(["word"] * 20)
+    scripts.server.tokens_per_second = 40
+    problems = []
+
+    async def test(http, server):
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: problems.append(context))
+        session_id = await create_session(http, "agent")
+        ws = await http.ws_connect(f"/sessions/{session_id}/ws")
+        await ws.send_str("Why is the sky blue?")
+        first = await ws.receive_json()
+        ws._response.close()  # Drop the connection, without a closing handshake
+        await wait_for(lambda: server.in_flight == 0)
+        await asyncio.sleep(0.5)  # The turn's worker keeps generating tokens for nobody
+        gc.collect()
+        forwarders = [task for task in asyncio.all_tasks() if "forward" in repr(task.get_coro())]
+        return first, forwarders
+
+    try:
+        (first, forwarders), server = serve(test)
+    finally:
+        scripts.server.tokens_per_second = None
+    assert first["type"] == "token"
+    assert forwarders == []
+    assert problems == []
+
+
+def test_overloaded_server_rejects_turns(serve):
+    async def test(http, server):
+        session_id = await create_session(http, "agent")
+        response = await http.post(f"/sessions/{session_id}/turns", json={"text": "What is 2 + 2?"})
+        return response.status, response.headers.get("Retry-After")
+
+    (status, retry_after), server = serve(test, max_queue=0)
+    assert (status, retry_after) == (503, "1")
+    assert server.counters["rejected"] == 1
+
+
+def test_unknown_sessions_and_apps(serve):
+    async def test(http, server):
+        missing = await http.post("/sessions/nope/turns", json={"text": "hi"})
+        bad_app = await http.post("/sessions", json={"app": "nope"})
+        return missing.status, bad_app.status
+
+    (missing, bad_app), _ = serve(test)
+    assert (missing, bad_app) == (404, 400)
+
+
+def test_stats_and_metrics(serve):
+    async def test(http, server):
+        stats = await (await http.get("/stats")).json()
+        metrics = await (await http.get("/metrics")).text()
+        return stats, metrics
+
+    (stats, metrics), _ = serve(test)
+    assert set(stats["coalescing"]) == set(APPS)
+    assert stats["sessions"] == 0
+    assert isinstance(metrics, str)
+
+
+def test_stop_closes_the_async_client(serve):
+    async def test(http, server):
+        server.client.async_client  # Opened by any async call
+        return server.client
+
+    client, _ = serve(test)
+    assert client._async is None
+    assert client._sync is None
@@ -0,0 +1,69 @@
+import asyncio
+import multiprocessing
+import time
+
+from benchmarks.bench_fused import make_market_data
+from llm_metrics import MetricsRecorder
+from llm_scheduler import ModelLimits, SharedTokenBucket
+from sharded_runner import ShardedRunner
+
+LIFTED = ModelLimits(max_concurrency=64, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)
+
+
+def _admit(bucket, ready, window, admitted):
+    """
+    Worker process: once every worker is ready, take one request at a time from
+    `bucket` for `window` seconds and report when each was admitted.
+    """
+    async def main():
+        times = []
+        stop_at = time.monotonic() + window
+        while time.monotonic() < stop_at:
+            try:
+                await asyncio.wait_for(bucket.acquire(1), stop_at - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            times.append(time.monotonic())
+        return times
+
+    ready.wait()
+    admitted.put(asyncio.run(main()))
+
+
+def test_shards_are_merged_in_input_order(scripts):
+    market = scripts.load("market")
+    items = list(make_market_data(7).items())
+    recorder = MetricsRecorder()
+    limits = {model: LIFTED for model in market.scheduler.limits}
+    runner = ShardedRunner("market", processes=2, shard_size=3, limits=limits, recorder=recorder)
+    results = list(runner.run(items))
+    aspects = len(market.MARKET_ASPECTS)
+    assert len(results) == len(items) * aspects
+    for i, (company, _) in enumerate(items):
+        assert all(f"for {company}:" in result for result in results[i * aspects:(i + 1) * aspects])
+    assert runner.stats == {"shards": 3, "companies": 7, "results": 28}
+    # The workers' call metrics are recorded in this process
+    assert len(recorder.spans) == len(results)
+    assert {span.workflow for span in recorder.spans} == {"market"}
+
+
+def test_worker_processes_share_one_rate_limit():
+    # The start method of the sharded runner's workers
+    context = multiprocessing.get_context("spawn")
+    bucket = SharedTokenBucket(per_minute=300, context=context)  # 5 requests/s, bursts of 5
+    processes = 3
+    ready = context.Barrier(processes + 1)
+    admitted = context.Queue()
+    workers = [context.Process(target=_admit, args=(bucket, ready, 1.0, admitted)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    ready.wait(timeout=60)
+    times = sorted(t for _ in workers for t in admitted.get(timeout=60))
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    # A burst, then the refill rate, for all the workers together; a bucket per worker
+    # would have let through about three times as many
+    span = times[-1] - times[0]
+    assert bucket.capacity <= len(times) <= bucket.capacity + bucket.rate * span + 1
+    assert len(times) < processes * bucket.capacity
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from llm_stream import TokenStream
+from speculation import Speculator
+
+
+class Launcher:
+    def __init__(self, pause=0.0):
+        """
+        Fake step: streams "<outcome> one two three" word by word, `pause` seconds apart,
+        and records which runs were started and which were closed early.
+        """
+        self.pause = pause
+        self.started = []
+        self.closed = []
+        self.lock = threading.Lock()
+
+    def __call__(self, key, outcome):
+        with self.lock:
+            self.started.append(outcome)
+        return TokenStream(self._chunks(outcome), step="step_3")
+
+    def _chunks(self, outcome):
+        words = [outcome] + [" one", " two", " three"]
+        try:
+            for word in words:
+                time.sleep(self.pause)
+                yield {"choices": [{"delta": {"content": word}}]}
+        except GeneratorExit:
+            with self.lock:
+                self.closed.append(outcome)
+            raise
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_hit_adopts_the_matching_run_and_cancels_the_others():
+    launch = Launcher(pause=0.05)
+    speculator = Speculator(launch, prompt_tokens=lambda key, outcome: 10, max_candidates=2, step="step_3")
+    speculation = speculator.start("topic", ["explain", "guide", "answer"])
+    assert sorted(speculation.runs) == ["explain", "guide"]
+    stream = speculation.adopt("guide")
+    assert stream.read() == "guide one two three"
+    assert stream.step == "step_3"
+    wait_for(lambda: launch.closed == ["explain"])
+    assert speculator.counters["hits"] == 1
+    assert speculator.counters["wasted_tokens"] >= 10
+    # Only the first decision counts
+    assert speculation.adopt("explain") is None
+
+
+def test_miss_cancels_every_run():
+    launch = Launcher(pause=0.05)
+    speculator = Speculator(launch, max_candidates=2)
+    speculation = speculator.start("topic", ["explain", "guide"])
+    assert speculation.adopt("clarify") is None
+    wait_for(lambda: sorted(launch.closed) == ["explain", "guide"])
+    assert speculator.counters["misses"] == 1
+    assert "hit rate 0%" in speculator.summary()
+
+
+def test_finished_run_replays_from_the_buffer():
+    launch = Launcher()
+    speculator = Speculator(launch)
+    speculation = speculator.start("topic", ["answer"])
+    wait_for(lambda: speculation.runs["answer"].finished.is_set())
+    assert speculation.adopt("answer").read() == "answer one two three"
+
+
+def test_plain_string_and_errors_are_passed_on():
+    speculator = Speculator(lambda key, outcome: f"canned {outcome}")
+    assert speculator.start("topic", ["clarify"]).adopt("clarify").read() == "canned clarify"
+
+    def failing(key, outcome):
+        raise RuntimeError("upstream failed")
+
+    speculation = Speculator(failing).start("topic", ["explain"])
+    with pytest.raises(RuntimeError, match="upstream failed"):
+        speculation.adopt("explain").read()
+
+
+def test_no_speculation_over_the_wasted_token_budget():
+    launch = Launcher()
+    speculator = Speculator(launch, prompt_tokens=lambda key, outcome: 100, wasted_tokens_per_hour=50)
+    assert speculator.start("topic", []) is None
+    speculator.start("topic", ["explain"]).cancel()
+    assert speculator.wasted_last_hour() >= 100
+    assert speculator.start("topic", ["explain"]) is None
+    assert speculator.counters["over_budget"] == 1
+    assert launch.started == ["explain"]
+
+
+def test_hybrid_app_adopts_the_speculative_step_3(scripts):
+    hybrid = scripts.load("hybrid")
+    app = hybrid.HybridLLMApp(speculate=3)
+    topic = "quantum entanglement"
+    assert app.router.will_escalate(topic)
+    scripts.server.reply = "1"  # The LLM picks "detailed explanation"
+    speculation = app.speculate(topic)
+    assert sorted(speculation.runs) == [1, 2, 3]
+    assert app.step_2_decide_action(topic) == 1
+    assert app.start_result(topic, 1, speculation).read() == "1"
+    assert app.speculator.counters["hits"] == 1
@@ -0,0 +1,86 @@
+import threading
+
+from llm_stream import TokenStream
+from summarizer import CHUNK_PROMPT, MERGE_PROMPT, SUMMARY_PROMPT, ChunkedSummarizer, split_point
+
+
+class FakeLLM:
+    """
+    Records the prompts it is sent and answers each with a short, numbered summary.
+    """
+
+    def __init__(self):
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, stream=False):
+        with self._lock:
+            self.prompts.append(prompt)
+            answer = f"summary {len(self.prompts)}"
+        return answer
+
+
+def paragraphs(count, size=90):
+    return "".join(f"{i:03d} " + "x" * (size - 6) + "\n\n" for i in range(count))
+
+
+def test_split_point_prefers_paragraphs_then_sentences():
+    assert split_point("short", 10) == 5
+    assert split_point("aaaaaaaa\n\nbbbb cccc", 16) == 10
+    assert split_point("One sentence. Two sentence.", 20) == 14
+    assert split_point("x" * 30, 10) == 10
+
+
+def test_short_texts_take_a_single_call():
+    llm = FakeLLM()
+    assert ChunkedSummarizer(llm, chunk_chars=1000).summarize("A short report.") == "summary 1"
+    assert llm.prompts == [SUMMARY_PROMPT.format(text="A short report.")]
+
+
+def test_chunks_are_summarized_while_the_text_streams():
+    llm = FakeLLM()
+    summarizer = ChunkedSummarizer(llm, chunk_chars=200)
+    text = paragraphs(10)
+    pipeline = summarizer.pipeline(TokenStream(iter({"choices": [{"delta": {"content": c}}]} for c in text)))
+    assert pipeline.read() == text
+    assert len(pipeline.partials) >= 4  # Submitted before the merge was asked for
+    assert all(len(prompt) <= len(CHUNK_PROMPT) + 200 for prompt in llm.prompts)
+    summary = pipeline.merge()
+    assert llm.prompts[-1].startswith(MERGE_PROMPT.split("{text}")[0])
+    assert summary == f"summary {len(llm.prompts)}"
+
+
+def test_merge_input_fits_the_chunk_budget():
+    llm = FakeLLM()
+    summarizer = ChunkedSummarizer(llm, chunk_chars=100)
+    summarizer.summarize(paragraphs(40))
+    merge = llm.prompts[-1]
+    assert len(merge) - len(MERGE_PROMPT.format(text="")) <= 100
+
+
+def test_long_summaries_are_reduced_again():
+    llm = FakeLLM()
+    summarizer = ChunkedSummarizer(llm, chunk_chars=40)
+    combined = summarizer.reduce([f"partial summary {i}" for i in range(10)])
+    assert len(combined) <= 40
+    assert len(llm.prompts) >= 5
+
+
+def test_pipeline_passes_the_deltas_through_once():
+    summarizer = ChunkedSummarizer(FakeLLM(), chunk_chars=50)
+    pipeline = summarizer.pipeline(["a" * 30, "b" * 30, "c" * 30])
+    first = next(iter(pipeline))
+    rest = list(pipeline)
+    assert [first] + rest == ["a" * 30, "b" * 30, "c" * 30]
+    assert summarizer.pipeline(pipeline) is pipeline
+
+
+def test_summarizes_with_the_mock_server(mock_llm, client):
+    mock_llm.reply = "Merged summary"
+
+    def complete(prompt, stream=False):
+        response = client.create(model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}])
+        return response["choices"][0]["message"]["content"]
+
+    assert ChunkedSummarizer(complete, chunk_chars=200).summarize(paragraphs(6)) == "Merged summary"
+    assert mock_llm.request_count >= 3
@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_cache import ResponseCache
+from llm_metrics import MetricsRecorder
+from workflow_engine import Node, Workflow
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResponseCache(str(tmp_path / "workflow.sqlite3"))
+    yield store
+    store.close()
+
+
+def run(workflow, inputs, **options):
+    return asyncio.run(workflow.run(inputs, **options))
+
+
+async def slow_double(x):
+    await asyncio.sleep(0.1)
+    return 2 * x
+
+
+async def slow_square(x):
+    await asyncio.sleep(0.1)
+    return x * x
+
+
+async def add(double, square):
+    return double + square
+
+
+def test_inputs_and_order():
+    workflow = Workflow([Node("sum", add, ["double", "square"]), Node("double", slow_double, ["x"]),
+                         Node("square", slow_square, ["x"])])
+    assert workflow.inputs == ["x"]
+    assert workflow.order.index("sum") > workflow.order.index("double")
+    assert workflow.order.index("sum") > workflow.order.index("square")
+
+
+def test_independent_nodes_run_concurrently():
+    workflow = Workflow([Node("double", slow_double, ["x"]), Node("square", slow_square, ["x"]),
+                         Node("sum", add, ["double", "square"])], recorder=MetricsRecorder())
+    started = time.perf_counter()
+    result = run(workflow, {"x": 3})
+    assert time.perf_counter() - started < 0.19
+    assert result["sum"] == 15
+    assert result.statuses == {"double": "ok", "square": "ok", "sum": "ok"}
+    assert result.timings["sum"][0] >= result.timings["double"][1]
+    assert "sum:" in result.format_timings()
+
+
+def test_plain_functions_run_on_a_worker_thread():
+    def blocking(x):
+        time.sleep(0.1)
+        return x + 1
+
+    workflow = Workflow([Node("a", blocking, ["x"]), Node("b", blocking, ["x"])], recorder=MetricsRecorder())
+    started = time.perf_counter()
+    result = run(workflow, {"x": 1})
+    assert (result["a"], result["b"]) == (2, 2)
+    assert time.perf_counter() - started < 0.19
+
+
+def test_results_are_reported_as_they_finish():
+    seen = []
+    workflow = Workflow([Node("double", slow_double, ["x"]), Node("sum", add, ["double", "square"]),
+                         Node("square", slow_square, ["x"])], recorder=MetricsRecorder())
+    run(workflow, {"x": 2}, on_result=lambda name, value: seen.append((name, value)))
+    assert seen[-1] == ("sum", 8)
+    assert sorted(seen[:2]) == [("double", 4), ("square", 4)]
+
+
+def test_invalid_workflows():
+    with pytest.raises(ValueError, match="duplicate"):
+        Workflow([Node("a", add), Node("a", add)])
+    with pytest.raises(ValueError, match="cycle"):
+        Workflow([Node("a", add, ["b"]), Node("b", add, ["a"])])
+    with pytest.raises(ValueError, match="missing workflow inputs: x"):
+        run(Workflow([Node("double", slow_double, ["x"])]), {})
+
+
+def test_a_failing_node_cancels_the_rest():
+    cancelled = []
+
+    async def fail(x):
+        raise RuntimeError("boom")
+
+    async def forever(x):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    workflow = Workflow([Node("fail", fail, ["x"]), Node("forever", forever, ["x"])], recorder=MetricsRecorder())
+    with pytest.raises(RuntimeError, match="boom"):
+        run(workflow, {"x": 1})
+    assert cancelled == [True]
+
+
+def test_memoized_nodes_reuse_earlier_outputs(store):
+    calls = []
+
+    async def expensive(x):
+        calls.append(x)
+        return x * 10
+
+    workflow = Workflow([Node("expensive", expensive, ["x"], memoize=True)], store=store, recorder=MetricsRecorder())
+    assert run(workflow, {"x": 1}).statuses["expensive"] == "ok"
+    second = run(workflow, {"x": 1})
+    assert (second["expensive"], second.statuses["expensive"]) == (10, "memoized")
+    run(workflow, {"x": 2})
+    assert calls == [1, 2]
+
+
+def test_failed_runs_resume_from_the_last_completed_step(store):
+    calls = []
+    failing = [True]
+
+    async def first(x):
+        calls.append("first")
+        return x + 1
+
+    async def second(first):
+        calls.append("second")
+        if failing[0]:
+            raise RuntimeError("crashed")
+        return first * 2
+
+    workflow = Workflow([Node("first", first, ["x"]), Node("second", second, ["first"])], store=store,
+                        recorder=MetricsRecorder())
+    with pytest.raises(RuntimeError):
+        run(workflow, {"x": 1}, run_id="run-1")
+    failing[0] = False
+    resumed = run(workflow, {"x": 1}, run_id="run-1")
+    assert resumed["second"] == 4
+    assert resumed.statuses == {"first": "resumed", "second": "ok"}
+    assert calls == ["first", "second", "second"]
+
+
+def test_unserializable_outputs_are_recomputed(store):
+    calls = []
+
+    async def make(x):
+        calls.append(x)
+        return object()
+
+    workflow = Workflow([Node("make", make, ["x"], memoize=True)], store=store, recorder=MetricsRecorder())
+    run(workflow, {"x": 1})
+    run(workflow, {"x": 1})
+    assert calls == [1, 1]
+
+
+def test_node_durations_are_recorded():
+    recorder = MetricsRecorder()
+    run(Workflow([Node("double", slow_double, ["x"])], name="test", recorder=recorder), {"x": 1})
+    (key, (runs, seconds)), = recorder.node_timings().items()
+    assert key == ("test", "double", "ok")
+    assert runs == 1 and seconds >= 0.1
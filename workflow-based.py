@@ -1,23 +1,42 @@
-import openai
-from dotenv import load_dotenv
-import os
+import argparse
+import asyncio
+import functools
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_client import get_client
+import llm_metrics
+from llm_metrics import TracedChatCompletion, step
+from llm_singleflight import SingleFlight
+from llm_stream import TokenStream, format_timings, print_stream
+from summarizer import ChunkedSummarizer
+from workflow_engine import Node, Workflow, new_run_id
 
-# Load environment variables
-load_dotenv()
-
-# Set up OpenAI API key from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Identical requests are answered from the shared on-disk response cache;
+# misses go through the shared OpenAI client (reads OPENAI_API_KEY), and
+# identical misses made at the same time share one call (llm_singleflight.py).
+# Every call is recorded in llm_metrics, tagged with the step that made it.
+flights = SingleFlight(create=get_client().create)
+llm = TracedChatCompletion(CachedChatCompletion(ResponseCache(), create=flights.create), workflow="workflow")
 
 class WorkflowBasedApp:
     def __init__(self):
         """
         Initialize the workflow-based application with predefined steps.
         """
-        self.workflow_steps = [
-            self.step_1_ask_for_topic,
-            self.step_2_generate_content,
-            self.step_3_summarize_content,
-        ]
+        # The steps and their inputs; workflow_engine runs them in dependency order.
+        # Completed steps are recorded in the response cache so a failed run can be resumed.
+        self.workflow = Workflow(
+            [
+                Node("topic", self.step_1_ask_for_topic),
+                Node("content_stream", functools.partial(self.step_2_generate_content, stream=True), ["topic"]),
+                Node("content", self.print_content, ["content_stream"]),
+                Node("summary_stream", self.start_summary, ["content"]),
+                Node("summary", self.print_summary, ["summary_stream"]),
+            ],
+            name="workflow",
+            store=llm.completion.cache,
+        )
+        # Long content is summarized chunk by chunk while it is still being generated
+        self.summarizer = ChunkedSummarizer(self.summarize_text)
 
     def step_1_ask_for_topic(self):
         """
@@ -25,45 +44,102 @@ class WorkflowBasedApp:
         """
         return input("Please enter a topic you'd like to learn about: ")
 
-    def step_2_generate_content(self, topic):
+    @step("step_2_generate_content")
+    def step_2_generate_content(self, topic, stream=False):
         """
         Step 2: Generate content about the topic using the LLM.
+        With stream=True, return a TokenStream that yields the content as it is generated.
         """
         prompt = f"Write a detailed explanation about {topic}."
-        response = openai.ChatCompletion.create(
+        response = llm.create(
             model="gpt-4",  # or "gpt-3.5-turbo"
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
+            ttl=7 * 24 * 60 * 60,  # Explanations of a topic rarely change
+            stream=stream,
         )
+        if stream:
+            return TokenStream(response, step="step_2_generate_content")
         return response['choices'][0]['message']['content']
 
-    def step_3_summarize_content(self, content):
+    @step("summarize_text")
+    def summarize_text(self, prompt, stream=False):
         """
-        Step 3: Summarize the generated content using the LLM.
+        Send one summarization prompt (a chunk, a merge or a whole text) to the LLM.
         """
-        prompt = f"Summarize the following text in one paragraph:\n\n{content}"
-        response = openai.ChatCompletion.create(
+        response = llm.create(
             model="gpt-4",  # or "gpt-3.5-turbo"
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
+            ttl=7 * 24 * 60 * 60,
+            stream=stream,
         )
+        if stream:
+            return TokenStream(response, step="step_3_summarize_content")
         return response['choices'][0]['message']['content']
 
-    def run_workflow(self):
+    @step("step_3_summarize_content")
+    def step_3_summarize_content(self, content, stream=False):
         """
-        Execute the workflow step by step.
+        Step 3: Summarize the generated content using the LLM.
+        `content` may be text, a TokenStream from step 2, or a SummaryPipeline
+        that has been summarizing the content while it was generated.
+        """
+        return self.summarizer.pipeline(content).merge(stream=stream)
+
+    def print_content(self, content_stream):
+        """
+        Show the content as it streams, summarizing completed chunks of it in the
+        meantime; returns the SummaryPipeline for step 3.
         """
-        print("Welcome to the Workflow-Based LLM Application!")
-        topic = self.step_1_ask_for_topic()
         print("\nGenerating content...")
-        content = self.step_2_generate_content(topic)
-        print("\nContent Generated:\n", content)
+        pipeline = self.summarizer.pipeline(content_stream)
+        print("\nContent Generated:")
+        print_stream(pipeline)
+        return pipeline
+
+    def start_summary(self, content):
         print("\nSummarizing content...")
-        summary = self.step_3_summarize_content(content)
-        print("\nSummary:\n", summary)
+        return self.step_3_summarize_content(content, stream=True)
+
+    def print_summary(self, summary_stream):
+        print("\nSummary:")
+        return print_stream(summary_stream)
+
+    def run_workflow(self, profile=False, run_id=None):
+        """
+        Execute the workflow step by step.
+        Pass the `run_id` of a failed run to resume it from its last completed step.
+        With profile=True, print a per-step breakdown of the LLM calls at the end.
+        """
+        mark = llm_metrics.default_recorder.mark()
+        run_id = run_id or new_run_id()
+        print("Welcome to the Workflow-Based LLM Application!")
+        try:
+            run = asyncio.run(self.workflow.run({}, run_id=run_id))
+        except (Exception, KeyboardInterrupt):
+            print(f"\nThe workflow stopped; resume it with --resume {run_id}")
+            raise
+        timings = format_timings([run["content_stream"], run["summary_stream"]])
+        if timings:
+            print("\n" + timings)
+        if profile:
+            print("\n" + run.format_timings())
+            print("\n" + llm_metrics.default_recorder.breakdown(since=mark))
         print("\nWorkflow complete. Thank you for using the app!")
 
 # Initialize and run the workflow-based app
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Workflow-based LLM application")
+    parser.add_argument("--resume", metavar="RUN_ID", help="resume a run that stopped, skipping its completed steps")
+    llm_metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
     app = WorkflowBasedApp()
-    app.run_workflow() 
\ No newline at end of file
+    app.run_workflow(profile=args.profile, run_id=args.resume)
+    llm_metrics.export(args)
+
+if __name__ == "__main__":
+    main() 
\ No newline at end of file
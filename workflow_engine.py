@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import time
+import uuid
+
+from deadline import DeadlineExceeded, budget, within
+import llm_metrics
+
+# Declarative async workflow engine.
+# A workflow is a set of named nodes; each node is a function called with the
+# results of the nodes (or run inputs) it depends on as keyword arguments, and
+# its own result is available to later nodes under its name. The engine orders
+# the nodes by their dependencies and starts each one as soon as its inputs are
+# ready, so independent steps run concurrently; `on_result` sees each result the
+# moment it is ready (e.g. to show the solution before the follow-up is done).
+#
+# With a store (anything with get(key) / set(key, value, ttl), e.g. a ResponseCache):
+#   - nodes marked memoize=True reuse the output of any earlier run with the same inputs
+#   - a run started with a run_id records every JSON-serializable output, so running
+#     the same run_id again after a failure resumes from the last completed step.
+#     Outputs that can't be stored (streams, pipelines) are recomputed.
+# Per-node durations are recorded in llm_metrics (workflow_node_duration_seconds).
+#
+# A run can be given a deadline (see deadline.py): each node may use its share of the
+# time left when it starts, the calls it makes time out with it, and a node still
+# running at its deadline is cancelled. With partial=True a failed or timed-out node
+# doesn't stop the run; the nodes that need its output are skipped and the run returns
+# what was completed, with a status per node.
+
+# How long the outputs of a run are kept for resuming it
+RESUME_TTL = 24 * 60 * 60
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+def _key(*parts):
+    # Hash of JSON-serializable parts, or None if some input can't be serialized
+    try:
+        canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    return "workflow:" + hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class Node:
+    def __init__(self, name, fn, deps=(), memoize=False, ttl=None, budget=None):
+        """
+        `fn(**{dep: result for dep in deps})` is a coroutine function, or a plain
+        function, which then runs on a worker thread. A dependency is either another
+        node or an input passed to Workflow.run.
+        With memoize=True the output is reused (for `ttl` seconds, or the store's default)
+        by runs with the same inputs; only use it for nodes without side effects.
+        Under a deadline, the node may use a `budget` share (0-1) of the time left when
+        it starts, leaving the rest to the nodes after it; by default it may use all of it.
+        """
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.memoize = memoize
+        self.ttl = ttl
+        self.budget = budget
+        self.is_async = inspect.iscoroutinefunction(fn)
+
+
+# Statuses of the nodes that produced no output in a partial run
+FAILED = ("timeout", "error", "skipped")
+
+
+class WorkflowRun:
+    def __init__(self, run_id, results, timings, statuses, errors=None):
+        """
+        The outcome of one run: `results` maps node and input names to values,
+        `timings` maps node names to (start, end) offsets in seconds from the start
+        of the run and `statuses` says whether each node ran, was memoized or was resumed;
+        in a partial run also whether it timed out, failed or was skipped, with the
+        exceptions of the failed nodes in `errors`.
+        """
+        self.run_id = run_id
+        self.results = results
+        self.timings = timings
+        self.statuses = statuses
+        self.errors = errors or {}
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def get(self, name, default=None):
+        return self.results.get(name, default)
+
+    @property
+    def complete(self):
+        return not any(status in FAILED for status in self.statuses.values())
+
+    def format_timings(self):
+        parts = []
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1]):
+            status = self.statuses.get(name, "ok")
+            parts.append(f"{name}: {start:.2f}s-{end:.2f}s" + (f" ({status})" if status != "ok" else ""))
+        return "Timings - " + "; ".join(parts)
+
+
+class Workflow:
+    def __init__(self, nodes, name="workflow", store=None, recorder=None):
+        """
+        Build a workflow from a list of nodes. Names not defined by a node are inputs.
+        Raises ValueError on duplicate names or dependency cycles.
+        """
+        self.name = name
+        self.store = store
+        self.recorder = recorder or llm_metrics.default_recorder
+        self.nodes = {}
+        for node in nodes:
+            if node.name in self.nodes:
+                raise ValueError(f"duplicate node {node.name!r}")
+            self.nodes[node.name] = node
+        self.inputs = sorted({dep for node in nodes for dep in node.deps if dep not in self.nodes})
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("dependency cycle: " + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for dep in self.nodes[name].deps:
+                if dep in self.nodes:
+                    visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name, [])
+        return order
+
+    async def run(self, inputs, on_result=None, run_id=None, deadline=None, partial=False):
+        """
+        Run every node and return a WorkflowRun. `inputs` must provide every input name.
+        `on_result(name, value)` is called as each node finishes. Pass the `run_id` of a
+        failed run to resume it. If a node fails, the nodes still running are cancelled
+        and the exception is raised. `deadline` is the run's budget in seconds, within
+        any deadline already set; a node that runs out of time fails with DeadlineExceeded.
+        With partial=True failed nodes don't stop the run (see WorkflowRun.statuses).
+        """
+        missing = [name for name in self.inputs if name not in inputs]
+        if missing:
+            raise ValueError(f"missing workflow inputs: {', '.join(missing)}")
+        started = time.perf_counter()
+        results = dict(inputs)
+        timings = {}
+        statuses = {}
+        errors = {}
+        tasks = {}
+
+        async def run_node(node):
+            for dep in node.deps:
+                if dep in tasks:
+                    await tasks[dep]
+            if any(statuses.get(dep) in FAILED for dep in node.deps):
+                statuses[node.name] = "skipped"
+                return None
+            begin = time.perf_counter()
+            values = {dep: results[dep] for dep in node.deps}
+            try:
+                with budget(share=node.budget):
+                    value, status = await within(self._execute(node, values, run_id), f"node {node.name!r}")
+            except BaseException as exc:
+                failure = "timeout" if isinstance(exc, DeadlineExceeded) else "error"
+                self.recorder.record_node(self.name, node.name, time.perf_counter() - begin, failure)
+                if not partial or not isinstance(exc, Exception):
+                    raise
+                timings[node.name] = (begin - started, time.perf_counter() - started)
+                statuses[node.name] = failure
+                errors[node.name] = exc
+                return None
+            end = time.perf_counter()
+            self.recorder.record_node(self.name, node.name, end - begin, status)
+            timings[node.name] = (begin - started, end - started)
+            statuses[node.name] = status
+            results[node.name] = value
+            if on_result is not None:
+                on_result(node.name, value)
+            return value
+
+        # The nodes' tasks inherit the run's deadline
+        with budget(deadline):
+            for name in self.order:
+                tasks[name] = asyncio.ensure_future(run_node(self.nodes[name]))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # Collect the other failures and cancellations so none is reported as never retrieved
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return WorkflowRun(run_id, results, timings, statuses, errors)
+
+    async def _execute(self, node, values, run_id):
+        """
+        Return (output, status), taking the output from the run record or the memo when possible.
+        """
+        resume_key = memo_key = None
+        if self.store is not None:
+            if run_id is not None:
+                resume_key = _key("run", self.name, run_id, node.name, values)
+            if node.memoize:
+                memo_key = _key("memo", self.name, node.name, values)
+        for key, status in ((resume_key, "resumed"), (memo_key, "memoized")):
+            if key is not None:
+                record = self.store.get(key)
+                if record is not None:
+                    return record["value"], status
+        if node.is_async:
+            value = await node.fn(**values)
+        else:
+            value = await asyncio.to_thread(node.fn, **values)
+        for key, ttl in ((resume_key, RESUME_TTL), (memo_key, node.ttl)):
+            if key is not None:
+                try:
+                    self.store.set(key, {"value": value}, ttl)
+                except (TypeError, ValueError):
+                    break  # Not serializable; recomputed next time
+        return value, "ok"
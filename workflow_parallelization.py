@@ -1,12 +1,42 @@
-import openai
+import argparse
 import asyncio
+import functools
 import random
-import os
-from dotenv import load_dotenv
+import time
+from batch_runner import BatchRunner, JobStore, LocalBatchBackend, OpenAIBatchBackend, analysis_requests, analysis_results
+from deadline import DeadlineExceeded, budget
+from fused_analysis import Aspect, FusedAnalyzer
+from llm_cache import CachedChatCompletion, ResponseCache, quantize
+from llm_client import get_client
+from llm_hedge import HedgedCompletion, HedgePolicy
+import llm_metrics
+from llm_metrics import TracedChatCompletion, step
+from llm_scheduler import LLMScheduler
+from llm_singleflight import SingleFlight
+from sharded_runner import ShardedRunner
+from workflow_engine import FAILED, Node, Workflow
 
-# Load OpenAI API Key
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# All model calls go through the scheduler so per-model rate limits are respected;
+# the scheduler owns retries, so the shared client's own retries are turned off
+scheduler = LLMScheduler(create=functools.partial(get_client().acreate, max_retries=0))
+
+# Each analysis may fall back to the next model of its tier: a call running past the 95th
+# percentile of its model's recent latencies is sent to the next one too, and the first
+# answer wins (llm_hedge.py)
+MARKET_HEDGE_TIERS = {
+    "analyze_stock_price": ["gpt-4-turbo", "gpt-4o", "gpt-3.5-turbo"],
+    "analyze_financials": ["gpt-3.5-turbo-16k", "gpt-3.5-turbo"],
+    "analyze_sentiment": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
+    "assess_risk": ["gpt-3.5-turbo", "gpt-3.5-turbo-16k"],
+}
+hedger = HedgedCompletion(HedgePolicy(MARKET_HEDGE_TIERS), acreate=scheduler.chat)
+
+# Analyses are cached on a quantized snapshot, so near-identical inputs reuse earlier results;
+# identical analyses requested at the same time (e.g. by overlapping runs) share one call, and
+# every call is recorded in llm_metrics, tagged with the analysis that made it
+flights = SingleFlight(acreate=hedger.acreate)
+llm = TracedChatCompletion(CachedChatCompletion(ResponseCache(), acreate=flights.acreate), workflow="market")
+MARKET_CACHE_TTL = 15 * 60
 
 # Mock financial market data with natural language descriptions
 companies = [
@@ -16,35 +46,45 @@ companies = [
     "Amazon.com Inc."
 ]
 
-market_data = {
-    company: {
-        "Current Stock Price": round(random.uniform(50, 500), 2),
-        "Quarterly Revenue (Billions)": round(random.uniform(10, 100), 2),
-        "Market Sentiment": random.choice([
-            "Strongly Bullish",
-            "Moderately Bullish",
-            "Neutral",
-            "Moderately Bearish",
-            "Strongly Bearish"
-        ]),
-        "Investment Risk Level": {
-            "score": round(random.uniform(1, 10), 1),
-            "category": random.choice([
-                "Very Low Risk",
-                "Low Risk",
-                "Moderate Risk",
-                "High Risk",
-                "Very High Risk"
-            ])
+def sample_market_data():
+    """ Random figures for each company, drawn when the analysis runs rather than at import """
+    return {
+        company: {
+            "Current Stock Price": round(random.uniform(50, 500), 2),
+            "Quarterly Revenue (Billions)": round(random.uniform(10, 100), 2),
+            "Market Sentiment": random.choice([
+                "Strongly Bullish",
+                "Moderately Bullish",
+                "Neutral",
+                "Moderately Bearish",
+                "Strongly Bearish"
+            ]),
+            "Investment Risk Level": {
+                "score": round(random.uniform(1, 10), 1),
+                "category": random.choice([
+                    "Very Low Risk",
+                    "Low Risk",
+                    "Moderate Risk",
+                    "High Risk",
+                    "Very High Risk"
+                ])
+            }
         }
+        for company in companies
     }
-    for company in companies
-}
+
+# The data analyzed by the modes below: sample data unless set beforehand (as the benchmarks do)
+market_data = None
+
+def get_market_data():
+    global market_data
+    if market_data is None:
+        market_data = sample_market_data()
+    return market_data
 
 # Async functions for parallel execution
-async def analyze_stock_price(company, data):
-    """ Uses GPT-4-Turbo to analyze stock trends """
-    prompt = f"""
+def stock_price_prompt(company, data):
+    return f"""
     Analyze the current stock price for {company}:
     - Current Price: ${data['Current Stock Price']}
     
@@ -53,16 +93,19 @@ async def analyze_stock_price(company, data):
     2. What this price suggests about the company's market position
     3. Any notable implications for investors
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def analyze_stock_price(company, data):
+    """ Uses GPT-4-Turbo to analyze stock trends """
+    response = await llm.acreate(
         model="gpt-4-turbo",
-        messages=[{"role": "system", "content": prompt}],
+        messages=[{"role": "system", "content": stock_price_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("stock_price", company, quantize(data['Current Stock Price'])),
     )
     return f"Stock Analysis for {company}: {response['choices'][0]['message']['content']}"
 
-async def analyze_financials(company, data):
-    """ Uses GPT-3.5-Turbo-16k for financial report analysis """
-    prompt = f"""
+def financials_prompt(company, data):
+    return f"""
     Analyze the quarterly financial performance of {company}:
     - Quarterly Revenue: ${data['Quarterly Revenue (Billions)']} billion
     
@@ -71,16 +114,19 @@ async def analyze_financials(company, data):
     2. What this revenue suggests about company growth
     3. Potential financial outlook based on this revenue
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def analyze_financials(company, data):
+    """ Uses GPT-3.5-Turbo-16k for financial report analysis """
+    response = await llm.acreate(
         model="gpt-3.5-turbo-16k",
-        messages=[{"role": "system", "content": prompt}],
+        messages=[{"role": "system", "content": financials_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("financials", company, quantize(data['Quarterly Revenue (Billions)'])),
     )
     return f"Financial Analysis for {company}: {response['choices'][0]['message']['content']}"
 
-async def analyze_sentiment(company, data):
-    """ Uses GPT-4 for sentiment analysis """
-    prompt = f"""
+def sentiment_prompt(company, data):
+    return f"""
     Evaluate the market sentiment for {company}:
     - Current Sentiment: {data['Market Sentiment']}
     
@@ -89,16 +135,19 @@ async def analyze_sentiment(company, data):
     2. Potential factors contributing to this sentiment
     3. How this sentiment might affect short-term trading
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def analyze_sentiment(company, data):
+    """ Uses GPT-4 for sentiment analysis """
+    response = await llm.acreate(
         model="gpt-4",
-        messages=[{"role": "system", "content": prompt}],
+        messages=[{"role": "system", "content": sentiment_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("sentiment", company, data['Market Sentiment']),
     )
     return f"Sentiment Analysis for {company}: {response['choices'][0]['message']['content']}"
 
-async def assess_risk(company, data):
-    """ Uses GPT-3.5-Turbo for risk assessment """
-    prompt = f"""
+def risk_prompt(company, data):
+    return f"""
     Assess the investment risk profile for {company}:
     - Risk Score: {data['Investment Risk Level']['score']}/10
     - Risk Category: {data['Investment Risk Level']['category']}
@@ -108,26 +157,150 @@ async def assess_risk(company, data):
     2. What this risk level means for different types of investors
     3. How this risk profile compares to typical market standards
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def assess_risk(company, data):
+    """ Uses GPT-3.5-Turbo for risk assessment """
+    response = await llm.acreate(
         model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": prompt}],
+        messages=[{"role": "system", "content": risk_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("risk", company, quantize(data['Investment Risk Level'])),
     )
     return f"Risk Assessment for {company}: {response['choices'][0]['message']['content']}"
 
-async def parallel_market_analysis():
+async def run_analysis(analysis, company, data):
+    """ Runs one analysis, turning a failure into a message so the batch keeps going """
+    try:
+        with step(analysis.__name__):
+            return await analysis(company, data)
+    except DeadlineExceeded:
+        raise  # Reported by the workflow run as a timeout
+    except Exception as exc:
+        return f"{analysis.__name__} failed for {company}: {exc}"
+
+# The four analyses, for the modes that handle them together (fused and batch)
+MARKET_ASPECTS = [
+    Aspect("stock_price", "Stock Analysis", stock_price_prompt, analyze_stock_price, model="gpt-4-turbo"),
+    Aspect("financials", "Financial Analysis", financials_prompt, analyze_financials, model="gpt-3.5-turbo-16k"),
+    Aspect("sentiment", "Sentiment Analysis", sentiment_prompt, analyze_sentiment, model="gpt-4"),
+    Aspect("risk", "Risk Assessment", risk_prompt, assess_risk, model="gpt-3.5-turbo"),
+]
+
+# Fused mode asks for all four analyses of a company (or several companies) in one
+# structured call, falling back to the separate analyses if the answer can't be parsed
+fused_analyzer = FusedAnalyzer(llm, MARKET_ASPECTS, fallback=run_analysis, ttl=MARKET_CACHE_TTL, key_prefix="fused")
+
+# Fan-out mode runs each company's analyses as a workflow of four independent nodes,
+# so they all run at once; failures come back as messages, so nothing is memoized
+# here (the response cache already reuses analyses of near-identical snapshots).
+# Under a deadline the run's analyses still running when it passes are cancelled
+# and reported as timed out, so one slow analysis doesn't hold up the others.
+analysis_workflow = Workflow(
+    [Node(aspect.key, functools.partial(run_analysis, aspect.analysis), ["company", "data"]) for aspect in MARKET_ASPECTS],
+    name="market",
+)
+
+def unfinished_results(run, company):
+    """ Messages for the analyses of a partial run that timed out or failed """
+    names = {aspect.key: aspect.analysis.__name__ for aspect in MARKET_ASPECTS}
+    return [f"{names[key]} {'timed out' if status == 'timeout' else 'failed'} for {company}"
+            for key, status in run.statuses.items() if status in FAILED]
+
+async def stream_market_analysis(mode="fanout", companies_per_call=1, deadline=None):
+    """ Runs all AI models in parallel and yields results in completion order, within `deadline` seconds (fanout mode) """
+    if mode == "fused":
+        async for result in fused_analyzer.stream(get_market_data().items(), companies_per_call):
+            yield result
+        return
+    results = asyncio.Queue()
+
+    async def analyze(company, data):
+        run = await analysis_workflow.run({"company": company, "data": data}, partial=deadline is not None,
+                                          on_result=lambda name, result: results.put_nowait(result))
+        for result in unfinished_results(run, company):
+            results.put_nowait(result)
+
+    # Each company's run inherits the deadline
+    with budget(deadline):
+        tasks = [asyncio.create_task(analyze(company, data)) for company, data in get_market_data().items()]
+    try:
+        for _ in range(len(tasks) * len(MARKET_ASPECTS)):
+            yield await results.get()
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def parallel_market_analysis(profile=False, mode="fanout", companies_per_call=1, deadline=None):
     """ Runs all AI models in parallel """
-    tasks = []
-    for company, data in market_data.items():
-        tasks.append(analyze_stock_price(company, data))
-        tasks.append(analyze_financials(company, data))
-        tasks.append(analyze_sentiment(company, data))
-        tasks.append(assess_risk(company, data))
-
-    results = await asyncio.gather(*tasks)
+    mark = llm_metrics.default_recorder.mark()
+    results = [result async for result in stream_market_analysis(mode, companies_per_call, deadline)]
+    if profile:
+        print(llm_metrics.default_recorder.breakdown(since=mark))
     return results
 
+async def analyze_companies(items):
+    """ Runs every analysis of the given companies; returns the results company by company, in aspect order """
+    runs = await asyncio.gather(*(analysis_workflow.run({"company": company, "data": data}) for company, data in items))
+    return [run[aspect.key] for run in runs for aspect in MARKET_ASPECTS]
+
+def sharded_market_analysis(processes=None, shard_size=25):
+    """ Splits the companies across worker processes that share the rate limits; yields results in company order """
+    return ShardedRunner("market", processes, shard_size).run(get_market_data().items())
+
+async def print_market_analysis(profile=False, mode="fanout", companies_per_call=1, deadline=None):
+    mark = llm_metrics.default_recorder.mark()
+    async for result in stream_market_analysis(mode, companies_per_call, deadline):
+        print(result)
+    if profile:
+        print("\n" + llm_metrics.default_recorder.breakdown(since=mark))
+        print(f"Hedging - {hedger.summary()}")
+        print(f"Coalescing - {flights.summary()}")
+
+def batch_market_analysis(run_id, backend=None, poll_interval=60.0):
+    """ Offline mode: sends every analysis through the Batch API; rerunning a run_id resumes it """
+    runner = BatchRunner(backend or OpenAIBatchBackend(), JobStore(), poll_interval=poll_interval)
+    # A resumed run keeps the snapshot it was started with
+    requests = None if runner.store.has_run(run_id) else analysis_requests(MARKET_ASPECTS, get_market_data().items())
+    return analysis_results(MARKET_ASPECTS, runner.run(run_id, requests))
+
 # Run the AI analysis
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel market analysis")
+    parser.add_argument("--mode", choices=["fanout", "fused", "batch", "sharded"], default="fanout",
+                        help="one call per analysis (fanout), one structured call per company batch (fused), "
+                             "offline through the Batch API (batch) or fan-out over worker processes (sharded)")
+    parser.add_argument("--companies-per-call", type=int, default=1, help="companies per call in fused mode")
+    parser.add_argument("--run-id", default=time.strftime("%Y-%m-%d"), help="batch mode: run to start or resume")
+    parser.add_argument("--batch-backend", choices=["openai", "local"], default="openai",
+                        help="batch mode: OpenAI Batch API or the local stand-in")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="batch mode: seconds between status checks")
+    parser.add_argument("--processes", type=int, help="sharded mode: worker processes (default: one per core)")
+    parser.add_argument("--shard-size", type=int, default=25, help="sharded mode: companies per shard")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="fanout mode: time budget of the run; analyses still running then are reported as timed out")
+    parser.add_argument("--no-hedge", action="store_true",
+                        help="don't duplicate slow calls (fallback tiers are still used after errors)")
+    llm_metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    # Load OpenAI API Key
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.no_hedge:
+        hedger.policy.max_hedges = 0
+    if args.mode == "batch":
+        backend = LocalBatchBackend() if args.batch_backend == "local" else None
+        for result in batch_market_analysis(args.run_id, backend, args.poll_interval):
+            print(result)
+    elif args.mode == "sharded":
+        mark = llm_metrics.default_recorder.mark()
+        for result in sharded_market_analysis(args.processes, args.shard_size):
+            print(result)
+        if args.profile:
+            print("\n" + llm_metrics.default_recorder.breakdown(since=mark))
+    else:
+        asyncio.run(print_market_analysis(args.profile, args.mode, args.companies_per_call, args.deadline))
+    llm_metrics.export(args)
+
 if __name__ == "__main__":
-    analysis_results = asyncio.run(parallel_market_analysis())
-    print("\n".join(analysis_results))
+    main()
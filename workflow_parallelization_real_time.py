@@ -1,12 +1,45 @@
-import openai
+import argparse
 import asyncio
+import functools
 import os
-import yfinance as yf
-from dotenv import load_dotenv
+import time
+from batch_runner import BatchRunner, JobStore, LocalBatchBackend, OpenAIBatchBackend, analysis_requests, analysis_results
+from deadline import DeadlineExceeded, budget
+from fused_analysis import Aspect, FusedAnalyzer
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_client import get_client
+from llm_hedge import HedgedCompletion, HedgePolicy
+import llm_metrics
+from llm_metrics import TracedChatCompletion, step
+from llm_scheduler import LLMScheduler
+from llm_singleflight import SingleFlight
+import market_data
+from market_watch import MarketWatcher, parse_threshold
+from sharded_runner import ShardedRunner
+from workflow_engine import FAILED, Node, Workflow
 
-# Load OpenAI API Key
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# All model calls go through the scheduler so per-model rate limits are respected;
+# the scheduler owns retries, so the shared client's own retries are turned off
+scheduler = LLMScheduler(create=functools.partial(get_client().acreate, max_retries=0))
+
+# Each analysis may fall back to the next model of its tier: a call running past the 95th
+# percentile of its model's recent latencies is sent to the next one too, and the first
+# answer wins (llm_hedge.py)
+MARKET_HEDGE_TIERS = {
+    "analyze_stock_price": ["gpt-4-turbo", "gpt-4o", "gpt-3.5-turbo"],
+    "analyze_financials": ["gpt-3.5-turbo-16k", "gpt-3.5-turbo"],
+    "analyze_sentiment": ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"],
+    "assess_risk": ["gpt-3.5-turbo", "gpt-3.5-turbo-16k"],
+}
+hedger = HedgedCompletion(HedgePolicy(MARKET_HEDGE_TIERS), acreate=scheduler.chat)
+
+# Analyses are cached on a quantized snapshot, so near-identical inputs reuse earlier results
+# (rounded finely enough for watch mode's thresholds, see market_watcher below);
+# identical analyses requested at the same time (e.g. by overlapping runs) share one call, and
+# every call is recorded in llm_metrics, tagged with the analysis that made it
+flights = SingleFlight(acreate=hedger.acreate)
+llm = TracedChatCompletion(CachedChatCompletion(ResponseCache(), acreate=flights.acreate), workflow="market-live")
+MARKET_CACHE_TTL = 15 * 60
 
 # Define companies and their stock symbols (Yahoo Finance tickers)
 company_tickers = {
@@ -15,26 +48,65 @@ company_tickers = {
     "Microsoft": "MSFT"
 }
 
+# Real-time market data comes from Yahoo Finance, fetched in batches on a thread pool
+market_data_provider = market_data.YFinanceProvider()
+
+# Every fetched snapshot is recorded in a columnar store on disk (market_store.py); the
+# prompts also get features of each company's history (price change since the last fetch,
+# trend and volatility over the last MARKET_FEATURE_WINDOW snapshots, revenue and beta changes),
+# read from the store's feature table. Analyses are cached on the coarse trend and volatility
+# buckets rather than their exact values, which move with every fetch
+MARKET_FEATURE_WINDOW = 20
+
+@functools.cache
+def get_market_store():
+    import market_store
+    return market_store.MarketStore(os.getenv("MARKET_STORE_PATH", ".market_store"))
+
+# Features of every ticker's stored history (a market_store.Features table), computed
+# once per fetch, before its first snapshot arrives
+market_features = None
+
+def stream_snapshots():
+    """ Yields (company, data) as each company's data arrives; the fetch is recorded when it ends """
+    global market_features
+    import market_store
+    store = get_market_store()
+    market_features = store.features(MARKET_FEATURE_WINDOW)
+    snapshots = market_data.stream_stock_data(market_data_provider, company_tickers)
+    return market_store.record_stream(store, snapshots, company_tickers)
+
+def history(company, feature):
+    """ One feature of the company's stored history, or None if there is none """
+    if market_features is None:
+        return None
+    return market_features.get(company_tickers[company], feature)
+
+def since_last(company, feature, now, relative=True):
+    """ Change of `now` since the company's last recorded snapshot (relative, or a difference) """
+    before = history(company, feature)
+    if before is None or not isinstance(now, (int, float)):
+        return None
+    import market_store
+    return market_store.change(now, before) if relative else market_store.delta(now, before)
+
 # Fetch real-time market data
 def get_stock_data():
-    stock_data = {}
-    for company, ticker in company_tickers.items():
-        stock = yf.Ticker(ticker)
-        stock_info = stock.history(period="1d")  # Fetch latest stock data
-
-        stock_data[company] = {
-            "Stock Price": round(stock_info["Close"].iloc[-1], 2),
-            "Revenue": stock.info.get("totalRevenue", "N/A"),
-            "Market Sentiment": "Neutral",  # Placeholder for now
-            "Risk Score": round(stock.info.get("beta", 1.0), 2)  # Beta as risk proxy
-        }
-    return stock_data
+    async def collect():
+        return {company: data async for company, data in stream_snapshots()}
+    return asyncio.run(collect())
+
+def percent(value, sign="+"):
+    return "n/a" if value is None else f"{value:{sign}.2%}"
 
 # Async AI functions for parallel execution
-async def analyze_stock_price(company, data):
-    prompt = f"""
+def stock_price_prompt(company, data):
+    return f"""
     Analyze the real-time stock price for {company}:
     - Current Price: ${data['Stock Price']}
+    - Change Since Last Snapshot: {percent(since_last(company, 'price', data['Stock Price']))}
+    - Trend Over Recent Snapshots: {percent(history(company, 'window_return'))}
+    - Volatility (std. of snapshot log returns): {percent(history(company, 'volatility'), sign='')}
     
     Please provide a brief analysis of the stock price, considering:
     1. Current price movement and trading patterns
@@ -42,17 +114,22 @@ async def analyze_stock_price(company, data):
     3. Key price levels and potential support/resistance points
     4. Notable implications for day traders and investors
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def analyze_stock_price(company, data):
+    response = await llm.acreate(
         model="gpt-4-turbo",
-        messages=[{"role": "system", "content": prompt}]
+        messages=[{"role": "system", "content": stock_price_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("live_stock_price", company, market_watcher.key('Stock Price', data['Stock Price']), history(company, 'trend'),
+                  history(company, 'volatility_band')),
     )
     return f"Stock Analysis for {company}: {response['choices'][0]['message']['content']}"
 
-async def analyze_financials(company, data):
-    prompt = f"""
+def financials_prompt(company, data):
+    return f"""
     Analyze the financial metrics for {company}:
     - Total Revenue: ${data['Revenue']:,.2f}
+    - Revenue Change Since Last Snapshot: {percent(since_last(company, 'revenue', data['Revenue']))}
     
     Please provide insights on:
     1. The company's revenue performance compared to industry peers
@@ -60,15 +137,18 @@ async def analyze_financials(company, data):
     3. Revenue growth trajectory and sustainability
     4. Impact on company's market position
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def analyze_financials(company, data):
+    response = await llm.acreate(
         model="gpt-3.5-turbo-16k",
-        messages=[{"role": "system", "content": prompt}]
+        messages=[{"role": "system", "content": financials_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("live_financials", company, market_watcher.key('Revenue', data['Revenue'])),
     )
     return f"Financial Analysis for {company}: {response['choices'][0]['message']['content']}"
 
-async def analyze_sentiment(company, data):
-    prompt = f"""
+def sentiment_prompt(company, data):
+    return f"""
     Evaluate the current market sentiment for {company}:
     - Market Sentiment: {data['Market Sentiment']}
     
@@ -78,17 +158,23 @@ async def analyze_sentiment(company, data):
     3. Social media and institutional investor sentiment
     4. Potential short-term sentiment shifts and catalysts
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def analyze_sentiment(company, data):
+    response = await llm.acreate(
         model="gpt-4",
-        messages=[{"role": "system", "content": prompt}]
+        messages=[{"role": "system", "content": sentiment_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("live_sentiment", company, data['Market Sentiment']),
     )
     return f"Sentiment Analysis for {company}: {response['choices'][0]['message']['content']}"
 
-async def assess_risk(company, data):
-    prompt = f"""
+def risk_prompt(company, data):
+    beta_change = since_last(company, 'beta', data['Risk Score'], relative=False)
+    return f"""
     Assess the real-time risk profile for {company}:
     - Beta (Risk Score): {data['Risk Score']}
+    - Beta Change Since Last Snapshot: {"n/a" if beta_change is None else f"{beta_change:+.2f}"}
+    - Volatility (std. of snapshot log returns): {percent(history(company, 'volatility'), sign='')}
     
     Please provide:
     1. Interpretation of the current beta value
@@ -96,27 +182,205 @@ async def assess_risk(company, data):
     3. Risk factors specific to {company}'s sector
     4. Recommendations for risk management
     """
-    
-    response = await openai.ChatCompletion.acreate(
+
+async def assess_risk(company, data):
+    response = await llm.acreate(
         model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": prompt}]
+        messages=[{"role": "system", "content": risk_prompt(company, data)}],
+        ttl=MARKET_CACHE_TTL,
+        key_data=("live_risk", company, market_watcher.key('Risk Score', data['Risk Score']), history(company, 'volatility_band')),
     )
     return f"Risk Assessment for {company}: {response['choices'][0]['message']['content']}"
 
-async def parallel_market_analysis():
-    stock_data = get_stock_data()  # Fetch real-time data
-    tasks = []
-    
-    for company, data in stock_data.items():
-        tasks.append(analyze_stock_price(company, data))
-        tasks.append(analyze_financials(company, data))
-        tasks.append(analyze_sentiment(company, data))
-        tasks.append(assess_risk(company, data))
+async def traced_analysis(analysis, company, data):
+    """ Runs one analysis under its metrics step; failures are raised """
+    with step(analysis.__name__):
+        return await analysis(company, data)
+
+async def run_analysis(analysis, company, data):
+    """ Runs one analysis, turning a failure into a message so the batch keeps going """
+    try:
+        return await traced_analysis(analysis, company, data)
+    except DeadlineExceeded:
+        raise  # Reported by the workflow run as a timeout
+    except Exception as exc:
+        return f"{analysis.__name__} failed for {company}: {exc}"
+
+# The four analyses, for the modes that handle them together (fused and batch)
+MARKET_ASPECTS = [
+    Aspect("stock_price", "Stock Analysis", stock_price_prompt, analyze_stock_price, model="gpt-4-turbo"),
+    Aspect("financials", "Financial Analysis", financials_prompt, analyze_financials, model="gpt-3.5-turbo-16k"),
+    Aspect("sentiment", "Sentiment Analysis", sentiment_prompt, analyze_sentiment, model="gpt-4"),
+    Aspect("risk", "Risk Assessment", risk_prompt, assess_risk, model="gpt-3.5-turbo"),
+]
+
+# Fused mode asks for all four analyses of a company (or several companies) in one
+# structured call, falling back to the separate analyses if the answer can't be parsed
+fused_analyzer = FusedAnalyzer(llm, MARKET_ASPECTS, fallback=run_analysis, ttl=MARKET_CACHE_TTL, key_prefix="live_fused")
+
+# Watch mode re-runs an analysis only when the snapshot field its prompt reads has moved;
+# a failed analysis (e.g. rate limited) is reported and tried again at the next poll.
+# The analyses' cache keys round each field with market_watcher.key, finely enough that
+# a move past its threshold (default or --threshold) always misses the cache
+market_watcher = MarketWatcher(
+    MARKET_ASPECTS,
+    {"stock_price": "Stock Price", "financials": "Revenue", "sentiment": "Market Sentiment", "risk": "Risk Score"},
+    run=traced_analysis,
+)
+
+async def watch_market_analysis(interval=60.0, rounds=None):
+    """ Polls market data every `interval` seconds and yields the analyses that had to be re-run """
+    async for result in market_watcher.watch(stream_snapshots, interval, rounds):
+        yield result
+
+async def print_watch_analysis(interval=60.0, rounds=None):
+    async for result in watch_market_analysis(interval, rounds):
+        print(result)
+
+# Fan-out mode runs each company's analyses as a workflow of four independent nodes,
+# so they all run at once; failures come back as messages, so nothing is memoized
+# here (the response cache already reuses analyses of near-identical snapshots).
+# Under a deadline the run's analyses still running when it passes are cancelled
+# and reported as timed out, so one slow analysis doesn't hold up the others.
+analysis_workflow = Workflow(
+    [Node(aspect.key, functools.partial(run_analysis, aspect.analysis), ["company", "data"]) for aspect in MARKET_ASPECTS],
+    name="market-live",
+)
 
-    results = await asyncio.gather(*tasks)
+def unfinished_results(run, company):
+    """ Messages for the analyses of a partial run that timed out or failed """
+    names = {aspect.key: aspect.analysis.__name__ for aspect in MARKET_ASPECTS}
+    return [f"{names[key]} {'timed out' if status == 'timeout' else 'failed'} for {company}"
+            for key, status in run.statuses.items() if status in FAILED]
+
+async def stream_market_analysis(mode="fanout", companies_per_call=1, deadline=None):
+    """ Runs all AI models in parallel and yields results in completion order, within `deadline` seconds (fanout mode) """
+    if mode == "fused":
+        async for result in fused_analyzer.stream(stream_snapshots(), companies_per_call):
+            yield result
+        return
+    results = asyncio.Queue()
+
+    async def analyze(company, data):
+        run = await analysis_workflow.run({"company": company, "data": data}, partial=deadline is not None,
+                                          on_result=lambda name, result: results.put_nowait(result))
+        for result in unfinished_results(run, company):
+            results.put_nowait(result)
+
+    async def schedule():
+        # Start the analyses for each ticker as soon as its data arrives; the deadline
+        # also covers the market data, so tickers not loaded by then are left out
+        tasks = []
+        try:
+            with budget(deadline):
+                async for company, data in stream_snapshots():
+                    tasks.append(asyncio.create_task(analyze(company, data)))
+            await asyncio.gather(*tasks)
+        finally:
+            await results.put(None)
+
+    producer = asyncio.create_task(schedule())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+        await producer
+    finally:
+        producer.cancel()
+
+async def parallel_market_analysis(profile=False, mode="fanout", companies_per_call=1, deadline=None):
+    """ Runs all AI models in parallel """
+    mark = llm_metrics.default_recorder.mark()
+    results = [result async for result in stream_market_analysis(mode, companies_per_call, deadline)]
+    if profile:
+        print(llm_metrics.default_recorder.breakdown(since=mark))
     return results
 
+async def analyze_companies(items, features=None):
+    """ Runs every analysis of the given companies (in a worker process, given their history's `features`); returns the results company by company, in aspect order """
+    global market_features
+    if features is not None:
+        market_features = features
+    runs = await asyncio.gather(*(analysis_workflow.run({"company": company, "data": data}) for company, data in items))
+    return [run[aspect.key] for run in runs for aspect in MARKET_ASPECTS]
+
+def shard_features(shard):
+    """ The feature table rows of a shard's companies, so its worker writes the same prompts and cache keys """
+    if market_features is None:
+        return {}
+    return {"features": market_features.subset([company_tickers[company] for company, _ in shard])}
+
+def sharded_market_analysis(processes=None, shard_size=25):
+    """ Splits the companies across worker processes that share the rate limits; yields results in company order """
+    items = get_stock_data().items()  # Also computes the feature table of the history before this fetch
+    return ShardedRunner("market-live", processes, shard_size, shard_args=shard_features).run(items)
+
+async def print_market_analysis(profile=False, mode="fanout", companies_per_call=1, deadline=None):
+    mark = llm_metrics.default_recorder.mark()
+    async for result in stream_market_analysis(mode, companies_per_call, deadline):
+        print(result)
+    if profile:
+        print("\n" + llm_metrics.default_recorder.breakdown(since=mark))
+        print(f"Hedging - {hedger.summary()}")
+        print(f"Coalescing - {flights.summary()}")
+
+def batch_market_analysis(run_id, backend=None, poll_interval=60.0):
+    """ Offline mode: sends every analysis through the Batch API; rerunning a run_id resumes it """
+    runner = BatchRunner(backend or OpenAIBatchBackend(), JobStore(), poll_interval=poll_interval)
+    # A resumed run keeps the snapshot it was started with
+    requests = None if runner.store.has_run(run_id) else analysis_requests(MARKET_ASPECTS, get_stock_data().items())
+    return analysis_results(MARKET_ASPECTS, runner.run(run_id, requests))
+
 # Run the AI analysis
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel market analysis")
+    parser.add_argument("--mode", choices=["fanout", "fused", "batch", "watch", "sharded"], default="fanout",
+                        help="one call per analysis (fanout), one structured call per company batch (fused), "
+                             "offline through the Batch API (batch), continuously, re-running what changed (watch) "
+                             "or fan-out over worker processes (sharded)")
+    parser.add_argument("--companies-per-call", type=int, default=1, help="companies per call in fused mode")
+    parser.add_argument("--run-id", default=time.strftime("%Y-%m-%d"), help="batch mode: run to start or resume")
+    parser.add_argument("--batch-backend", choices=["openai", "local"], default="openai",
+                        help="batch mode: OpenAI Batch API or the local stand-in")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="batch mode: seconds between status checks")
+    parser.add_argument("--processes", type=int, help="sharded mode: worker processes (default: one per core)")
+    parser.add_argument("--shard-size", type=int, default=25, help="sharded mode: companies per shard")
+    parser.add_argument("--interval", type=float, default=60.0, help="watch mode: seconds between polls")
+    parser.add_argument("--rounds", type=int, help="watch mode: stop after this many polls")
+    parser.add_argument("--threshold", type=parse_threshold, action="append", default=[], metavar="FIELD=VALUE",
+                        help='watch mode: relative change of a field that triggers a re-run, e.g. "Stock Price=0.01"')
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="fanout mode: time budget of the run; analyses still running then are reported as timed out")
+    parser.add_argument("--no-hedge", action="store_true",
+                        help="don't duplicate slow calls (fallback tiers are still used after errors)")
+    llm_metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    # Load OpenAI API Key
+    from dotenv import load_dotenv
+    load_dotenv()
+    if args.no_hedge:
+        hedger.policy.max_hedges = 0
+    if args.mode == "watch":
+        market_watcher.thresholds.update(args.threshold)
+        try:
+            asyncio.run(print_watch_analysis(args.interval, args.rounds))
+        except KeyboardInterrupt:
+            pass
+    elif args.mode == "batch":
+        backend = LocalBatchBackend() if args.batch_backend == "local" else None
+        for result in batch_market_analysis(args.run_id, backend, args.poll_interval):
+            print(result)
+    elif args.mode == "sharded":
+        mark = llm_metrics.default_recorder.mark()
+        for result in sharded_market_analysis(args.processes, args.shard_size):
+            print(result)
+        if args.profile:
+            print("\n" + llm_metrics.default_recorder.breakdown(since=mark))
+    else:
+        asyncio.run(print_market_analysis(args.profile, args.mode, args.companies_per_call, args.deadline))
+    llm_metrics.export(args)
+
 if __name__ == "__main__":
-    analysis_results = asyncio.run(parallel_market_analysis())
-    print("\n".join(analysis_results))
+    main()
@@ -1,12 +1,25 @@
-import openai
-from dotenv import load_dotenv
+import argparse
+import asyncio
+import functools
 import os
+from conversation import ConversationMemory
+from llm_cache import CachedChatCompletion, ResponseCache
+from llm_client import get_client
+import llm_metrics
+from llm_metrics import TracedChatCompletion, step
+from llm_singleflight import SingleFlight
+from faq_index import FAQIndex, format_faq, openai_embedder
+from llm_stream import AsyncTokenStream, TokenStream
+from workflow_engine import Node, Workflow
 
-# Load environment variables
-load_dotenv()
-
-# Set up OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Identical requests are answered from the shared on-disk response cache;
+# misses go through the shared OpenAI client (reads OPENAI_API_KEY), and
+# identical misses made at the same time share one call (llm_singleflight.py).
+# Every call is recorded in llm_metrics, tagged with the step that made it.
+flights = SingleFlight(create=get_client().create, acreate=get_client().acreate)
+llm = TracedChatCompletion(
+    CachedChatCompletion(ResponseCache(), create=flights.create, acreate=flights.acreate), workflow="support"
+)
 
 # Define FAQs database
 FAQS = {
@@ -28,95 +41,419 @@ FAQS = {
     }
 }
 
-def identify_issue(user_input):
+# The FAQ index is built on first use, or a prebuilt one (with embeddings) is loaded
+# from FAQ_INDEX_PATH. Each prompt only includes the top FAQ_TOP_K matches.
+FAQ_TOP_K = 3
+
+@functools.cache
+def get_faq_index():
     """
-    Identify the type of issue from user input and match with FAQs.
+    The FAQ index, built once per process when the first turn needs it.
+    """
+    path = os.getenv("FAQ_INDEX_PATH")
+    if path:
+        return FAQIndex.load(path, embed=openai_embedder())
+    return FAQIndex(FAQS)
+
+# Follow-up used when an FAQ is answered directly, without calling the LLM
+FAQ_FOLLOW_UP = "Did that answer your question, or is there anything else I can help with?"
+
+# Said in place of (or after the part of) a solution that couldn't be written before the turn's deadline
+LATE_SOLUTION = "Sorry, this is taking longer than expected. Could you try again in a moment, or rephrase your question?"
+
+# Canned follow-ups for the template follow-up mode, by FAQ key (FAQ_FOLLOW_UP otherwise)
+FOLLOW_UP_TEMPLATES = {
+    "password": "Were you able to reset your password with those steps, or is the reset email not arriving?",
+    "business_hours": "Does that answer your question about our hours, or is there anything else I can help with?",
+    "contact": "Were you able to reach us through one of those channels, or is there anything else I can help with?",
+    "order_history": "Could you find the order you were looking for, or is something missing from your history?",
+}
+
+# In a conversation the system message of identify_issue is byte-identical every turn,
+# so the provider can cache it: it lists every FAQ when there are at most
+# STABLE_FAQ_LIMIT of them; otherwise each message carries its own top matches.
+STABLE_FAQ_LIMIT = 20
+
+@functools.cache
+def conversation_prefix():
+    faqs = get_faq_index().faqs
+    if len(faqs) <= STABLE_FAQ_LIMIT:
+        return "You are a customer support assistant. Use these FAQs as reference:\n\n" + "\n".join(
+            format_faq(faq) for faq in faqs
+        ) + "\n\nIdentify the main issue from the user's latest message, using the conversation so far, and match it with the most relevant FAQ if applicable."
+    return "You are a customer support assistant. Each user message comes with the most relevant FAQs.\n\nIdentify the main issue from the user's latest message, using the conversation so far, and match it with the most relevant FAQ if applicable."
+
+def new_memory():
     """
-    # Create a context string from FAQs
-    faq_context = "\n".join([f"Q: {faq['question']}\nA: {faq['answer']}" for faq in FAQS.values()])
-    
-    response = openai.ChatCompletion.create(
+    Conversation memory for one customer; earlier turns are summarized with summarize_history.
+    """
+    return ConversationMemory(summarize_history)
+
+@step("summarize_history")
+def summarize_history(prompt):
+    """
+    Fold older turns into the conversation summary (runs in the background).
+    """
+    response = llm.create(
         model="gpt-3.5-turbo",
-        messages=[
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.3,
+    )
+    return response['choices'][0]['message']['content']
+
+def identify_messages(user_input, memory=None):
+    """
+    Messages for identifying the issue; with a ConversationMemory, the earlier conversation is included.
+    """
+    if memory is not None:
+        if len(get_faq_index().faqs) > STABLE_FAQ_LIMIT:
+            user_input = f"Relevant FAQs:\n{get_faq_index().context(user_input, k=FAQ_TOP_K)}\n\nMessage: {user_input}"
+        return memory.messages([{"role": "system", "content": conversation_prefix()}], user_input)
+    # Create a context string from the most relevant FAQs
+    faq_context = get_faq_index().context(user_input, k=FAQ_TOP_K)
+    return [
+        {
+            "role": "system",
+            "content": f"You are a customer support assistant. Use these FAQs as reference:\n\n{faq_context}\n\nIdentify the main issue from the user's input and match it with the most relevant FAQ if applicable."
+        },
+        {
+            "role": "user",
+            "content": user_input
+        }
+    ]
+
+def solution_messages(issue):
+    # Create a context string from the most relevant FAQs
+    faq_context = get_faq_index().context(issue, k=FAQ_TOP_K)
+    return [
+        {
+            "role": "system",
+            "content": f"You are a customer support assistant. Use these FAQs as reference:\n\n{faq_context}\n\nProvide a detailed solution for the following issue, incorporating relevant FAQ information if applicable."
+        },
+        {
+            "role": "user",
+            "content": f"Issue: {issue}"
+        }
+    ]
+
+def fused_messages(user_input, memory=None):
+    """
+    Messages for identifying the issue and writing the solution in one call.
+    """
+    instruction = "Identify the main issue from the user's message, then provide a detailed solution for it, incorporating relevant FAQ information if applicable. Answer with the solution only."
+    faq_context = get_faq_index().context(user_input, k=FAQ_TOP_K)
+    if memory is not None:
+        prefix = [{"role": "system", "content": conversation_prefix()}, {"role": "system", "content": instruction}]
+        if len(get_faq_index().faqs) > STABLE_FAQ_LIMIT:
+            user_input = f"Relevant FAQs:\n{faq_context}\n\nMessage: {user_input}"
+        return memory.messages(prefix, user_input)
+    return [
+        {
+            "role": "system",
+            "content": f"You are a customer support assistant. Use these FAQs as reference:\n\n{faq_context}\n\n{instruction}"
+        },
+        {
+            "role": "user",
+            "content": user_input
+        }
+    ]
+
+def satisfaction_messages(solution=None, issue=None):
+    """
+    Messages for the follow-up question, written from the solution or, speculatively,
+    from the issue alone while the solution is still being generated.
+    """
+    if solution is None:
+        return [
             {
                 "role": "system",
-                "content": f"You are a customer support assistant. Use these FAQs as reference:\n\n{faq_context}\n\nIdentify the main issue from the user's input and match it with the most relevant FAQ if applicable."
+                "content": "You are a customer support assistant. A solution to the customer's issue below is being sent to them. Generate a follow-up question to check if the solution was helpful and if the user needs any clarification."
             },
             {
                 "role": "user",
-                "content": user_input
+                "content": f"Issue: {issue}"
             }
-        ],
+        ]
+    return [
+        {
+            "role": "system",
+            "content": "You are a customer support assistant. Generate a follow-up question to check if the solution was helpful and if the user needs any clarification."
+        },
+        {
+            "role": "user",
+            "content": f"Solution provided: {solution}"
+        }
+    ]
+
+@step("identify_issue")
+def identify_issue(user_input, memory=None):
+    """
+    Identify the type of issue from user input and match with FAQs.
+    With a ConversationMemory, the earlier conversation is taken into account.
+    """
+    response = llm.create(
+        model="gpt-3.5-turbo",
+        messages=identify_messages(user_input, memory),
         temperature=0.7,
+        ttl=24 * 60 * 60,  # FAQ answers are stable for a day
     )
     return response['choices'][0]['message']['content']
 
-def generate_solution(issue):
+@step("generate_solution")
+def generate_solution(issue, stream=False):
     """
     Generate a solution based on the identified issue and FAQs.
+    With stream=True, return a TokenStream that yields the solution as it is generated.
     """
-    # Create a context string from FAQs
-    faq_context = "\n".join([f"Q: {faq['question']}\nA: {faq['answer']}" for faq in FAQS.values()])
-    
-    response = openai.ChatCompletion.create(
+    response = llm.create(
         model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": f"You are a customer support assistant. Use these FAQs as reference:\n\n{faq_context}\n\nProvide a detailed solution for the following issue, incorporating relevant FAQ information if applicable."
-            },
-            {
-                "role": "user",
-                "content": f"Issue: {issue}"
-            }
-        ],
+        messages=solution_messages(issue),
         temperature=0.7,
+        ttl=24 * 60 * 60,
+        stream=stream,
     )
+    if stream:
+        return TokenStream(response, step="generate_solution")
     return response['choices'][0]['message']['content']
 
-def check_satisfaction(solution):
+@step("check_satisfaction")
+def check_satisfaction(solution, stream=False):
     """
     Generate a follow-up question to check if the solution was helpful.
+    `solution` may be a TokenStream from generate_solution; it is read to the end first.
     """
-    response = openai.ChatCompletion.create(
+    if isinstance(solution, TokenStream):
+        solution = solution.read()
+    response = llm.create(
         model="gpt-3.5-turbo",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a customer support assistant. Generate a follow-up question to check if the solution was helpful and if the user needs any clarification."
-            },
-            {
-                "role": "user",
-                "content": f"Solution provided: {solution}"
-            }
-        ],
+        messages=satisfaction_messages(solution),
         temperature=0.7,
+        ttl=24 * 60 * 60,
+        stream=stream,
     )
+    if stream:
+        return TokenStream(response, step="check_satisfaction")
     return response['choices'][0]['message']['content']
 
-def customer_support_chatbot():
+# Async versions of the steps, used by the concurrent support turn below.
+# With a prebuilt index (FAQ_INDEX_PATH) searching the FAQs embeds the query over HTTP,
+# so the prompts are built on a worker thread rather than blocking the event loop.
+
+async def faq_prompt(build, *args):
+    """
+    Call `build(*args)`, which searches the FAQ index, off the event loop if the search embeds its query.
+    """
+    if get_faq_index().embeds_queries:
+        return await asyncio.to_thread(build, *args)
+    return build(*args)
+
+async def aidentify_issue(user_input, memory=None):
+    if memory is not None:
+        await memory.wait_for_summary()
+    with step("identify_issue"):
+        messages = await faq_prompt(identify_messages, user_input, memory)
+        response = await llm.acreate(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            temperature=0.7,
+            ttl=24 * 60 * 60,
+        )
+    return response['choices'][0]['message']['content']
+
+async def agenerate_solution(issue, stream=False):
+    with step("generate_solution"):
+        messages = await faq_prompt(solution_messages, issue)
+        response = await llm.acreate(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            temperature=0.7,
+            ttl=24 * 60 * 60,
+            stream=stream,
+        )
+    if stream:
+        return AsyncTokenStream(response, step="generate_solution")
+    return response['choices'][0]['message']['content']
+
+async def aidentify_and_solve(user_input, memory=None, stream=False):
+    """
+    Identify the issue and generate the solution in a single call.
+    """
+    if memory is not None:
+        await memory.wait_for_summary()
+    with step("identify_and_solve"):
+        messages = await faq_prompt(fused_messages, user_input, memory)
+        response = await llm.acreate(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            temperature=0.7,
+            ttl=24 * 60 * 60,
+            stream=stream,
+        )
+    if stream:
+        return AsyncTokenStream(response, step="identify_and_solve")
+    return response['choices'][0]['message']['content']
+
+async def acheck_satisfaction(solution=None, issue=None):
+    """
+    Generate the follow-up question from the solution, or speculatively from the issue alone.
+    """
+    with step("check_satisfaction"):
+        response = await llm.acreate(
+            model="gpt-3.5-turbo",
+            messages=satisfaction_messages(solution, issue),
+            temperature=0.7,
+            ttl=24 * 60 * 60,
+        )
+    return response['choices'][0]['message']['content']
+
+def template_follow_up(issue):
+    """
+    Pick the canned follow-up of the FAQ closest to the issue, without calling the LLM.
+    """
+    matches = get_faq_index().search(issue, k=1)
+    return FOLLOW_UP_TEMPLATES.get(matches[0][0], FAQ_FOLLOW_UP) if matches else FAQ_FOLLOW_UP
+
+# The support turn as a DAG. The solution streams to `emit` as it is generated, and
+# the follow-up question doesn't wait for it unless follow_up="serial":
+#   serial:      identify -> solve -> follow-up from the solution (three calls in a row)
+#   speculative: identify -> solve, and follow-up from the issue at the same time
+#   template:    identify -> solve, and a canned follow-up for the closest FAQ (no call)
+# With fuse=True identify and solve are one call, and the follow-up is based on the user's message.
+# Under a deadline, identifying the issue may use up to half of the turn's budget, and a
+# step that runs past it is cut short: the turn still answers, with what was streamed of
+# the solution (or an apology) and a canned follow-up in place of the missing one.
+FOLLOW_UP_MODES = ("speculative", "template", "serial")
+
+async def _relay(stream, emit, field):
+    async for text in stream:
+        if emit is not None:
+            emit(field, text)
+    return stream.text
+
+async def _issue(user_input, memory):
+    issue = await aidentify_issue(user_input, memory)
+    # The solution and the template follow-up search the FAQs for the issue at the same
+    # time; embed it once here so both find its vector cached
+    if get_faq_index().embeds_queries:
+        await faq_prompt(get_faq_index().search, issue, FAQ_TOP_K)
+    return issue
+
+async def _message_as_issue(user_input):
+    return user_input
+
+async def _solution(issue, emit):
+    return await _relay(await agenerate_solution(issue, stream=True), emit, "solution")
+
+async def _fused_solution(user_input, memory, emit):
+    return await _relay(await aidentify_and_solve(user_input, memory, stream=True), emit, "solution")
+
+async def _serial_follow_up(solution):
+    return await acheck_satisfaction(solution=solution)
+
+async def _speculative_follow_up(issue):
+    return await acheck_satisfaction(issue=issue)
+
+async def _template_follow_up(issue):
+    return await faq_prompt(template_follow_up, issue)
+
+def support_workflow(follow_up="speculative", fuse=False):
+    if fuse:
+        nodes = [Node("issue", _message_as_issue, ["user_input"]),
+                 Node("solution", _fused_solution, ["user_input", "memory", "emit"])]
+    else:
+        nodes = [Node("issue", _issue, ["user_input", "memory"], budget=0.5),
+                 Node("solution", _solution, ["issue", "emit"])]
+    if follow_up == "serial":
+        nodes.append(Node("follow_up", _serial_follow_up, ["solution"]))
+    elif follow_up == "speculative":
+        nodes.append(Node("follow_up", _speculative_follow_up, ["issue"]))
+    elif follow_up == "template":
+        nodes.append(Node("follow_up", _template_follow_up, ["issue"]))
+    else:
+        raise ValueError(f"follow_up must be one of {', '.join(FOLLOW_UP_MODES)}")
+    return Workflow(nodes, name="support")
+
+SUPPORT_WORKFLOWS = {(mode, fuse): support_workflow(mode, fuse) for mode in FOLLOW_UP_MODES for fuse in (False, True)}
+
+async def support_turn(user_input, memory=None, follow_up="speculative", fuse=False, emit=None, deadline=None):
+    """
+    Run one support turn and return {"solution", "follow_up", "run"}.
+    `emit(field, text)` receives the solution tokens as they are generated.
+    `deadline` is the turn's budget in seconds; run.statuses tells which steps timed out.
+    """
+    # Fast path: an exact FAQ question is answered without calling the LLM
+    match = get_faq_index().exact_match(user_input)
+    if match:
+        _, faq = match
+        if emit is not None:
+            emit("solution", faq['answer'])
+        result = {"solution": faq['answer'], "follow_up": FAQ_FOLLOW_UP, "run": None}
+    else:
+        streamed = []
+
+        def relay(field, text):
+            streamed.append(text)
+            if emit is not None:
+                emit(field, text)
+
+        run = await SUPPORT_WORKFLOWS[(follow_up, fuse)].run(
+            {"user_input": user_input, "memory": memory, "emit": relay}, deadline=deadline, partial=deadline is not None
+        )
+        solution = run.get("solution")
+        if solution is None:
+            # Keep what the customer has already seen and say the rest is late
+            solution = ("".join(streamed) + "\n\n" if streamed else "") + LATE_SOLUTION
+            if emit is not None:
+                emit("solution", ("\n\n" if streamed else "") + LATE_SOLUTION)
+        follow_up_text = run.get("follow_up")
+        if follow_up_text is None:
+            issue = run.get("issue")
+            follow_up_text = await faq_prompt(template_follow_up, issue) if issue else FAQ_FOLLOW_UP
+        result = {"solution": solution, "follow_up": follow_up_text, "run": run}
+    if memory is not None:
+        memory.add_exchange(user_input, result["solution"])
+    return result
+
+async def customer_support_chatbot(follow_up="speculative", fuse=False, profile=False, deadline=None):
     """
     Main function to run the customer support chatbot.
     """
     print("Welcome to Customer Support! How can I assist you today?")
     print("(Type 'exit', 'quit', or 'bye' to end the conversation)")
-    
+    memory = new_memory()
+    loop = asyncio.get_running_loop()
+
+    def emit(field, text):
+        print(text, end="", flush=True)
+
     while True:
-        user_input = input("\nYou: ")
+        user_input = await loop.run_in_executor(None, input, "\nYou: ")
         if user_input.lower() in ['exit', 'quit', 'bye']:
             print("\nThank you for using our customer support. Goodbye!")
             break
 
-        # Step 1: Identify the issue
-        issue = identify_issue(user_input)
-        
-        # Step 2: Generate a solution
-        solution = generate_solution(issue)
-        print(f"\nAgent: {solution}")
-        
-        # Step 3: Check satisfaction
-        follow_up = check_satisfaction(solution)
-        print(f"\nAgent: {follow_up}")
+        # The solution is printed as it streams; the follow-up is usually ready by the time it ends
+        print("\nAgent: ", end="", flush=True)
+        result = await support_turn(user_input, memory, follow_up=follow_up, fuse=fuse, emit=emit, deadline=deadline)
+        print(f"\n\nAgent: {result['follow_up']}")
+        if profile and result["run"] is not None:
+            print(result["run"].format_timings())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Customer support chatbot")
+    parser.add_argument("--follow-up", choices=FOLLOW_UP_MODES, default="speculative",
+                        help="write the follow-up from the issue while the solution streams (speculative), "
+                             "pick a canned one (template) or write it from the solution afterwards (serial)")
+    parser.add_argument("--fuse", action="store_true", help="identify the issue and write the solution in one call")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="time budget of each turn; late steps are cut short and the reply degrades instead")
+    llm_metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+    asyncio.run(customer_support_chatbot(args.follow_up, args.fuse, args.profile, args.deadline))
+    llm_metrics.export(args)
 
 if __name__ == "__main__":
-    customer_support_chatbot()
\ No newline at end of file
+    main()
@@ -0,0 +1,38 @@
+import importlib.util
+import os
+import sys
+
+# Registry of the repository's workflow scripts.
+# Several scripts have hyphenated file names, so they are loaded by path
+# rather than imported by module name.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    "agent": "simple-autonomous-agent.py",
+    "workflow": "workflow-based.py",
+    "hybrid": "hybrid-agent-workflow.py",
+    "support": "workflow_prompt_chaining.py",
+    "market": "workflow_parallelization.py",
+    "market-live": "workflow_parallelization_real_time.py",
+}
+
+
+def load_script(name):
+    """
+    Import the script registered under `name` and return the module.
+    Each script is loaded once per process.
+    """
+    filename = SCRIPTS[name]
+    module_name = os.path.splitext(filename)[0].replace("-", "_")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module